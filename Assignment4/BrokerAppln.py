@@ -23,12 +23,13 @@ import time   # for sleep
 import argparse # for argument parsing
 import configparser # for configuration parsing
 import logging
-from CS6381_MW.Common import Constants
+from CS6381_MW.Common import Constants, OwnershipArbiter, payload_value
 
 from topic_selector import TopicSelector
 
 # Now import our CS6381 Middleware
 from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.Egress import POLICIES
 # We also need the message formats to handle incoming responses.
 from CS6381_MW import discovery_pb2
 
@@ -57,6 +58,15 @@ class BrokerAppln():
         self.config = None
         self.frequency = None
         self.iters = None
+        self.standby_received = 0 # publications drained while we were a standby
+        self.forwarded = 0 # publications forwarded as the leader
+        self.arbiter = None # decides which publisher owns each topic
+        self.workers = 0 # worker processes doing the forwarding, 0 to do it ourselves
+        self.publishers = [] # from discovery, handed to the workers
+        self.parent = None # the broker we take our data from in a broker tree, None if from the publishers
+        self.report_interval = 5.0 # seconds between forwarding rate reports
+        self.report_at = None # when the next report is due
+        self.reported = 0 # forwarded count at the last report
 
     ########################################
     # Configure/initialize
@@ -75,6 +85,8 @@ class BrokerAppln():
             self.name = args.name
             self.frequency = args.frequency # frequency with which topics are disseminated
             self.iters = args.iters  # num of iterations
+            self.arbiter = OwnershipArbiter(args.ownership_threshold)
+            self.workers = args.workers
       
             # Now, get the configuration object
             self.logger.debug ("BrokerAppln::configure - parsing config.ini")
@@ -113,11 +125,15 @@ class BrokerAppln():
             self.dump()
 
             # Confirm that we are using broker strategy, if not we do nothing
-            if (self.dissemination == Constants.DISSEMINATION_STRATEGY_BROKER):
+            if (self.dissemination in (Constants.DISSEMINATION_STRATEGY_BROKER, Constants.DISSEMINATION_STRATEGY_HYBRID)):
                 # Set the upcall handle on our MW
                 self.logger.debug("BrokerAppln::driver - upcall handle")
                 self.mw_obj.set_upcall_handle(self)
 
+                # Compete for leadership right away; standbys go through the
+                # same lifecycle so they already hold their publisher connections
+                self.mw_obj.join_election(self.leader_elected)
+
                 self.state = self.State.REGISTER
 
                 self.mw_obj.event_loop(timeout=0)
@@ -166,7 +182,7 @@ class BrokerAppln():
                 # Use the MW object to send a look up publishers by topic list request
                 # self.mw_obj.lookup_publishers_by_topiclist(self.topiclist)
                 # Load all of the publishers in the system
-                self.mw_obj.lookup_all_publishers()
+                self.mw_obj.lookup_all_publishers(self.name)
 
                 # We are awaiting a reply from the discovery service
                 return None
@@ -175,33 +191,78 @@ class BrokerAppln():
                 # We have the publishers
                 self.logger.debug("BrokerAppln::invoke_operation - start Consuming data")
 
+                # Sharded: the workers consume, arbitrate and disseminate. A
+                # standby starts them too, so its publisher connections are hot,
+                # but they only forward while we lead; losing our zookeeper
+                # session shows up here within a second.
+                if self.workers > 0:
+                    if not self.mw_obj.workers_started():
+                        self.mw_obj.start_workers(self.publishers, self.topiclist, watch=self.parent is None)
+                    self.mw_obj.lead_workers(self.mw_obj.is_leader())
+                    return 1000
+
                 # We could specify a number of iterations to run the broker option
                 # And complete after 
 
                 # Time to receive a message 
                 publication = self.mw_obj.consume()
 
-                self.logger.info("Received Data: {}".format(publication))
+                self.logger.debug("Received Data: %s", publication)
+
+                # Enforce ownership strength here, once, so samples of the weaker
+                # publishers on a topic never go out to the subscribers. Standbys
+                # arbitrate too so they know the owners when they take over.
+                handovers = self.arbiter.handovers
+                admitted = self.arbiter.admit(publication.topic, publication.pub_id, publication.strength, publication.ByteSize())
+                if self.arbiter.handovers != handovers:
+                    self.logger.info("BrokerAppln::invoke_operation - {} now owned by {} (strength {}); dropped {} of {} bytes so far".format(
+                        publication.topic, publication.pub_id, publication.strength, self.arbiter.dropped_bytes,
+                        self.arbiter.admitted_bytes + self.arbiter.dropped_bytes))
+
+                # A standby keeps draining its publisher connections so they are
+                # hot when it takes over, but only the leader forwards
+                if not self.mw_obj.is_leader():
+                    self.standby_received += 1
+                    return 0
+
+                if not admitted:
+                    self.logger.debug("BrokerAppln::invoke_operation - {} is not the owner of {}, dropped".format(publication.pub_id, publication.topic))
+                    return 0
 
                 # Parse out the values of the publication for passing on
                 id = publication.pub_id
                 topic = publication.topic
-                content = publication.content
+                content = payload_value(publication)
                 timestamp = publication.tstamp
+                strength = publication.strength
+                seq = publication.seq
+                epoch = publication.epoch
 
                 self.logger.debug("BrokerAppln::invoke_operation - Now we disseminate what we received")
 
                 # Now disseminate the data the Broker has received
-                self.mw_obj.disseminate(id, topic, content, timestamp)
+                self.mw_obj.disseminate(id, topic, content, timestamp, strength, seq, epoch)
                 # self.mw_obj.disseminate(publication)
-                
-                self.logger.debug("BrokerAppln::invoke_operation:: Data has been disseminated")
+                self.forwarded += 1
+
+                # Our share of the load when discovery balances subscribers
+                now = time.time()
+                if self.report_at is None:
+                    self.report_at = now + self.report_interval
+                elif now >= self.report_at:
+                    self.logger.info("BrokerAppln::invoke_operation - {} forwarding {:.1f} samples/s".format(
+                        self.name, (self.forwarded - self.reported) / (now - self.report_at + self.report_interval)))
+                    self.reported = self.forwarded
+                    self.report_at = now + self.report_interval
+                    if self.mw_obj.egress is not None:
+                        for subscriber, (queued, lag, dropped, sent, deepest) in self.mw_obj.egress.stats().items():
+                            self.logger.info("BrokerAppln::invoke_operation - {}: {} queued, lag {:.1f} ms, {} dropped, {} sent, deepest queue {}".format(
+                                subscriber, queued, lag * 1000, dropped, sent, deepest))
 
-                # Do we want the broker to rest? Or just push along as soon as possible
-                # I feel like no rest
-                time.sleep (1/float (self.frequency)) 
+                self.logger.debug("BrokerAppln::invoke_operation:: Data has been disseminated")
 
-                # Timeout after the sleep is done
+                # No rest for the broker: pacing is the publishers' job and
+                # sleeping here would cap forwarding at "frequency" messages/sec
                 return 0
             elif (self.state == self.State.COMPLETED):
                 self.mw_obj.disable_event_loop ()
@@ -228,6 +289,22 @@ class BrokerAppln():
         except Exception as e:
             raise e
 
+    ########################################
+    # We are now the forwarding broker
+    #
+    # Upcall made on the zookeeper thread; the ACTIVE loop picks the
+    # change up on its next message.
+    ########################################
+    def leader_elected(self):
+        ''' Take over forwarding '''
+
+        self.logger.info("BrokerAppln::leader_elected - {} taking over at {} (drained {} publications as standby)".format(
+            self.name, time.time(), self.standby_received))
+
+        # the workers of a sharded broker start forwarding right away
+        if self.workers > 0:
+            self.mw_obj.lead_workers(True)
+
     def register_response(self, reg_resp):
         ''' Handle register response '''
 
@@ -291,8 +368,28 @@ class BrokerAppln():
             if (lookup_all_resp.status == discovery_pb2.STATUS_SUCCESS):
                 self.logger.debug("BrokerAppln::lookup_all_publisher_list_response - Success! List of publishers provided from Discovery")
 
-                # Connect to each of list of publishers 
-                for publisher in lookup_all_resp.publisher_list:
+                # Connect to each of list of publishers (with worker processes
+                # they connect themselves, to their share of the topics). In a
+                # broker tree the list is our parent broker, which we connect
+                # to like a publisher.
+                self.publishers = list(lookup_all_resp.publisher_list)
+
+                # Forward only what some subscriber's content filter passes
+                self.mw_obj.set_filters(lookup_all_resp.filters)
+
+                # Hybrid dissemination: the other topics go to the subscribers
+                # directly, so we stop taking them in
+                if lookup_all_resp.routes:
+                    forwarded = [route.topic for route in lookup_all_resp.routes if route.via_broker]
+                    self.logger.info("BrokerAppln::lookup_all_publisher_list_response - hybrid dissemination, forwarding {}".format(forwarded))
+                    self.mw_obj.unsubscribe([topic for topic in self.topiclist if topic not in forwarded])
+                    self.topiclist = forwarded
+
+                if lookup_all_resp.parent:
+                    self.parent = self.publishers[0]
+                    self.logger.info("BrokerAppln::lookup_all_publisher_list_response - {} takes its data from broker {} at {}:{}".format(
+                        self.name, self.parent.id, self.parent.addr, self.parent.port))
+                for publisher in (self.publishers if self.workers == 0 else []):
                     self.logger.debug("BrokerAppln::lookup_all_publisher_list_response - Connecting to publisher {} {}:{}".format(publisher.id, publisher.addr, publisher.port))
                     
                     # Connect to this publisher for the topics we are interested in via MW
@@ -300,11 +397,16 @@ class BrokerAppln():
 
                 self.logger.debug("BrokerAppln::lookup_all_publisher_list_response - Done connecting to publishers")
 
+                # Publishers that come and go from now on (workers watch their
+                # own); below the root of a tree they reach us through it
+                if self.workers == 0 and self.parent is None:
+                    self.mw_obj.watch_publishers(self.topiclist)
+
                 # Change the state to ACTIVE
                 # It is time to consume then republish
                 self.state = self.State.ACTIVE
 
-            elif (lookup_all_resp.status == discovery_pb2.STATUSSTATUS_CHECK_AGAIN_CHECK_AGAIN):
+            elif (lookup_all_resp.status == discovery_pb2.STATUS_CHECK_AGAIN):
                 # Discovery service is not ready yet to give out list of pubs yet
                 self.logger.debug ("BrokerAppln::lookup_all_publisher_list_response - Not ready yet; check again")
                 time.sleep(10)  # sleep between calls so that we don't make excessive calls
@@ -340,8 +442,42 @@ def parseCmdLineArgs ():
         
     parser.add_argument("-d", "--discovery", default="localhost:5556", help="IP Addr:Port combo for the discovery service, default localhost:5556")
 
+    parser.add_argument("-z", "--zookeeper", default=None, help="IP Addr:Port of zookeeper; if given we follow the discovery leader elected there and join the broker leader election (default: use --discovery only, single broker)")
+
     parser.add_argument ("-T", "--num_topics", type=int, choices=range(1,10), default=1, help="Number of topics to publish, currently restricted to max of 9")
 
+    parser.add_argument ("--watch_window", type=float, default=0.05, help="Seconds publisher join/leave watch events are coalesced over, 0 = on every event (default 0.05)")
+
+    parser.add_argument ("--zk_timeout", type=float, default=3.0, help="Zookeeper session timeout in seconds; bounds broker failover time (default 3)")
+
+    parser.add_argument("--no_last_value", action="store_true", help="Do not send new subscribers the newest sample of their topics right away (default: send it)")
+
+    parser.add_argument("--history", type=int, default=0, help="Samples per topic kept for late joining subscribers, needs --history_port (default: 0, none)")
+
+    parser.add_argument("--history_port", type=int, default=None, help="Port on which late joiners ask for history, required with --history")
+
+    parser.add_argument("--log_dir", default=None, help="Append every forwarded sample to a durable per topic log under this directory (default: no log)")
+
+    parser.add_argument("--segment_bytes", type=int, default=16 * 1024 * 1024, help="Size of a log segment file (default: 16 MB)")
+
+    parser.add_argument("--sync_every", type=int, default=0, help="Force the log to disk every so many samples; 0 leaves it to the OS, which survives a broker crash but not a host crash (default: 0)")
+
+    parser.add_argument("--log_port", type=int, default=None, help="Port on which subscribers read the log, required with --log_dir")
+
+    parser.add_argument("--egress", choices=["pub", "router"], default="pub", help="router also serves subscribers on a ROUTER socket with a bounded queue each, so a slow one only backs up its own queue; pub only publishes on our XPUB socket (default: pub)")
+
+    parser.add_argument("--egress_port", type=int, default=None, help="Port of the ROUTER egress, required with --egress router")
+
+    parser.add_argument("--queue_limit", type=int, default=100, help="Samples queued for a subscriber on the ROUTER egress before the drop policy applies (default: 100)")
+
+    parser.add_argument("--drop_policy", choices=POLICIES, default="oldest", help="When a subscriber's queue is full: drop its oldest queued sample, drop the new sample, or disconnect it (it subscribes again) (default: oldest)")
+
+    parser.add_argument("--ownership_threshold", type=int, default=5, help="Samples from weaker publishers of a topic after which a silent owner loses the topic (default 5)")
+
+    parser.add_argument("--no_election", action="store_true", help="Forward even with --zookeeper instead of electing one forwarding broker; for brokers discovery balances subscribers over (discovery --threshold)")
+
+    parser.add_argument("--workers", type=int, default=0, help="Forward through this many worker processes, each owning a share of the topics, behind an XSUB/XPUB proxy; 0 forwards in this process (default: 0)")
+
     parser.add_argument("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
 
     parser.add_argument("-f", "--frequency", type=int,default=1, help="Rate at which topics disseminated: default once a second - use integers")
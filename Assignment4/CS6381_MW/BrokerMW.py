@@ -30,19 +30,47 @@ import datetime
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import LeaderReq, HistoryService, ContentFilters, TopicIds, set_payload
+from CS6381_MW.TopicLog import TopicLog, LogService
+from CS6381_MW.BrokerShards import ShardedFront
+from CS6381_MW.Egress import RouterEgress
 
 class BrokerMW():
 
     def __init__(self, logger):
         self.logger = logger
-        self.req = None # ZMQ REQ for connecting to Discovery service
+        self.req = None # LeaderReq (ZMQ REQ) for connecting to Discovery service
         self.sub = None # ZMQ SUB socket for receiving from the publishers
-        self.pub = None # ZMQ PUB socket for publishing what is received from the publishers to the subscribers
+        self.pub = None # ZMQ XPUB socket for publishing what is received from the publishers to the subscribers
         self.poller = None # Wait on incoming replies
         self.addr = None # Broker's IP Address
         self.port = None # Broker's port
         self.upcall_obj = None
         self.handle_events = True
+        self.zk_client = None # ZK_Driver for the broker leader election (only with --zookeeper)
+        self.history = None # HistoryService with the recent samples we forwarded
+        self.data_poller = None # waits on the sub socket, subscriptions and history requests
+        self.last_values = None # topic -> newest frame we forwarded, for new subscribers
+        self.lvc_sent = 0 # cached samples sent on subscription
+        self.topic_log = None # TopicLog every forwarded frame is appended to
+        self.log_service = None # LogService subscribers fetch the log from
+        self.history_port = 0 # advertised to discovery, 0 if none
+        self.log_port = 0 # advertised to discovery, 0 if none
+        self.egress = None # RouterEgress giving every subscriber a queue of its own
+        self.egress_port = 0 # advertised to discovery, 0 if none
+        self.front = None # ShardedFront when worker processes do the forwarding
+        self.context = None
+        self.zookeeper = None # addr:port of zookeeper, None without
+        self.watcher = None # LeaderWatcher on the discovery leader; its session also announces us
+        self.watch_window = 0.05 # seconds membership watch events are coalesced over
+        self.connected = set() # publisher endpoints our SUB socket is connected to
+        self.members = {} # live publisher name -> endpoint
+        self.membership = None # MembershipFeed of the live publishers
+        self.watched_topics = [] # what we subscribe to at publishers that join
+        self.awaiting = {} # publisher name -> when we connected, until its first sample
+        self.filters = ContentFilters() # what the subscribers want of each topic, from discovery
+        self.topic_ids = TopicIds() # the ids topics go by on the wire, when discovery gives them out
+        self.join_delays = [] # seconds from a publisher showing up to its first sample
 
     ####################################
     # Configure Broker MW
@@ -56,6 +84,8 @@ class BrokerMW():
 
             self.addr = args.addr
             self.port = args.port
+            self.zookeeper = args.zookeeper
+            self.watch_window = args.watch_window
 
             self.logger.debug("BrokerMW::configure - obtain ZMQ context")
             context = zmq.Context()
@@ -66,27 +96,160 @@ class BrokerMW():
 
             # Load all three sockets
             self.logger.debug("BrokerMW::configure - obtain REQ and PUB sockets")
-            self.req = context.socket(zmq.REQ)
             self.sub = context.socket(zmq.SUB)
-            self.pub = context.socket(zmq.PUB)
-     
-            self.logger.debug("BrokerMW::configure - register the REQ socket for incoming replies")
-            self.poller.register(self.req, zmq.POLLIN)
+            # XPUB so we see subscriptions come in and can answer them from
+            # the last value cache. Verbose: every subscriber's subscription,
+            # not just the first one for a topic.
+            self.pub = context.socket(zmq.XPUB)
+            self.pub.setsockopt(zmq.XPUB_VERBOSE, 1)
 
             self.logger.debug("BrokerMW::configure - connect to Discovery service")
             
             connect_str = "tcp://" + args.discovery
-            self.req.connect (connect_str)
+
+            # If zookeeper is given, follow the discovery leader instead
+            watcher = None
+            if args.zookeeper:
+                from ZookeeperClient import LeaderWatcher
+                self.logger.debug("BrokerMW::configure - follow the discovery leader via zookeeper")
+                watcher = LeaderWatcher(self.logger, args.zookeeper, "/discovery/leader", context)
+                leader = watcher.wait(timeout=30)
+                if leader is not None:
+                    connect_str = "tcp://" + leader
+     
+            self.logger.debug("BrokerMW::configure - register the REQ socket for incoming replies")
+            self.req = LeaderReq(self.logger, context, self.poller, connect_str, watcher)
+            self.watcher = watcher
 
             self.logger.debug("BrokerMW::configure - bind to the pub socket")
             bind_string = "tcp://*:" + str(self.port)
             self.pub.bind (bind_string)
-            
+
+            # Side channels bind only where we are told to: brokers and
+            # publishers often run on consecutive ports of one host
+            if args.history > 0 and not args.history_port:
+                raise ValueError("--history needs --history_port")
+            if args.log_dir and not args.log_port:
+                raise ValueError("--log_dir needs --log_port")
+            if args.egress == "router" and not args.egress_port:
+                raise ValueError("--egress router needs --egress_port")
+            self.history_port = args.history_port if args.history > 0 else 0
+            self.log_port = args.log_port if args.log_dir else 0
+            self.egress_port = args.egress_port if args.egress == "router" else 0
+
+            if args.workers > 0:
+                if self.egress_port:
+                    raise ValueError("--egress router needs --workers 0")
+                # Worker processes forward (and keep the caches, history and
+                # log of their share of the topics); we only run the XSUB/XPUB
+                # proxy in front of them and route history and log reads
+                self.logger.debug("BrokerMW::configure - forward through {} worker processes".format(args.workers))
+                self.front = ShardedFront(self.logger, context, args, self.pub)
+                self.front.bind_routes(self.history_port, self.log_port)
+            else:
+                self.configure_data_path(context, args, self.history_port, self.log_port)
+
+                # Subscribers that want a queue of their own connect here
+                if self.egress_port:
+                    self.logger.debug("BrokerMW::configure - per subscriber queues of {} samples, drop {}".format(args.queue_limit, args.drop_policy))
+                    self.egress = RouterEgress(self.logger, context, args.queue_limit, args.drop_policy)
+                    self.egress.bind(self.egress_port)
+                    self.data_poller.register(self.egress.socket, zmq.POLLIN)
+
+            # Broker replicas elect a leader in zookeeper. Every replica is
+            # connected to the publishers but only the leader forwards.
+            # Brokers that discovery balances subscribers over all forward.
+            if args.zookeeper and not args.no_election:
+                from ZookeeperClient import ZK_Driver
+                zk_addr, zk_port = args.zookeeper.split(":")
+                self.logger.debug("BrokerMW::configure - connect to zookeeper for the broker election")
+                self.zk_client = ZK_Driver(self.logger, zk_addr, int(zk_port), zkTimeout=args.zk_timeout, electionRoot="/broker")
+                self.zk_client.init_driver()
+                self.zk_client.start_session()
+
             self.logger.info ("BrokerMW::configure completed")
 
         except Exception as e:
             raise e
 
+    ####################################
+    # Set up what consume and disseminate need besides the sockets
+    #
+    # history_bind and log_bind are ports, or endpoints for a worker process
+    ####################################
+    def configure_data_path(self, context, args, history_bind, log_bind):
+        ''' Poller, last value cache, history and log '''
+        try:
+            self.context = context
+
+            # consume () waits on data, subscriptions and history requests
+            self.data_poller = zmq.Poller()
+            self.data_poller.register(self.sub, zmq.POLLIN)
+            self.data_poller.register(self.pub, zmq.POLLIN)
+
+            # The newest sample of every topic goes to a subscriber as soon as
+            # it subscribes instead of with the next publication
+            if not args.no_last_value:
+                self.last_values = {}
+
+            # Keep the last samples we forwarded on every topic for late joiners.
+            if args.history > 0:
+                self.logger.debug("BrokerMW::configure_data_path - keep {} samples per topic of history".format(args.history))
+                self.history = HistoryService(self.logger, context, args.history)
+                self.history.bind(history_bind)
+                self.data_poller.register(self.history.socket, zmq.POLLIN)
+
+            # Durable log of everything we forward; subscribers read it from
+            # an offset or a time on the log port
+            if args.log_dir:
+                self.logger.debug("BrokerMW::configure_data_path - log forwarded samples under {}".format(args.log_dir))
+                self.topic_log = TopicLog(args.log_dir, args.segment_bytes, args.sync_every)
+                self.log_service = LogService(self.logger, context, self.topic_log)
+                self.log_service.bind(log_bind)
+                self.data_poller.register(self.log_service.socket, zmq.POLLIN)
+
+        except Exception as e:
+            raise e
+
+    ####################################
+    # Configure a worker process of a sharded broker (see BrokerShards.py)
+    #
+    # No discovery and no election: we publish into the front's XSUB socket
+    # and serve history and log reads the front routes to us.
+    ####################################
+    def configure_worker(self, args, frontend, history_bind, log_bind):
+        ''' Initialize the object as a broker worker '''
+        try:
+            self.logger.info("BrokerMW::configure_worker")
+            self.zookeeper = args.zookeeper
+            self.watch_window = args.watch_window
+
+            context = zmq.Context()
+            self.sub = context.socket(zmq.SUB)
+            self.pub = context.socket(zmq.XPUB)
+            self.pub.setsockopt(zmq.XPUB_VERBOSE, 1)
+            self.pub.connect(frontend)
+
+            self.configure_data_path(context, args, history_bind, log_bind)
+
+        except Exception as e:
+            raise e
+
+    ####################################
+    # Hand the publishers to the worker processes (sharded broker only)
+    ####################################
+    def start_workers(self, publishers, topiclist, watch=True):
+        ''' Start the worker processes; they forward only while we lead '''
+        self.front.lead(self.is_leader())
+        self.front.start([(publisher.addr, publisher.port) for publisher in publishers], topiclist, watch, self.filters.filters,
+                         list(self.topic_ids.ids.items()))
+
+    def workers_started(self):
+        return self.front.started
+
+    def lead_workers(self, leading):
+        self.front.lead(leading)
+
     ############################################
     # Run the event loop where we expect to receive a reply to a sent request
     #
@@ -105,9 +268,12 @@ class BrokerMW():
                     # Timeout has occurred
                     # Now it is time for application logic to take control again
                     timeout = self.upcall_obj.invoke_operation()
-                elif self.req in events:
+                elif self.req.socket in events:
                     # Handle the incoming reply from remote entity and return the result
                     timeout = self.handle_reply()
+                elif self.req.watch_socket in events:
+                    # The discovery leader changed
+                    timeout = self.req.redirect(timeout)
                 else:
                     raise Exception("Unknown event after poll")
             
@@ -131,6 +297,9 @@ class BrokerMW():
             reg_info.id = name  # our id
             reg_info.addr = self.addr  # our advertised IP addr where we are publishing
             reg_info.port = self.port # port on which we are publishing
+            reg_info.history_port = self.history_port # where late joiners get history
+            reg_info.log_port = self.log_port # where our log is read
+            reg_info.egress_port = self.egress_port # where subscribers get their own queue
             self.logger.debug("BrokerMW::register - done populating the Registrant Info")
 
             self.logger.debug("BrokerMW::register - PORT is " + str (reg_info.port))
@@ -145,6 +314,12 @@ class BrokerMW():
             register_req.topiclist[:] = topiclist   # this is how repeated entries are added (or use append() or extend ()
             self.logger.debug("BrokerMW::register - done populating nested RegisterReq")
 
+            # Discovery moves our subscribers elsewhere once our live node goes
+            if self.watcher is not None:
+                from ZookeeperClient import announce, LIVE_BROKERS
+                self.logger.debug("BrokerMW::register - announce ourselves under {}".format(LIVE_BROKERS))
+                announce(self.watcher.zk, LIVE_BROKERS, name, register_req.SerializeToString())
+
             # Build the outer layer DiscoveryReq message
             self.logger.debug("BrokerMW::register - build the outer DiscoveryReq message")
             disc_req = discovery_pb2.DiscoveryReq ()  # allocate
@@ -169,6 +344,30 @@ class BrokerMW():
         except Exception as e:
             raise e
 
+    ##########################################
+    # Join the broker leader election
+    #
+    # Without zookeeper there is a single broker which always leads.
+    ##########################################
+    def join_election(self, on_elected=None):
+        ''' Compete to be the forwarding broker '''
+
+        try:
+            if self.zk_client is None:
+                if on_elected is not None:
+                    on_elected()
+                return
+
+            self.logger.info("BrokerMW::join_election")
+            leader_value = bytes("{}:{}".format(self.addr, self.port), "utf-8")
+            self.zk_client.join_election(leader_value, on_elected)
+
+        except Exception as e:
+            raise e
+
+    def is_leader(self):
+        return self.zk_client is None or self.zk_client.is_leader
+
     ##########################################
     # Check if the system is ready
     #
@@ -228,6 +427,8 @@ class BrokerMW():
 
             # Check the type of reply
             if (disc_resp.msg_type == discovery_pb2.TYPE_REGISTER):
+                # topics come in and go out with these ids instead of their names
+                self.topic_ids.update((topic_id.topic, topic_id.id) for topic_id in disc_resp.register_resp.topic_ids)
                 timeout = self.upcall_obj.register_response(disc_resp.register_resp)
             elif(disc_resp.msg_type == discovery_pb2.TYPE_ISREADY):
                 timeout = self.upcall_obj.isready_response (disc_resp.isready_resp)
@@ -247,7 +448,7 @@ class BrokerMW():
     #
     # Disseminate data on the pub socket
     ####################################
-    def disseminate (self, id, topic, data, timestamp):
+    def disseminate (self, id, topic, data, timestamp, strength=0, seq=0, epoch=0):
     # def disseminate (self, publication):    
         ''' Disseminate the data '''
 
@@ -262,16 +463,24 @@ class BrokerMW():
 
             # Build the Publication message 
             publication = topic_pb2.Publication()
-            publication.topic = topic
-            publication.content = data
+            self.topic_ids.stamp(publication, topic) # its id if it has one, else its name
+            set_payload(publication, topic, data) # typed as the publisher sent it
             publication.pub_id = id
             publication.tstamp = timestamp # Use the time set at publisher level
+            publication.strength = strength # the owner's strength
+            publication.seq = seq # as the publisher numbered it
+            publication.epoch = epoch # in the publisher's current run
+
+            # None of the subscribers of the topic wants this sample
+            if not self.filters.passes(topic, data, publication.ByteSize()):
+                self.logger.debug("BrokerMW::disseminate - {} sample filtered out".format(topic))
+                return
 
             # self.logger.debug ("BrokerMW::disseminate - Built the Publication message to sent")
 
             self.logger.debug ("BrokerMW::disseminate - publication to send: ")
             self.logger.debug(publication)
-            self.logger.debug ("BrokerMW::disseminate - topic to send for: " + publication.topic,)
+            self.logger.debug ("BrokerMW::disseminate - topic to send for: " + topic,)
 
             # Serialize the publication
             buf2send = publication.SerializeToString()
@@ -285,7 +494,19 @@ class BrokerMW():
             self.logger.debug("BrokerMW::disseminate - Publish the stringified buffer")
             # send the info as bytes. See how we are providing an encoding of utf-8
             # self.pub.send(bytes(send_str, "utf-8"))
-            self.pub.send_multipart([bytes(publication.topic, "utf-8"), buf2send])
+            self.pub.send_multipart([self.topic_ids.envelope(topic), buf2send])
+
+            # remember the frame as sent for new subscribers and late joiners
+            if self.last_values is not None:
+                self.last_values[topic] = buf2send
+            if self.history is not None:
+                self.history.record(topic, buf2send)
+            if self.topic_log is not None:
+                self.topic_log.append(topic, buf2send)
+
+            # and to the subscribers with a queue of their own
+            if self.egress is not None:
+                self.egress.publish(topic, buf2send)
 
             self.logger.debug ("BrokerMW::disseminate complete")
         except Exception as e:
@@ -295,7 +516,7 @@ class BrokerMW():
     # Look up a list of publishers by the topic list
     #
     ################################################
-    def lookup_all_publishers(self):
+    def lookup_all_publishers(self, name):
         ''' Look up a list of publishers by topic list '''
         try:
             self.logger.debug("BrokerMW::lookup_all_publishers")
@@ -303,6 +524,7 @@ class BrokerMW():
             # Build the inner LookupAllPubReq  message
             self.logger.debug("BrokerMW::lookup_all_publishers - populate the nested LookupAllPubReq msg")
             lookup_req = discovery_pb2.LookupAllPubReq()  
+            lookup_req.id = name # in a broker tree discovery answers with our parent
             self.logger.debug("BrokerMW::lookup_all_publishers - done populating nested LookupAllPubReq msg")
 
             # Build the outer layer Discovery message
@@ -336,9 +558,16 @@ class BrokerMW():
 
         for topic in topic_list:
             self.logger.debug("SubscriberMW::subscribe - Subscribing to topic {}".format(topic))
-            # Pass in the binary representation of the topic name to the subscribe socket
-            # Use UTF-8 encoding
-            self.sub.setsockopt(zmq.SUBSCRIBE, bytes(topic, "utf-8"))
+            # Pass in the binary representation of the topic to the subscribe socket:
+            # its id from discovery, else its name in UTF-8
+            self.sub.setsockopt(zmq.SUBSCRIBE, self.topic_ids.envelope(topic))
+
+    def unsubscribe(self, topic_list):
+        ''' Stop taking in a list of topics '''
+
+        for topic in topic_list:
+            self.logger.debug("BrokerMW::unsubscribe - Unsubscribing from topic {}".format(topic))
+            self.sub.setsockopt(zmq.UNSUBSCRIBE, self.topic_ids.envelope(topic))
 
 
     ##################################################
@@ -353,17 +582,104 @@ class BrokerMW():
             # Build connection string
             connect_str = "tcp://" + ip_address + ":" + str(port)
 
-            self.logger.debug("BrokerMW::connect_to_publisher - connecting to {}".format(connect_str))
-            self.sub.connect(connect_str)
+            # a second connect to the same endpoint would duplicate its samples
+            if connect_str not in self.connected:
+                self.logger.debug("BrokerMW::connect_to_publisher - connecting to {}".format(connect_str))
+                self.sub.connect(connect_str)
+                self.connected.add(connect_str)
 
             # Specify which topics we are subscribing to on this socket
             for topic in topiclist:
-                self.sub.subscribe(topic)
+                self.sub.subscribe(self.topic_ids.envelope(topic))
                 self.logger.debug("BrokerMW::connect_to_publisher - Connecting to {} for topic {}".format(connect_str, topic))
 
         except Exception as e:
             raise e
 
+    ####################################################
+    # Follow the live publishers in zookeeper
+    #
+    # Publishers that join after our lookup get connected and ones whose
+    # session ends get disconnected, from consume (), between two samples.
+    # client is a Coordination session to use instead of one to zookeeper.
+    ####################################################
+    def watch_publishers(self, topiclist, client=None):
+        ''' Connect and disconnect publishers as they come and go '''
+        try:
+            if self.zookeeper is None and client is None:
+                return
+
+            from ZookeeperClient import MembershipFeed, LIVE_PUBLISHERS
+            self.logger.debug("BrokerMW::watch_publishers - follow {}".format(LIVE_PUBLISHERS))
+            self.watched_topics = list(topiclist)
+            self.membership = MembershipFeed(self.logger, self.zookeeper, LIVE_PUBLISHERS, self.context,
+                                             window=self.watch_window, client=client)
+            self.data_poller.register(self.membership.socket, zmq.POLLIN)
+
+        except Exception as e:
+            raise e
+
+    def apply_membership(self):
+        ''' Apply the publisher joins and leaves seen since last time '''
+        try:
+            for seen_at, added, removed in self.membership.changes():
+                for name, value in added.items():
+                    reg_req = discovery_pb2.RegisterReq()
+                    reg_req.ParseFromString(value)
+                    topics = [topic for topic in self.watched_topics if topic in reg_req.topiclist]
+                    if not topics:
+                        continue
+
+                    endpoint = "tcp://{}:{}".format(reg_req.info.addr, reg_req.info.port)
+                    moved_from = self.members.get(name)
+                    if moved_from not in (None, endpoint) and moved_from in self.connected:
+                        # came back elsewhere within the window
+                        self.logger.info("BrokerMW::apply_membership - publisher {} moved, disconnect {}".format(name, moved_from))
+                        self.sub.disconnect(moved_from)
+                        self.connected.discard(moved_from)
+                    if endpoint not in self.connected:
+                        self.logger.info("BrokerMW::apply_membership - publisher {} joined at {}".format(name, endpoint))
+                        self.awaiting[name] = seen_at
+                    self.connect_to_publisher(reg_req.info.addr, reg_req.info.port, topics)
+                    self.members[name] = endpoint
+
+                for name in removed:
+                    endpoint = self.members.pop(name, None)
+                    self.awaiting.pop(name, None)
+                    if endpoint in self.connected:
+                        self.logger.info("BrokerMW::apply_membership - publisher {} left, disconnect {}".format(name, endpoint))
+                        self.sub.disconnect(endpoint)
+                        self.connected.discard(endpoint)
+
+        except Exception as e:
+            raise e
+
+    ####################################################
+    # A subscription (or unsubscription) came in on the XPUB socket
+    #
+    # Subscriptions are prefixes, as in ZMQ. On a subscription we send out
+    # the cached sample of every matching topic. XPUB cannot address one
+    # subscriber, so the others on that topic get it again; subscribers
+    # drop samples they have already seen.
+    ####################################################
+    def handle_subscription(self):
+        ''' Answer a new subscription from the last value cache '''
+        try:
+            event = self.pub.recv()
+            if not event or event[0] != 1 or self.last_values is None:
+                return
+
+            prefix = event[1:]
+            for topic, frame in self.last_values.items():
+                envelope = self.topic_ids.envelope(topic)
+                if envelope.startswith(prefix):
+                    self.logger.debug("BrokerMW::handle_subscription - send the last value of {}".format(topic))
+                    self.pub.send_multipart([envelope, frame])
+                    self.lvc_sent += 1
+
+        except Exception as e:
+            raise e
+
     ####################################################
     # Consume data from the publishers we have subscribed to
     #
@@ -373,6 +689,23 @@ class BrokerMW():
         ''' Consume messages sent from the publishers we subscribe to '''
         try:
             self.logger.debug("SubscriberMW::consume - Consume from our configured sub socket")
+
+            # Answer new subscribers and late joiners while we wait for the
+            # next publication
+            while True:
+                events = dict(self.data_poller.poll())
+                if self.pub in events:
+                    self.handle_subscription()
+                if self.history is not None and self.history.socket in events:
+                    self.history.serve()
+                if self.log_service is not None and self.log_service.socket in events:
+                    self.log_service.serve()
+                if self.membership is not None and self.membership.socket in events:
+                    self.apply_membership()
+                if self.egress is not None and self.egress.socket in events:
+                    self.egress.serve(self.last_values)
+                if self.sub in events:
+                    break
             
             # bytesReceived = self.sub.recv_string()
             bytesReceived = self.sub.recv_multipart()
@@ -385,6 +718,13 @@ class BrokerMW():
             # Decode the data 
             publication = topic_pb2.Publication()
             publication.ParseFromString(publicationBytes)
+            self.topic_ids.restore(publication)
+
+            # the first sample of a publisher that joined while we were running
+            if publication.pub_id in self.awaiting:
+                delay = time.time() - self.awaiting.pop(publication.pub_id)
+                self.join_delays.append(delay)
+                self.logger.info("BrokerMW::consume - data from {} flowing {:.1f} ms after it joined".format(publication.pub_id, delay * 1000))
     
             # self.logger.debug("SubscriberMW::consume - Received " + publication.content)
 
@@ -395,6 +735,15 @@ class BrokerMW():
         except Exception as e:
             raise e
 
+    ########################################
+    # the content filters of the subscribers, as discovery gave them
+    ########################################
+    def set_filters(self, filters):
+        ''' Forward only what passes the subscribers' content filters '''
+        self.filters = ContentFilters((f.topic, f.op, f.values) for f in filters)
+        if self.filters.filters:
+            self.logger.info("BrokerMW::set_filters - forwarding only what passes {}".format(self.filters.filters))
+
     ########################################
     # set upcall handle
     #
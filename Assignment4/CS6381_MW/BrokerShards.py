@@ -0,0 +1,212 @@
+###############################################
+#
+# Purpose: A broker spread over several processes
+#
+# The broker loop is single threaded Python, so one core caps how much it
+# can forward. With BrokerAppln --workers N the broker process becomes a
+# front and N worker processes do the forwarding:
+#
+#   publishers --> worker i (SUB, only topics with shard_of (topic) == i)
+#              --> front XSUB (ipc) == zmq.proxy ==> front XPUB (the broker's
+#                                                    port) --> subscribers
+#
+# Subscriptions travel the other way through the proxy, so each worker's
+# XPUB still sees them and answers from its last value cache. A worker is a
+# BrokerMW (configure_worker) running the same consume / arbitrate /
+# disseminate loop as BrokerAppln, so ownership, history and the log all
+# work per topic as before. The front keeps the advertised history and log
+# ports and routes every request to the worker(s) owning the topics.
+#
+# A standby broker runs its workers too: they stay connected to the
+# publishers and keep arbitrating ownership, but disseminate only while the
+# front tells them it leads (ShardedFront.lead ()).
+#
+###############################################
+
+import os
+import zlib
+import logging
+import tempfile
+import threading
+import multiprocessing
+
+import zmq
+
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import OwnershipArbiter, ContentFilters, payload_value
+
+##################################
+# Which worker owns a topic; the same in every process (unlike hash ())
+##################################
+def shard_of(topic, workers):
+    return zlib.crc32(bytes(topic, "utf-8")) % workers
+
+
+##################################
+# A worker process
+##################################
+def run_worker(index, args, frontend, history_bind, log_bind, publishers, topics, watch, filters, topic_ids, leading):
+    # spawned, so logging starts from scratch
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger("BrokerWorker{}".format(index))
+    logger.setLevel(args.loglevel)
+
+    from CS6381_MW.BrokerMW import BrokerMW
+    mw_obj = BrokerMW(logger)
+    mw_obj.configure_worker(args, frontend, history_bind, log_bind)
+    mw_obj.filters = ContentFilters(filters)
+    mw_obj.topic_ids.update(topic_ids)
+    for addr, port in publishers:
+        mw_obj.connect_to_publisher(addr, port, topics)
+    if watch:
+        mw_obj.watch_publishers(topics)
+    logger.info("run_worker - worker {} forwards {}".format(index, topics))
+
+    # what BrokerAppln does in its ACTIVE state; a standby's workers drain
+    # and arbitrate, but only the leader's forward
+    arbiter = OwnershipArbiter(args.ownership_threshold)
+    while True:
+        publication = mw_obj.consume()
+        admitted = arbiter.admit(publication.topic, publication.pub_id, publication.strength, publication.ByteSize())
+        if admitted and leading.is_set():
+            mw_obj.disseminate(publication.pub_id, publication.topic, payload_value(publication), publication.tstamp, publication.strength,
+                               publication.seq, publication.epoch)
+
+
+##################################
+# The front: proxy, request routing and the worker processes
+##################################
+class ShardedFront():
+
+    def __init__(self, logger, context, args, xpub):
+        self.logger = logger
+        self.context = context
+        self.args = args
+        self.workers = args.workers
+        self.name = "cs6381-broker-{}-{}".format(os.getpid(), args.port)
+        self.xpub = xpub # the broker's public XPUB socket
+        self.xsub = context.socket(zmq.XSUB)
+        self.frontend = self.endpoint("front")
+        self.xsub.bind(self.frontend)
+        self.history_router = None # ROUTER on the advertised history port
+        self.log_router = None # ROUTER on the advertised log port
+        self.spawn = multiprocessing.get_context("spawn")
+        self.leading = self.spawn.Event() # set while the workers forward
+        self.processes = []
+        self.started = False
+
+    def endpoint(self, name):
+        return "ipc://" + os.path.join(tempfile.gettempdir(), "{}-{}".format(self.name, name))
+
+    def bind_routes(self, history_port, log_port):
+        if history_port:
+            self.history_router = self.context.socket(zmq.ROUTER)
+            self.history_router.bind("tcp://*:" + str(history_port))
+        if log_port:
+            self.log_router = self.context.socket(zmq.ROUTER)
+            self.log_router.bind("tcp://*:" + str(log_port))
+
+    ##################################
+    # Start the proxy and one process per shard
+    #
+    # publishers are (addr, port) pairs; with watch the workers also follow
+    # publishers joining and leaving (not when the "publisher" is our parent
+    # in a broker tree); filters are the subscribers' content filters as
+    # (topic, op, values), topic_ids (name, id) pairs from discovery
+    ##################################
+    def start(self, publishers, topiclist, watch=True, filters=(), topic_ids=()):
+        self.logger.info("ShardedFront::start - {} workers".format(self.workers))
+
+        threading.Thread(target=zmq.proxy, args=(self.xsub, self.xpub), daemon=True).start()
+
+        # spawn, not fork: a forked child would share our ZMQ context
+        for index in range(self.workers):
+            topics = [topic for topic in topiclist if shard_of(topic, self.workers) == index]
+            process = self.spawn.Process(target=run_worker, daemon=True,
+                                    args=(index, self.args, self.frontend, self.endpoint("history-{}".format(index)),
+                                          self.endpoint("log-{}".format(index)), publishers, topics, watch, list(filters), list(topic_ids),
+                                          self.leading))
+            process.start()
+            self.processes.append(process)
+
+        if self.history_router is not None or self.log_router is not None:
+            threading.Thread(target=self.route, daemon=True).start()
+
+        self.started = True
+
+    def lead(self, leading):
+        ''' Have the workers forward, or only drain as a standby '''
+        if leading != self.leading.is_set():
+            self.logger.info("ShardedFront::lead - workers {}".format("forward" if leading else "drain only"))
+            if leading:
+                self.leading.set()
+            else:
+                self.leading.clear()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    ##################################
+    # Route history and log requests to the workers owning the topics
+    #
+    # Runs on its own thread, which owns the ROUTER and worker REQ sockets.
+    ##################################
+    def route(self):
+        poller = zmq.Poller()
+        for router in (self.history_router, self.log_router):
+            if router is not None:
+                poller.register(router, zmq.POLLIN)
+        worker_reqs = {} # endpoint -> REQ socket
+
+        def ask(endpoint, buf):
+            req = worker_reqs.get(endpoint)
+            if req is None:
+                req = worker_reqs[endpoint] = self.context.socket(zmq.REQ)
+                req.connect(endpoint)
+            req.send(buf)
+            if not req.poll(timeout=2000):
+                # the worker is gone; a REQ socket cannot send again unanswered
+                req.close(linger=0)
+                del worker_reqs[endpoint]
+                return None
+            return req.recv()
+
+        while True:
+            events = dict(poller.poll())
+
+            if self.history_router in events:
+                identity, empty, buf = self.history_router.recv_multipart()
+                history_req = topic_pb2.HistoryReq()
+                history_req.ParseFromString(buf)
+
+                # split the topics by shard and merge the answers
+                shards = {}
+                for topic in history_req.topiclist:
+                    shards.setdefault(shard_of(topic, self.workers), []).append(topic)
+                history_resp = topic_pb2.HistoryResp()
+                for index, topics in shards.items():
+                    part = topic_pb2.HistoryReq()
+                    part.topiclist[:] = topics
+                    part.depth = history_req.depth
+                    reply = ask(self.endpoint("history-{}".format(index)), part.SerializeToString())
+                    if reply is not None:
+                        part_resp = topic_pb2.HistoryResp()
+                        part_resp.ParseFromString(reply)
+                        history_resp.samples.extend(part_resp.samples)
+                self.history_router.send_multipart([identity, empty, history_resp.SerializeToString()])
+
+            if self.log_router in events:
+                identity, empty, buf = self.log_router.recv_multipart()
+                fetch_req = topic_pb2.FetchReq()
+                fetch_req.ParseFromString(buf)
+
+                # a fetch is for one topic; pass it through as is
+                reply = ask(self.endpoint("log-{}".format(shard_of(fetch_req.topic, self.workers))), buf)
+                if reply is None:
+                    fetch_resp = topic_pb2.FetchResp()
+                    fetch_resp.topic = fetch_req.topic
+                    reply = fetch_resp.SerializeToString()
+                self.log_router.send_multipart([identity, empty, reply])
@@ -16,6 +16,12 @@
 # all our middleware objects. Make sure then to import this file in those files once
 # some content is added here that is needed by others. 
 
+import zmq
+import struct
+from collections import deque
+
+from CS6381_MW import topic_pb2
+
 # Combine the data models into one entity with a role variale
 class Entity:
 
@@ -24,13 +30,637 @@ class Entity:
         self.name = None
         self.ip_address = None
         self.port = None
+        self.history_port = 0 # where late joiners ask for history, 0 if nowhere
+        self.log_port = 0 # where the broker's durable log is read, 0 if nowhere
+        self.egress_port = 0 # where the broker gives subscribers a queue of their own, 0 if nowhere
         self.topic_list = None
+        self.filters = [] # a subscriber's content filters, (topic, op, values)
 
 # Use constants instead of magic strings
 class Constants:
 
     DISSEMINATION_STRATEGY_DIRECT = "Direct"
     DISSEMINATION_STRATEGY_BROKER = "Broker"
+    DISSEMINATION_STRATEGY_HYBRID = "Hybrid"
 
     def __init__(self):
-        pass
\ No newline at end of file
+        pass
+
+# A REQ socket to the discovery service that follows the discovery leader.
+#
+# Without a watcher it is just a REQ socket. With a LeaderWatcher (see
+# ZookeeperClient.py) the middleware registers "watch_socket" in its poller
+# and calls redirect () when it fires; we then reconnect to the new leader and
+# resend the request that the old leader never answered (the "lazy pirate"
+# pattern), so clients survive a discovery failover without re-registering.
+class LeaderReq:
+
+    def __init__(self, logger, context, poller, connect_str, watcher=None):
+        self.logger = logger
+        self.context = context
+        self.poller = poller
+        self.watcher = watcher
+        self.watch_socket = None
+        self.socket = None
+        self.connect_str = None
+        self.outstanding = None # serialized request still awaiting a reply
+        self.resent = 0 # requests the old leader swallowed
+        self.redirects = 0
+
+        if watcher is not None:
+            self.watch_socket = watcher.socket
+            self.poller.register(self.watch_socket, zmq.POLLIN)
+
+        self.connect(connect_str)
+
+    def connect(self, connect_str):
+        if self.socket is not None:
+            self.poller.unregister(self.socket)
+            self.socket.close(linger=0)
+
+        self.connect_str = connect_str
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.connect(connect_str)
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def send(self, buf):
+        self.outstanding = buf
+        self.socket.send(buf)
+
+    def recv(self):
+        buf = self.socket.recv()
+        self.outstanding = None
+        return buf
+
+    # Returns the timeout the event loop should use next
+    def redirect(self, timeout):
+        leader = self.watcher.latest()
+        if leader is None or "tcp://" + leader == self.connect_str:
+            return timeout
+
+        self.logger.info("LeaderReq::redirect - discovery leader is now {}".format(leader))
+        self.redirects += 1
+        self.connect("tcp://" + leader)
+
+        if self.outstanding is not None:
+            self.logger.info("LeaderReq::redirect - resending the unanswered request")
+            self.resent += 1
+            self.socket.send(self.outstanding)
+            # still waiting on that reply
+            return None
+
+        return timeout
+
+# Exclusive ownership of a topic: of the publishers on a topic only the one
+# with the highest ownership strength is delivered. admit () is called once
+# per sample; samples from weaker publishers are dropped and counted. If one of
+# them gets "threshold" samples in while the owner is quiet, it takes the topic
+# over (and a stronger publisher takes it straight back on its next sample).
+# Counting per publisher keeps a burst from several weak publishers from
+# passing for a dead owner. Equal strength does not displace the owner.
+#
+# The broker runs this before forwarding so the weaker samples never reach the
+# subscribers; with direct dissemination the subscriber runs it itself.
+class OwnershipArbiter:
+
+    def __init__(self, threshold=5):
+        self.threshold = threshold
+        self.owners = {} # topic -> (pub_id, strength)
+        self.ignores = {} # topic -> {pub_id: samples since the owner was last heard}
+        # counters
+        self.admitted = 0
+        self.dropped = 0
+        self.admitted_bytes = 0
+        self.dropped_bytes = 0
+        self.handovers = 0
+
+    def admit(self, topic, pub_id, strength, size=0):
+        owner = self.owners.get(topic)
+
+        if owner is None or owner[0] == pub_id or strength > owner[1]:
+            if owner is not None and owner[0] != pub_id:
+                self.handovers += 1
+            self.owners[topic] = (pub_id, strength)
+            self.ignores[topic] = {}
+        elif self.ignores[topic].get(pub_id, 0) + 1 >= self.threshold:
+            # the owner has gone quiet, hand the topic over
+            self.handovers += 1
+            self.owners[topic] = (pub_id, strength)
+            self.ignores[topic] = {}
+        else:
+            self.ignores[topic][pub_id] = self.ignores[topic].get(pub_id, 0) + 1
+            self.dropped += 1
+            self.dropped_bytes += size
+            return False
+
+        self.admitted += 1
+        self.admitted_bytes += size
+        return True
+
+    def owner(self, topic):
+        owner = self.owners.get(topic)
+        return owner[0] if owner is not None else None
+
+# Loss, duplicates and reordering from sequence numbers. Every publisher
+# numbers its samples per topic from 1 (Publication.seq; 0 is not
+# numbered). Per (pub_id, topic) we keep the highest number seen and a bitmap
+# of which of the "window" numbers below it came in, so each sample costs a
+# shift and a mask:
+#
+#   above the highest: the numbers skipped are counted missing
+#   in the window, seen: a duplicate
+#   in the window, not seen: reordered, and no longer missing
+#   below the window: late; it was counted missing and stays so
+#
+# A stream starts at the first sample we get, so what was sent before we
+# joined is not missing (but see "first" for how late we came in).
+# observe () is False for a duplicate, so the tracker also dedupes; a late
+# or unnumbered sample cannot be told from one and counts as new.
+#
+# A publisher that restarts under the same pub_id numbers from 1 again, in
+# a new epoch (Publication.epoch, its start time): a newer epoch starts the
+# stream over, and a sample of an older one still in flight counts late.
+class SequenceTracker:
+
+    RECEIVED, MISSING, DUPLICATES, REORDERED, LATE = range(5)
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.streams = {} # (pub_id, topic) -> [highest, bitmap, first, epoch]
+        self.counts = {} # (pub_id, topic) -> [received, missing, duplicates, reordered, late]
+
+    def observe(self, pub_id, topic, seq, epoch=0):
+        if seq == 0:
+            return True
+        key = (pub_id, topic)
+        stream = self.streams.get(key)
+        if stream is None or epoch > stream[3]:
+            # a new stream, or the publisher restarted: counts carry on
+            self.streams[key] = [seq, 1, seq, epoch]
+            counts = self.counts.setdefault(key, [0, 0, 0, 0, 0])
+            counts[self.RECEIVED] += 1
+            return True
+
+        counts = self.counts[key]
+        highest, bitmap = stream[0], stream[1]
+        if epoch < stream[3]:
+            counts[self.LATE] += 1
+        elif seq > highest:
+            counts[self.MISSING] += seq - highest - 1
+            stream[0] = seq
+            stream[1] = ((bitmap << (seq - highest)) | 1) & self.mask
+        elif highest - seq >= self.window:
+            counts[self.LATE] += 1
+        elif bitmap >> (highest - seq) & 1:
+            counts[self.DUPLICATES] += 1
+            return False
+        else:
+            stream[1] = bitmap | (1 << (highest - seq))
+            # from before the stream started it was never counted missing
+            if seq > stream[2]:
+                counts[self.MISSING] -= 1
+                counts[self.REORDERED] += 1
+        counts[self.RECEIVED] += 1
+        return True
+
+    def first(self, pub_id, topic):
+        stream = self.streams.get((pub_id, topic))
+        return stream[2] if stream is not None else None
+
+    def totals(self):
+        ''' [received, missing, duplicates, reordered, late] over all streams '''
+        return [sum(counts[i] for counts in self.counts.values()) for i in range(5)]
+
+# The subscriptions and connections of one SUB socket. A ZMQ subscription
+# belongs to the socket, not to a connection: one subscribe () goes to every
+# publisher the socket is connected to, now or later. So we subscribe to a
+# topic once, however many publishers we take it from, and count who wants
+# it. set () gives the topics we want from an endpoint (None for the socket
+# as a whole) and connects, subscribes, unsubscribes and disconnects only
+# what changed; move () takes an endpoint's topics over to another. "calls"
+# counts the (un)subscribe () calls made, "saved" the subscribe () calls
+# one per topic per endpoint would have made on top.
+class SubscriptionManager:
+
+    def __init__(self, logger, socket):
+        self.logger = logger
+        self.socket = socket
+        self.endpoints = {} # endpoint (or None) -> set of topics we want from it
+        self.refs = {} # topic -> endpoints wanting it
+        self.calls = 0
+        self.saved = 0
+
+    def set(self, endpoint, topiclist):
+        old = self.endpoints.get(endpoint, set())
+        new = set(topiclist)
+        if new and not old and endpoint is not None:
+            self.logger.debug("SubscriptionManager::set - connect to {}".format(endpoint))
+            self.socket.connect(endpoint)
+        for topic in sorted(new - old):
+            self.add(topic)
+        for topic in sorted(old - new):
+            self.release(topic)
+        if new:
+            self.endpoints[endpoint] = new
+        elif old:
+            del self.endpoints[endpoint]
+            if endpoint is not None:
+                self.logger.debug("SubscriptionManager::set - disconnect from {}".format(endpoint))
+                self.socket.disconnect(endpoint)
+
+    def drop(self, endpoint):
+        self.set(endpoint, [])
+
+    def move(self, old, new):
+        ''' Take old's topics from new instead; no subscription changes '''
+        topics = self.endpoints.get(old)
+        if topics is None or old == new:
+            return
+        merged = self.endpoints.get(new)
+        if merged is None:
+            self.socket.connect(new)
+            merged = self.endpoints[new] = set()
+        self.socket.disconnect(old)
+        del self.endpoints[old]
+        # wanted from one endpoint fewer now, still subscribed
+        for topic in topics & merged:
+            self.refs[topic] -= 1
+        merged |= topics
+
+    def add(self, topic):
+        self.refs[topic] = self.refs.get(topic, 0) + 1
+        if self.refs[topic] == 1:
+            self.socket.subscribe(topic)
+            self.calls += 1
+        else:
+            self.saved += 1
+
+    def release(self, topic):
+        self.refs[topic] -= 1
+        if self.refs[topic] == 0:
+            del self.refs[topic]
+            self.socket.unsubscribe(topic)
+            self.calls += 1
+
+    def topics(self):
+        return sorted(self.refs)
+
+# Compact topic ids (DiscoveryAppln --topic_ids). Discovery numbers topic
+# names from 1 as they first register and hands every registrant the ids
+# of its topics. A sample then goes out with its id as a fixed size binary
+# envelope and in Publication.topic_id, without its name; fixed size keeps
+# ZMQ's prefix matching of the envelope exact. Receivers restore () the
+# name right after parsing, so everything above the socket still goes by
+# name. A topic without an id goes by name as before, so senders and
+# receivers that never asked discovery keep working.
+TOPIC_ID = struct.Struct(">I")
+
+class TopicIds:
+
+    def __init__(self, pairs=()):
+        self.ids = {} # name -> id
+        self.names = {} # id -> name
+        self.envelopes = {} # name -> envelope
+        self.by_envelope = {} # envelope -> name
+        self.next_id = 1 # what assign () gives the next new name
+        self.update(pairs)
+
+    def update(self, pairs):
+        for name, topic_id in pairs:
+            self.ids[name] = topic_id
+            self.names[topic_id] = name
+            envelope = TOPIC_ID.pack(topic_id)
+            self.envelopes[name] = envelope
+            self.by_envelope[envelope] = name
+            self.next_id = max(self.next_id, topic_id + 1)
+
+    def assign(self, topiclist):
+        ''' Discovery: the ids of topiclist, numbering the new names '''
+        for topic in topiclist:
+            if topic not in self.ids:
+                self.update([(topic, self.next_id)])
+        return [self.ids[topic] for topic in topiclist]
+
+    def envelope(self, topic):
+        envelope = self.envelopes.get(topic)
+        return envelope if envelope is not None else bytes(topic, "utf-8")
+
+    def name(self, envelope):
+        name = self.by_envelope.get(envelope)
+        return name if name is not None else envelope.decode("utf-8")
+
+    def stamp(self, publication, topic):
+        topic_id = self.ids.get(topic)
+        if topic_id is None:
+            publication.topic = topic
+        else:
+            publication.topic_id = topic_id
+
+    def restore(self, publication):
+        if publication.topic_id and not publication.topic:
+            publication.topic = self.names.get(publication.topic_id, "")
+        return publication
+
+# Typed payloads. A Publication carries its value in one field of its
+# "payload" oneof, chosen by the value's type: a float goes in real, an int
+# in integer, bytes in raw, and a word of a topic with an enum of its own
+# (weather, airquality, location) in that enum; any other string stays text
+# in content. payload_value () gives the value back as it was set, enums as
+# their (lower case) word, so publishers, brokers and subscribers filter
+# and log the same values and numbers are never formatted or parsed.
+PAYLOAD_WORDS = {} # enum field -> {word: number}
+PAYLOAD_NAMES = {} # enum field -> {number: word}
+for field in topic_pb2.Publication.DESCRIPTOR.oneofs_by_name["payload"].fields:
+    if field.enum_type is not None:
+        PAYLOAD_WORDS[field.name] = {value.name.lower(): value.number for value in field.enum_type.values}
+        PAYLOAD_NAMES[field.name] = {value.number: value.name.lower() for value in field.enum_type.values}
+
+def set_payload(publication, topic, value):
+    if isinstance(value, str):
+        number = PAYLOAD_WORDS.get(topic, {}).get(value)
+        if number is None:
+            publication.content = value
+        else:
+            setattr(publication, topic, number)
+    elif isinstance(value, bytes):
+        publication.raw = value
+    elif isinstance(value, float):
+        publication.real = value
+    else:
+        publication.integer = value
+
+def payload_value(publication):
+    field = publication.WhichOneof("payload")
+    if field is None:
+        return ""
+    value = getattr(publication, field)
+    names = PAYLOAD_NAMES.get(field)
+    return names.get(value, str(value)) if names is not None else value
+
+def payload_text(publication):
+    ''' The value as text, for results files and logs '''
+    value = payload_value(publication)
+    if isinstance(value, str):
+        return value
+    return value.hex() if isinstance(value, bytes) else str(value)
+
+# Content filters: a subscriber's condition on the content of a topic's
+# samples, written "<topic> <op> <values>" (SubscriberAppln --filter):
+#
+#   temperature > 90           <, <=, >, >=, ==, !=
+#   humidity range 20 40       from the first value to the second, inclusive
+#   weather in sunny cloudy    one of the values
+#
+# Values that all read as numbers compare as numbers (a payload that is not
+# one is filtered out), others as words regardless of case (the enum names
+# are lowercase). parse_filter () checks the text and returns (topic, op,
+# values), the form filters travel in through discovery.
+FILTER_OPS = ("<", "<=", ">", ">=", "==", "!=", "range", "in")
+
+def parse_filter(text):
+    words = text.split()
+    if len(words) < 3 or words[1] not in FILTER_OPS:
+        raise ValueError("Content filter '{}' is not <topic> <op> <values>, op one of {}".format(text, " ".join(FILTER_OPS)))
+    topic, op, values = words[0], words[1], tuple(words[2:])
+    if (op == "range" and len(values) != 2) or (op not in ("range", "in") and len(values) != 1):
+        raise ValueError("Content filter '{}' has the wrong number of values for {}".format(text, op))
+    return topic, op, values
+
+def compile_filter(op, values):
+    ''' A predicate on a sample's payload value; a value of another kind never matches '''
+    # numbers compare with real and integer payloads only, words with text
+    # and enum payloads only; nothing is converted, so raw bytes or text
+    # under a numeric filter are no match rather than an error. Words match
+    # regardless of case: "Sunny" is the enum's "sunny"
+    try:
+        values = [float(value) for value in values]
+        kinds = (int, float)
+        fold = lambda content: content
+    except ValueError:
+        values = [value.lower() for value in values]
+        kinds = (str,)
+        fold = str.lower
+
+    if op == "in":
+        wanted = set(values)
+        test = lambda content: content in wanted
+    elif op == "range":
+        low, high = values
+        test = lambda content: low <= content <= high
+    else:
+        value = values[0]
+        test = {"<": lambda content: content < value,
+                "<=": lambda content: content <= value,
+                ">": lambda content: content > value,
+                ">=": lambda content: content >= value,
+                "==": lambda content: content == value,
+                "!=": lambda content: content != value}[op]
+
+    def predicate(content):
+        if not isinstance(content, kinds) or isinstance(content, bool):
+            return False
+        return test(fold(content))
+    return predicate
+
+# The filters a sender (publisher or broker) applies before sending. A PUB
+# socket sends a sample to every subscriber of its topic alike, so for each
+# topic we get every filter of its subscribers and send what any of them
+# passes; a topic without filters goes out whole (discovery leaves out the
+# filters of a topic one of its subscribers takes whole). A subscriber runs
+# its own filters on what comes in, as others' filters let more through.
+class ContentFilters:
+
+    def __init__(self, filters=()):
+        self.predicates = {} # topic -> predicates, any of which passes a sample
+        self.filters = [] # (topic, op, values) as given
+        # counters
+        self.passed = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        for topic, op, values in filters:
+            self.add(topic, op, values)
+
+    def add(self, topic, op, values):
+        self.predicates.setdefault(topic, []).append(compile_filter(op, values))
+        self.filters.append((topic, op, tuple(values)))
+
+    def passes(self, topic, content, size=0):
+        predicates = self.predicates.get(topic)
+        if predicates is None or any(predicate(content) for predicate in predicates):
+            self.passed += 1
+            return True
+        self.dropped += 1
+        self.dropped_bytes += size
+        return False
+
+# Spreads subscribers over brokers that all forward everything (brokers run
+# with --no_election). Until the first broker has "threshold" subscribers
+# everybody goes there; after that a new subscriber goes to the broker with
+# the fewest (the earliest joined on a tie). A broker joining takes
+# subscribers from the fullest brokers until it is level with them; the
+# subscribers of a broker that leaves spread over the rest. add_broker and
+# remove_broker return the moves as {subscriber: new broker or None}.
+class BrokerBalancer:
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.brokers = {} # broker name -> set of subscriber names, in join order
+        self.assignment = {} # subscriber name -> broker name
+        self.moves = 0 # subscribers moved by a join or a leave
+
+    def load(self):
+        return {broker: len(subscribers) for broker, subscribers in self.brokers.items()}
+
+    def place(self, subscriber, broker):
+        previous = self.assignment.get(subscriber)
+        if previous is not None and previous in self.brokers:
+            self.brokers[previous].discard(subscriber)
+        self.assignment[subscriber] = broker
+        self.brokers[broker].add(subscriber)
+
+    def least_loaded(self):
+        return min(self.brokers, key=lambda broker: len(self.brokers[broker]))
+
+    def assign(self, subscriber):
+        broker = self.assignment.get(subscriber)
+        if broker is not None or not self.brokers:
+            return broker
+
+        first = next(iter(self.brokers))
+        if len(self.brokers[first]) < self.threshold:
+            broker = first
+        else:
+            broker = self.least_loaded()
+        self.place(subscriber, broker)
+        return broker
+
+    def release(self, subscriber):
+        broker = self.assignment.pop(subscriber, None)
+        if broker is not None and broker in self.brokers:
+            self.brokers[broker].discard(subscriber)
+
+    def add_broker(self, broker):
+        moves = {}
+        if broker in self.brokers:
+            return moves
+        self.brokers[broker] = set()
+
+        # nobody moves while everybody still fits on the first broker
+        if len(self.assignment) <= self.threshold:
+            return moves
+        while True:
+            fullest = max(self.brokers, key=lambda name: len(self.brokers[name]))
+            if len(self.brokers[fullest]) - len(self.brokers[broker]) <= 1:
+                break
+            subscriber = min(self.brokers[fullest])
+            self.place(subscriber, broker)
+            moves[subscriber] = broker
+        self.moves += len(moves)
+        return moves
+
+    def remove_broker(self, broker):
+        moves = {}
+        for subscriber in sorted(self.brokers.pop(broker, ())):
+            del self.assignment[subscriber]
+            moves[subscriber] = self.assign(subscriber)
+        self.moves += len(moves)
+        return moves
+
+# Brokers in a tree (DiscoveryAppln --tree_fanout). In the order they
+# registered, broker i subscribes to broker (i - 1) // fanout instead of to
+# the publishers, so every broker sends a sample to at most "fanout" child
+# brokers plus its own subscribers. Returns the parent's index, None for the
+# root (which is the one connected to the publishers).
+def tree_parent(index, fanout):
+    return (index - 1) // fanout if index > 0 else None
+
+# Hybrid dissemination: does a topic with this many publishers and
+# subscribers go through the broker? Directly every subscriber connects to
+# every publisher of it (P x S connections), through the broker everybody
+# connects to the broker once (P + S) but every sample takes an extra hop.
+# So only many-to-many topics go through the broker, when that saves at
+# least "min_saved" connections; one-to-many and many-to-one stay direct.
+def via_broker(publishers, subscribers, min_saved=1):
+    return publishers * subscribers - (publishers + subscribers) >= min_saved
+
+# History QoS: the last "depth" samples of every topic we send, kept as the
+# serialized frames that went out on the PUB socket (fixed size ring buffers,
+# so recording a sample never re-encodes or grows anything), and a ROUTER
+# socket on which a late joiner asks for them. The reply goes back to that
+# subscriber only; the PUB socket never carries history.
+#
+# The middleware registers "socket" in its poller and calls serve () when it
+# fires. Subscribers use request_history ().
+class HistoryService:
+
+    def __init__(self, logger, context, depth):
+        self.logger = logger
+        self.depth = depth
+        self.buffers = {} # topic -> deque of serialized Publications
+        self.socket = context.socket(zmq.ROUTER)
+        self.port = None
+        self.served = 0 # history requests answered
+
+    # a port, or a full endpoint such as ipc://... (then port is that endpoint)
+    def bind(self, port):
+        self.port = port
+        self.socket.bind(port if isinstance(port, str) else "tcp://*:" + str(port))
+
+    def record(self, topic, frame):
+        buffer = self.buffers.get(topic)
+        if buffer is None:
+            buffer = self.buffers[topic] = deque(maxlen=self.depth)
+        buffer.append(frame)
+
+    def serve(self):
+        identity, empty, buf = self.socket.recv_multipart()
+
+        history_req = topic_pb2.HistoryReq()
+        history_req.ParseFromString(buf)
+
+        history_resp = topic_pb2.HistoryResp()
+        for topic in history_req.topiclist:
+            buffer = self.buffers.get(topic, ())
+            depth = min(history_req.depth, len(buffer))
+            # the newest "depth" samples, oldest first
+            history_resp.samples.extend(list(buffer)[len(buffer) - depth:])
+
+        self.logger.debug("HistoryService::serve - {} samples of {}".format(len(history_resp.samples), list(history_req.topiclist)))
+        self.socket.send_multipart([identity, empty, history_resp.SerializeToString()])
+        self.served += 1
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+# Ask a history service for the last "depth" samples of our topics. Returns
+# the Publications, or an empty list if nobody answered within "timeout"
+# seconds (the publisher may have no history port, or may have gone away).
+def request_history(logger, context, addr, port, topiclist, depth, timeout=2.0, topic_ids=None):
+    history_req = topic_pb2.HistoryReq()
+    history_req.topiclist[:] = topiclist
+    history_req.depth = depth
+
+    req = context.socket(zmq.REQ)
+    req.connect("tcp://{}:{}".format(addr, port))
+    try:
+        req.send(history_req.SerializeToString())
+        if not req.poll(timeout=int(timeout * 1000)):
+            logger.info("request_history - no history from {}:{}".format(addr, port))
+            return []
+
+        history_resp = topic_pb2.HistoryResp()
+        history_resp.ParseFromString(req.recv())
+    finally:
+        req.close(linger=0)
+
+    publications = []
+    for sample in history_resp.samples:
+        publication = topic_pb2.Publication()
+        publication.ParseFromString(sample)
+        if topic_ids is not None:
+            topic_ids.restore(publication)
+        publications.append(publication)
+
+    return publications
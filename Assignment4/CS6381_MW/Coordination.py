@@ -0,0 +1,113 @@
+###############################################
+#
+# Purpose: Coordination service backends for the middleware
+#
+# The discovery middleware only needs a small part of what ZooKeeper offers:
+# persistent, ephemeral and sequential znodes, reads, one shot watches and
+# kazoo's re-arming ChildrenWatch/DataWatch helpers. Coordination describes
+# that part; ZK_Driver and LeaderWatcher are written against it.
+#
+#   KazooCoordination    - a real ZooKeeper ensemble through kazoo
+#   InMemoryCoordination - sessions on an in-process server (InMemoryZK.py),
+#                          so registry and election logic can be load tested
+#                          and failed over on one box with no ZooKeeper. An
+#                          optional latency is added to every call.
+#
+# Use make_coordination () to pick one from the command line.
+#
+###############################################
+
+# Kazoo and the in-process stand-in are imported lazily so the middleware
+# does not drag in a backend it does not use.
+
+class Coordination ():
+    """ What the middleware needs from a coordination service """
+
+    def __init__ (self, client):
+        self.client = client # a KazooClient or something with the same API
+
+    # session handling
+    def start (self, timeout=None):
+        return self.client.start () if timeout is None else self.client.start (timeout)
+
+    def stop (self):
+        return self.client.stop ()
+
+    def add_listener (self, listener):
+        return self.client.add_listener (listener)
+
+    @property
+    def state (self):
+        return self.client.state
+
+    # znodes
+    def create (self, path, value=b"", ephemeral=False, sequence=False, makepath=False):
+        return self.client.create (path, value=value, ephemeral=ephemeral, sequence=sequence, makepath=makepath)
+
+    def ensure_path (self, path):
+        return self.client.ensure_path (path)
+
+    def get (self, path, watch=None):
+        return self.client.get (path, watch=watch)
+
+    def set (self, path, value):
+        return self.client.set (path, value)
+
+    def delete (self, path, recursive=False):
+        return self.client.delete (path, recursive=recursive)
+
+    def exists (self, path, watch=None):
+        return self.client.exists (path, watch=watch)
+
+    def get_children (self, path, watch=None):
+        return self.client.get_children (path, watch=watch)
+
+    # watches that re-arm themselves until the callback returns False
+    def ChildrenWatch (self, path, func=None):
+        return self.client.ChildrenWatch (path, func) if func is not None else self.client.ChildrenWatch (path)
+
+    def DataWatch (self, path, func=None):
+        return self.client.DataWatch (path, func) if func is not None else self.client.DataWatch (path)
+
+
+class KazooCoordination (Coordination):
+    """ A session with a ZooKeeper ensemble """
+
+    def __init__ (self, hosts, timeout=10.0):
+        from kazoo.client import KazooClient
+        super ().__init__ (KazooClient (hosts, timeout=timeout))
+
+
+class InMemoryCoordination (Coordination):
+    """ A session on an in-process server shared by everybody in this process """
+
+    servers = {} # name -> InMemoryZKServer
+
+    def __init__ (self, name="default", timeout=10.0, latency=0.0):
+        from InMemoryZK import InMemoryZKServer, InMemoryKazooClient
+
+        if name not in InMemoryCoordination.servers:
+            InMemoryCoordination.servers[name] = InMemoryZKServer ()
+        self.server = InMemoryCoordination.servers[name]
+
+        # watches are delivered on the session's own thread, as with kazoo
+        super ().__init__ (InMemoryKazooClient (self.server, name, timeout, latency, threaded=True))
+
+    def expire (self):
+        ''' Simulate a crash: drop the session and its ephemeral nodes '''
+        self.client.expire ()
+
+
+##################################
+# Pick a backend
+#
+# backend is "zookeeper" (hosts is "addr:port") or "inmemory" (hosts names
+# the shared in-process server).
+##################################
+def make_coordination (backend, hosts, timeout=10.0, latency=0.0):
+    if backend == "zookeeper":
+        return KazooCoordination (hosts, timeout)
+    elif backend == "inmemory":
+        return InMemoryCoordination (hosts, timeout, latency)
+    else:
+        raise ValueError ("Unknown coordination backend {}".format (backend))
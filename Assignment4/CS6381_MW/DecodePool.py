@@ -0,0 +1,272 @@
+###############################################
+#
+# Purpose: A subscriber's samples decoded and handled in several processes
+#
+# With Direct dissemination a subscriber is connected to every publisher of
+# its topics and parses every sample in Python on the one thread that also
+# polls, so one core caps how many samples it takes in. With
+# SubscriberAppln --decoders N, N decoder processes do that instead:
+#
+#   publishers --> SUB i (only topics with shard_of (topic) == i)
+#              == zmq.proxy ==> PUSH i (ipc) --> PULL in decoder i
+#
+# The proxies run inside ZMQ, so the subscriber process never touches a
+# sample. Topics are split over the decoders as over the workers of a
+# sharded broker, so every sample of a topic, from each of its publishers,
+# goes through one decoder in the order it arrived: a publisher's samples
+# stay in order and ownership strength is still arbitrated per topic. A
+# decoder does what SubscriberAppln does in its CONSUME state
+# (SampleHandler), with results and latency snapshot files of its own
+# (./csv/<name>-<i>_...; latency_report.py merges the snapshots), and tells
+# the subscriber how many samples it consumed so it still stops after
+# --iters.
+#
+###############################################
+
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+import multiprocessing
+
+import zmq
+
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import OwnershipArbiter, SequenceTracker, SubscriptionManager, ContentFilters, TopicIds, parse_filter, payload_value
+from CS6381_MW.BrokerShards import shard_of
+from CS6381_MW.ResultsWriter import ResultsWriter
+from CS6381_MW.Histogram import LatencyStats, PERCENTILES
+
+# seconds between a decoder's reports of how many samples it consumed
+REPORT_INTERVAL = 0.05
+
+##################################
+# What SubscriberAppln does with every sample that comes in live
+##################################
+class SampleHandler():
+
+    def __init__(self, logger, name, args, results_path, snapshot_path, arbitrate=True, topic_ids=None):
+        self.logger = logger
+        self.name = name
+        self.results = ResultsWriter(logger, results_path, args.results, interval=args.flush_interval)
+        self.latency = LatencyStats()
+        self.sequences = SequenceTracker()
+        self.arbiter = OwnershipArbiter(args.ownership_threshold) if arbitrate else None
+        self.filters = ContentFilters(parse_filter(text) for text in args.filter)
+        self.topic_ids = topic_ids if topic_ids is not None else TopicIds()
+        self.stats_interval = args.stats_interval
+        self.snapshot_path = snapshot_path
+        self.pause = 1 / float(args.frequency) if args.frequency > 0 else 0 # 0 to take samples as fast as they come
+        self.consumed = 0 # samples taken, kept or not, as SubscriberAppln counts its --iters
+
+    def start(self):
+        self.results.start()
+
+    def handle(self, frame):
+        publication = topic_pb2.Publication()
+        publication.ParseFromString(frame)
+        self.topic_ids.restore(publication)
+        self.consumed += 1
+
+        # a duplicate by its sequence number; out of order samples stay
+        if not self.sequences.observe(publication.pub_id, publication.topic, publication.seq, publication.epoch):
+            return
+
+        if self.arbiter is not None and not self.arbiter.admit(publication.topic, publication.pub_id, publication.strength):
+            return
+
+        if not self.filters.passes(publication.topic, payload_value(publication)):
+            return
+
+        received = time.time()
+        latency = received - publication.tstamp
+        self.results.write(publication, latency, received, False)
+        self.latency.record(publication.topic, publication.pub_id, latency)
+        if self.latency.due(self.stats_interval):
+            self.report()
+
+        if self.pause:
+            time.sleep(self.pause)
+
+    def report(self):
+        for topic, (count, rate, percentiles) in self.latency.report().items():
+            self.logger.info("SampleHandler::report - {}: {} samples, {:.1f}/s, latency {}".format(
+                topic, count, rate, ", ".join("p{:g} {:.2f} ms".format(p, latency * 1000) for p, latency in zip(PERCENTILES, percentiles))))
+        self.latency.snapshot(self.snapshot_path, self.name, self.sequences.counts)
+
+    def close(self):
+        self.results.close()
+        self.report()
+
+
+##################################
+# A decoder process
+##################################
+def run_decoder(index, args, endpoint, name, results_path, snapshot_path, arbitrate, topic_ids, reports, stop):
+    # spawned, so logging starts from scratch
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger("SubscriberDecoder{}".format(index))
+    logger.setLevel(args.loglevel)
+
+    handler = SampleHandler(logger, name, args, results_path, snapshot_path, arbitrate, TopicIds(topic_ids))
+    handler.start()
+
+    context = zmq.Context()
+    pull = context.socket(zmq.PULL)
+    pull.connect(endpoint)
+    logger.info("run_decoder - decoder {} takes {}".format(index, endpoint))
+
+    reported = 0
+    last_report = time.time()
+    while not stop.is_set():
+        if pull.poll(timeout=100):
+            topic, frame = pull.recv_multipart()
+            handler.handle(frame)
+        now = time.time()
+        if handler.consumed != reported and now - last_report >= REPORT_INTERVAL:
+            reports.put((index, handler.consumed, None))
+            reported, last_report = handler.consumed, now
+
+    handler.close()
+    reports.put((index, handler.consumed, handler.sequences.totals()))
+    pull.close(linger=0)
+    context.term()
+
+
+##################################
+# The subscriber's side: SUB sockets, proxies and the decoder processes
+##################################
+class DecodePool():
+
+    def __init__(self, logger, context, args, topic_ids=None):
+        self.logger = logger
+        self.context = context
+        self.args = args
+        self.topic_ids = topic_ids if topic_ids is not None else TopicIds() # the subscriber's, filled in when it registers
+        self.workers = args.decoders
+        self.name = "cs6381-decode-{}-{}".format(os.getpid(), args.port)
+        self.subs = [] # SUB socket per decoder
+        self.subscriptions = [] # and its SubscriptionManager
+        self.pushes = [] # PUSH socket per decoder, to its PULL
+        self.controls = [] # PAIR per proxy, to stop it
+        for index in range(self.workers):
+            self.subs.append(context.socket(zmq.SUB))
+            self.subscriptions.append(SubscriptionManager(logger, self.subs[index]))
+            push = context.socket(zmq.PUSH)
+            push.bind(self.endpoint(index))
+            self.pushes.append(push)
+        spawn = multiprocessing.get_context("spawn")
+        self.spawn = spawn
+        self.reports = spawn.Queue()
+        self.stop_event = spawn.Event()
+        self.consumed = [0] * self.workers # as last reported by each decoder
+        self.processes = []
+        self.threads = []
+
+    def endpoint(self, index):
+        return "ipc://" + os.path.join(tempfile.gettempdir(), "{}-{}".format(self.name, index))
+
+    def shards(self, topiclist):
+        ''' decoder index -> the topics of topiclist it takes '''
+        shards = {}
+        for topic in topiclist:
+            shards.setdefault(shard_of(topic, self.workers), []).append(topic)
+        return shards
+
+    def envelopes(self, topiclist):
+        return [self.topic_ids.envelope(topic) for topic in topiclist]
+
+    def subscribe(self, topiclist):
+        shards = self.shards(topiclist)
+        for index, subscriptions in enumerate(self.subscriptions):
+            subscriptions.set(None, self.envelopes(shards.get(index, [])))
+
+    def connect(self, connect_str, topiclist):
+        ''' Connect the SUB sockets of the decoders taking any of topiclist '''
+        shards = self.shards(topiclist)
+        for index, subscriptions in enumerate(self.subscriptions):
+            subscriptions.set(connect_str, self.envelopes(shards.get(index, [])))
+
+    def disconnect(self, connect_str):
+        if self.threads:
+            raise ValueError("The decoders' SUB sockets belong to their proxies once started")
+        for subscriptions in self.subscriptions:
+            subscriptions.drop(connect_str)
+
+    ##################################
+    # Start the proxies and one process per decoder
+    #
+    # outputs are (name, results path, snapshot path), one per decoder
+    ##################################
+    def start(self, outputs, arbitrate=True):
+        self.logger.info("DecodePool::start - {} decoders".format(self.workers))
+
+        for index in range(self.workers):
+            control = self.context.socket(zmq.PAIR)
+            control.bind("inproc://{}-control-{}".format(self.name, index))
+            command = self.context.socket(zmq.PAIR)
+            command.connect("inproc://{}-control-{}".format(self.name, index))
+            self.controls.append(command)
+            thread = threading.Thread(target=self.forward, args=(index, control), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        # spawn, not fork: a forked child would share our ZMQ context
+        for index, (name, results_path, snapshot_path) in enumerate(outputs):
+            process = self.spawn.Process(target=run_decoder, daemon=True,
+                                         args=(index, self.args, self.endpoint(index), name, results_path, snapshot_path,
+                                               arbitrate, list(self.topic_ids.ids.items()), self.reports, self.stop_event))
+            process.start()
+            self.processes.append(process)
+
+    def forward(self, index, control):
+        zmq.proxy_steerable(self.subs[index], self.pushes[index], None, control)
+        for socket in (self.subs[index], self.pushes[index], control):
+            socket.close(linger=0)
+
+    def update(self, timeout=None):
+        ''' Take in the decoders' reports; samples consumed by all of them so far '''
+        try:
+            while True:
+                index, consumed, totals = self.reports.get(timeout=timeout)
+                self.consumed[index] = consumed
+                timeout = 0
+        except queue.Empty:
+            pass
+        return sum(self.consumed)
+
+    def wait(self, count):
+        ''' Until the decoders consumed count samples together '''
+        while self.update(timeout=1.0) < count:
+            pass
+
+    ##################################
+    # Stop the proxies, then the decoders (they write out their results and
+    # snapshots); the sequence totals over all decoders
+    #
+    # In this order: a proxy waits in a send for its decoder to take the
+    # sample, and would never see the command if the decoder were gone.
+    ##################################
+    def stop(self):
+        for command in self.controls:
+            command.send(b"TERMINATE")
+        for thread in self.threads:
+            thread.join()
+        for command in self.controls:
+            command.close(linger=0)
+
+        self.stop_event.set()
+        totals = None
+        finished = 0
+        while finished < len(self.processes):
+            index, consumed, decoder_totals = self.reports.get()
+            self.consumed[index] = consumed
+            if decoder_totals is not None:
+                finished += 1
+                totals = decoder_totals if totals is None else [a + b for a, b in zip(totals, decoder_totals)]
+        for process in self.processes:
+            process.join()
+        self.logger.info("DecodePool::stop - {} samples consumed by {} decoders".format(sum(self.consumed), self.workers))
+        return totals
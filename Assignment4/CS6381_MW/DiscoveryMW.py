@@ -25,7 +25,8 @@ import time   # for sleep
 import logging # for logging. Use it in place of print statements.
 import zmq  # ZMQ sockets
 
-from ZookeeperClient import ZK_Driver
+from ZookeeperClient import ZK_Driver, LIVE_BROKERS, LIVE_SUBSCRIBERS
+from CS6381_MW.Coordination import make_coordination
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
@@ -44,6 +45,7 @@ class DiscoveryMW():
         self.upcall_obj = None # handle to appln obj to handle appln-specific data
         self.handle_events = True # in general we keep going thru the event loop
         self.zk_client = None
+        self.watch_window = 0.05 # seconds registry watch events are coalesced over
 
     ########################################
     # configure/initialize
@@ -54,12 +56,10 @@ class DiscoveryMW():
             # Here we initialize any internal variables
             self.logger.info ("DiscoveryMW::configure")
 
-            # Init the zookeeper client
-            self.zk_client = ZK_Driver()
-
             # First retrieve our advertised IP addr and the publication port num
             self.port = args.port
             self.addr = args.addr
+            self.watch_window = args.watch_window
 
             # Next get the ZMQ context
             self.logger.debug("DiscoveryMW::configure - obtain ZMQ context")
@@ -85,6 +85,17 @@ class DiscoveryMW():
             self.logger.debug("DiscoveryMW::configure - attempting to bind to " + bind_string)
             self.rep.bind(bind_string)
 
+            # Init the zookeeper client. Every discovery replica is a candidate in
+            # the election; the winner advertises our addr:port in the leader znode.
+            # The coordination backend is ZooKeeper unless an in-process one is
+            # asked for (load tests), in which case the address just names it.
+            hosts = "{}:{}".format(args.zookeeper_addr, args.zookeeper_port)
+            self.logger.debug("DiscoveryMW::configure - connect to {} coordination at {}".format(args.coordination, hosts))
+            coordination = make_coordination(args.coordination, hosts, args.zk_timeout, args.coord_latency)
+            self.zk_client = ZK_Driver(self.logger, args.zookeeper_addr, args.zookeeper_port, zkTimeout=args.zk_timeout)
+            self.zk_client.init_driver(coordination)
+            self.zk_client.start_session()
+
             self.logger.info ("DiscoveryMW::configure completed")
         except Exception as e:
             raise e
@@ -152,15 +163,49 @@ class DiscoveryMW():
             raise e 
 
     ##########################################
-    # Adapter code to add node to zk
+    # Join the discovery leader election
     #
+    # Standbys keep serving reads from their mirrored registry; the
+    # callback is made once we hold the leader znode.
     ###########################################
-    def register_entity_zk(self, entity):
+    def join_election(self, on_elected=None):
 
         try:
-            self.zk_client.add_entity(entity)
+            leader_value = bytes("{}:{}".format(self.addr, self.port), "utf-8")
+            self.zk_client.join_election(leader_value, on_elected)
+        except Exception as e:
+            raise e
 
-            
+    def is_leader(self):
+        return self.zk_client.is_leader
+
+    ##########################################
+    # Mirror every registration made through the leader
+    #
+    # callback (role, name, RegisterReq or None if removed)
+    ###########################################
+    def watch_registry(self, callback):
+
+        def registry_change(role, name, value):
+            reg_req = None
+            if value is not None:
+                reg_req = discovery_pb2.RegisterReq()
+                reg_req.ParseFromString(value)
+            callback(role, name, reg_req)
+
+        try:
+            self.zk_client.watch_registry(registry_change, self.watch_window)
+        except Exception as e:
+            raise e
+
+    ##########################################
+    # Adapter code to add node to zk
+    #
+    ###########################################
+    def register_entity_zk(self, reg_req):
+
+        try:
+            self.zk_client.add_entity(reg_req.role, reg_req.info.id, reg_req.SerializeToString())
         except Exception as e:
             raise e
     
@@ -168,10 +213,57 @@ class DiscoveryMW():
     # Adapter code to remove node to zk
     #
     ###########################################
-    def deregister_entity_zk(self, entity):
+    def deregister_entity_zk(self, role, name):
+
+        try:
+            self.zk_client.delete_entity(role, name)
+        except Exception as e:
+            raise e
+
+    ##########################################
+    # Follow the brokers and subscribers that are alive
+    #
+    # callback (added {name: RegisterReq}, removed {names}), made on the
+    # zookeeper thread. Only entities started with --zookeeper announce
+    # themselves.
+    ###########################################
+    def watch_live(self, on_brokers, on_subscribers):
+
+        def parsed(callback):
+            def live_change(added, removed):
+                requests = {}
+                for name, value in added.items():
+                    reg_req = discovery_pb2.RegisterReq()
+                    reg_req.ParseFromString(value)
+                    requests[name] = reg_req
+                callback(requests, removed)
+            return live_change
+
+        try:
+            self.zk_client.watch_live(LIVE_BROKERS, parsed(on_brokers), self.watch_window)
+            self.zk_client.watch_live(LIVE_SUBSCRIBERS, parsed(on_subscribers), self.watch_window)
+        except Exception as e:
+            raise e
+
+    ##########################################
+    # Adapter code for the broker assignments of subscribers
+    #
+    # broker is the Entity of the broker, or None to drop the assignment
+    ###########################################
+    def write_assignment(self, name, broker):
 
         try:
-            self.zk_client.delete_entity(entity)
+            if broker is None:
+                self.zk_client.delete_assignment(name)
+            else:
+                self.zk_client.write_assignment(name, bytes("{}:{}".format(broker.ip_address, broker.port), "utf-8"))
+        except Exception as e:
+            raise e
+
+    def read_assignments(self):
+
+        try:
+            return {name: value.decode("utf-8") for name, value in self.zk_client.read_assignments().items()}
         except Exception as e:
             raise e
 
@@ -179,7 +271,7 @@ class DiscoveryMW():
     #####################################################
     # Send a response to an entity attempting to register with the discovery server
     #####################################################
-    def send_register_response(self, status, reason):
+    def send_register_response(self, status, reason, topic_ids=()):
         ''' Send a response back to a registrant that has attempted to register '''
 
         try:
@@ -195,6 +287,12 @@ class DiscoveryMW():
             # If status is not null add in the reason
             if reason != None:
                 register_response.reason = reason
+
+            # and the ids its topics go by, if discovery hands them out
+            for topic, topic_id in topic_ids:
+                entry = register_response.topic_ids.add()
+                entry.topic = topic
+                entry.id = topic_id
             self.logger.debug("DiscoveryMW::register - done populating nested RegisterResp")
 
             self.logger.debug("DiscoveryMW::send_register_response - build the outer DiscoveryResp message")
@@ -224,7 +322,7 @@ class DiscoveryMW():
     ############################################
     # Send a response to an is ready response
     ############################################
-    def send_isready_response(self, isready):
+    def send_isready_response(self, isready, filters=()):
         ''' Send a response back to a registrant that has made an isready_request '''
 
         try:
@@ -235,6 +333,8 @@ class DiscoveryMW():
             isready_response = discovery_pb2.IsReadyResp()
             # Load the isready response with the passed in status
             isready_response.status = isready
+            # and what the subscribers want of each topic, for the publishers to filter on
+            self.add_filters(isready_response.filters, filters)
             
             self.logger.debug("DiscoveryMW::send_isready_response - done populating the nested isready resp")
             
@@ -262,7 +362,7 @@ class DiscoveryMW():
     ############################################
     # Send a response to a lookup pub by topiclist request
     ############################################
-    def send_lookup_pub_by_topiclist_response(self, status, publisher_list):
+    def send_lookup_pub_by_topiclist_response(self, status, publisher_list, routes=()):
         ''' Send a response back fore a request made to load list of pubishers by topic list '''
         
         try:
@@ -287,8 +387,14 @@ class DiscoveryMW():
                     registrant_info.id = publisher.name
                     registrant_info.addr = publisher.ip_address
                     registrant_info.port = publisher.port
+                    registrant_info.history_port = publisher.history_port
+                    registrant_info.log_port = publisher.log_port
+                    registrant_info.egress_port = publisher.egress_port
                     # self.logger.debug("DiscoveryMW::send_lookup_pub_by_topiclist_response - FLAG 1: Adding " + registrant_info.id + " " + registrant_info.addr  + " " +  str(registrant_info.port))
 
+            # Hybrid dissemination: where each topic comes from
+            self.add_routes(lookup_resp.routes, routes)
+
             self.logger.debug("DiscoveryMW::send_lookup_pub_by_topiclist_response done building nested look_resp object")
 
             self.logger.debug ("DiscoveryMW::send_lookup_pub_by_topiclist_response - build the outer DiscoveryResp message")
@@ -314,8 +420,8 @@ class DiscoveryMW():
         except Exception as e:
             raise e
     
-    def send_lookup_all_publisher_response(self, status, all_publisher_list):
-        ''' Send a response to a request for all publishers '''
+    def send_lookup_all_publisher_response(self, status, all_publisher_list, parent=False, routes=(), filters=()):
+        ''' Send a response to a request for all publishers (or for the parent broker) '''
 
         try:
             self.logger.debug("DiscoveryMW::send_lookup_all_publisher_response")
@@ -323,6 +429,7 @@ class DiscoveryMW():
             # Build the inner LookupPubByTopicReq  object
             lookup_resp = discovery_pb2.LookupAllPubResp()
             lookup_resp.status = status
+            lookup_resp.parent = parent
 
             # Only build out the list of publishers if there any to send
             if (len(all_publisher_list) > 0):
@@ -337,6 +444,15 @@ class DiscoveryMW():
                     registrant_info.id = publisher.name
                     registrant_info.addr = publisher.ip_address
                     registrant_info.port = publisher.port
+                    registrant_info.history_port = publisher.history_port
+                    registrant_info.log_port = publisher.log_port
+                    registrant_info.egress_port = publisher.egress_port
+
+            # Hybrid dissemination: which topics the broker forwards
+            self.add_routes(lookup_resp.routes, routes)
+
+            # and what the subscribers want of each topic, for the broker to filter on
+            self.add_filters(lookup_resp.filters, filters)
 
             self.logger.debug("DiscoveryMW::send_lookup_all_publisher_response done building nested look_resp object")
 
@@ -364,6 +480,23 @@ class DiscoveryMW():
         except Exception as e:
             raise e
 
+    ############################################
+    # Fill in TopicRoutes from (topic, via broker, names of the sources)
+    ############################################
+    def add_routes(self, route_list, routes):
+        for topic, via_broker, sources in routes:
+            route = route_list.add()
+            route.topic = topic
+            route.via_broker = via_broker
+            route.sources[:] = sources
+
+    def add_filters(self, filter_list, filters):
+        for topic, op, values in filters:
+            content_filter = filter_list.add()
+            content_filter.topic = topic
+            content_filter.op = op
+            content_filter.values[:] = values
+
     ########################################
     # set upcall handle
     #
@@ -0,0 +1,155 @@
+###############################################
+#
+# Purpose: Broker egress with a queue of its own for every subscriber
+#
+# On the XPUB socket all subscribers share one send path and whatever ZMQ
+# cannot deliver to a slow one is dropped where nobody sees it. With
+# BrokerAppln --egress router the broker also serves subscribers on a
+# ROUTER socket with credit based flow control:
+#
+#   subscriber (DEALER) --EgressReq (topics, credit)--> broker (ROUTER)
+#   broker --[topic, frame]--> subscriber, one sample per credit
+#
+# A subscriber returns credit as it consumes. While it has none, its samples
+# wait in a queue of at most "limit" samples; when that is full the policy
+# decides: drop the oldest queued sample, drop the new one, or disconnect
+# the subscriber (forget it and tell it so with an empty message; it
+# subscribes again from the newest samples on). Only the slow subscriber's
+# own queue fills up, and its lag (how old its oldest queued sample is),
+# depth and drops are reported per subscriber.
+#
+###############################################
+
+import time
+from collections import deque
+
+import zmq
+
+from CS6381_MW import topic_pb2
+
+POLICIES = ("oldest", "newest", "disconnect")
+
+##################################
+# What we keep for one subscriber
+##################################
+class SubscriberQueue():
+
+    def __init__(self, topics):
+        self.topics = topics # prefixes, as with ZMQ subscriptions
+        self.credit = 0 # samples we may still send without hearing back
+        self.queue = deque() # (queued at, topic, frame) waiting for credit
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def wants(self, topic):
+        return any(topic.startswith(prefix) for prefix in self.topics)
+
+    def lag(self, now):
+        return now - self.queue[0][0] if self.queue else 0.0
+
+
+##################################
+# The ROUTER egress
+#
+# The middleware registers "socket" in its poller and calls serve () when it
+# fires, and publish () for every frame it forwards.
+##################################
+class RouterEgress():
+
+    def __init__(self, logger, context, limit, policy):
+        self.logger = logger
+        self.limit = limit # samples queued per subscriber at most
+        self.policy = policy # one of POLICIES
+        self.socket = context.socket(zmq.ROUTER)
+        # fail instead of silently dropping for a subscriber that is gone
+        self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.port = None
+        self.subscribers = {} # identity -> SubscriberQueue
+        self.dropped = 0 # over all subscribers, including disconnected ones
+        self.disconnects = 0
+
+    def bind(self, port):
+        self.port = port
+        self.socket.bind("tcp://*:" + str(port))
+
+    ##################################
+    # A subscription or more credit. A new subscriber first gets the
+    # newest sample of its topics from last_values (topic -> frame), if any.
+    ##################################
+    def serve(self, last_values=None):
+        identity, buf = self.socket.recv_multipart()
+        egress_req = topic_pb2.EgressReq()
+        egress_req.ParseFromString(buf)
+
+        subscriber = self.subscribers.get(identity)
+        if egress_req.topiclist:
+            self.logger.debug("RouterEgress::serve - {} subscribes to {}".format(identity, list(egress_req.topiclist)))
+            subscriber = self.subscribers[identity] = SubscriberQueue(list(egress_req.topiclist))
+            now = time.time()
+            for topic, frame in (last_values or {}).items():
+                if subscriber.wants(topic):
+                    subscriber.queue.append((now, topic, frame))
+        if subscriber is None:
+            return # credit from a subscriber we disconnected; it subscribes again
+
+        subscriber.credit += egress_req.credit
+        self.flush(identity, subscriber)
+
+    def publish(self, topic, frame):
+        now = time.time()
+        for identity, subscriber in list(self.subscribers.items()):
+            if not subscriber.wants(topic):
+                continue
+            if subscriber.credit > 0 and not subscriber.queue:
+                self.send(identity, subscriber, topic, frame)
+            else:
+                self.enqueue(identity, subscriber, topic, frame, now)
+
+    def enqueue(self, identity, subscriber, topic, frame, now):
+        if len(subscriber.queue) >= self.limit:
+            subscriber.dropped += 1
+            self.dropped += 1
+            if self.policy == "newest":
+                return
+            if self.policy == "disconnect":
+                self.logger.info("RouterEgress::enqueue - {} is {} samples behind, disconnecting it".format(identity, len(subscriber.queue)))
+                self.disconnect(identity)
+                return
+            subscriber.queue.popleft()
+
+        subscriber.queue.append((now, topic, frame))
+        subscriber.max_depth = max(subscriber.max_depth, len(subscriber.queue))
+
+    def flush(self, identity, subscriber):
+        while subscriber.credit > 0 and subscriber.queue and identity in self.subscribers:
+            queued_at, topic, frame = subscriber.queue.popleft()
+            self.send(identity, subscriber, topic, frame)
+
+    def send(self, identity, subscriber, topic, frame):
+        try:
+            self.socket.send_multipart([identity, bytes(topic, "utf-8"), frame], zmq.NOBLOCK)
+            subscriber.credit -= 1
+            subscriber.sent += 1
+        except zmq.ZMQError:
+            # gone (or, despite the credit, not reading at all)
+            self.logger.info("RouterEgress::send - cannot reach {}, forgetting it".format(identity))
+            self.subscribers.pop(identity, None)
+
+    def disconnect(self, identity):
+        del self.subscribers[identity]
+        self.disconnects += 1
+        try:
+            self.socket.send_multipart([identity, b"", b""], zmq.NOBLOCK)
+        except zmq.ZMQError:
+            pass
+
+    # name -> (queued, lag in seconds, dropped, sent, deepest queue)
+    def stats(self):
+        now = time.time()
+        return {identity.decode("utf-8", "replace"): (len(subscriber.queue), subscriber.lag(now), subscriber.dropped,
+                                                      subscriber.sent, subscriber.max_depth)
+                for identity, subscriber in self.subscribers.items()}
+
+    def close(self):
+        self.socket.close(linger=0)
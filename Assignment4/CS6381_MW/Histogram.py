@@ -0,0 +1,179 @@
+###############################################
+#
+# Purpose: Latency histograms the subscriber keeps as it goes
+#
+# Instead of keeping every latency to sort later, we count it in a log
+# bucketed histogram, as HDR histograms do: latencies are counted in whole
+# microseconds, exactly below 2^bits and above that in buckets that are
+# 1/2^(bits-1) of their value wide, so any percentile is within that
+# relative error (1.6% with the default 7 bits) whatever the range. The
+# buckets are kept sparse: a histogram is at most a few thousand counters.
+#
+# Histograms with the same bits merge by adding their counts, so the
+# snapshots of many subscribers (SubscriberAppln writes one per run, see
+# latency_report.py) combine exactly as if one subscriber had seen every
+# sample. Snapshots also carry the subscriber's sequence counts (received,
+# missing, duplicates, reordered, late per publisher and topic, see
+# SequenceTracker in Common.py), which add up the same way.
+#
+###############################################
+
+import os
+import json
+import time
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+##################################
+# One histogram
+##################################
+class LatencyHistogram():
+
+    def __init__(self, bits=7):
+        self.bits = bits
+        self.counts = {} # bucket index -> samples
+        self.count = 0
+        self.total = 0 # microseconds, for the mean
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        if value < (1 << self.bits):
+            return value
+        shift = value.bit_length() - self.bits
+        return (shift << self.bits) + (value >> shift)
+
+    def value(self, index):
+        ''' The middle of a bucket, in microseconds '''
+        shift = index >> self.bits
+        if shift == 0:
+            return index
+        mantissa = index & ((1 << self.bits) - 1)
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1e6))
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.bits != self.bits:
+            raise ValueError("Cannot merge histograms of {} and {} bits".format(self.bits, other.bits))
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, p):
+        ''' In seconds; 0 when empty '''
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return max(self.min, min(self.value(index), self.max)) / 1e6
+        return self.max / 1e6
+
+    def mean(self):
+        return self.total / self.count / 1e6 if self.count else 0.0
+
+    def to_dict(self):
+        return {"bits": self.bits, "count": self.count, "total_us": self.total, "min_us": self.min, "max_us": self.max,
+                "counts": {str(index): count for index, count in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, d):
+        histogram = cls(d["bits"])
+        histogram.counts = {int(index): count for index, count in d["counts"].items()}
+        histogram.count = d["count"]
+        histogram.total = d["total_us"]
+        histogram.min = d["min_us"]
+        histogram.max = d["max_us"]
+        return histogram
+
+
+##################################
+# What a subscriber keeps: a histogram per topic and per publisher
+#
+# record () only touches the histograms of the current interval; report ()
+# summarizes those, folds them into the totals for the run and starts a
+# new interval.
+##################################
+class LatencyStats():
+
+    def __init__(self, bits=7):
+        self.bits = bits
+        self.topics = {} # topic -> LatencyHistogram over the run
+        self.publishers = {} # pub_id -> LatencyHistogram over the run
+        self.interval_topics = {}
+        self.interval_publishers = {}
+        self.started = time.time()
+        self.interval_started = self.started
+
+    def record(self, topic, pub_id, seconds):
+        histogram = self.interval_topics.get(topic)
+        if histogram is None:
+            histogram = self.interval_topics[topic] = LatencyHistogram(self.bits)
+        histogram.record(seconds)
+        histogram = self.interval_publishers.get(pub_id)
+        if histogram is None:
+            histogram = self.interval_publishers[pub_id] = LatencyHistogram(self.bits)
+        histogram.record(seconds)
+
+    def due(self, interval):
+        return interval > 0 and time.time() - self.interval_started >= interval
+
+    def report(self):
+        ''' topic -> (samples, samples/s, [latency at PERCENTILES]) over the interval just ended '''
+        now = time.time()
+        seconds = max(now - self.interval_started, 1e-9)
+        summary = {topic: (histogram.count, histogram.count / seconds, [histogram.percentile(p) for p in PERCENTILES])
+                   for topic, histogram in sorted(self.interval_topics.items())}
+        self.fold()
+        self.interval_started = now
+        return summary
+
+    def fold(self):
+        for interval, totals in ((self.interval_topics, self.topics), (self.interval_publishers, self.publishers)):
+            for key, histogram in interval.items():
+                if key in totals:
+                    totals[key].merge(histogram)
+                else:
+                    totals[key] = histogram
+            interval.clear()
+
+    def snapshot(self, path, name, sequences=None):
+        ''' Write the histograms of the run so far, and (pub_id, topic) -> sequence counts, (atomically) for latency_report.py '''
+        self.fold()
+        snapshot = {"name": name, "started": self.started, "ended": time.time(),
+                    "topics": {topic: histogram.to_dict() for topic, histogram in self.topics.items()},
+                    "publishers": {pub_id: histogram.to_dict() for pub_id, histogram in self.publishers.items()},
+                    "sequences": [{"pub_id": pub_id, "topic": topic, "counts": counts}
+                                  for (pub_id, topic), counts in sorted((sequences or {}).items())]}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(path + ".tmp", path)
+
+def load_snapshot(path):
+    ''' (name, seconds covered, topic -> LatencyHistogram, pub_id -> LatencyHistogram, (pub_id, topic) -> sequence counts) '''
+    with open(path) as f:
+        snapshot = json.load(f)
+    return (snapshot["name"], snapshot["ended"] - snapshot["started"],
+            {topic: LatencyHistogram.from_dict(d) for topic, d in snapshot["topics"].items()},
+            {pub_id: LatencyHistogram.from_dict(d) for pub_id, d in snapshot["publishers"].items()},
+            {(d["pub_id"], d["topic"]): d["counts"] for d in snapshot.get("sequences", [])})
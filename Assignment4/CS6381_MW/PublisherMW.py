@@ -34,6 +34,7 @@ import datetime
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import LeaderReq, HistoryService, ContentFilters, TopicIds, set_payload
 
 # import any other packages you need.
 
@@ -47,17 +48,21 @@ class PublisherMW ():
   ########################################
   def __init__ (self, logger):
     self.logger = logger  # internal logger for print statements
-    self.req = None # will be a ZMQ REQ socket to talk to Discovery service
+    self.req = None # will be a LeaderReq (ZMQ REQ socket) to talk to Discovery service
     self.pub = None # will be a ZMQ PUB socket for dissemination
     self.poller = None # used to wait on incoming replies
     self.addr = None # our advertised IP address
     self.port = None # port num where we are going to publish our topics
     self.upcall_obj = None # handle to appln obj to handle appln-specific data
     self.handle_events = True # in general we keep going thru the event loop
-    self.history_deque = None
-    self.ownership_dict = None
-    self.history_intervals = 0 
+    self.history = None # HistoryService late joiners ask for our recent samples
+    self.strength = 0 # our ownership strength, stamped on every publication
+    self.seqs = {} # topic -> sequence number of the last sample we sent of it
+    self.epoch = int (time.time () * 1000) # our numbering starts over if we restart
+    self.filters = ContentFilters () # what the subscribers want of each topic, from discovery
+    self.topic_ids = TopicIds () # the ids we send our topics with, when discovery gives them out
     self.sent_count = 0
+    self.watcher = None # LeaderWatcher when we follow zookeeper; its session also announces us
 
   ########################################
   # configure/initialize
@@ -72,6 +77,7 @@ class PublisherMW ():
       # First retrieve our advertised IP addr and the publication port num
       self.port = args.port
       self.addr = args.addr
+      self.strength = args.strength
       
       # Next get the ZMQ context
       self.logger.debug ("PublisherMW::configure - obtain ZMQ context")
@@ -85,15 +91,8 @@ class PublisherMW ():
       # REQ is needed because we are the client of the Discovery service
       # PUB is needed because we publish topic data
       self.logger.debug ("PublisherMW::configure - obtain REQ and PUB sockets")
-      self.req = context.socket (zmq.REQ)
       self.pub = context.socket (zmq.PUB)
 
-      # Since are using the event loop approach, register the REQ socket for incoming events
-      # Note that nothing ever will be received on the PUB socket and so it does not make
-      # any sense to register it with the poller for an incoming message.
-      self.logger.debug ("PublisherMW::configure - register the REQ socket for incoming replies")
-      self.poller.register (self.req, zmq.POLLIN)
-      
       # Now connect ourselves to the discovery service. Recall that the IP/port were
       # supplied in our argument parsing. Best practices of ZQM suggest that the
       # one who maintains the REQ socket should do the "connect"
@@ -101,7 +100,23 @@ class PublisherMW ():
       # For our assignments we will use TCP. The connect string is made up of
       # tcp:// followed by IP addr:port number.
       connect_str = "tcp://" + args.discovery
-      self.req.connect (connect_str)
+
+      # If zookeeper is given, follow the discovery leader instead
+      watcher = None
+      if args.zookeeper:
+        from ZookeeperClient import LeaderWatcher
+        self.logger.debug ("PublisherMW::configure - follow the discovery leader via zookeeper")
+        watcher = LeaderWatcher (self.logger, args.zookeeper, "/discovery/leader", context)
+        leader = watcher.wait (timeout=30)
+        if leader is not None:
+          connect_str = "tcp://" + leader
+
+      # Since are using the event loop approach, the REQ socket is registered for incoming
+      # events. Note that nothing ever will be received on the PUB socket and so it does not
+      # make any sense to register it with the poller for an incoming message.
+      self.logger.debug ("PublisherMW::configure - register the REQ socket for incoming replies")
+      self.req = LeaderReq (self.logger, context, self.poller, connect_str, watcher)
+      self.watcher = watcher
       
       # Since we are the publisher, the best practice as suggested in ZMQ is for us to
       # "bind" the PUB socket
@@ -111,6 +126,16 @@ class PublisherMW ():
       # Since port is an integer, we convert it to string to make it part of the URL
       bind_string = "tcp://*:" + str(self.port)
       self.pub.bind (bind_string)
+
+      # Keep the last samples of every topic for late joiners; they ask for
+      # them on a ROUTER socket which we serve from the event loop
+      if args.history > 0:
+        if not args.history_port:
+          raise ValueError ("--history needs --history_port")
+        self.logger.debug ("PublisherMW::configure - keep {} samples per topic of history".format (args.history))
+        self.history = HistoryService (self.logger, context, args.history)
+        self.history.bind (args.history_port)
+        self.poller.register (self.history.socket, zmq.POLLIN)
       
       self.logger.info ("PublisherMW::configure completed")
 
@@ -147,10 +172,20 @@ class PublisherMW ():
           # object is in.
           timeout = self.upcall_obj.invoke_operation ()
           
-        elif self.req in events:  # this is the only socket on which we should be receiving replies
+        elif self.req.socket in events:  # this is the only socket on which we should be receiving replies
 
           # handle the incoming reply from remote entity and return the result
           timeout = self.handle_reply ()
+
+        elif self.req.watch_socket in events:
+          # the discovery leader changed
+          timeout = self.req.redirect (timeout)
+
+        elif self.history is not None and self.history.socket in events:
+          # a late joiner wants our recent samples; then let the application
+          # work out how long is left until its next round
+          self.history.serve ()
+          timeout = 0
           
         else:
           raise Exception ("Unknown event after poll")
@@ -184,6 +219,9 @@ class PublisherMW ():
       # Note also that we expect the return value to be the desired timeout to use
       # in the next iteration of the poll.
       if (disc_resp.msg_type == discovery_pb2.TYPE_REGISTER):
+        # we send our topics with these ids instead of their names
+        self.topic_ids.update ((topic_id.topic, topic_id.id) for topic_id in disc_resp.register_resp.topic_ids)
+
         # let the appln level object decide what to do
         timeout = self.upcall_obj.register_response (disc_resp.register_resp)
       elif (disc_resp.msg_type == discovery_pb2.TYPE_ISREADY):
@@ -227,6 +265,7 @@ class PublisherMW ():
       reg_info.id = name  # our id
       reg_info.addr = self.addr  # our advertised IP addr where we are publishing
       reg_info.port = self.port # port on which we are publishing
+      reg_info.history_port = self.history.port if self.history is not None else 0 # where late joiners get history
       self.logger.debug ("PublisherMW::register - done populating the Registrant Info")
       
       # Next build a RegisterReq message
@@ -239,6 +278,13 @@ class PublisherMW ():
       register_req.topiclist[:] = topiclist   # this is how repeated entries are added (or use append() or extend ()
       self.logger.debug ("PublisherMW::register - done populating nested RegisterReq")
 
+      # Brokers that are already running learn about us from our live node,
+      # which goes away with our zookeeper session
+      if self.watcher is not None:
+        from ZookeeperClient import announce, LIVE_PUBLISHERS
+        self.logger.debug ("PublisherMW::register - announce ourselves under {}".format (LIVE_PUBLISHERS))
+        announce (self.watcher.zk, LIVE_PUBLISHERS, name, register_req.SerializeToString ())
+
       # Finally, build the outer layer DiscoveryReq Message
       self.logger.debug ("PublisherMW::register - build the outer DiscoveryReq message")
       disc_req = discovery_pb2.DiscoveryReq ()  # allocate
@@ -342,10 +388,21 @@ class PublisherMW ():
 
       # Build the Publication message 
       publication = topic_pb2.Publication()
-      publication.topic = topic
-      publication.content = data
+      self.topic_ids.stamp (publication, topic) # its id if it has one, else its name
+      set_payload (publication, topic, data) # data as the generator gave it, typed
       publication.pub_id = id
       publication.tstamp = send_timestamp
+      publication.strength = self.strength
+
+      # None of the subscribers of the topic wants this sample: it is not
+      # sent (nor numbered, so they see no gap)
+      if not self.filters.passes (topic, data, publication.ByteSize ()):
+        self.logger.debug ("PublisherMW::disseminate - {} sample filtered out".format (topic))
+        return
+
+      # number the samples of each topic so subscribers can tell what they missed
+      publication.seq = self.seqs[topic] = self.seqs.get (topic, 0) + 1
+      publication.epoch = self.epoch
 
 
       self.logger.debug ("PublisherMW::disseminate - Built the Publication message to sent")
@@ -364,12 +421,25 @@ class PublisherMW ():
       self.logger.debug("PublisherMW::disseminate - Publish the stringified buffer")
       # send the info as bytes. See how we are providing an encoding of utf-8
       # self.pub.send(bytes(send_str, "utf-8"))
-      self.pub.send_multipart([bytes(topic, "utf-8"), buf2send])
+      self.pub.send_multipart([self.topic_ids.envelope (topic), buf2send])
+
+      # remember the frame as sent for late joiners
+      if self.history is not None:
+        self.history.record (topic, buf2send)
 
       self.logger.debug ("PublisherMW::disseminate complete")
     except Exception as e:
       raise e
             
+  ########################################
+  # the content filters of our subscribers, as discovery gave them
+  ########################################
+  def set_filters (self, filters):
+    ''' Filter what we send on the subscribers' content filters '''
+    self.filters = ContentFilters ((f.topic, f.op, f.values) for f in filters)
+    if self.filters.filters:
+      self.logger.info ("PublisherMW::set_filters - sending only what passes {}".format (self.filters.filters))
+
   ########################################
   # set upcall handle
   #
@@ -388,29 +458,3 @@ class PublisherMW ():
   def disable_event_loop (self):
     ''' disable event loop '''
     self.handle_events = False
-
-#################################################################
-  # disseminate the data on our pub socket
-  #
-  # do the actual dissemination of info using the ZMQ pub socket
-  #
-  # Note, here I am sending three diff params. I am eventually going to replace this
-  # sending of a simple string with protobuf serialization. Recall that we need to be
-  # sending publisher id, topic, data, timestamp at a minimum for our experimental
-  # data collection. So anyway we will need to do the necessary serialization.
-  #
-  # This part is left as an exercise.
-  #################################################################
-  def disseminate_history (self, depth):
-    try:
-      self.logger.debug ("PublisherMW::disseminate_history")
-
-      for i in range(min(depth, len(self.history_deque))):
-        send_str = self.history_deque[i]
-        self.logger.debug ("PublisherMW::disseminate_history - {}".format (send_str))
-        # send the info as bytes. See how we are providing an encoding of utf-8
-        self.pub.send (bytes(send_str, "utf-8"))
-
-      self.logger.debug ("PublisherMW::disseminate_history complete")
-    except Exception as e:
-      raise e
\ No newline at end of file
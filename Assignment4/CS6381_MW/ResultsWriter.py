@@ -0,0 +1,174 @@
+###############################################
+#
+# Purpose: Stream a subscriber's results to disk while it runs
+#
+# SubscriberAppln used to keep every sample it received (the parsed
+# publication, latency, arrival time) in a list and write the csv when it
+# was done, so memory grew with the run and a killed subscriber left
+# nothing. Instead it hands each result to a ResultsWriter, which keeps only
+# the plain fields in a bounded queue; a thread writes them out in batches
+# and flushes at least every "interval" seconds. If the disk cannot keep
+# up, write () waits for room rather than letting the queue grow.
+#
+# Two formats (SubscriberAppln --results):
+#
+#   csv:     the same rows as before, readable by everything we have
+#   binary:  columnar blocks, much smaller and cheaper to write:
+#              b"CSR2" once, then per block
+#              uint32 rows
+#              float64[rows] timestamp, latency, received
+#              uint8[rows]   replayed
+#              uint64[rows]  seq
+#              for topic, content and publisher_id:
+#                uint32[rows] lengths, then the utf-8 bytes one after another
+#            A block is only complete once written, so read_results ()
+#            stops at a block cut short by a crash.
+#
+###############################################
+
+import os
+import csv
+import queue
+import struct
+import datetime
+import threading
+from array import array
+
+from CS6381_MW.Common import payload_text
+
+FORMATS = ("csv", "binary")
+
+MAGIC = b"CSR2"
+
+HEADER = ['topic', 'content', 'publisher_id', 'timestamp', 'latency', 'received', 'replayed', 'seq']
+
+# queued by close () after the last result
+STOP = None
+
+##################################
+# The writer thread
+##################################
+class ResultsWriter():
+
+    def __init__(self, logger, path, fmt="csv", batch=1000, interval=1.0):
+        self.logger = logger
+        self.path = path
+        self.fmt = fmt # one of FORMATS
+        self.batch = batch # rows written at a time at most
+        self.interval = interval # seconds a row waits for its batch at most
+        self.pending = queue.Queue(maxsize=10 * batch)
+        self.written = 0
+        self.thread = None
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, publication, latency, received, replayed):
+        ''' Queue one result; waits while the writer is 10 batches behind '''
+        # only the fields, so the publication itself can go
+        self.pending.put((publication.topic, payload_text(publication), publication.pub_id, publication.tstamp,
+                          latency, received, replayed, publication.seq))
+
+    def close(self):
+        ''' Write out what is still queued and stop '''
+        self.pending.put(STOP)
+        self.thread.join()
+        self.logger.debug("ResultsWriter::close - {} results in {}".format(self.written, self.path))
+
+    def run(self):
+        with open(self.path, "w" if self.fmt == "csv" else "wb", newline="" if self.fmt == "csv" else None) as f:
+            if self.fmt == "csv":
+                writer = csv.writer(f)
+                writer.writerow(HEADER)
+            else:
+                f.write(MAGIC)
+
+            done = False
+            while not done:
+                rows, done = self.collect()
+                if rows:
+                    if self.fmt == "csv":
+                        self.write_csv(writer, rows)
+                    else:
+                        f.write(encode_block(rows))
+                    self.written += len(rows)
+                f.flush()
+
+    def collect(self):
+        ''' Up to a batch of rows, or what came in within the interval; and whether we are told to stop '''
+        rows = []
+        try:
+            row = self.pending.get(timeout=self.interval)
+        except queue.Empty:
+            return rows, False
+        while row is not STOP:
+            rows.append(row)
+            if len(rows) >= self.batch:
+                return rows, False
+            try:
+                row = self.pending.get_nowait()
+            except queue.Empty:
+                return rows, False
+        return rows, True
+
+    def write_csv(self, writer, rows):
+        for topic, content, pub_id, tstamp, latency, received, replayed, seq in rows:
+            writer.writerow([topic, content, pub_id, datetime.datetime.fromtimestamp(tstamp).isoformat(),
+                             str(latency), repr(received), str(replayed), str(seq)])
+
+
+##################################
+# The binary format
+##################################
+def encode_block(rows):
+    columns = list(zip(*rows))
+    parts = [struct.pack("<I", len(rows))]
+    for index in (3, 4, 5):
+        parts.append(array("d", columns[index]).tobytes())
+    parts.append(bytes(bytearray(1 if replayed else 0 for replayed in columns[6])))
+    parts.append(array("Q", columns[7]).tobytes())
+    for index in (0, 1, 2):
+        encoded = [value.encode("utf-8") for value in columns[index]]
+        parts.append(array("I", [len(value) for value in encoded]).tobytes())
+        parts.extend(encoded)
+    return b"".join(parts)
+
+def read_results(path):
+    ''' Yield (topic, content, publisher_id, timestamp, latency, received, replayed, seq) from a binary results file '''
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError("{} is not a binary results file".format(path))
+
+    offset = 4
+    while offset + 4 <= len(data):
+        try:
+            (rows,), offset = struct.unpack_from("<I", data, offset), offset + 4
+            floats = []
+            for i in range(3):
+                floats.append(array("d", data[offset:offset + 8 * rows]))
+                offset += 8 * rows
+            replayed = data[offset:offset + rows]
+            offset += rows
+            seqs = array("Q", data[offset:offset + 8 * rows])
+            offset += 8 * rows
+            strings = []
+            for i in range(3):
+                lengths = array("I", data[offset:offset + 4 * rows])
+                offset += 4 * rows
+                values = []
+                for length in lengths:
+                    values.append(data[offset:offset + length].decode("utf-8"))
+                    offset += length
+                strings.append(values)
+        except ValueError:
+            return # the last block was cut short
+        if offset > len(data) or len(seqs) < rows:
+            return
+
+        for i in range(rows):
+            yield (strings[0][i], strings[1][i], strings[2][i], floats[0][i], floats[1][i], floats[2][i], bool(replayed[i]), seqs[i])
@@ -39,23 +39,50 @@ import time   # for sleep
 import logging # for logging. Use it in place of print statements.
 import zmq  # ZMQ sockets
 import datetime
+from collections import deque
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import LeaderReq, SequenceTracker, SubscriptionManager, TopicIds, request_history
+from CS6381_MW.TopicLog import fetch_log
+from CS6381_MW.DecodePool import DecodePool
 
 class SubscriberMW ():
 
     def __init__(self, logger):
         self.logger = logger  # internal logger for print statements
         self.sub = None # will be a ZMQ SUB socket for receiving information/topics
-        self.req = None # will be a ZMQ REQ socket to talk to Discovery service
+        self.subscriptions = None # SubscriptionManager of the SUB socket: who we are connected to for which topics
+        self.req = None # will be a LeaderReq (ZMQ REQ socket) to talk to Discovery service
         self.poller = None # used to wait on incoming replies
         self.addr = None # our advertised IP address
         self.port = None # port num where we are going to publish our topics
         self.upcall_obj = None # handle to appln obj to handle appln-specific data
         self.handle_events = True # in general we keep going thru the event loop
         self.lookup = None # one of the diff ways we do lookup
+        self.context = None # ZMQ context, also used for history requests
+        self.name = None # our name, once we register
+        self.zookeeper = None # addr:port of zookeeper, None without
+        self.watcher = None # LeaderWatcher when we follow zookeeper; its session also announces us
+        self.assignment = None # LeaderWatcher on the broker discovery assigned us
+        self.broker_endpoint = None # where our SUB socket is connected when we follow an assignment
+        self.data_poller = None # sub socket and assignment changes
+        self.conflate = None # topics we only want the newest sample of (empty: all), None to take every sample
+        self.latest = {} # conflated topic -> newest frame not consumed yet
+        self.queue = deque() # what consume () hands out next: (topic, frame), or the name of a conflated topic
+        self.conflated = 0 # samples replaced by a newer one before we got to them
+        self.sources = [] # sockets samples come in on: the SUB socket and our broker egress DEALERs
+        self.credit = 100 # samples a broker egress may send ahead of us
+        self.egress = {} # DEALER on a broker's ROUTER egress -> [topics, samples not yet credited back]
+        self.broker_sub = None # SUB socket for the topics routed through the broker with Hybrid dissemination
+        self.broker_subscriptions = None # and its SubscriptionManager
+        self.sequences = SequenceTracker() # missing, duplicate and reordered samples per publisher and topic
+        self.decoders = None # DecodePool when decoder processes take our samples instead of consume ()
+        self.handlers = {} # topic frame -> (callback, batch) registered for dispatch ()
+        self.default_handler = (None, False) # for the topics without a handler of their own
+        self.table = {} # handlers, and the topics seen that fell to the default handler
+        self.topic_ids = TopicIds() # the ids of our topics, when discovery gives them out
 
     def configure(self, args):
         ''' Initialize the subscriber middleware object '''
@@ -67,10 +94,15 @@ class SubscriberMW ():
             # Retrieve advertised IP address and subscriber port num
             self.port = args.port
             self.addr = args.addr
+            self.zookeeper = args.zookeeper
+            if args.conflate is not None:
+                self.conflate = set(args.conflate)
+            self.credit = args.credit
 
             # Get the ZMQ context
             self.logger.debug("SubscriberMW::configure - obtain ZMQ context")
             context = zmq.Context()
+            self.context = context
 
             # Get the ZMQ Poller object
             self.logger.debug("SubscriberMW::configure - obtain poller")
@@ -80,20 +112,42 @@ class SubscriberMW ():
             # REQ needed because we are client of the Discovery service
             # SUB needed because we subscribe to publisher's topic data
             self.logger.debug("SubscriberMW::configure - obtain REQ and SUB sockets")
-            self.req = context.socket(zmq.REQ)
             self.sub = context.socket(zmq.SUB)
-
-            # Register the req socket for incoming request
-            self.logger.debug ("SubscriberMW::configure - register the REQ socket for incoming replies")
-            self.poller.register(self.req, zmq.POLLIN)
-            # self.poller.register(self.sub, zmq.POLLIN)
+            self.subscriptions = SubscriptionManager(self.logger, self.sub)
+            self.sources = [self.sub]
+
+            # or have decoder processes take in our samples, each a share of
+            # the topics on SUB sockets of its own
+            if args.decoders > 0:
+                if self.conflate is not None:
+                    raise ValueError("--conflate needs --decoders 0")
+                self.logger.debug("SubscriberMW::configure - take samples in with {} decoder processes".format(args.decoders))
+                self.decoders = DecodePool(self.logger, context, args, self.topic_ids)
+
+            # conflation takes in whatever is waiting on any of our sockets
+            if self.conflate is not None:
+                self.data_poller = zmq.Poller()
+                self.data_poller.register(self.sub, zmq.POLLIN)
 
             # Connect to the discovery service 
             # Use TCP followed by Ip addr:port number
             self.logger.debug("SubscriberMW::configure - connect to Discovery service")
             connect_str = "tcp://" + args.discovery
-         
-            self.req.connect(connect_str)
+
+            # If zookeeper is given, follow the discovery leader instead
+            watcher = None
+            if args.zookeeper:
+                from ZookeeperClient import LeaderWatcher
+                self.logger.debug("SubscriberMW::configure - follow the discovery leader via zookeeper")
+                watcher = LeaderWatcher(self.logger, args.zookeeper, "/discovery/leader", context)
+                leader = watcher.wait(timeout=30)
+                if leader is not None:
+                    connect_str = "tcp://" + leader
+
+            # Register the req socket for incoming request
+            self.logger.debug ("SubscriberMW::configure - register the REQ socket for incoming replies")
+            self.req = LeaderReq(self.logger, context, self.poller, connect_str, watcher)
+            self.watcher = watcher
 
             self.logger.info("SubscriberMW::configure completed")
 
@@ -103,7 +157,7 @@ class SubscriberMW ():
     ########################################
     # register with the discovery service
     ########################################
-    def register(self, name, topicList):
+    def register(self, name, topicList, filters=()):
         ''' Register the AppLn with the discovery service '''
         try:
             self.logger.debug("SubscriberMW::register")
@@ -122,8 +176,21 @@ class SubscriberMW ():
             register_req.role = discovery_pb2.ROLE_SUBSCRIBER  # we are a publishe
             register_req.info.CopyFrom(reg_info)  # copy contents of inner structure
             register_req.topiclist[:] = topicList   # this is how repeated entries are added (or use append() or extend ()
+            # and what we want of the content of our topics, (topic, op, values)
+            for topic, op, values in filters:
+                content_filter = register_req.filters.add()
+                content_filter.topic = topic
+                content_filter.op = op
+                content_filter.values[:] = values
       
             self.logger.debug ("SubscriberMW::register - done populating nested RegisterReq")
+            self.name = name
+
+            # Discovery counts us against our broker while our live node is there
+            if self.watcher is not None:
+                from ZookeeperClient import announce, LIVE_SUBSCRIBERS
+                self.logger.debug("SubscriberMW::register - announce ourselves under {}".format(LIVE_SUBSCRIBERS))
+                announce(self.watcher.zk, LIVE_SUBSCRIBERS, name, register_req.SerializeToString())
 
             # Build the outer layer Discovery message
             self.logger.debug("SubscriberMW::register - build the outer DiscoveryReq message")
@@ -160,6 +227,8 @@ class SubscriberMW ():
             self.logger.debug("SubscriberMW::lookup_publishers_by_topiclist - populate the nested LookupPubByTopicReq msg")
             lookup_req = discovery_pb2.LookupPubByTopicReq()  
             lookup_req.topiclist[:] = topiclist
+            if self.name is not None:
+                lookup_req.id = self.name # lets discovery assign us a broker
             self.logger.debug("SubscriberMW::lookup_publishers_by_topiclist - done populating nested LookupPubByTopicReq msg")
 
             # Build the outer layer Discovery message
@@ -204,9 +273,13 @@ class SubscriberMW ():
                     timeout = self.upcall_obj.invoke_operation()
 
                 # Only should be receiving messages in the req socket
-                elif self.req in events: 
+                elif self.req.socket in events: 
                     timeout = self.handle_reply()
 
+                # The discovery leader changed
+                elif self.req.watch_socket in events:
+                    timeout = self.req.redirect(timeout)
+
                 else:
                     raise Exception("Unknown event after poll")
         
@@ -232,6 +305,9 @@ class SubscriberMW ():
             disc_resp.ParseFromString(bytesRcvd)
 
             if (disc_resp.msg_type == discovery_pb2.TYPE_REGISTER):
+                # Samples of our topics come with these ids instead of their names
+                self.topic_ids.update((topic_id.topic, topic_id.id) for topic_id in disc_resp.register_resp.topic_ids)
+
                 # Invoke the application logic to handle the response from discovery for register request
                 timeout = self.upcall_obj.register_response(disc_resp.register_resp)
             elif (disc_resp.msg_type == discovery_pb2.TYPE_LOOKUP_PUB_BY_TOPIC):
@@ -251,11 +327,18 @@ class SubscriberMW ():
     def subscribe(self, topic_list):
         ''' Subscribe to a list of topics '''
 
-        for topic in topic_list:
-            self.logger.debug("SubscriberMW::subscribe - Subscribing to topic {}".format(topic))
-            # Pass in the binary representation of the topic name to the subscribe socket
-            # Use UTF-8 encoding
-            self.sub.setsockopt(zmq.SUBSCRIBE, bytes(topic, "utf-8"))
+        if self.decoders is not None:
+            self.logger.debug("SubscriberMW::subscribe - Subscribing the decoders to {}".format(topic_list))
+            self.decoders.subscribe(topic_list)
+            return
+
+        # Once per topic, whoever else we take it from
+        self.logger.debug("SubscriberMW::subscribe - Subscribing to topics {}".format(topic_list))
+        self.subscriptions.set(None, self.envelopes(topic_list))
+
+    def envelopes(self, topic_list):
+        ''' What the samples of these topics come with: their ids, or else their names '''
+        return [self.topic_ids.envelope(topic) for topic in topic_list]
 
     ########################################
     # set upcall handle
@@ -281,20 +364,189 @@ class SubscriberMW ():
     #
     # Need to tell only subscribe to the topics this subscriber is interested in
     ##################################################
-    def connect_to_publisher(self, ip_address, port, topiclist):
+    def connect_to_publisher(self, ip_address, port, topiclist, via_broker=False):
         ''' Connect to a publisher for the list of topics we are interested in '''
 
         try :
             # Build connection string
             connect_str = "tcp://" + ip_address + ":" + str(port)
 
-            self.logger.debug("SubscriberMW::connect_to_publisher - connecting to {}".format(connect_str))
-            self.sub.connect(connect_str)
+            # The decoders taking any of these topics connect instead of us
+            if self.decoders is not None:
+                self.logger.debug("SubscriberMW::connect_to_publisher - connecting the decoders to {} for {}".format(connect_str, topiclist))
+                self.decoders.connect(connect_str, topiclist)
+                return
+
+            # With Hybrid dissemination the broker's topics come in on a SUB
+            # socket of their own: subscriptions are per socket, and on ours
+            # the publishers we are connected to directly would send them too
+            subscriptions = self.subscriptions
+            if via_broker:
+                if self.broker_sub is None:
+                    self.broker_sub = self.context.socket(zmq.SUB)
+                    self.broker_subscriptions = SubscriptionManager(self.logger, self.broker_sub)
+                    self.sources.append(self.broker_sub)
+                    self.poll_source(self.broker_sub)
+                subscriptions = self.broker_subscriptions
+
+            # Connect if we are not yet, and subscribe only to the topics the
+            # socket is not subscribed to already; called again for the same
+            # publisher, only what changed is applied
+            self.logger.debug("SubscriberMW::connect_to_publisher - Connecting to {} for topics {}".format(connect_str, topiclist))
+            subscriptions.set(connect_str, self.envelopes(topiclist))
+
+        except Exception as e:
+            raise e
+
+    ####################################################
+    # Decoder processes (SubscriberAppln --decoders, see DecodePool.py)
+    #
+    # outputs are (name, results path, latency snapshot path), one per
+    # decoder; they consume our samples from then on, not consume ()
+    ####################################################
+    def start_decoders(self, outputs, arbitrate=True):
+        ''' Start the decoder processes '''
+        try:
+            self.logger.debug("SubscriberMW::start_decoders")
+            self.decoders.start(outputs, arbitrate)
+
+        except Exception as e:
+            raise e
+
+    def wait_decoders(self, count):
+        ''' Wait until the decoders consumed count samples together '''
+        try:
+            self.decoders.wait(count)
+
+        except Exception as e:
+            raise e
+
+    def stop_decoders(self):
+        ''' Stop the decoders; their sequence totals (received, missing, duplicates, reordered, late) '''
+        try:
+            self.logger.debug("SubscriberMW::stop_decoders")
+            return self.decoders.stop()
+
+        except Exception as e:
+            raise e
+
+    ##################################################
+    # Disconnect from a publisher that went away, and unsubscribe from the
+    # topics nobody else we are connected to sends
+    ##################################################
+    def disconnect_from_publisher(self, ip_address, port):
+        ''' Disconnect from a publisher '''
+
+        try:
+            connect_str = "tcp://" + ip_address + ":" + str(port)
+            self.logger.debug("SubscriberMW::disconnect_from_publisher - disconnecting from {}".format(connect_str))
+            if self.decoders is not None:
+                self.decoders.disconnect(connect_str)
+                return
+            for subscriptions in (self.subscriptions, self.broker_subscriptions):
+                if subscriptions is not None:
+                    subscriptions.drop(connect_str)
+
+        except Exception as e:
+            raise e
+
+    ####################################################
+    # Get a queue of our own at a broker (BrokerAppln --egress router)
+    #
+    # One DEALER per broker, named after us, so the broker can tell us apart
+    # and our credit goes to the broker that spent it. The broker sends us
+    # up to "credit" samples ahead; we give credit back as we consume.
+    ####################################################
+    def connect_to_egress(self, ip_address, port, topiclist):
+        ''' Subscribe on a broker's ROUTER egress '''
+
+        try:
+            connect_str = "tcp://" + ip_address + ":" + str(port)
+            self.logger.debug("SubscriberMW::connect_to_egress - connecting to {} for {}".format(connect_str, topiclist))
 
-            # Specify which topics we are subscribing to on this socket
-            for topic in topiclist:
-                self.sub.subscribe(topic)
-                self.logger.debug("SubscriberMW::connect_to_publisher - Connecting to {} for topic {}".format(connect_str, topic))
+            dealer = self.context.socket(zmq.DEALER)
+            if self.name is not None:
+                dealer.setsockopt(zmq.IDENTITY, bytes(self.name, "utf-8"))
+            dealer.connect(connect_str)
+            self.egress[dealer] = [list(topiclist), 0]
+            self.sources.append(dealer)
+            self.poll_source(dealer)
+            self.subscribe_egress(dealer)
+
+        except Exception as e:
+            raise e
+
+    def subscribe_egress(self, dealer):
+        egress_req = topic_pb2.EgressReq()
+        egress_req.topiclist[:] = self.egress[dealer][0]
+        egress_req.credit = self.credit
+        self.egress[dealer][1] = 0
+        dealer.send(egress_req.SerializeToString())
+
+    ####################################################
+    # A sample came in on source; None if it was not a sample but the
+    # broker dropping us for falling too far behind (we subscribe again)
+    ####################################################
+    def receive(self, source, flags=0):
+        topic, frame = source.recv_multipart(flags)
+        if source not in self.egress:
+            return topic, frame
+
+        if not topic:
+            self.logger.info("SubscriberMW::receive - the broker dropped us for falling behind, subscribing again")
+            self.subscribe_egress(source)
+            return None
+
+        # give back half the window at a time
+        self.egress[source][1] += 1
+        if self.egress[source][1] >= max(1, self.credit // 2):
+            egress_req = topic_pb2.EgressReq()
+            egress_req.credit = self.egress[source][1]
+            self.egress[source][1] = 0
+            source.send(egress_req.SerializeToString())
+        return topic, frame
+
+    def poll_source(self, socket):
+        if self.data_poller is None:
+            self.data_poller = zmq.Poller()
+            self.data_poller.register(self.sub, zmq.POLLIN)
+        self.data_poller.register(socket, zmq.POLLIN)
+
+    ####################################################
+    # Follow the broker discovery assigned us
+    #
+    # Discovery (with --threshold) moves subscribers when brokers come and
+    # go by rewriting our node under /assign; consume () then switches our
+    # SUB socket over between two samples. Needs zookeeper.
+    ####################################################
+    def follow_assignment(self, addr, port):
+        ''' Switch brokers whenever discovery reassigns us '''
+        try:
+            self.broker_endpoint = "tcp://{}:{}".format(addr, port)
+            if self.zookeeper is None or self.name is None:
+                return
+
+            from ZookeeperClient import LeaderWatcher, ASSIGNMENTS
+            self.logger.debug("SubscriberMW::follow_assignment - follow {}/{}".format(ASSIGNMENTS, self.name))
+            self.assignment = LeaderWatcher(self.logger, self.zookeeper, ASSIGNMENTS + "/" + self.name, self.context)
+            self.poll_source(self.assignment.socket)
+
+        except Exception as e:
+            raise e
+
+    def switch_broker(self):
+        ''' Move our SUB socket to the broker we are assigned now '''
+        try:
+            value = self.assignment.latest()
+            if value is None:
+                return
+            endpoint = "tcp://" + value
+            if endpoint == self.broker_endpoint:
+                return
+
+            self.logger.info("SubscriberMW::switch_broker - reassigned from {} to {}".format(self.broker_endpoint, endpoint))
+            self.subscriptions.move(self.broker_endpoint, endpoint)
+            self.broker_endpoint = endpoint
 
         except Exception as e:
             raise e
@@ -308,16 +560,10 @@ class SubscriberMW ():
         ''' Consume messages sent from the publishers we subscribe to '''
         try:
             self.logger.debug("SubscriberMW::consume - Consume from our configured sub socket")
-            
-            # bytesReceived = self.sub.recv_string()
-            bytesReceived = self.sub.recv_multipart()
-            # Receiving two parts of the message topic, serializedObject
 
-            # self.logger.debug("RECEIVED: ")
-            # self.logger.debug(bytesReceived)
-
-            # Get the second element 
-            publicationBytes = bytesReceived[1]
+            # Receiving two parts of the message topic, serializedObject;
+            # get the second element
+            publicationBytes = self.next_frame()[1]
 
             # self.logger.debug("ELEMENT 1: ")
             # self.logger.debug(publicationBytes)
@@ -330,8 +576,12 @@ class SubscriberMW ():
             # Decode the data 
             publication = topic_pb2.Publication()
             publication.ParseFromString(publicationBytes)
+            self.topic_ids.restore(publication)
             # publication = bytesReceived.decode("utf-8")
 
+            # Keep track of what we missed (samples conflation skipped count too)
+            self.sequences.observe(publication.pub_id, publication.topic, publication.seq, publication.epoch)
+
             # self.logger.debug("SubscriberMW::consume - Received " + publication.content)
 
             self.logger.debug("SubscriberMW::consume - Consumption complete")
@@ -340,61 +590,169 @@ class SubscriberMW ():
 
         except Exception as e:
             raise e
-        
-      #################################################################
-    # collect the data on our pub socket
+
+    ####################################################
+    # The next sample to hand out, (topic frame, serialized publication);
+    # without block, None if none is waiting
+    ####################################################
+    def next_frame(self, block=True):
+        # Switch brokers as discovery tells us while we wait for one of
+        # our sockets
+        source = self.sub
+        while self.data_poller is not None and not self.queue:
+            events = dict(self.data_poller.poll(None if block else 0))
+            if self.assignment is not None and self.assignment.socket in events:
+                self.switch_broker()
+            ready = [socket for socket in self.sources if socket in events]
+            if ready:
+                source = ready[0]
+                break
+            if not block:
+                return None
+        if self.data_poller is None and not block:
+            try:
+                return self.receive(self.sub, zmq.NOBLOCK)
+            except zmq.Again:
+                return None
+
+        if self.conflate is None:
+            sample = self.receive(source)
+            if sample is None:
+                return self.next_frame(block)
+            return sample
+
+        # Take in everything that arrived while the application was
+        # busy, so the freshest sample of a conflated topic is next
+        self.drain()
+        if not self.queue:
+            return self.next_frame(block)
+        item = self.queue.popleft()
+        if isinstance(item, str):
+            return self.topic_ids.envelope(item), self.latest.pop(item)
+        return item
+
+    ####################################################
+    # Handlers per topic (the dispatch table)
     #
-    # do the actual dissemination of info using the ZMQ pub socket
+    # Instead of consume ()-ing every sample, an application can register a
+    # callback per topic and let dispatch () hand the samples out. The table
+    # is keyed by the topic frame, so a sample is looked up before it is
+    # parsed, and a topic whose handler is None is dropped without parsing
+    # at all (nor counted by the sequence tracker). A batch handler gets the
+    # samples of its topic that dispatch () took in one go as a list.
+    # Topics without a handler of their own go to the default handler. A
+    # topic that comes with its id goes to the handler of its name.
+    ####################################################
+    def register_handler(self, topic, callback, batch=False):
+        ''' Hand the samples of topic to callback (None to drop them) '''
+        self.handlers[bytes(topic, "utf-8")] = (callback, batch)
+        self.table = dict(self.handlers)
+
+    def register_default_handler(self, callback, batch=False):
+        ''' Hand the samples of every other topic to callback (None to drop them) '''
+        self.default_handler = (callback, batch)
+        self.table = dict(self.handlers)
+
+    def dispatch(self, limit):
+        ''' Take up to limit samples, waiting for the first only, to their handlers; how many we took '''
+        try:
+            batches = {} # batch callback -> publications
+            taken = 0
+            sample = self.next_frame()
+            while sample is not None:
+                topic, frame = sample
+                entry = self.table.get(topic)
+                if entry is None:
+                    entry = self.table[topic] = self.handlers.get(bytes(self.topic_ids.name(topic), "utf-8"), self.default_handler)
+                callback, batch = entry
+                taken += 1
+
+                if callback is not None:
+                    publication = topic_pb2.Publication()
+                    publication.ParseFromString(frame)
+                    self.topic_ids.restore(publication)
+                    self.sequences.observe(publication.pub_id, publication.topic, publication.seq, publication.epoch)
+                    if batch:
+                        batches.setdefault(callback, []).append(publication)
+                    else:
+                        callback(publication)
+
+                if taken >= limit:
+                    break
+                sample = self.next_frame(block=False)
+
+            for callback, publications in batches.items():
+                callback(publications)
+            return taken
+
+        except Exception as e:
+            raise e
+
+    ####################################################
+    # Conflation (SubscriberAppln --conflate)
     #
-    # Note, here I am sending three diff params. I am eventually going to replace this
-    # sending of a simple string with protobuf serialization. Recall that we need to be
-    # sending publisher id, topic, data, timestamp at a minimum for our experimental
-    # data collection. So anyway we will need to do the necessary serialization.
+    # A slow subscriber would otherwise work through a queue of stale samples
+    # in ZMQ (and lose the newest ones at the high water mark). Instead we
+    # empty our sockets on every consume () and keep only the newest frame
+    # of each conflated topic, in the place in line of its oldest unconsumed
+    # sample; other topics keep every sample in order. ZMQ_CONFLATE would
+    # keep one message for all topics together and cannot carry our two
+    # frame messages.
+    ####################################################
+    def conflates(self, topic):
+        return not self.conflate or any(topic.startswith(prefix) for prefix in self.conflate)
+
+    def drain(self):
+        ''' Move everything waiting on our sockets into our queue '''
+        for source in self.sources:
+            while True:
+                try:
+                    sample = self.receive(source, zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                if sample is not None:
+                    self.enqueue(*sample)
+
+    def enqueue(self, topic, frame):
+        name = self.topic_ids.name(topic)
+        if not self.conflates(name):
+            self.queue.append((topic, frame))
+        elif name in self.latest:
+            self.latest[name] = frame
+            self.conflated += 1
+        else:
+            self.latest[name] = frame
+            self.queue.append(name)
+
+    ####################################################
+    # Ask a publisher (or the broker) for the recent samples of our topics
     #
-    # This part is left as an exercise.
-    #################################################################
-    def collect (self):
+    # Call after connect_to_publisher so nothing published in between is
+    # missed; the reply comes to us only, not to every subscriber.
+    ####################################################
+    def request_history(self, ip_address, history_port, topiclist, depth):
+        ''' Fetch the last depth samples per topic from a history service '''
+
         try:
-            self.logger.debug ("SubscriberMW::collect")
+            self.logger.debug("SubscriberMW::request_history - ask {}:{} for {} samples of {}".format(ip_address, history_port, depth, topiclist))
+            return request_history(self.logger, self.context, ip_address, history_port, topiclist, depth, topic_ids=self.topic_ids)
 
-            # receive the info as bytes. See how we are providing an encoding of utf-8
-            message = self.sub.recv_string(encoding="utf-8")
+        except Exception as e:
+            raise e
 
-            self.logger.debug ("SubscriberMW::collect complete")
-            resultParcel = Common.TopicParcel.fromMessage(message)
-            latency = (datetime.datetime.now() - datetime.datetime.fromisoformat(resultParcel.sent_at)).microseconds / 1000
+    ####################################################
+    # Read a topic from the broker's durable log, from the first sample it
+    # logged at or after "since" up to the end
+    ####################################################
+    def fetch_log(self, ip_address, log_port, topic, since):
+        ''' Catch up on a topic from the broker's log '''
 
         try:
-            ownership = self.max_ownerships_dict[resultParcel.topic]
-        except KeyError:
-            # topic ownership max not yet set
-            self.max_ownerships_dict[resultParcel.topic] = resultParcel.ownership
-            ownership = self.max_ownerships_dict[resultParcel.topic]
-
-        if (resultParcel.ownership < ownership):
-            self.logger.debug ("SubscriberMW::collect latency of message: " + str(latency) + "ms" + " THIS MESSAGE IS IGNORED DUE TO LOW STRENGTH!")
-            ignores = self.ownership_ignores_dict.get(resultParcel.topic, 0)
-            if ignores == 0:
-                # topic ownership max not yet set
-                self.ownership_ignores_dict[resultParcel.topic] = 1
-                ignores = 1
-            else:
-                self.ownership_ignores_dict[resultParcel.topic] = self.ownership_ignores_dict[resultParcel.topic] + 1
-
-            # reset the max ownership for the topic if the threshold has been met
-            if ignores >= self.ownership_threshold:
-            self.ownership_ignores_dict[resultParcel.topic] = 0
-            self.max_ownerships_dict[resultParcel.topic] = 0
-
-            return resultParcel
-        else:
-            self.ownership_ignores_dict[resultParcel.topic] = 0
-            self.max_ownerships_dict[resultParcel.topic] = resultParcel.ownership
+            self.logger.debug("SubscriberMW::fetch_log - read {} since {} from {}:{}".format(topic, since, ip_address, log_port))
+            publications, offset = fetch_log(self.logger, self.context, ip_address, log_port, topic, since=since)
+            for publication in publications:
+                self.topic_ids.restore(publication)
+            return publications
 
-        self.logger.debug ("SubscriberMW::collect latency of message: " + str(latency) + "ms")
-
-        return resultParcel
-        
         except Exception as e:
-        raise e
-            
\ No newline at end of file
+            raise e
@@ -0,0 +1,312 @@
+###############################################
+#
+# Purpose: Durable per topic log of what the broker forwarded
+#
+# Every topic gets a directory of segment files. A segment is preallocated
+# to segment_bytes and memory mapped; records are appended to the map as
+#
+#     uint32 length | double logged at (epoch seconds) | frame
+#
+# and a zero length marks the end of what was written. A record's offset is
+# its position in the topic (0, 1, 2, ...); segment files are named by the
+# offset of their first record, so a reopened log finds its place by
+# scanning the segments once. Reads come straight out of the maps.
+#
+# Appends survive a crash of the broker process as soon as they are in the
+# map (the kernel owns the pages); sync_every forces them to disk as well.
+#
+#   TopicLog    - the logs of all topics under one directory
+#   LogService  - a ROUTER socket answering FetchReq from subscribers
+#   fetch_log   - the subscriber side of a fetch
+#
+###############################################
+
+import os
+import mmap
+import struct
+import time
+import bisect
+from array import array
+from urllib.parse import quote, unquote
+
+import zmq
+
+from CS6381_MW import topic_pb2
+
+HEADER = struct.Struct("<Id") # length, logged at
+
+##################################
+# One memory mapped segment file
+##################################
+class Segment ():
+
+    def __init__ (self, path, base_offset, size):
+        self.path = path
+        self.base_offset = base_offset # offset of the first record
+        self.positions = array ("q") # where each record starts
+        self.times = array ("d") # when each record was logged
+
+        new_file = not os.path.exists (path)
+        self.file = open (path, "a+b")
+        if new_file or os.path.getsize (path) < size:
+            self.file.truncate (max (size, os.path.getsize (path)))
+        self.size = os.path.getsize (path)
+        self.map = mmap.mmap (self.file.fileno (), self.size)
+
+        # find our records
+        self.end = 0
+        while self.end + HEADER.size <= self.size:
+            length, logged_at = HEADER.unpack_from (self.map, self.end)
+            if length == 0:
+                break
+            self.positions.append (self.end)
+            self.times.append (logged_at)
+            self.end += HEADER.size + length
+
+    def __len__ (self):
+        return len (self.positions)
+
+    def fits (self, length):
+        return self.end + HEADER.size + length <= self.size
+
+    def append (self, frame, logged_at):
+        HEADER.pack_into (self.map, self.end, len (frame), logged_at)
+        start = self.end + HEADER.size
+        self.map[start:start + len (frame)] = frame
+        self.positions.append (self.end)
+        self.times.append (logged_at)
+        self.end = start + len (frame)
+
+    # frames from the index'th record on, until max_bytes is reached
+    # (always at least one)
+    def read (self, index, max_bytes):
+        frames = []
+        total = 0
+        view = memoryview (self.map)
+        try:
+            while index < len (self.positions):
+                position = self.positions[index]
+                length = HEADER.unpack_from (self.map, position)[0]
+                if frames and total + length > max_bytes:
+                    break
+                frames.append (bytes (view[position + HEADER.size:position + HEADER.size + length]))
+                total += length
+                index += 1
+        finally:
+            view.release ()
+        return frames
+
+    def flush (self):
+        self.map.flush ()
+
+    def close (self):
+        self.map.close ()
+        self.file.close ()
+
+
+##################################
+# The log of one topic
+##################################
+class SegmentedLog ():
+
+    def __init__ (self, directory, segment_bytes, sync_every=0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_every = sync_every # flush to disk every so many appends, 0 never
+        self.unsynced = 0
+        self.segments = []
+        self.bases = [] # base offset of each segment, for bisect
+
+        os.makedirs (directory, exist_ok=True)
+        for name in sorted (os.listdir (directory)):
+            if name.endswith (".log"):
+                self.open_segment (int (name[:-4]), 0)
+
+        if not self.segments:
+            self.open_segment (0, segment_bytes)
+
+    def open_segment (self, base_offset, size):
+        path = os.path.join (self.directory, "{:020d}.log".format (base_offset))
+        segment = Segment (path, base_offset, size)
+        self.segments.append (segment)
+        self.bases.append (base_offset)
+        return segment
+
+    # offset the next record will get
+    def end_offset (self):
+        last = self.segments[-1]
+        return last.base_offset + len (last)
+
+    def append (self, frame, logged_at=None):
+        if logged_at is None:
+            logged_at = time.time ()
+
+        segment = self.segments[-1]
+        if not segment.fits (len (frame)):
+            segment.flush ()
+            # a frame bigger than a segment gets a segment of its own
+            segment = self.open_segment (self.end_offset (), max (self.segment_bytes, HEADER.size + len (frame)))
+
+        offset = self.end_offset ()
+        segment.append (frame, logged_at)
+
+        self.unsynced += 1
+        if self.sync_every and self.unsynced >= self.sync_every:
+            segment.flush ()
+            self.unsynced = 0
+
+        return offset
+
+    # (first offset, frames) from offset on, up to about max_bytes, all
+    # from one segment. An offset before the log is read from the start.
+    def read (self, offset, max_bytes):
+        offset = max (offset, self.bases[0])
+        if offset >= self.end_offset ():
+            return offset, []
+
+        segment = self.segments[bisect.bisect_right (self.bases, offset) - 1]
+        return offset, segment.read (offset - segment.base_offset, max_bytes)
+
+    # offset of the first record logged at or after "since"
+    def offset_for_time (self, since):
+        for segment in self.segments:
+            if len (segment) and segment.times[-1] >= since:
+                return segment.base_offset + bisect.bisect_left (segment.times, since)
+        return self.end_offset ()
+
+    def flush (self):
+        for segment in self.segments:
+            segment.flush ()
+
+    def close (self):
+        for segment in self.segments:
+            segment.close ()
+
+
+##################################
+# The logs of all topics
+##################################
+class TopicLog ():
+
+    def __init__ (self, directory, segment_bytes=16 * 1024 * 1024, sync_every=0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_every = sync_every
+        self.logs = {} # topic -> SegmentedLog
+
+        # pick up what an earlier run logged
+        os.makedirs (directory, exist_ok=True)
+        for name in os.listdir (directory):
+            path = os.path.join (directory, name)
+            if os.path.isdir (path):
+                self.logs[unquote (name)] = SegmentedLog (path, segment_bytes, sync_every)
+
+    def log (self, topic):
+        topic_log = self.logs.get (topic)
+        if topic_log is None:
+            path = os.path.join (self.directory, quote (topic, safe=""))
+            topic_log = self.logs[topic] = SegmentedLog (path, self.segment_bytes, self.sync_every)
+        return topic_log
+
+    def append (self, topic, frame, logged_at=None):
+        return self.log (topic).append (frame, logged_at)
+
+    def flush (self):
+        for topic_log in self.logs.values ():
+            topic_log.flush ()
+
+    def close (self):
+        for topic_log in self.logs.values ():
+            topic_log.close ()
+
+
+##################################
+# Fetches from subscribers
+#
+# The middleware registers "socket" in its poller and calls serve () when it
+# fires. A FetchReq names a topic and either an offset or, with offset < 0,
+# a time; the FetchResp carries up to max_bytes of frames starting there,
+# the offset to ask for next and the current end of the log.
+##################################
+class LogService ():
+
+    def __init__ (self, logger, context, topic_log, max_bytes=1024 * 1024):
+        self.logger = logger
+        self.topic_log = topic_log
+        self.max_bytes = max_bytes # cap on a single response
+        self.socket = context.socket (zmq.ROUTER)
+        self.port = None
+        self.served = 0
+
+    # a port, or a full endpoint such as ipc://... (then port is that endpoint)
+    def bind (self, port):
+        self.port = port
+        self.socket.bind (port if isinstance (port, str) else "tcp://*:" + str (port))
+
+    def serve (self):
+        identity, empty, buf = self.socket.recv_multipart ()
+
+        fetch_req = topic_pb2.FetchReq ()
+        fetch_req.ParseFromString (buf)
+
+        fetch_resp = topic_pb2.FetchResp ()
+        fetch_resp.topic = fetch_req.topic
+        topic_log = self.topic_log.logs.get (fetch_req.topic)
+        if topic_log is not None:
+            offset = fetch_req.offset if fetch_req.offset >= 0 else topic_log.offset_for_time (fetch_req.since)
+            max_bytes = min (fetch_req.max_bytes or self.max_bytes, self.max_bytes)
+            first, frames = topic_log.read (offset, max_bytes)
+            fetch_resp.first_offset = first
+            fetch_resp.next_offset = first + len (frames)
+            fetch_resp.end_offset = topic_log.end_offset ()
+            fetch_resp.samples.extend (frames)
+
+        self.socket.send_multipart ([identity, empty, fetch_resp.SerializeToString ()])
+        self.served += 1
+
+    def close (self):
+        self.socket.close (linger=0)
+
+
+##################################
+# Read a topic from "offset" (or, if offset is None, from "since") to the
+# end of the log. Returns (publications, next offset); next offset is where
+# to resume later. With parse=False the serialized frames come back instead
+# of Publications. Nothing comes back if the broker does not answer within
+# "timeout" seconds.
+##################################
+def fetch_log (logger, context, addr, port, topic, offset=None, since=0.0, max_bytes=1024 * 1024, timeout=2.0, parse=True):
+    req = context.socket (zmq.REQ)
+    req.connect ("tcp://{}:{}".format (addr, port))
+
+    publications = []
+    try:
+        while True:
+            fetch_req = topic_pb2.FetchReq ()
+            fetch_req.topic = topic
+            fetch_req.offset = offset if offset is not None else -1
+            fetch_req.since = since
+            fetch_req.max_bytes = max_bytes
+            req.send (fetch_req.SerializeToString ())
+
+            if not req.poll (timeout=int (timeout * 1000)):
+                logger.info ("fetch_log - no answer from {}:{} for {}".format (addr, port, topic))
+                break
+
+            fetch_resp = topic_pb2.FetchResp ()
+            fetch_resp.ParseFromString (req.recv ())
+            if parse:
+                for sample in fetch_resp.samples:
+                    publication = topic_pb2.Publication ()
+                    publication.ParseFromString (sample)
+                    publications.append (publication)
+            else:
+                publications.extend (fetch_resp.samples)
+
+            offset = fetch_resp.next_offset
+            if not fetch_resp.samples or offset >= fetch_resp.end_offset:
+                break
+    finally:
+        req.close (linger=0)
+
+    return publications, offset
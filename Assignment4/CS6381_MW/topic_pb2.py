@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 # Generated by the protocol buffer compiler.  DO NOT EDIT!
 # source: topic.proto
-
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
 from google.protobuf import descriptor as _descriptor
-from google.protobuf import message as _message
-from google.protobuf import reflection as _reflection
+from google.protobuf import descriptor_pool as _descriptor_pool
 from google.protobuf import symbol_database as _symbol_database
 # @@protoc_insertion_point(imports)
 
@@ -13,79 +13,29 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor.FileDescriptor(
-  name='topic.proto',
-  package='',
-  syntax='proto3',
-  serialized_options=None,
-  create_key=_descriptor._internal_create_key,
-  serialized_pb=b'\n\x0btopic.proto\"M\n\x0bPublication\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t\x12\x0e\n\x06pub_id\x18\x03 \x01(\t\x12\x0e\n\x06tstamp\x18\x04 \x01(\x02\x62\x06proto3'
-)
-
-
-
-
-_PUBLICATION = _descriptor.Descriptor(
-  name='Publication',
-  full_name='Publication',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  create_key=_descriptor._internal_create_key,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='topic', full_name='Publication.topic', index=0,
-      number=1, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='content', full_name='Publication.content', index=1,
-      number=2, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='pub_id', full_name='Publication.pub_id', index=2,
-      number=3, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=b"".decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-    _descriptor.FieldDescriptor(
-      name='tstamp', full_name='Publication.tstamp', index=3,
-      number=4, type=2, cpp_type=6, label=1,
-      has_default_value=False, default_value=float(0),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto3',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=15,
-  serialized_end=92,
-)
-
-DESCRIPTOR.message_types_by_name['Publication'] = _PUBLICATION
-_sym_db.RegisterFileDescriptor(DESCRIPTOR)
-
-Publication = _reflection.GeneratedProtocolMessageType('Publication', (_message.Message,), {
-  'DESCRIPTOR' : _PUBLICATION,
-  '__module__' : 'topic_pb2'
-  # @@protoc_insertion_point(class_scope:Publication)
-  })
-_sym_db.RegisterMessage(Publication)
-
-
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0btopic.proto\"\xab\x02\n\x0bPublication\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x11\n\x07\x63ontent\x18\x02 \x01(\tH\x00\x12\x0e\n\x04real\x18\x07 \x01(\x01H\x00\x12\x11\n\x07integer\x18\x08 \x01(\x12H\x00\x12\r\n\x03raw\x18\t \x01(\x0cH\x00\x12\x1b\n\x07weather\x18\n \x01(\x0e\x32\x08.WeatherH\x00\x12!\n\nairquality\x18\x0b \x01(\x0e\x32\x0b.AirQualityH\x00\x12\x1d\n\x08location\x18\x0c \x01(\x0e\x32\t.LocationH\x00\x12\x0e\n\x06pub_id\x18\x03 \x01(\t\x12\x0e\n\x06tstamp\x18\x04 \x01(\x01\x12\x10\n\x08strength\x18\x05 \x01(\x05\x12\x0b\n\x03seq\x18\x06 \x01(\x04\x12\x10\n\x08topic_id\x18\r \x01(\r\x12\r\n\x05\x65poch\x18\x0e \x01(\x04\x42\t\n\x07payload\".\n\nHistoryReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\x12\r\n\x05\x64\x65pth\x18\x02 \x01(\r\"\x1e\n\x0bHistoryResp\x12\x0f\n\x07samples\x18\x01 \x03(\x0c\"K\n\x08\x46\x65tchReq\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\x03\x12\r\n\x05since\x18\x03 \x01(\x01\x12\x11\n\tmax_bytes\x18\x04 \x01(\r\"j\n\tFetchResp\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x14\n\x0c\x66irst_offset\x18\x02 \x01(\x03\x12\x13\n\x0bnext_offset\x18\x03 \x01(\x03\x12\x12\n\nend_offset\x18\x04 \x01(\x03\x12\x0f\n\x07samples\x18\x05 \x03(\x0c\".\n\tEgressReq\x12\x11\n\ttopiclist\x18\x01 \x03(\t\x12\x0e\n\x06\x63redit\x18\x02 \x01(\r*?\n\x07Weather\x12\t\n\x05SUNNY\x10\x00\x12\n\n\x06\x43LOUDY\x10\x01\x12\t\n\x05RAINY\x10\x02\x12\t\n\x05\x46OGGY\x10\x03\x12\x07\n\x03ICY\x10\x04**\n\nAirQuality\x12\x08\n\x04GOOD\x10\x00\x12\x08\n\x04SMOG\x10\x01\x12\x08\n\x04POOR\x10\x02*H\n\x08Location\x12\x0b\n\x07\x41MERICA\x10\x00\x12\n\n\x06\x45UROPE\x10\x01\x12\x08\n\x04\x41SIA\x10\x02\x12\n\n\x06\x41\x46RICA\x10\x03\x12\r\n\tAUSTRALIA\x10\x04\x62\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'topic_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _WEATHER._serialized_start=630
+  _WEATHER._serialized_end=693
+  _AIRQUALITY._serialized_start=695
+  _AIRQUALITY._serialized_end=737
+  _LOCATION._serialized_start=739
+  _LOCATION._serialized_end=811
+  _PUBLICATION._serialized_start=16
+  _PUBLICATION._serialized_end=315
+  _HISTORYREQ._serialized_start=317
+  _HISTORYREQ._serialized_end=363
+  _HISTORYRESP._serialized_start=365
+  _HISTORYRESP._serialized_end=395
+  _FETCHREQ._serialized_start=397
+  _FETCHREQ._serialized_end=472
+  _FETCHRESP._serialized_start=474
+  _FETCHRESP._serialized_end=580
+  _EGRESSREQ._serialized_start=582
+  _EGRESSREQ._serialized_end=628
 # @@protoc_insertion_point(module_scope)
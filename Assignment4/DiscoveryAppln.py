@@ -36,6 +36,7 @@ import time   # for sleep
 import argparse # for argument parsing
 import configparser # for configuration parsing
 import logging # for logging. Use it in place of print statements.
+import threading # the registry is also updated from the zookeeper thread
 import zmq  # ZMQ sockets
 
 # Now import our CS6381 Middleware
@@ -51,14 +52,19 @@ from CS6381_MW.Common import Constants
 
 # Simple data models I created to hold info about publishers and subscribers
 from CS6381_MW.Common import Entity
+from CS6381_MW.Common import BrokerBalancer, TopicIds, tree_parent, via_broker
 
 ##################################
 #       DiscoveryAppln class
 ##################################
 class DiscoveryAppln():
 
-    # At this time I only want one broker, maybe one day I want more
+    # One broker unless hot standby replicas are requested with --num_brokers
     DEFAULT_NUM_BROKERS = 1
+
+    ROLE_NAMES = {discovery_pb2.ROLE_PUBLISHER: "publisher",
+                  discovery_pb2.ROLE_SUBSCRIBER: "subscriber",
+                  discovery_pb2.ROLE_BOTH: "broker"}
     
     class State (Enum):
         INITIALIZE = 0,
@@ -81,8 +87,13 @@ class DiscoveryAppln():
         self.zookeeper_addr = None
         self.zookeeper_port = None
         self.adapter = None # Zookeeper Discovery Service Adapaters
-        self.broker_connections_dict = {} # Dictionary of counts of broker names and requests for them
+        self.broker_connections_dict = {} # broker name -> names of the subscribers assigned to it
         self.broker_threshold = 0 # threshold before starting to load balance out brokers
+        self.balancer = None # BrokerBalancer when subscribers are spread over the brokers
+        self.tree_fanout = 0 # child brokers per broker in a broker tree, 0 if every broker subscribes to the publishers
+        self.hybrid_min_saved = 1 # connections a topic must save to go through the broker with Hybrid dissemination
+        self.registry_lock = threading.Lock() # the standby mirror writes from the zookeeper thread
+        self.topic_ids = None # TopicIds when topics go by compact ids on the wire
 
     def configure(self, args):
         ''' Initialize the object '''
@@ -97,11 +108,21 @@ class DiscoveryAppln():
             # Initialize our variables
             self.specified_num_publishers = args.num_publishers
             self.specified_num_subscribers = args.num_subscribers
-            self.specified_num_brokers = self.DEFAULT_NUM_BROKERS
+            self.specified_num_brokers = args.num_brokers
             self.name = args.name
-            self.zookeeper_addr = args.zookeeper
-            self.zookeeper_port = 2181 # This is the zookeeper default
+            self.zookeeper_addr = args.zookeeper_addr
+            self.zookeeper_port = args.zookeeper_port
             self.broker_threshold = args.threshold
+            self.tree_fanout = args.tree_fanout
+            self.hybrid_min_saved = args.hybrid_min_saved
+            if args.topic_ids:
+                self.topic_ids = TopicIds()
+            # a tree spreads subscribers over all of its brokers
+            if self.tree_fanout > 0 and self.broker_threshold == 0:
+                self.broker_threshold = 1
+            if self.broker_threshold > 0:
+                self.balancer = BrokerBalancer(self.broker_threshold)
+                self.broker_connections_dict = self.balancer.brokers
             
             # Now, get the configuration object
             self.logger.debug ("DiscoveryAppln::configure - parsing config.ini")
@@ -156,6 +177,14 @@ class DiscoveryAppln():
             self.logger.debug ("DiscoveryAppln::driver - upcall handle")
             self.mw_obj.set_upcall_handle(self)
 
+            # Mirror the registry before competing for leadership so that a
+            # standby is already warm when it takes over
+            self.logger.debug ("DiscoveryAppln::driver - mirror the registry and join the election")
+            self.mw_obj.watch_registry(self.mirror_registration)
+            if self.balancer is not None:
+                self.mw_obj.watch_live(self.live_brokers, self.live_subscribers)
+            self.mw_obj.join_election(self.leader_elected)
+
             # Set to the register state
             # We want to accept registrations from pubs and subs
             self.state = self.State.REGISTER
@@ -181,134 +210,80 @@ class DiscoveryAppln():
             # Load the role of the entity attempting to register
             role = reg_req.role
 
-            # Handle registration differently based on the role of the entity attempting to register
-            if (role == discovery_pb2.ROLE_PUBLISHER):
-                self.logger.info("DiscoveryAppln::register_request Registering a publisher")
+            if (role not in self.ROLE_NAMES):
+                self.logger.debug ("DiscoveryAppln::register_request - registration is a failure because invalid role provided")
+                raise ValueError("Invalid role provided for registration request to Discovery server")
 
-                # Verify that there is still room for publishers in the system
-                if (len(self.publisher_list) < self.specified_num_publishers):
-                    self.logger.debug("DiscoveryAppln::register_request Creating a new publisher record")
-                   
-                    # Create a new publisher record
-                    publisher = Entity()
+            self.logger.info("DiscoveryAppln::register_request Registering a {}".format(self.ROLE_NAMES[role]))
 
-                    # Load the publisher with values from RegistrantInfo
-                    publisher.role = discovery_pb2.ROLE_BOTH
-                    publisher.name = reg_req.info.id
-                    publisher.ip_address = reg_req.info.addr
-                    publisher.port = reg_req.info.port
-                    publisher.topic_list = reg_req.topiclist
+            # Only the leader writes to the registry. Standbys mirror it and
+            # will take over the writes if the leader goes away.
+            if (not self.mw_obj.is_leader()):
+                self.logger.info("DiscoveryAppln::register_request Not the leader, rejecting registration")
+                self.mw_obj.send_register_response(discovery_pb2.STATUS_FAILURE, "Not the discovery leader")
+                return 0
 
-                    # Add the created object to the list of publishers registered
-                    self.publisher_list.append(publisher)
+            with self.registry_lock:
+                entity_list, specified_num = self.registry_for_role(role)
 
-                    # Set status to success if we have gotten this far
+                if (any(entity.name == reg_req.info.id for entity in entity_list)):
+                    # Already known, e.g., a request resent after a failover that the old
+                    # leader had recorded before dying. Registration is idempotent.
+                    self.logger.debug("DiscoveryAppln::register_request {} already registered".format(reg_req.info.id))
                     status = discovery_pb2.STATUS_SUCCESS
-
-                    # No reason to send
                     reason = None
-                    
-                    self.logger.debug("DiscoveryAppln::register_request Done creating a new publisher record")
-                   
-                else:
-                    self.logger.info("DiscoveryAppln::register_request Publisher attempting to register, but no more publisher roles are allocated")
-
-                    # Set status to failure
-                    status = discovery_pb2.STATUS_FAILURE
+                    topic_ids = self.assign_topic_ids(reg_req)
 
-                    # Pass in a reason to let the registrant know why it failed
-                    reason = "Max publishers already reached for this system"
+                    # It may come with other topics, and their ids, this time. Persist
+                    # it as for a new record so the standbys learn them too.
+                    self.mw_obj.register_entity_zk(reg_req)
+                    known = [i for i, entity in enumerate(entity_list) if entity.name == reg_req.info.id]
+                    entity_list[known[0]] = self.build_entity(reg_req)
 
-                # Send a register reply with the MW
-                self.mw_obj.send_register_response(status, reason)
+                    # a broker coming back after it left
+                    if (role == discovery_pb2.ROLE_BOTH and self.balancer is not None):
+                        self.rebalance(self.balancer.add_broker(reg_req.info.id))
 
-                self.logger.info("DiscoveryAppln::register_request Done registering a publisher")
+                # Verify that there is still room for this role in the system
+                elif (len(entity_list) < specified_num):
+                    self.logger.debug("DiscoveryAppln::register_request Creating a new {} record".format(self.ROLE_NAMES[role]))
 
-            elif (role == discovery_pb2.ROLE_SUBSCRIBER):
-                self.logger.info("DiscoveryAppln::register_request Registering a subscriber")
+                    # Number its new topics in the request itself, so the standbys
+                    # learn the same ids from zookeeper
+                    topic_ids = self.assign_topic_ids(reg_req)
 
-                # Verify that there is still room for subscribers in the system
-                if (len(self.subscriber_list) < self.specified_num_subscribers):
-                    self.logger.debug("DiscoveryAppln::register_request Creating a new subscriber record")
-                    # Create new subscriber object
-                    subscriber = Entity()
+                    # Persist in zookeeper first so the standbys see it before we reply
+                    self.mw_obj.register_entity_zk(reg_req)
 
-                    # Load the subscriber values from registrant info
-                    subscriber.role = discovery_pb2.ROLE_SUBSCRIBER
-                    subscriber.name = reg_req.info.id
-                    subscriber.ip_address = reg_req.info.addr
-                    subscriber.port = reg_req.info.port
-                    subscriber.topic_list = reg_req.topiclist
+                    # Add the created object to the list registered for this role
+                    entity_list.append(self.build_entity(reg_req))
 
-                    # Add the created object to the list of publishers registered
-                    self.subscriber_list.append(subscriber)
+                    # A new broker takes subscribers off the busiest ones
+                    if (role == discovery_pb2.ROLE_BOTH and self.balancer is not None):
+                        self.rebalance(self.balancer.add_broker(reg_req.info.id))
 
                     # Set status to success if we have gotten this far
                     status = discovery_pb2.STATUS_SUCCESS
 
                     # No reason to send
                     reason = None
-                    
-                    self.logger.debug("DiscoveryAppln::register_request Done creating a new subscriber record")
-
-                else:
-                    self.logger.info("DiscoveryAppln::register_request Subscriber attempting to register, but no more subscriber roles are allocated")
-
-                    # Set status to failure
-                    status = discovery_pb2.STATUS_FAILURE
-
-                    # Pass in a reason to let the registrant know why it failed
-                    reason = "Max subscribers already reached for this system"
-                
-                # Send a register reply with the MW
-                self.mw_obj.send_register_response(status, reason)
-
-                self.logger.info("DiscoveryAppln::register_request Done registering a subscriber")
-            elif (role == discovery_pb2.ROLE_BOTH):
-                self.logger.info("DiscoveryAppln::register_request Registering a broker")
-
-                # Check if specified number of brokers is met 
-                # For now hard coding one broker but perhaps one day we want multiple
-                if (len(self.broker_list) < self.specified_num_brokers):
-                    self.logger.debug("DiscoveryAppln::register_request Creating a new broker record")
-                    # Create new Entity object
-                    broker = Entity()
-
-                    # Load the subscriber values from registrant info
-                    broker.role = discovery_pb2.ROLE_BOTH
-                    broker.name = reg_req.info.id
-                    broker.ip_address = reg_req.info.addr
-                    broker.port = reg_req.info.port
-                    broker.topic_list = reg_req.topiclist
-
-                    # Add the created object to the list of publishers registered
-                    self.broker_list.append(broker)
 
-                    # Set status to success if we have gotten this far
-                    status = discovery_pb2.STATUS_SUCCESS
-
-                    # No reason to send
-                    reason = None
-                    
-                    self.logger.debug("DiscoveryAppln::register_request Done creating a new broker record")
+                    self.logger.debug("DiscoveryAppln::register_request Done creating a new {} record".format(self.ROLE_NAMES[role]))
 
                 else:
-                    self.logger.info("DiscoveryAppln::register_request Broker attempting to register, but no more brokers roles are allocated")
+                    self.logger.info("DiscoveryAppln::register_request {} attempting to register, but no more roles are allocated".format(self.ROLE_NAMES[role]))
 
                     # Set status to failure
                     status = discovery_pb2.STATUS_FAILURE
 
                     # Pass in a reason to let the registrant know why it failed
-                    reason = "Max brokers already reached for this system"
-
-                # Send a register reply with the MW
-                self.mw_obj.send_register_response(status, reason)
+                    reason = "Max {}s already reached for this system".format(self.ROLE_NAMES[role])
+                    topic_ids = ()
 
-                self.logger.info("DiscoveryAppln::register_request Done registering a broker")
+            # Send a register reply with the MW
+            self.mw_obj.send_register_response(status, reason, topic_ids)
 
-            else:
-                self.logger.debug ("DiscoveryAppln::register_request - registration is a failure because invalid role provided")
-                raise ValueError("Invalid role provided for registration request to Discovery server")
+            self.logger.info("DiscoveryAppln::register_request Done registering a {}".format(self.ROLE_NAMES[role]))
 
             # This register request has been handled 
             # We are not awaiting any incoming call for this logic
@@ -317,7 +292,139 @@ class DiscoveryAppln():
 
         except Exception as e:
             raise e
-    
+
+    ########################################
+    # Build the record we keep for a registrant
+    ########################################
+    def build_entity(self, reg_req):
+        entity = Entity()
+
+        # Load the entity with values from RegistrantInfo
+        entity.role = reg_req.role
+        entity.name = reg_req.info.id
+        entity.ip_address = reg_req.info.addr
+        entity.port = reg_req.info.port
+        entity.history_port = reg_req.info.history_port
+        entity.log_port = reg_req.info.log_port
+        entity.egress_port = reg_req.info.egress_port
+        entity.topic_list = list(reg_req.topiclist)
+        entity.filters = [(f.topic, f.op, tuple(f.values)) for f in reg_req.filters]
+
+        # the ids the leader gave its topics
+        if self.topic_ids is not None:
+            self.topic_ids.update(zip(reg_req.topiclist, reg_req.topic_ids))
+
+        return entity
+
+    ########################################
+    # The ids of a registrant's topics, as (name, id), numbering new topics
+    ########################################
+    def assign_topic_ids(self, reg_req):
+        if self.topic_ids is None:
+            return ()
+
+        reg_req.topic_ids[:] = self.topic_ids.assign(reg_req.topiclist)
+        return list(zip(reg_req.topiclist, reg_req.topic_ids))
+
+    def registry_for_role(self, role):
+        if (role == discovery_pb2.ROLE_PUBLISHER):
+            return self.publisher_list, self.specified_num_publishers
+        elif (role == discovery_pb2.ROLE_SUBSCRIBER):
+            return self.subscriber_list, self.specified_num_subscribers
+        else:
+            return self.broker_list, self.specified_num_brokers
+
+    ########################################
+    # Keep a standby's registry warm
+    #
+    # Upcall from the middleware (on the zookeeper thread) for every
+    # registration written by the leader, including our own writes.
+    ########################################
+    def mirror_registration(self, role, name, reg_req):
+        ''' Apply a registry change seen in zookeeper '''
+
+        with self.registry_lock:
+            entity_list, specified_num = self.registry_for_role(role)
+
+            if (reg_req is None):
+                entity_list[:] = [entity for entity in entity_list if entity.name != name]
+                self.logger.debug("DiscoveryAppln::mirror_registration - removed {}".format(name))
+            else:
+                # new, or registered again (e.g. with topics that got new ids);
+                # in place, as the order of registration counts
+                entity = self.build_entity(reg_req)
+                known = [i for i, other in enumerate(entity_list) if other.name == name]
+                if known:
+                    entity_list[known[0]] = entity
+                else:
+                    entity_list.append(entity)
+                self.logger.debug("DiscoveryAppln::mirror_registration - mirrored {}".format(name))
+
+    ########################################
+    # We just became the leader
+    ########################################
+    def leader_elected(self):
+        ''' Take over as the discovery leader '''
+
+        with self.registry_lock:
+            self.logger.info("DiscoveryAppln::leader_elected - taking over with {} pubs, {} subs, {} brokers already mirrored".format(
+                len(self.publisher_list), len(self.subscriber_list), len(self.broker_list)))
+
+            # Pick up the broker assignments where the old leader left them
+            if self.balancer is not None:
+                for broker in self.broker_list:
+                    self.balancer.add_broker(broker.name)
+                endpoints = {"{}:{}".format(broker.ip_address, broker.port): broker.name for broker in self.broker_list}
+                for subscriber, endpoint in self.mw_obj.read_assignments().items():
+                    if endpoint in endpoints:
+                        self.balancer.place(subscriber, endpoints[endpoint])
+                self.report_fanout()
+
+    ########################################
+    # Spreading subscribers over the brokers
+    #
+    # Only with --threshold > 0, and only the leader moves anybody. The
+    # live_* upcalls come from the zookeeper thread.
+    ########################################
+    def broker_entity(self, name):
+        for broker in self.broker_list:
+            if broker.name == name:
+                return broker
+        return None
+
+    def rebalance(self, moves):
+        ''' Tell moved subscribers where to go; call with the registry lock held '''
+        for subscriber, broker in moves.items():
+            self.logger.info("DiscoveryAppln::rebalance - {} moves to {}".format(subscriber, broker))
+            self.mw_obj.write_assignment(subscriber, self.broker_entity(broker) if broker is not None else None)
+        self.report_fanout()
+
+    def report_fanout(self):
+        self.logger.info("DiscoveryAppln::report_fanout - subscribers per broker: {} ({} moved so far)".format(
+            ", ".join("{} {}".format(broker, count) for broker, count in self.balancer.load().items()), self.balancer.moves))
+
+    def live_brokers(self, added, removed):
+        ''' Brokers came up or went away '''
+        with self.registry_lock:
+            if not self.mw_obj.is_leader():
+                return
+            for name in added:
+                if self.broker_entity(name) is not None:
+                    self.rebalance(self.balancer.add_broker(name))
+            for name in removed:
+                self.logger.info("DiscoveryAppln::live_brokers - broker {} went away".format(name))
+                self.rebalance(self.balancer.remove_broker(name))
+
+    def live_subscribers(self, added, removed):
+        ''' Subscribers went away; they no longer count against their broker '''
+        with self.registry_lock:
+            if not self.mw_obj.is_leader() or not removed:
+                return
+            for name in removed:
+                self.balancer.release(name)
+                self.mw_obj.write_assignment(name, None)
+            self.report_fanout()
+
     ############################################
     # Handle an incoming isready request
     #
@@ -339,8 +446,9 @@ class DiscoveryAppln():
                 # The specified number of subscribers and publishers has not been reached
                 isready = False
 
-            # Send the isready response in the MW
-            self.mw_obj.send_isready_response(isready)
+            # Send the isready response in the MW, with what the subscribers
+            # want of each topic for the publishers to filter on
+            self.mw_obj.send_isready_response(isready, self.content_filters() if isready else [])
 
             self.logger.info("DiscoveryAppln::is_ready_request Done handling isready request")
 
@@ -363,6 +471,7 @@ class DiscoveryAppln():
 
             # Init the publisher by topic list 
             publisher_by_topic_list = []
+            topic_routes = [] # (topic, via broker, names of its sources) with Hybrid dissemination
 
             # Check the dissemination method
             if (self.dissemination == Constants.DISSEMINATION_STRATEGY_DIRECT):
@@ -394,8 +503,7 @@ class DiscoveryAppln():
                 if (len(self.broker_list) == self.specified_num_brokers):
                     # The broker(s) is the only thing subscribers need to describe to for 
                     # Broker dissemination
-                    for broker in self.broker_list:
-                        publisher_by_topic_list.append(broker)
+                    publisher_by_topic_list.extend(self.brokers_for(lookup_req))
 
                     self.logger.debug("DiscoveryAppln::lookup_pub_by_topiclist_request - Sending the broker list as publisher list")
                     # self.logger.debug(publisher_by_topic_list[0])
@@ -407,11 +515,32 @@ class DiscoveryAppln():
                     
                     # Broker not registered, check again
                     status = discovery_pb2.STATUS_CHECK_AGAIN
+            elif (self.dissemination == Constants.DISSEMINATION_STRATEGY_HYBRID):
+                self.logger.debug("DiscoveryAppln::lookup_pub_by_topiclist_request -- Using hybrid strategy")
+                # The routes depend on who else wants the topics, so everybody
+                # has to be there before we decide
+                routes = self.topic_routes(lookup_req.topiclist)
+                forwarded = routes is not None and any(via for via, publishers in routes.values())
+                if (routes is None):
+                    status = discovery_pb2.STATUS_CHECK_AGAIN
+                elif (forwarded and len(self.broker_list) != self.specified_num_brokers):
+                    self.logger.debug("DiscoveryAppln::lookup_pub_by_topiclist_request - Broker not registered check again")
+                    status = discovery_pb2.STATUS_CHECK_AGAIN
+                else:
+                    brokers = self.brokers_for(lookup_req) if forwarded else []
+                    for topic, (via, publishers) in routes.items():
+                        sources = brokers if via else publishers
+                        topic_routes.append((topic, via, [source.name for source in sources]))
+                        for source in sources:
+                            if source not in publisher_by_topic_list:
+                                publisher_by_topic_list.append(source)
+
+                    status = discovery_pb2.STATUS_SUCCESS
             else:
                 raise ValueError("ERROR: Invalid dissemination provided in the config: {}".format(self.dissemination))
 
             # Send the lookup_pub_by_topiclist response in the MW
-            self.mw_obj.send_lookup_pub_by_topiclist_response(status, publisher_by_topic_list)
+            self.mw_obj.send_lookup_pub_by_topiclist_response(status, publisher_by_topic_list, topic_routes)
 
             self.logger.info("DiscoveryAppln::lookup_pub_by_topiclist_request Done handling a lookup pub list by topic list request")
 
@@ -425,7 +554,7 @@ class DiscoveryAppln():
     #
     # Only should be usable by broker
     ################################################
-    def lookup_all_publishers(self, lookup_all_resp):
+    def lookup_all_publishers(self, lookup_all_req):
         ''' Look up all publishers '''
 
         try:
@@ -433,10 +562,34 @@ class DiscoveryAppln():
 
             all_publisher_list = []
 
+            # With Hybrid dissemination the broker only forwards the topics
+            # routed through it, and only needs the publishers of those
+            topic_routes = []
+            if (self.dissemination == Constants.DISSEMINATION_STRATEGY_HYBRID):
+                routes = self.topic_routes({topic for pub in self.publisher_list for topic in pub.topic_list})
+                if (routes is None):
+                    self.mw_obj.send_lookup_all_publisher_response(discovery_pb2.STATUS_CHECK_AGAIN, [])
+                    return
+                topic_routes = [(topic, via, [pub.name for pub in publishers]) for topic, (via, publishers) in routes.items()]
+                self.logger.info("DiscoveryAppln::lookup_all_publishers - {} forwards {}".format(
+                    lookup_all_req.id, sorted(topic for topic, (via, publishers) in routes.items() if via)))
+
+            # In a broker tree only the root subscribes to the publishers; the
+            # others get their parent broker, which registered before them
+            parent = self.broker_parent(lookup_all_req.id)
+            if (parent is not None):
+                self.logger.info("DiscoveryAppln::lookup_all_publishers - {} takes its data from broker {}".format(lookup_all_req.id, parent.name))
+                self.mw_obj.send_lookup_all_publisher_response(discovery_pb2.STATUS_SUCCESS, [parent], parent=True, routes=topic_routes,
+                                                               filters=self.content_filters())
+                return
+
             # Check if all the publishers have been added to the system
             if (len(self.publisher_list) == self.specified_num_publishers):
                 # Return all of the publishers
                 all_publisher_list = self.publisher_list
+                if (topic_routes):
+                    forwarded = {name for topic, via, names in topic_routes if via for name in names}
+                    all_publisher_list = [pub for pub in self.publisher_list if pub.name in forwarded]
 
                 # We got what we needed 
                 status = discovery_pb2.STATUS_SUCCESS
@@ -446,11 +599,82 @@ class DiscoveryAppln():
             self.logger.debug("DiscoveryAppln::lookup_all_publishers Done looking up all publishers")
 
             # Send a response to the look up all publisher request
-            self.mw_obj.send_lookup_all_publisher_response(status, all_publisher_list)
+            self.mw_obj.send_lookup_all_publisher_response(status, all_publisher_list, routes=topic_routes, filters=self.content_filters())
             
         except Exception as e:
             raise e
 
+    def brokers_for(self, lookup_req):
+        ''' The brokers a subscriber gets: the one assigned to it when balancing, else all of them '''
+        if (self.balancer is not None and lookup_req.id):
+            with self.registry_lock:
+                broker = self.broker_entity(self.balancer.assign(lookup_req.id))
+                if (broker is not None and self.mw_obj.is_leader()):
+                    self.mw_obj.write_assignment(lookup_req.id, broker)
+                    self.report_fanout()
+            if (broker is not None):
+                return [broker]
+        return list(self.broker_list)
+
+    ################################################
+    # Hybrid dissemination: route every topic on its own
+    #
+    # From how many registered publishers and subscribers a topic has,
+    # via_broker () decides whether it goes through the broker. Returns
+    # topic -> (via broker, its publishers) for the topics that have
+    # publishers, or None until everybody has registered (the counts would
+    # still change and with them the routes).
+    ################################################
+    def topic_routes(self, topics):
+        ''' Decide per topic between direct and broker dissemination '''
+        if (len(self.publisher_list) != self.specified_num_publishers or len(self.subscriber_list) != self.specified_num_subscribers):
+            return None
+
+        routes = {}
+        for topic in sorted(topics):
+            publishers = [pub for pub in self.publisher_list if topic in pub.topic_list]
+            if (not publishers):
+                continue
+            subscribers = sum(1 for sub in self.subscriber_list if topic in sub.topic_list)
+            routes[topic] = (via_broker(len(publishers), subscribers, self.hybrid_min_saved), publishers)
+            self.logger.debug("DiscoveryAppln::topic_routes - {}: {} publishers, {} subscribers, {}".format(
+                topic, len(publishers), subscribers, "via the broker" if routes[topic][0] else "direct"))
+        return routes
+
+    ################################################
+    # Content filters for the senders of the subscribers' topics
+    #
+    # A PUB socket cannot filter per subscriber, so a topic is filtered on
+    # every filter of its subscribers (a sample goes out if any passes it),
+    # and not at all if one of them takes it whole. Nothing until every
+    # subscriber has registered: one still to come may want it all.
+    ################################################
+    def content_filters(self):
+        ''' (topic, op, values) the publishers and the broker filter on '''
+        with self.registry_lock:
+            if (len(self.subscriber_list) != self.specified_num_subscribers):
+                return []
+
+            filters = []
+            for topic in sorted({topic for sub in self.subscriber_list for topic in sub.topic_list}):
+                wanted = [[f for f in sub.filters if f[0] == topic] for sub in self.subscriber_list if topic in sub.topic_list]
+                if (all(wanted)):
+                    filters.extend(f for sub_filters in wanted for f in sub_filters)
+            if (filters):
+                self.logger.debug("DiscoveryAppln::content_filters - {}".format(filters))
+            return filters
+
+    def broker_parent(self, name):
+        ''' The broker a broker subscribes to in a broker tree, None for the root or without a tree '''
+        with self.registry_lock:
+            if (self.tree_fanout == 0):
+                return None
+            names = [broker.name for broker in self.broker_list]
+            if (name not in names):
+                return None
+            index = tree_parent(names.index(name), self.tree_fanout)
+            return self.broker_list[index] if index is not None else None
+
     def refresh_leading_broker_publishers(self):
         if self.discovery_ledger.broker != None:
             self.logger.info ("DiscoverlyMw::refresh_broker_publishers - send all")
@@ -484,13 +708,31 @@ def parseCmdLineArgs ():
 
     parser.add_argument ("-S", "--num_subscribers", type=int, choices=range(1,50), default=1, help="Number of subscribers to build for the system")
 
+    parser.add_argument ("-B", "--num_brokers", type=int, default=DiscoveryAppln.DEFAULT_NUM_BROKERS, help="Number of brokers (including hot standbys) to build for the system, default 1")
+
     parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
     
     parser.add_argument ("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
 
     parser.add_argument("-z", "--zookeeper_addr", default="10.0.0.1", help="Specify location of zookeeper") 
 
-    parser.add_argument ("-th", "--threshold", type=int, default=10, help="broker threshold for load balancing")
+    parser.add_argument ("--zookeeper_port", type=int, default=2181, help="Port of zookeeper, default 2181")
+
+    parser.add_argument ("--zk_timeout", type=float, default=3.0, help="Zookeeper session timeout in seconds; bounds how long a dead leader blocks failover (default 3)")
+
+    parser.add_argument ("--coordination", choices=["zookeeper", "inmemory"], default="zookeeper", help="Coordination backend; inmemory runs on an in-process server shared by this process (load tests), default zookeeper")
+
+    parser.add_argument ("--coord_latency", type=float, default=0.0, help="Seconds added to every inmemory coordination call, default 0")
+
+    parser.add_argument ("--watch_window", type=float, default=0.05, help="Seconds registry watch events are coalesced over before re-reading, 0 = on every event (default 0.05)")
+
+    parser.add_argument ("--tree_fanout", type=int, default=0, help="Arrange the brokers in a tree with this many child brokers each; only the first broker subscribes to the publishers, the others to their parent, and subscribers spread over all of them. Brokers must run with --no_election. 0 = every broker subscribes to the publishers, default 0")
+
+    parser.add_argument ("--hybrid_min_saved", type=int, default=1, help="With Hybrid dissemination, connections a topic must save (publishers x subscribers against publishers + subscribers) to go through the broker instead of directly, default 1")
+
+    parser.add_argument ("--topic_ids", action="store_true", help="Give every topic a compact integer id as it first registers; publishers, brokers and subscribers then send and subscribe with the id instead of the name")
+
+    parser.add_argument ("-th", "--threshold", type=int, default=0, help="Subscribers the first broker takes before new ones go to the least loaded broker; brokers must then run with --no_election. 0 sends every subscriber all brokers (hot standbys), default 0")
 
     return parser.parse_args()
 
@@ -0,0 +1,326 @@
+#
+# In-process stand-in for a ZooKeeper server and kazoo client sessions.
+#
+# Lets the coordination code in ZookeeperClient.py (elections, the registry
+# mirror, barriers) run and be measured without a ZooKeeper ensemble. The
+# client side mirrors the subset of the KazooClient API that we use and raises
+# the same kazoo exceptions, so a ZK_Driver cannot tell the difference.
+#
+# Watch callbacks are never made from inside the operation that triggered
+# them. By default they are queued and delivered once the outermost operation
+# returns, which keeps single threaded benchmarks deterministic. A session
+# created with threaded=True instead gets its own event thread, like a real
+# kazoo client, so callbacks may take locks the writer is holding. An optional
+# per call latency stands in for the round trip to a server. Every
+# create/set/delete, read, child name returned and delivered notification
+# is counted in "stats".
+#
+
+import time
+import queue
+import threading
+from collections import deque
+
+from kazoo.client import KazooState
+from kazoo.exceptions import BadArgumentsError, NodeExistsError, NoNodeError, NotEmptyError
+from kazoo.protocol.states import EventType, WatchedEvent, ZnodeStat
+
+
+class InMemoryZKServer ():
+    """ The znode tree shared by all sessions """
+
+    def __init__ (self):
+        self.lock = threading.RLock ()
+        self.zxid = 0
+        self.nodes = {"/": self.new_node (b"", 0)}
+        self.children = {"/": set ()}
+        self.sequences = {} # parent path -> next sequence number
+        self.next_session = 1
+        self.data_watches = {} # path -> [(client, callback)] for exists/get watches
+        self.child_watches = {} # path -> [(client, callback)] for get_children watches
+        self.pending = deque () # (client, callback, event) waiting to be delivered
+        self.dispatching = False
+        self.stats = {"writes": 0, "reads": 0, "entries": 0, "notifications": 0}
+
+    def new_node (self, value, owner):
+        self.zxid += 1
+        now = int (time.time () * 1000)
+        return {"value": value, "owner": owner, "version": 0, "cversion": 0,
+                "czxid": self.zxid, "mzxid": self.zxid, "ctime": now, "mtime": now}
+
+    def reset_stats (self):
+        for key in self.stats:
+            self.stats[key] = 0
+
+    def new_session (self):
+        with self.lock:
+            session = self.next_session
+            self.next_session += 1
+            return session
+
+    #################
+    # helpers
+    #################
+    @staticmethod
+    def parent_of (path):
+        parent = path.rsplit ("/", 1)[0]
+        return parent or "/"
+
+    def stat (self, path):
+        node = self.nodes[path]
+        return ZnodeStat (node["czxid"], node["mzxid"], node["ctime"], node["mtime"], node["version"],
+                          node["cversion"], 0, node["owner"], len (node["value"]),
+                          len (self.children[path]), node["mzxid"])
+
+    def trigger (self, table, path, event_type):
+        # watches are one shot: remove them before queueing the callbacks
+        for client, callback in table.pop (path, []):
+            self.pending.append ((client, callback, WatchedEvent (event_type, KazooState.CONNECTED, path)))
+
+    def dispatch (self):
+        # only the outermost call drains the queue; callbacks that write
+        # just add to it
+        if self.dispatching:
+            return
+        self.dispatching = True
+        try:
+            while self.pending:
+                client, callback, event = self.pending.popleft ()
+                if client.events is not None:
+                    client.events.put ((callback, event))
+                    continue
+                self.stats["notifications"] += 1
+                callback (event)
+        finally:
+            self.dispatching = False
+
+    #################
+    # operations, all made with the lock held
+    #################
+    def create (self, path, value, session, ephemeral, sequence, makepath):
+        parent = self.parent_of (path)
+        if parent not in self.nodes:
+            if not makepath:
+                raise NoNodeError (parent)
+            self.create (parent, b"", session, False, False, True)
+
+        if sequence:
+            number = self.sequences.get (parent, 0)
+            self.sequences[parent] = number + 1
+            path = "{}{:010d}".format (path, number)
+
+        if path in self.nodes:
+            raise NodeExistsError (path)
+        if self.nodes[parent]["owner"]:
+            raise NoNodeError ("ephemeral nodes cannot have children")
+
+        self.stats["writes"] += 1
+        self.nodes[path] = self.new_node (value, session if ephemeral else 0)
+        self.children[path] = set ()
+        self.children[parent].add (path.rsplit ("/", 1)[1])
+        self.nodes[parent]["cversion"] += 1
+        self.trigger (self.data_watches, path, EventType.CREATED)
+        self.trigger (self.child_watches, parent, EventType.CHILD)
+        return path
+
+    def delete (self, path, recursive=False):
+        if path not in self.nodes:
+            raise NoNodeError (path)
+        if self.children[path]:
+            if not recursive:
+                raise NotEmptyError (path)
+            for child in list (self.children[path]):
+                self.delete (path + "/" + child, True)
+
+        parent = self.parent_of (path)
+        self.stats["writes"] += 1
+        del self.nodes[path]
+        del self.children[path]
+        self.children[parent].discard (path.rsplit ("/", 1)[1])
+        self.nodes[parent]["cversion"] += 1
+        self.trigger (self.data_watches, path, EventType.DELETED)
+        self.trigger (self.child_watches, path, EventType.DELETED)
+        self.trigger (self.child_watches, parent, EventType.CHILD)
+
+    def set (self, path, value):
+        if path not in self.nodes:
+            raise NoNodeError (path)
+        self.stats["writes"] += 1
+        self.zxid += 1
+        node = self.nodes[path]
+        node["value"] = value
+        node["version"] += 1
+        node["mzxid"] = self.zxid
+        node["mtime"] = int (time.time () * 1000)
+        self.trigger (self.data_watches, path, EventType.CHANGED)
+        return self.stat (path)
+
+    def exists (self, path, client, watch):
+        self.stats["reads"] += 1
+        if watch is not None:
+            self.data_watches.setdefault (path, []).append ((client, watch))
+        return self.stat (path) if path in self.nodes else None
+
+    def get (self, path, client, watch):
+        self.stats["reads"] += 1
+        if path not in self.nodes:
+            raise NoNodeError (path)
+        if watch is not None:
+            self.data_watches.setdefault (path, []).append ((client, watch))
+        return self.nodes[path]["value"], self.stat (path)
+
+    def get_children (self, path, client, watch):
+        self.stats["reads"] += 1
+        if path not in self.nodes:
+            raise NoNodeError (path)
+        if watch is not None:
+            self.child_watches.setdefault (path, []).append ((client, watch))
+        self.stats["entries"] += len (self.children[path])
+        return list (self.children[path])
+
+    def close_session (self, session):
+        # a closed or expired session takes its ephemeral nodes with it
+        for path in [p for p, node in self.nodes.items () if node["owner"] == session]:
+            if path in self.nodes:
+                self.delete (path, True)
+
+
+class InMemoryKazooClient ():
+    """ A session against an InMemoryZKServer with the KazooClient API we use """
+
+    def __init__ (self, server, hosts=None, timeout=10.0, latency=0.0, threaded=False):
+        self.server = server
+        self.hosts = hosts
+        self.timeout = timeout
+        self.latency = latency # seconds added to every call
+        self.threaded = threaded
+        self.events = None # queue feeding our event thread when threaded
+        self.event_thread = None
+        self.session = None
+        self.state = KazooState.LOST
+        self.listeners = []
+        self.connected = False
+
+    #################
+    # session handling
+    #################
+    def add_listener (self, listener):
+        self.listeners.append (listener)
+
+    def set_state (self, state):
+        self.state = state
+        for listener in self.listeners:
+            listener (state)
+
+    def start (self, timeout=None):
+        if self.threaded:
+            self.events = queue.Queue ()
+            self.event_thread = threading.Thread (target=self.deliver, daemon=True)
+            self.event_thread.start ()
+        self.session = self.server.new_session ()
+        self.connected = True
+        self.set_state (KazooState.CONNECTED)
+
+    def stop (self):
+        if self.session is None:
+            return
+        with self.server.lock:
+            try:
+                self.server.close_session (self.session)
+            finally:
+                self.server.dispatch ()
+        self.session = None
+        self.connected = False
+        if self.events is not None:
+            self.events.put (None)
+        self.set_state (KazooState.LOST)
+
+    def deliver (self):
+        # our event thread: watch callbacks run here, one at a time
+        while True:
+            item = self.events.get ()
+            if item is None:
+                return
+            callback, event = item
+            with self.server.lock:
+                self.server.stats["notifications"] += 1
+            callback (event)
+
+    def expire (self):
+        ''' Simulate a crash: the server drops the session and its ephemerals '''
+        self.stop ()
+
+    def close (self):
+        pass
+
+    def call (self, operation, path, *args):
+        # the server rejects these too
+        if not path.startswith ("/") or (path != "/" and path.endswith ("/")):
+            raise BadArgumentsError ("invalid path {}".format (path))
+        if self.latency:
+            time.sleep (self.latency)
+        with self.server.lock:
+            try:
+                return operation (path, *args)
+            finally:
+                self.server.dispatch ()
+
+    #################
+    # znode operations
+    #################
+    def create (self, path, value=b"", ephemeral=False, sequence=False, makepath=False):
+        return self.call (self.server.create, path, value, self.session, ephemeral, sequence, makepath)
+
+    def ensure_path (self, path):
+        try:
+            self.create (path, makepath=True)
+        except NodeExistsError:
+            pass
+        return True
+
+    def delete (self, path, recursive=False):
+        self.call (self.server.delete, path, recursive)
+        return True
+
+    def set (self, path, value):
+        return self.call (self.server.set, path, value)
+
+    def exists (self, path, watch=None):
+        return self.call (self.server.exists, path, self, watch)
+
+    def get (self, path, watch=None):
+        return self.call (self.server.get, path, self, watch)
+
+    def get_children (self, path, watch=None):
+        return self.call (self.server.get_children, path, self, watch)
+
+    #################
+    # kazoo's re-arming watch helpers
+    #################
+    def ChildrenWatch (self, path, func=None):
+        def decorate (func):
+            def rearm (event=None):
+                if event is not None and event.type == EventType.DELETED:
+                    return
+                if func (self.get_children (path, watch=rearm)) is False:
+                    # kazoo stops watching when the callback returns False;
+                    # the one shot watch we just set simply goes unanswered
+                    self.server.child_watches[path].remove ((self, rearm))
+            rearm ()
+            return func
+        return decorate (func) if func is not None else decorate
+
+    def DataWatch (self, path, func=None):
+        def decorate (func):
+            def rearm (event=None):
+                # like kazoo: read with a watch, fall back to exists if the
+                # node is not there so its creation is still noticed
+                try:
+                    data, stat = self.get (path, watch=rearm)
+                except NoNodeError:
+                    data, stat = None, self.exists (path, watch=rearm)
+                if func (data, stat) is False:
+                    self.server.data_watches[path].remove ((self, rearm))
+            rearm ()
+            return func
+        return decorate (func) if func is not None else decorate
@@ -92,6 +92,8 @@ class PublisherAppln ():
     self.dissemination = None # direct or via broker
     self.mw_obj = None # handle to the underlying Middleware object
     self.logger = logger  # internal logger for print statements
+    self.iteration = 0 # publication rounds done so far
+    self.next_round = None # when the next round is due (time.monotonic)
 
   ########################################
   # configure/initialize
@@ -234,12 +236,21 @@ class PublisherAppln ():
         self.logger.debug ("PublisherAppln::invoke_operation - start Disseminating")
 
         # Now disseminate topics at the rate at which we have configured ourselves.
-        ts = TopicSelector ()
-        for i in range (self.iters):
+        # One round per upcall: instead of sleeping between rounds we hand the
+        # remaining time back to the event loop as its timeout, so history
+        # requests from late joiners are served while we wait.
+        now = time.monotonic ()
+        if self.next_round is None:
+          self.next_round = now
+        if now < self.next_round:
+          return int ((self.next_round - now) * 1000)
+
+        if self.iteration < self.iters:
           # I leave it to you whether you want to disseminate all the topics of interest in
           # each iteration OR some subset of it. Please modify the logic accordingly.
           # Here, we choose to disseminate on all topics that we publish.  Also, we don't care
           # about their values. But in future assignments, this can change.
+          ts = TopicSelector ()
           for topic in self.topiclist:
             # Generate the data to disseminate
             dissemination_data = ts.gen_publication(topic)
@@ -247,11 +258,17 @@ class PublisherAppln ():
             # Send out the data
             self.mw_obj.disseminate(self.name, topic, dissemination_data)
 
-          # Now sleep for an interval of time to ensure we disseminate at the
+          # Now wait for an interval of time to ensure we disseminate at the
           # frequency that was configured.
-          time.sleep (1 / float (self.frequency))  # ensure we get a floating point num
+          self.iteration += 1
+          self.next_round += 1 / float (self.frequency)  # ensure we get a floating point num
+          return int (max (0, self.next_round - time.monotonic ()) * 1000)
 
         self.logger.debug ("PublisherAppln::invoke_operation - Dissemination completed")
+        filters = self.mw_obj.filters
+        if filters.dropped:
+          self.logger.info ("PublisherAppln::invoke_operation - {} of {} samples ({} content bytes) filtered out".format (
+            filters.dropped, filters.dropped + filters.passed, filters.dropped_bytes))
 
         # we are done. So we move to the completed state
         self.state = self.State.COMPLETED
@@ -325,8 +342,9 @@ class PublisherAppln ():
         time.sleep (10)  # sleep between calls so that we don't make excessive calls
 
       else:
-        # we got the go ahead
+        # we got the go ahead, and what the subscribers want of our topics
         # set the state to disseminate
+        self.mw_obj.set_filters (isready_resp.filters)
         self.state = self.State.DISSEMINATE
         
       # return timeout of 0 so event loop calls us back in the invoke_operation
@@ -381,8 +399,16 @@ def parseCmdLineArgs ():
     
   parser.add_argument ("-d", "--discovery", default="localhost:5556", help="IP Addr:Port combo for the discovery service, default localhost:5556")
 
+  parser.add_argument ("-z", "--zookeeper", default=None, help="IP Addr:Port of zookeeper; if given we follow the discovery leader elected there (default: use --discovery only)")
+
   parser.add_argument ("-T", "--num_topics", type=int, choices=range(1,10), default=1, help="Number of topics to publish, currently restricted to max of 9")
 
+  parser.add_argument ("-s", "--strength", type=int, default=0, help="Ownership strength; per topic only the strongest publisher is delivered (default: 0)")
+
+  parser.add_argument ("--history", type=int, default=0, help="Samples per topic kept for late joining subscribers, needs --history_port (default: 0, none)")
+
+  parser.add_argument ("--history_port", type=int, default=None, help="Port on which late joiners ask for history, required with --history")
+
   parser.add_argument ("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
 
   parser.add_argument ("-f", "--frequency", type=int,default=1, help="Rate at which topics disseminated: default once a second - use integers")
@@ -34,7 +34,6 @@ import argparse # for argument parsing
 import configparser # for configuration parsing
 import logging # for logging. Use it in place of print statements.
 import datetime
-import csv
 
 from topic_selector import TopicSelector
 
@@ -44,7 +43,13 @@ from CS6381_MW.SubscriberMW import SubscriberMW
 from CS6381_MW import discovery_pb2
 
 # Import the constants for the dissemination strategy
-from CS6381_MW.Common import Constants
+from CS6381_MW.Common import Constants, OwnershipArbiter, ContentFilters, SequenceTracker, parse_filter, payload_value
+
+# Streams our results to disk
+from CS6381_MW.ResultsWriter import ResultsWriter, FORMATS
+
+# Latency histograms per topic and publisher
+from CS6381_MW.Histogram import LatencyStats, PERCENTILES
 
 from enum import Enum  # for an enumeration we are using to describe what state we are in
 
@@ -74,9 +79,21 @@ class SubscriberAppln():
         self.num_topics = None # total num of topics the subscriber is interested in
         self.topiclist = None # the different topics that the subscriber is interested in
         self.frequency = None # rate at which consumption takes place
-        self.receivedPublicationList = []
+        self.results = None # ResultsWriter streaming what we receive to disk
+        self.latency = None # LatencyStats: latency histograms per topic and publisher, from when we subscribe
+        self.stats_interval = 10 # seconds between latency reports, 0 for none until we are done
+        self.snapshot_path = None # where we keep our latency histograms for latency_report.py
+        self.results_format = None # one of FORMATS
+        self.decoders = 0 # decoder processes taking in our samples, 0 to do it ourselves
         self.dissemination = None # Hold the dissemination strategy
         self.iters = None # Number of iterations to receive data
+        self.arbiter = None # ownership strength, when nobody upstream enforces it
+        self.filters = None # ContentFilters: what we want of the content of our topics
+        self.history = 0 # samples per topic to ask for when we join
+        self.resume_since = None # read the broker's log from this time when we join
+        self.kept = SequenceTracker() # the samples we kept, live or replayed, by publisher and topic
+        self.subscribed_at = None # when we connected to the publishers (or the broker)
+        self.first_message = {} # topic -> seconds from subscribing to its first sample
 
     ########################################
     # Set up initial configuration for our subscriber
@@ -97,6 +114,8 @@ class SubscriberAppln():
             self.iters = args.iters # Number of iterations
             self.frequency = args.frequency
             self.num_topics = args.num_topics
+            self.history = args.history
+            self.resume_since = args.resume_since
 
             # Get the configuration object
             self.logger.debug("SubscriberAppln::configure - parsing config.ini")
@@ -106,6 +125,27 @@ class SubscriberAppln():
             self.lookup = config["Discovery"]["Strategy"]
             self.dissemination = config["Dissemination"]["Strategy"]
 
+            # What we receive goes to disk as we go, not when we are done
+            self.results_format = args.results
+            self.stats_interval = args.stats_interval
+            results_path, self.snapshot_path = self.output_paths(self.name)
+            self.results = ResultsWriter(self.logger, results_path, args.results, interval=args.flush_interval)
+
+            # Decoder processes only take samples straight from the publishers
+            self.decoders = args.decoders
+            if self.decoders > 0 and self.dissemination != Constants.DISSEMINATION_STRATEGY_DIRECT:
+                raise ValueError("--decoders needs Direct dissemination")
+
+            # The broker forwards only the owner of each topic. Publishers we are
+            # connected to directly we have to arbitrate between ourselves.
+            if (self.dissemination in (Constants.DISSEMINATION_STRATEGY_DIRECT, Constants.DISSEMINATION_STRATEGY_HYBRID)):
+                self.arbiter = OwnershipArbiter(args.ownership_threshold)
+
+            # Our content filters go to discovery with our registration; the
+            # publishers and the broker filter on them (and those of the other
+            # subscribers of our topics), so we filter what comes in again
+            self.filters = ContentFilters(parse_filter(text) for text in args.filter)
+
             # Now get the list of topics that this subscriber will be interested in
             self.logger.debug ("SubscriberAppln::configure - selecting our topic list")
             ts = TopicSelector()
@@ -122,6 +162,16 @@ class SubscriberAppln():
         except Exception as e:
             raise e
 
+    ########################################
+    # Where results are streamed to and the latency snapshot kept, for us
+    # or one of our decoders
+    ########################################
+    def output_paths(self, name):
+        ''' (results path, latency snapshot path) '''
+        extension = "csv" if self.results_format == "csv" else "bin"
+        prefix = "./csv/{}_{}".format(name, self.dissemination.lower())
+        return prefix + "_output." + extension, prefix + "_latency.json"
+
     ########################################
     # driver program
     #
@@ -140,6 +190,12 @@ class SubscriberAppln():
             self.logger.debug("SubscriberAppln::driver - Set the upcall handle")
             self.mw_obj.set_upcall_handle(self)
 
+            # and to hand us the samples of our topics
+            self.mw_obj.register_default_handler(self.handle_publication)
+
+            # Start streaming our results
+            self.results.start()
+
             # Enter the register state
             # Must register the subscriber with the Discovery service
             self.state = self.State.REGISTER
@@ -168,6 +224,7 @@ class SubscriberAppln():
             self.logger.info ("     Lookup: {}".format (self.lookup))
             self.logger.info ("     Num Topics: {}".format (self.num_topics))
             self.logger.info ("     TopicList: {}".format (self.topiclist))
+            self.logger.info ("     Filters: {}".format (self.filters.filters))
             self.logger.info ("**********************************")
 
         except Exception as e:
@@ -193,7 +250,7 @@ class SubscriberAppln():
                 # send a register msg to discovery service 
                 # Include the list of topics the subscriber is interested in
                 self.logger.debug ("SubscriberAppln::invoke_operation - register with the discovery service")
-                self.mw_obj.register (self.name, self.topiclist)
+                self.mw_obj.register (self.name, self.topiclist, self.filters.filters)
 
                 # Remember that we were invoked by the event loop as part of the upcall.
                 # So we are going to return back to it for its next iteration. Because
@@ -217,41 +274,17 @@ class SubscriberAppln():
                 # We are connected... now we CONSUME the data
                 self.logger.debug ("SubscriberAppln::invoke_operation - start Consuming data")
 
-                # Only want to consume the defined amount of times
-                for i in range(self.iters):
-
-                    publication = self.mw_obj.consume()
-
-                    # self.logger.info("Received data: {}".format(publication))
+                # Our decoders consume and keep the samples themselves
+                if self.decoders > 0:
+                    self.mw_obj.wait_decoders(self.iters)
+                    self.state = self.State.COMPLETED
+                    return 0
 
-                    # Timestamp of receiving the message
-                    receivedTimestamp = datetime.datetime.now().timestamp()
-
-                    # Find the duration between the timestamps
-                    # latency = publication.tstamp - receivedTimestamp
-                    latency = receivedTimestamp - publication.tstamp
-
-                    # self.logger.info("PublisherAppln Latency: {}".format(latency))
-
-                    # Change the publication's timestamp back into a datetime to display
-                    # publicationTimestamp = datetime.datetime.fromtimestamp(publication.tstamp)
-                    # self.logger.debug(publicationTimestamp)
-                    # Store the converted timestamp in the message
-                    # publication.tstamp = publicationTimestamp
-
-                    # Make the publication and latency a set
-                    publicationTuple = (publication, latency)
-
-                    # Add the data to some list to export to a csv?
-                    self.receivedPublicationList.append(publicationTuple)
-
-                    self.logger.info("SubscriberAppln::invoke_operation -  Received Data: {}".format(publicationTuple))
-
-                    # self.logger.debug ("SubscriberAppln::invoke_operation - Consumption completed")
-
-                    # Now sleep for an interval of time to ensure we consume at the
-                    # frequency that was configured.
-                    time.sleep (1/float (self.frequency)) 
+                # Only want to consume the defined amount of times; the
+                # middleware hands each sample to handle_publication
+                consumed = 0
+                while consumed < self.iters:
+                    consumed += self.mw_obj.dispatch(self.iters - consumed)
 
                 self.logger.debug("SubscriberAppln::invoke_operation - Consumption completed")
 
@@ -266,33 +299,20 @@ class SubscriberAppln():
                 
                 self.logger.debug ("SubscriberAppln::invoke_operation - Subscriber lifecycle completed. Writing CSV")
 
-                # Write out the list of the publications received into a a csv for graphing
-                with open("./csv/" + self.name + "_" + self.dissemination.lower() + "_output.csv", "w", newline="") as f:
-                    # Create write variable 
-                    writer = csv.writer(f)
-
-                    # Write the header for the csv
-                    rowHeaders = ['topic', 'content', 'publisher_id', 'timestamp', 'latency']
-
-                    # Write the header for the csv 
-                    writer.writerow(rowHeaders)
-
-                    # Write each tuple as a row in the csv 
-                    for publicationTuple in self.receivedPublicationList:
-                        # Get the publication record, first record in the tuple we build
-                        publication = publicationTuple[0]
-
-                        # Get date string from the timestamp
-                        timestampString = datetime.datetime.fromtimestamp(publication.tstamp).isoformat()
+                if self.mw_obj.conflate is not None:
+                    self.logger.info("SubscriberAppln::invoke_operation - {} stale samples skipped by conflation".format(self.mw_obj.conflated))
 
-                        # Get the latency, second record in the tuple we build
-                        latency = publicationTuple[1]
+                # Write out what the writer has not written yet
+                self.results.close()
 
-                        # Build the string to write
-                        rowToWrite = [publication.topic,  publication.content, publication.pub_id, timestampString, str(latency)]
-
-                        # Turn each element in our list to a row in the csv
-                        writer.writerow(rowToWrite)
+                # and our histograms, to be merged with other subscribers'
+                # (our decoders snapshot theirs when they stop)
+                if self.decoders > 0:
+                    received, missing, duplicates, reordered, late = self.mw_obj.stop_decoders()
+                    self.logger.info("SubscriberAppln::invoke_operation - decoders: {} received, {} missing ({:.2f}%), {} duplicates, {} reordered, {} late".format(
+                        received, missing, 100.0 * missing / max(1, received + missing), duplicates, reordered, late))
+                else:
+                    self.report_latency()
 
                 self.logger.debug ("SubscriberAppln::invoke_operation - CSV written")
                     
@@ -306,6 +326,97 @@ class SubscriberAppln():
         except Exception as e:
             raise e
     
+    ########################################
+    # What we do with every sample that comes in live
+    #
+    # Our default handler: the middleware's dispatch () calls us for
+    # every topic we have no handler of our own for
+    ########################################
+    def handle_publication(self, publication):
+        ''' Keep a sample '''
+
+        try:
+            # Seen already: replayed from history, or a cached last value
+            # the broker re-sent for another subscriber. By sequence number,
+            # so samples coming in out of order over different routes stay.
+            if not self.kept.observe(publication.pub_id, publication.topic, publication.seq, publication.epoch):
+                return
+
+            if self.arbiter is not None and not self.arbiter.admit(publication.topic, publication.pub_id, publication.strength):
+                self.logger.debug("SubscriberAppln::handle_publication - %s is not the owner of %s, ignored", publication.pub_id, publication.topic)
+                return
+
+            # Let through for another subscriber's filter, not ours
+            if not self.filters.passes(publication.topic, payload_value(publication)):
+                return
+
+            # self.logger.info("Received data: {}".format(publication))
+
+            # Timestamp of receiving the message
+            receivedTimestamp = datetime.datetime.now().timestamp()
+
+            # Find the duration between the timestamps
+            # latency = publication.tstamp - receivedTimestamp
+            latency = receivedTimestamp - publication.tstamp
+
+            if publication.topic not in self.first_message:
+                self.first_message[publication.topic] = receivedTimestamp - self.subscribed_at
+                self.logger.info("SubscriberAppln::handle_publication - first {} sample {:.3f} s after subscribing".format(
+                    publication.topic, self.first_message[publication.topic]))
+
+            # self.logger.info("PublisherAppln Latency: {}".format(latency))
+
+            # Change the publication's timestamp back into a datetime to display
+            # publicationTimestamp = datetime.datetime.fromtimestamp(publication.tstamp)
+            # self.logger.debug(publicationTimestamp)
+            # Store the converted timestamp in the message
+            # publication.tstamp = publicationTimestamp
+
+            # Make the publication, latency and arrival time a set. The arrival
+            # time is kept at full precision so gaps (e.g. a broker failover)
+            # can be measured from the csv
+            publicationTuple = (publication, latency, receivedTimestamp, False)
+
+            # Hand the data to the writer, which exports it to a csv
+            self.results.write(*publicationTuple)
+
+            # Count it in our histograms, and report on them every so often
+            self.latency.record(publication.topic, publication.pub_id, latency)
+            if self.latency.due(self.stats_interval):
+                self.report_latency()
+
+            self.logger.debug("SubscriberAppln::handle_publication - Received Data: %s", publicationTuple)
+
+            # self.logger.debug ("SubscriberAppln::handle_publication - Consumption completed")
+
+            # Now sleep for an interval of time to ensure we consume at the
+            # frequency that was configured.
+            time.sleep (1/float (self.frequency))
+
+        except Exception as e:
+            raise e
+
+    ########################################
+    # Latency percentiles and throughput per topic over the last interval,
+    # what we missed, and a snapshot of our histograms and sequence counts
+    ########################################
+    def report_latency(self):
+        ''' Log and snapshot our latency histograms '''
+
+        try:
+            for topic, (count, rate, percentiles) in self.latency.report().items():
+                self.logger.info("SubscriberAppln::report_latency - {}: {} samples, {:.1f}/s, latency {}".format(
+                    topic, count, rate, ", ".join("p{:g} {:.2f} ms".format(p, latency * 1000) for p, latency in zip(PERCENTILES, percentiles))))
+
+            # and what the sequence numbers say we missed so far
+            received, missing, duplicates, reordered, late = self.mw_obj.sequences.totals()
+            self.logger.info("SubscriberAppln::report_latency - {} received, {} missing ({:.2f}%), {} duplicates, {} reordered, {} late".format(
+                received, missing, 100.0 * missing / max(1, received + missing), duplicates, reordered, late))
+            self.latency.snapshot(self.snapshot_path, self.name, self.mw_obj.sequences.counts)
+
+        except Exception as e:
+            raise e
+
     ########################################
     # Handle register response method called as part of upcall
     #
@@ -322,7 +433,10 @@ class SubscriberAppln():
                 # Invoke the MW logic to subscribe to our list of topics now that we are registered
                 # I do not think I actually need to do this? 
                 # I thikn I can subscribe when I connect to each publisher
-                self.mw_obj.subscribe(self.topiclist)
+                # (with Hybrid dissemination we must: which topics we take from
+                # whom is only known then)
+                if (self.dissemination != Constants.DISSEMINATION_STRATEGY_HYBRID):
+                    self.mw_obj.subscribe(self.topiclist)
 
                 # Now that we are connected we must look up a list
                 # of publishers based on our topics we are interested in
@@ -336,6 +450,58 @@ class SubscriberAppln():
         except Exception as e:
             raise e
 
+    ########################################
+    # Fetch and keep the recent samples of a publisher (or the broker)
+    #
+    # We are already subscribed, so samples sent while the request is in
+    # flight may also come in live; consume skips those.
+    ########################################
+    def replay_history(self, publisher):
+        ''' Catch up from a history service '''
+
+        try:
+            publications = self.mw_obj.request_history(publisher.addr, publisher.history_port, self.topiclist, self.history)
+            self.logger.info("SubscriberAppln::replay_history - {} samples from {}".format(len(publications), publisher.id))
+            self.replay(publications)
+
+        except Exception as e:
+            raise e
+
+    ########################################
+    # Read our topics from the broker's durable log
+    ########################################
+    def resume_from_log(self, broker):
+        ''' Catch up from the broker's log '''
+
+        try:
+            for topic in self.topiclist:
+                publications = self.mw_obj.fetch_log(broker.addr, broker.log_port, topic, self.resume_since)
+                self.logger.info("SubscriberAppln::resume_from_log - {} samples of {} from {}".format(len(publications), topic, broker.id))
+                self.replay(publications)
+
+        except Exception as e:
+            raise e
+
+    ########################################
+    # Keep replayed samples, skipping any we have already
+    ########################################
+    def replay(self, publications):
+        ''' Keep samples that did not come in live '''
+
+        try:
+            for publication in publications:
+                if not self.kept.observe(publication.pub_id, publication.topic, publication.seq, publication.epoch):
+                    continue # seen it already, e.g. from another broker replica
+
+                if self.arbiter is not None and not self.arbiter.admit(publication.topic, publication.pub_id, publication.strength):
+                    continue
+
+                receivedTimestamp = datetime.datetime.now().timestamp()
+                self.results.write(publication, receivedTimestamp - publication.tstamp, receivedTimestamp, True)
+
+        except Exception as e:
+            raise e
+
     ########################################
     # Handle lookup publisher list by topic list response 
     #
@@ -349,14 +515,57 @@ class SubscriberAppln():
             if (lookup_resp.status == discovery_pb2.STATUS_SUCCESS):
                 self.logger.debug("SubscriberAppln::lookup_publisher_list_response - Success! List of publishers provided from Discovery")
 
+                # Time to first message is measured from here
+                self.subscribed_at = datetime.datetime.now().timestamp()
+                self.latency = LatencyStats()
+
+                # With Hybrid dissemination discovery routed each topic either
+                # through the broker or directly from its publishers
+                routes = {publisher.id: [] for publisher in lookup_resp.publisher_list}
+                via_broker = set()
+                for route in lookup_resp.routes:
+                    self.logger.info("SubscriberAppln::lookup_publisher_list_response - {} {} from {}".format(
+                        route.topic, "via the broker" if route.via_broker else "directly", list(route.sources)))
+                    for source in route.sources:
+                        routes[source].append(route.topic)
+                        if route.via_broker:
+                            via_broker.add(source)
+
                 # Connect to each of list of publishers 
                 for publisher in lookup_resp.publisher_list:
                     self.logger.debug("SubscriberAppln::lookup_publisher_list_response - Connecting to publisher {} {}:{}".format(publisher.id, publisher.addr, publisher.port))
+                    topiclist = routes[publisher.id] if lookup_resp.routes else self.topiclist
                     
-                    # Connect to this publisher for the topics we are interested in via MW
-                    self.mw_obj.connect_to_publisher(publisher.addr, publisher.port, self.topiclist)
+                    # Connect to this publisher for the topics we are interested in via MW;
+                    # a broker that can keep a queue for us gets us through that
+                    if publisher.egress_port:
+                        self.mw_obj.connect_to_egress(publisher.addr, publisher.egress_port, topiclist)
+                    else:
+                        self.mw_obj.connect_to_publisher(publisher.addr, publisher.port, topiclist, via_broker=publisher.id in via_broker)
+
+                    # Restarted: catch up on everything since we went away
+                    # (oldest first, or the history would hide it)
+                    if self.resume_since is not None and publisher.log_port:
+                        self.resume_from_log(publisher)
+
+                    # Late joiner: catch up on what we missed
+                    if self.history > 0 and publisher.history_port:
+                        self.replay_history(publisher)
 
                 self.logger.debug("SubscriberAppln::lookup_publisher_list_response - Done connecting to publishers")
+
+                # Decoders, each with results and a latency snapshot of its own
+                if self.decoders > 0:
+                    self.mw_obj.start_decoders([(name,) + self.output_paths(name)
+                                                for name in ("{}-{}".format(self.name, index) for index in range(self.decoders))],
+                                               arbitrate=self.arbiter is not None)
+
+                # Discovery balancing subscribers over brokers gave us just one
+                # (we follow reassignments on the SUB socket only)
+                if (self.dissemination == Constants.DISSEMINATION_STRATEGY_BROKER and len(lookup_resp.publisher_list) == 1
+                        and not lookup_resp.publisher_list[0].egress_port):
+                    broker = lookup_resp.publisher_list[0]
+                    self.mw_obj.follow_assignment(broker.addr, broker.port)
        
                 # Change the state to CONSUME time for us to just accept data
                 self.state = self.State.CONSUME
@@ -396,8 +605,30 @@ def parseCmdLineArgs ():
         
     parser.add_argument("-d", "--discovery", default="localhost:5556", help="IP Addr:Port combo for the discovery service, default localhost:5556")
 
+    parser.add_argument("-z", "--zookeeper", default=None, help="IP Addr:Port of zookeeper; if given we follow the discovery leader elected there (default: use --discovery only)")
+
     parser.add_argument ("-T", "--num_topics", type=int, choices=range(1,10), default=1, help="Number of topics to publish, currently restricted to max of 9")
 
+    parser.add_argument("--history", type=int, default=0, help="On joining, ask each publisher (or the broker) for this many recent samples per topic (default: 0, none)")
+
+    parser.add_argument("--resume_since", type=float, default=None, help="On joining, read our topics from the broker's durable log starting at this time (epoch seconds, e.g. the last 'received' in our csv) (default: do not)")
+
+    parser.add_argument("--conflate", nargs="*", default=None, help="Only take the newest sample of these topics (topic prefixes; all topics if none are listed) when we fall behind, instead of working through a backlog (default: take every sample)")
+
+    parser.add_argument("--filter", action="append", default=[], help="Only take the samples whose content passes '<topic> <op> <values>', op one of < <= > >= == != range in, e.g. 'temperature > 90', 'humidity range 20 40', 'weather in sunny icy'; publishers and the broker filter before sending. Repeat for more; samples passing any filter of a topic are taken (default: take every sample)")
+
+    parser.add_argument("--credit", type=int, default=100, help="Samples a broker with a ROUTER egress (BrokerAppln --egress router) may send us ahead of what we consumed (default: 100)")
+
+    parser.add_argument("--results", choices=FORMATS, default="csv", help="Format our results are streamed to ./csv in: csv, or compact binary columns (read them with ResultsWriter.read_results) (default: csv)")
+
+    parser.add_argument("--flush_interval", type=float, default=1.0, help="Seconds at most between writing our results to disk (default: 1)")
+
+    parser.add_argument("--stats_interval", type=float, default=10.0, help="Seconds between logging latency percentiles and throughput per topic and updating ./csv/<name>_<strategy>_latency.json, 0 to do so only when done (default: 10)")
+
+    parser.add_argument("--decoders", type=int, default=0, help="With direct dissemination, decode and keep our samples in this many processes, each taking a share of the topics in order; 0 does it in this process (default: 0)")
+
+    parser.add_argument("--ownership_threshold", type=int, default=5, help="With direct dissemination, samples from weaker publishers of a topic after which a silent owner loses the topic (default 5)")
+
     parser.add_argument("-c", "--config", default="config.ini", help="configuration file (default: config.ini)")
 
     parser.add_argument("-f", "--frequency", type=int,default=1, help="Rate at which topics disseminated: default once a second - use integers")
@@ -16,16 +16,21 @@ import os
 import sys
 import time
 import logging # for logging. Use it in place of print statements.
+import threading # for the debounce timers
 
 # argument parser
 import argparse
 
 # Now import the kazoo package that supports Python binding
 # to ZooKeeper
-from kazoo.client import KazooClient   # client API
 from kazoo.client import KazooState    # for the state machine
+from kazoo.exceptions import NodeExistsError, NoNodeError
+from kazoo.protocol.states import EventType
+
+import zmq # for waking up a middleware event loop from a watch
 
 from CS6381_MW import discovery_pb2
+from CS6381_MW.Coordination import KazooCoordination
 
 #--------------------------------------------------------------------------
 # define a callback function to let us know what state we are in currently
@@ -56,18 +61,37 @@ class ZK_Driver ():
     #################################################################
     # constructor
     #################################################################
-    def __init__ (self, args, logger):
+    def __init__ (self, logger, zkIPAddr, zkPort=2181, zkName="/foo", zkVal=b"bar", totalEntities=14, zkTimeout=10.0, electionRoot="/discovery"):
         self.zk = None  # session handle to the zookeeper server
-        self.zkIPAddr = args.zkIPAddr  # ZK server IP address
-        self.zkPort = args.zkPort # ZK server port num
-        self.zkName = args.zkName # refers to the znode path being manipulated
-        self.zkVal = args.zkVal # refers to the znode value
+        self.zkIPAddr = zkIPAddr  # ZK server IP address
+        self.zkPort = zkPort # ZK server port num
+        self.zkName = zkName # refers to the znode path being manipulated
+        self.zkVal = zkVal # refers to the znode value
+        self.zkTimeout = zkTimeout # session timeout; bounds how long a dead leader holds its ephemeral node
         self.logger = logger  # internal logger for print statements
         self.server_active = True
         # Watch mechanism variables
-        self.total_entities = args.totalEntities # Keep track of how many total entities should be in the system
+        self.total_entities = totalEntities # Keep track of how many total entities should be in the system
+        self.current_num_entities = 0
+        # Double barrier variables. Participants are ephemeral children of the
+        # barrier; the last one in creates the ready node everybody watches.
         self.barrier_path = "/barrier"
-        self.election_path = "/leader"
+        self.ready_path = self.barrier_path + "/ready"
+        self.barrier_name = None # our participant node under the barrier path
+        self.barrier_ready = False
+        self.on_barrier_ready = None # callback made (on the kazoo thread) once all have entered
+        self.on_barrier_left = None # callback made once all have left
+        # Leader election variables. The discovery replicas elect under /discovery
+        # and the broker replicas under /broker
+        self.election_path = electionRoot + "/election" # sequential ephemeral candidates
+        self.leader_path = electionRoot + "/leader" # ephemeral node holding the leader's "addr:port"
+        self.registry_path = "/registry" # persistent mirror of every registration
+        self.node_path = None # our own candidate node under the election path
+        self.leader_value = None # what we advertise once we become the leader
+        self.is_leader = False
+        self.on_elected = None # callback made (on the kazoo thread) when we take over
+        self.registry_watchers = {} # role directory -> MembershipWatcher
+        self.live_watchers = {} # live directory -> MembershipWatcher
 
     #-----------------------------------------------------------------------
     # Debugging: Dump the contents
@@ -81,10 +105,16 @@ class ZK_Driver ():
     # -----------------------------------------------------------------------
     # Initialize the driver
     # -----------------------------------------------------------------------
-    def init_driver (self):
+    def init_driver (self, client=None):
         """Initialize the client driver program"""
 
         try:
+            # an already built client, e.g. an InMemoryCoordination session
+            if client is not None:
+                self.zk = client
+                self.zk.add_listener (self.session_listener)
+                return
+
             # debug output
             self.dump ()
 
@@ -95,10 +125,8 @@ class ZK_Driver ():
             print ("Driver::init_driver -- instantiate zk obj: hosts = {}".format(hosts))
 
             # instantiate the kazoo client object
-            self.zk = KazooClient (hosts)
-
-            # Add barrier watcher
-            self.zk.create(self.barrier_path, value=b"0")
+            self.zk = KazooCoordination (hosts, timeout=self.zkTimeout)
+            self.zk.add_listener (self.session_listener)
 
             # register it with the state listener.
             # recall that the "listener4state" is a callback method
@@ -112,6 +140,15 @@ class ZK_Driver ():
             raise
 
 
+    # -----------------------------------------------------------------------
+    # Losing the session takes our ephemeral nodes, and with them any
+    # leadership, away
+    # -----------------------------------------------------------------------
+    def session_listener (self, state):
+        if state == KazooState.LOST and self.is_leader:
+            self.logger.info ("ZookeeperClient::session_listener - session lost, no longer the leader")
+            self.is_leader = False
+
     # -----------------------------------------------------------------------
     # A watcher function to see if value for a node in the znode tree
     # has changed
@@ -168,8 +205,8 @@ class ZK_Driver ():
     def create_znode (self, zk_name, zk_value):
         """ ******************* znode creation ************************ """
         try:
-            print ("Creating an ephemeral znode {} with value {}".format(self.zkName,self.zkVal))
-            self.zk.create (self.zkName, value=self.zkVal, ephemeral=True, makepath=True)
+            print ("Creating an ephemeral znode {} with value {}".format(zk_name, zk_value))
+            self.zk.create (zk_name, value=zk_value, ephemeral=True, makepath=True)
 
         except:
             print("Exception thrown in create (): ", sys.exc_info()[0])
@@ -246,14 +283,9 @@ class ZK_Driver ():
             # first step is to start a session
             self.start_session ()
 
-            @self.zk.ChildrenWatch(self.barrier_path)
-            def child_change_watcher(children):
-                if self.zk.exists (self.barrier_path):
-                    print(("Driver::child_change_watcher - setting new value for children = {}".format (len(children))))
-                    self.zk.set (self.barrier_path, bytes (str (len (children)), 'utf-8'))
-                else:
-                    print ("Driver:run_driver -- child watcher -- znode does not exist")
- 
+            # wait for the whole system at the barrier
+            self.enter_barrier ("driver-{}".format (os.getpid ()))
+
             while (self.server_active):
                 pass
            
@@ -267,26 +299,150 @@ class ZK_Driver ():
             print("Exception thrown: ", sys.exc_info()[0])
     
 
+    ####################################################
+    # Double barrier - enter
+    #
+    # Each participant creates an ephemeral child of the barrier and counts
+    # the children once. The one that brings the count to total_entities
+    # creates the ready node. Everybody set an exists watch on the ready node
+    # before joining, so readiness is a single notification per participant
+    # instead of a count rewrite (and a notification to all) per arrival.
+    ####################################################
+    def enter_barrier(self, name, on_ready=None):
+        try:
+            self.logger.info("ZookeeperClient::enter_barrier - {}".format(name))
+
+            self.barrier_name = name
+            self.barrier_ready = False
+            self.on_barrier_ready = on_ready
+
+            self.zk.ensure_path(self.barrier_path)
+
+            # watch first so the creation of the ready node cannot be missed
+            ready = self.zk.exists(self.ready_path, watch=self.ready_watcher)
+            self.zk.create(self.barrier_path + "/" + name, ephemeral=True)
+
+            if ready is not None:
+                self.barrier_released()
+                return
+
+            children = self.zk.get_children(self.barrier_path)
+            if len(children) >= self.total_entities:
+                self.logger.debug("ZookeeperClient::enter_barrier - last to arrive, releasing the barrier")
+                try:
+                    self.zk.create(self.ready_path)
+                except NodeExistsError:
+                    pass
+
+        except Exception as e:
+            raise e
+
+    def ready_watcher(self, event):
+        if event.type == EventType.CREATED:
+            self.barrier_released()
+
+    def barrier_released(self):
+        if self.barrier_ready:
+            return
+
+        self.barrier_ready = True
+        self.logger.info("ZookeeperClient::barrier_released - all {} entities are in".format(self.total_entities))
+
+        if self.on_barrier_ready is not None:
+            self.on_barrier_ready()
+
+    ####################################################
+    # Double barrier - leave
+    #
+    # The lowest participant leaves last: it waits on the highest one, all
+    # others delete themselves and wait on the lowest. The last one out
+    # removes the ready node so the barrier can be used again.
+    ####################################################
+    def leave_barrier(self, on_left=None):
+        try:
+            self.logger.info("ZookeeperClient::leave_barrier - {}".format(self.barrier_name))
+
+            self.on_barrier_left = on_left
+            self.leave_step()
+
+        except Exception as e:
+            raise e
+
+    def leave_step(self, event=None):
+        mine = self.barrier_name
+        my_path = self.barrier_path + "/" + mine
+
+        while True:
+            children = sorted(c for c in self.zk.get_children(self.barrier_path) if c != "ready")
+
+            if not children:
+                break
+
+            if children == [mine]:
+                self.zk.delete(my_path)
+                try:
+                    self.zk.delete(self.ready_path)
+                except NoNodeError:
+                    pass
+                break
+
+            if mine == children[0]:
+                wait_on = children[-1]
+            else:
+                if mine in children:
+                    self.zk.delete(my_path)
+                wait_on = children[0]
+
+            # if the node is already gone there is nothing to wait for
+            if self.zk.exists(self.barrier_path + "/" + wait_on, watch=self.leave_step) is not None:
+                return
+
+        self.barrier_ready = False
+        self.logger.info("ZookeeperClient::leave_step - everybody has left the barrier")
+
+        if self.on_barrier_left is not None:
+            self.on_barrier_left()
+
     ####################################################
     # Zookeeper election support function
     #
+    # Every replica creates a sequential ephemeral candidate node. The
+    # lowest sequence number leads; everybody else watches only the node
+    # just ahead of it so a leader crash wakes up exactly one standby.
     ####################################################
-    def join_election(self):
+    def join_election(self, leader_value, on_elected=None):
         try:
-            self.zk.create(self.node_path, ephemeral=True)
-            self.elect_leader()
+            self.logger.info("ZookeeperClient::join_election")
+
+            self.leader_value = leader_value
+            self.on_elected = on_elected
+
+            self.node_path = self.zk.create(self.election_path + "/n_", value=leader_value, ephemeral=True, sequence=True, makepath=True)
+            self.logger.debug("ZookeeperClient::join_election - candidate node {}".format(self.node_path))
+
+            self.leader_election()
+
         except Exception as e:
-            self.watch_previous_node()
+            raise e
 
     ####################################################
     # Zookeeper election - Watch previous node
     #
     ####################################################
-    def watch_previous_node(self, previous_children=None):
-        if previous_children is None:
-            previous_children = self.zk.get_children(self.election_path, self.elect_leader)
+    def watch_previous_node(self, previous_children):
         index = previous_children.index(self.node_path.split("/")[-1])
-        self.zk.exists(f"{self.election_path}/{previous_children[index-1]}", self.elect_leader)
+        previous_path = "{}/{}".format(self.election_path, previous_children[index-1])
+
+        self.logger.debug("ZookeeperClient::watch_previous_node - watching {}".format(previous_path))
+
+        # exists returns None if the node vanished between get_children and now;
+        # in that case there is no watch to wait on so run the election again
+        if self.zk.exists(previous_path, watch=self.previous_node_watcher) is None:
+            self.leader_election()
+
+    def previous_node_watcher(self, event):
+        self.logger.debug("ZookeeperClient::previous_node_watcher - {}".format(event))
+        self.leader_election()
 
     ####################################################
     # Zookeeper leader election
@@ -295,35 +451,69 @@ class ZK_Driver ():
     def leader_election(self):
         children = self.zk.get_children(self.election_path)
         children.sort()
-        if self.node_path == f"{self.election_path}/{children[0]}":
-            self.leader_path = self.node_path
-            self.is_leader = True
+
+        if self.node_path == "{}/{}".format(self.election_path, children[0]):
+            self.become_leader()
         else:
             self.watch_previous_node(children)
 
+    ####################################################
+    # Publish ourselves as the leader
+    #
+    # The leader znode is what clients watch to find the discovery service.
+    # A dead leader's node may linger until its session expires, so if it is
+    # still there we wait for its deletion instead of failing.
+    ####################################################
+    def become_leader(self):
+        try:
+            self.zk.create(self.leader_path, value=self.leader_value, ephemeral=True, makepath=True)
+        except NodeExistsError:
+            if self.zk.exists(self.leader_path, watch=self.stale_leader_watcher) is not None:
+                self.logger.debug("ZookeeperClient::become_leader - previous leader node still present, waiting")
+                return
+            self.zk.create(self.leader_path, value=self.leader_value, ephemeral=True, makepath=True)
+
+        # do not start taking writes with registrations still in the window
+        self.sync_registry()
+
+        self.is_leader = True
+        self.logger.info("ZookeeperClient::become_leader - we are the leader ({})".format(self.leader_value))
+
+        if self.on_elected is not None:
+            self.on_elected()
+
+    def stale_leader_watcher(self, event):
+        self.logger.debug("ZookeeperClient::stale_leader_watcher - {}".format(event))
+        if not self.is_leader:
+            self.become_leader()
 
     ##############################
     # Store info on an entity in the systen
     #
+    # Registry nodes are persistent: they are written by the discovery
+    # leader, not by the entity itself, and must survive the leader.
     ##############################
-    def add_entity(self, entity_to_write):
+    def add_entity(self, role, name, value):
         result = False
 
         try:
             self.logger.info("ZookeeperClient::add_entity")
 
             # Check the role of the entity we are registering
-            node_directory = self.get_node_directory(entity_to_write)
+            node_path = self.get_node_directory(role) + name
 
-            # Create the new node
-            self.create_znode(node_directory + entity_to_write.name, entity_to_write)
+            # Create the new node, overwriting a stale one from an earlier run
+            if self.zk.exists(node_path):
+                self.zk.set(node_path, value)
+            else:
+                self.zk.create(node_path, value=value, makepath=True)
             
             # Increment number of nodes
             self.current_num_entities = self.current_num_entities + 1
 
             # Return true if the create works as expected
             result = True
-            self.logger.info("ZookeeperClient::add_entity - Created node {}".format(node_directory + entity_to_write.name))
+            self.logger.info("ZookeeperClient::add_entity - Created node {}".format(node_path))
 
         except Exception as e:
             result = False
@@ -335,61 +525,378 @@ class ZK_Driver ():
     # Read info on an entity in the systen
     #
     ##############################
-    def read_entity(self, entity_to_read):
+    def read_entity(self, role, name):
         try:
             self.logger.info("ZookeeperClient::read_entity")
 
-             # Check the role of the entity we are reading
-            node_directory = self.get_node_directory(entity_to_read)
-
-            entity = self.read_entity(node_directory + entity_to_read.name)
+            # Check the role of the entity we are reading
+            value, stat = self.zk.get(self.get_node_directory(role) + name)
 
             self.logger.info("ZookeeperClient::read_entity - Read success")
-        except Exception as e:
-            entity = None
-            raise e
+        except NoNodeError:
+            value = None
 
-        return entity
+        return value
 
     ##############################
     # Delete entity in the systen
     #
     ##############################
-    def delete_entity(self, entity_to_delete):
+    def delete_entity(self, role, name):
         result = False
 
         try:
             self.logger.info("ZookeeperClient::delete_entity")
 
-            # Check the role of the entity we are reading
-            node_directory = self.get_node_directory(entity_to_delete)
-
-            self.delete_entity(node_directory + entity_to_delete)
+            # Check the role of the entity we are deleting
+            self.zk.delete(self.get_node_directory(role) + name)
 
             # Decrement number of nodes
             self.current_num_entities = self.current_num_entities -1
 
             # The result is true if the action happens with no error
             result = True
-            self.logger.info("ZookeeperClient::read_entity - Deleted {} successfully".format(entity_to_delete))
+            self.logger.info("ZookeeperClient::delete_entity - Deleted {} successfully".format(name))
 
-        except Exception as e:
-            raise e
+        except NoNodeError:
+            result = False
 
         return result
 
-    def get_node_directory(self, entity): 
+    ##############################
+    # Mirror the registry into a standby
+    #
+    # callback (role, name, value) is made for every registration that appears
+    # and callback (role, name, None) for every one that is removed. Watch
+    # events are coalesced over "window" seconds and only the changed
+    # children are read (see MembershipWatcher).
+    ##############################
+    def watch_registry(self, callback, window=0.05):
+        self.logger.info("ZookeeperClient::watch_registry")
+
+        for role in (discovery_pb2.ROLE_PUBLISHER, discovery_pb2.ROLE_SUBSCRIBER, discovery_pb2.ROLE_BOTH):
+            # znode paths may not end in "/" (the directory is a name prefix)
+            node_directory = self.get_node_directory(role).rstrip("/")
+            self.zk.ensure_path(node_directory)
+            self.registry_watchers[node_directory] = MembershipWatcher(self.logger, self.zk, node_directory,
+                                                                       self.make_registry_watcher(role, callback), window)
+
+    def make_registry_watcher(self, role, callback):
+        def registry_watcher(added, removed):
+            for name, value in added.items():
+                callback(role, name, value)
+            for name in removed:
+                callback(role, name, None)
+
+        return registry_watcher
+
+    ##############################
+    # Bring the mirror up to date now instead of at the end of the window,
+    # e.g. right before a standby starts taking writes
+    ##############################
+    def sync_registry(self):
+        for watcher in self.registry_watchers.values():
+            watcher.flush()
+
+    ##############################
+    # Follow the live members under "path" (see announce ()); callback
+    # (added, removed) as for MembershipWatcher
+    ##############################
+    def watch_live(self, path, callback, window=0.05):
+        self.logger.info("ZookeeperClient::watch_live - {}".format(path))
+        self.zk.ensure_path(path)
+        self.live_watchers[path] = MembershipWatcher(self.logger, self.zk, path, callback, window)
+
+    ##############################
+    # Which broker each subscriber is assigned to ("addr:port"), written by
+    # the discovery leader; a subscriber follows its own node
+    ##############################
+    def write_assignment(self, name, value):
+        node_path = ASSIGNMENTS + "/" + name
+        if self.zk.exists(node_path):
+            self.zk.set(node_path, value)
+        else:
+            self.zk.create(node_path, value=value, makepath=True)
+
+    def delete_assignment(self, name):
+        try:
+            self.zk.delete(ASSIGNMENTS + "/" + name)
+        except NoNodeError:
+            pass
+
+    def read_assignments(self):
+        assignments = {}
+        try:
+            children = self.zk.get_children(ASSIGNMENTS)
+        except NoNodeError:
+            return assignments
+        for name in children:
+            try:
+                assignments[name] = self.zk.get(ASSIGNMENTS + "/" + name)[0]
+            except NoNodeError:
+                continue
+        return assignments
+
+    def watch_stats(self):
+        stats = {"watch_events": 0, "children_reads": 0, "data_reads": 0, "flushes": 0}
+        for watcher in self.registry_watchers.values():
+            for key in stats:
+                stats[key] += getattr(watcher, key)
+        return stats
+
+    def get_node_directory(self, role): 
         # We will be grouping the nodes based on role
-        if entity.role == discovery_pb2.ROLE_SUBSCRIBER:
-            node_directory = "/sub/"
-        elif entity.role == discovery_pb2.ROLE_PUBLISHER:
-            node_directory = "/pub/"
-        elif entity.role == discovery_pb2.ROLE_BOTH:
-            node_directory = "/broker/"
+        if role == discovery_pb2.ROLE_SUBSCRIBER:
+            node_directory = self.registry_path + "/sub/"
+        elif role == discovery_pb2.ROLE_PUBLISHER:
+            node_directory = self.registry_path + "/pub/"
+        elif role == discovery_pb2.ROLE_BOTH:
+            node_directory = self.registry_path + "/broker/"
+        else:
+            raise ValueError("Unknown role {}".format(role))
 
         return node_directory
 
 
+# ------------------------------------------------------------------
+# Debounced, incremental view of the children of one znode
+#
+# A re-arming ChildrenWatch re-reads the whole child list on every change,
+# so a burst of N joins costs each watcher N list reads of up to N names.
+# Here the first watch event starts a "window" second timer and the watch is
+# not re-armed until it expires: then the list is read once (re-arming the
+# watch), diffed against what we knew, and only the added children are
+# fetched. Every child read also sets a data watch on it, so a child whose
+# value is rewritten in place is read again in the same window.
+# callback (added, removed) gets {name: value} of the added and changed
+# children and a set of removed names. A window of 0 refreshes on every
+# event (still incrementally).
+#
+class MembershipWatcher ():
+    """ Coalesced membership diffs for one znode's children """
+
+    def __init__ (self, logger, zk, path, callback, window=0.05):
+        self.logger = logger
+        self.zk = zk # a Coordination session
+        self.path = path
+        self.callback = callback
+        self.window = window
+        self.members = {} # name -> value
+        self.changed = set () # members whose value was rewritten since the last refresh
+        self.lock = threading.Lock ()
+        self.refresh_lock = threading.Lock () # a flush may race the timer
+        self.timer = None # pending refresh while we coalesce
+        self.closed = False
+        # counters
+        self.watch_events = 0 # notifications received
+        self.children_reads = 0 # get_children calls
+        self.data_reads = 0 # get calls for added and changed children
+        self.flushes = 0 # diffs computed
+
+        self.refresh ()
+
+    def watcher (self, event):
+        with self.lock:
+            self.watch_events += 1
+            if self.closed or self.timer is not None:
+                return
+            if self.window > 0:
+                self.timer = threading.Timer (self.window, self.refresh)
+                self.timer.daemon = True
+                self.timer.start ()
+                return
+
+        self.refresh ()
+
+    def member_watcher (self, event):
+        # rewritten, or deleted (and maybe created again within the window,
+        # which the child list alone does not show): read it again
+        with self.lock:
+            self.changed.add (event.path.rsplit ("/", 1)[-1])
+        self.watcher (event)
+
+    def flush (self):
+        ''' Apply a pending window right away, or wait for the one being applied '''
+        with self.lock:
+            timer = self.timer
+            if timer is not None:
+                timer.cancel ()
+        if timer is not None:
+            self.refresh ()
+            return
+
+        # refresh () clears the timer only once it holds refresh_lock, so a
+        # refresh already under way on the timer thread finishes first
+        with self.refresh_lock:
+            pass
+
+    def refresh (self):
+        with self.refresh_lock:
+            with self.lock:
+                self.timer = None
+                if self.closed:
+                    return
+                changed, self.changed = self.changed, set ()
+
+            # reading the list re-arms the (one shot) watch
+            try:
+                current = set (self.zk.get_children (self.path, watch=self.watcher))
+            except NoNodeError:
+                current = set ()
+            self.children_reads += 1
+
+            # reading a child (re-)arms its (one shot) data watch
+            added = {}
+            for name in (current - self.members.keys ()) | (changed & current):
+                try:
+                    value, stat = self.zk.get (self.path + "/" + name, watch=self.member_watcher)
+                except NoNodeError:
+                    continue # came and went within the window
+                self.data_reads += 1
+                if self.members.get (name) != value:
+                    added[name] = value
+            removed = self.members.keys () - current
+
+            for name in removed:
+                del self.members[name]
+            self.members.update (added)
+            self.flushes += 1
+
+            if added or removed:
+                self.logger.debug ("MembershipWatcher::refresh - {}: +{} -{}".format (self.path, len (added), len (removed)))
+                self.callback (added, removed)
+
+    def close (self):
+        with self.lock:
+            self.closed = True
+            if self.timer is not None:
+                self.timer.cancel ()
+
+# ------------------------------------------------------------------
+# Watches a leader znode on behalf of a middleware object
+#
+# Kazoo fires its watches on its own thread but ZMQ sockets are not thread
+# safe, so every change is posted to an inproc PAIR socket. The middleware
+# registers "socket" with its poller and reads "latest ()" when it fires.
+#
+class LeaderWatcher ():
+    """ Follow whoever currently owns a leader znode """
+
+    def __init__ (self, logger, hosts, leader_path, context=None, timeout=10.0, client=None):
+        self.logger = logger
+        self.leader_path = leader_path
+        self.value = None # latest leader value, None while there is no leader
+        self.lost_at = None # when the previous leader disappeared
+        self.failover_times = [] # seconds from leader loss to a new leader
+        self.changes = [] # (time.time (), value) for every leader we saw
+        self.context = context or zmq.Context.instance ()
+        endpoint = "inproc://leader-{}".format (id (self))
+        self.socket = self.context.socket (zmq.PAIR)
+        self.socket.bind (endpoint)
+        self.notifier = self.context.socket (zmq.PAIR)
+        self.notifier.connect (endpoint)
+        # any Coordination session will do; a ZooKeeper one unless told otherwise
+        self.zk = client or KazooCoordination (hosts, timeout=timeout)
+        self.zk.start ()
+        self.zk.DataWatch (self.leader_path, self.leader_change)
+
+    def leader_change (self, data, stat):
+        now = time.time ()
+        if data is None:
+            if self.value is not None:
+                self.lost_at = now
+            self.value = None
+            return
+
+        self.value = data.decode ("utf-8")
+        self.changes.append ((now, self.value))
+        if self.lost_at is not None:
+            self.failover_times.append (now - self.lost_at)
+            self.logger.info ("LeaderWatcher::leader_change - new leader {} after {:.3f} s".format (self.value, now - self.lost_at))
+            self.lost_at = None
+
+        self.notifier.send (b"")
+
+    def latest (self):
+        # drain the notification(s); we only care about the newest value
+        while self.socket.poll (0):
+            self.socket.recv ()
+        return self.value
+
+    def wait (self, timeout=None):
+        deadline = None if timeout is None else time.time () + timeout
+        while self.value is None and (deadline is None or time.time () < deadline):
+            time.sleep (0.05)
+        return self.value
+
+    def close (self):
+        self.zk.stop ()
+        self.notifier.close (linger=0)
+        self.socket.close (linger=0)
+
+
+# ------------------------------------------------------------------
+# Live members of a role, for the data path
+#
+# The registry under /registry is persistent and written by the discovery
+# leader, so it never forgets anybody. For the data path an entity also
+# announces itself with an ephemeral child of a "live" directory holding
+# its serialized RegisterReq; it goes away with the entity's session.
+# MembershipFeed follows such a directory with a MembershipWatcher and, as
+# LeaderWatcher does, hands the diffs to a middleware's poller through an
+# inproc PAIR socket.
+#
+LIVE_PUBLISHERS = "/live/pub"
+LIVE_SUBSCRIBERS = "/live/sub"
+LIVE_BROKERS = "/live/broker"
+ASSIGNMENTS = "/assign" # subscriber name -> "addr:port" of its broker
+
+def announce (zk, path, name, value):
+    node_path = path + "/" + name
+    try:
+        zk.delete (node_path) # left behind by an earlier session of ours
+    except NoNodeError:
+        pass
+    zk.create (node_path, value=value, ephemeral=True, makepath=True)
+
+class MembershipFeed ():
+    """ Membership diffs of one live directory, delivered to a poller """
+
+    def __init__ (self, logger, hosts, path, context=None, timeout=10.0, window=0.05, client=None):
+        self.logger = logger
+        self.path = path
+        self.pending = [] # (time.time (), added, removed) not yet taken
+        self.lock = threading.Lock ()
+        self.context = context or zmq.Context.instance ()
+        endpoint = "inproc://membership-{}".format (id (self))
+        self.socket = self.context.socket (zmq.PAIR)
+        self.socket.bind (endpoint)
+        self.notifier = self.context.socket (zmq.PAIR)
+        self.notifier.connect (endpoint)
+        self.zk = client or KazooCoordination (hosts, timeout=timeout)
+        self.zk.start ()
+        self.zk.ensure_path (path)
+        self.watcher = MembershipWatcher (logger, self.zk, path, self.membership_change, window)
+
+    def membership_change (self, added, removed):
+        with self.lock:
+            self.pending.append ((time.time (), added, removed))
+        self.notifier.send (b"")
+
+    def changes (self):
+        # drain the notifications and take every diff seen since last time
+        while self.socket.poll (0):
+            self.socket.recv ()
+        with self.lock:
+            pending, self.pending = self.pending, []
+        return pending
+
+    def close (self):
+        self.watcher.close ()
+        self.zk.stop ()
+        self.notifier.close (linger=0)
+        self.socket.close (linger=0)
+
 
 ##################################
 # Command line parsing
@@ -427,7 +934,7 @@ def main ():
     logger.debug("Main: effective log level is {}".format(logger.getEffectiveLevel ()))
     
     # invoke the driver program
-    driver = ZK_Driver (parsed_args, logger)
+    driver = ZK_Driver (logger, parsed_args.zkIPAddr, parsed_args.zkPort, parsed_args.zkName, parsed_args.zkVal, parsed_args.totalEntities)
 
     # initialize the driver
     driver.init_driver ()
@@ -0,0 +1,229 @@
+###############################################
+#
+# Purpose: Spreading subscribers over brokers (DiscoveryAppln --threshold)
+#
+# One publisher sends T topics at --rate samples/s per topic into B real
+# BrokerMWs that all forward (BrokerAppln --no_election); S subscribers are
+# placed on the brokers by the BrokerBalancer discovery uses. For each
+# threshold we measure, per broker, the fan-out (subscribers) and the
+# samples/s it pushes out (forwarded x fan-out), and the end to end latency
+# at the subscribers, in two phases:
+#
+#   steady:  B - 1 brokers
+#   joined:  broker B joins and the balancer moves subscribers onto it;
+#            subscribers switch brokers as SubscriberMW does when its
+#            assignment changes
+#
+# A threshold of S or more keeps every subscriber on the first broker (no
+# balancing). Everything runs in this process over tcp on localhost.
+#
+# Results are appended to ./csv/balance_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import threading
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.Common import BrokerBalancer
+from CS6381_MW import topic_pb2
+
+class BalanceBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("BalanceBenchmark::configure")
+    self.args = args
+
+  #################
+  # the publisher
+  #################
+  def publisher (self, context, port, stop):
+    pub = context.socket (zmq.PUB)
+    pub.bind ("tcp://*:{}".format (port))
+    content = "x" * self.args.size
+    while not stop.is_set ():
+      for t in range (self.args.topics):
+        publication = topic_pb2.Publication ()
+        publication.topic = "topic{}".format (t)
+        publication.content = content
+        publication.pub_id = "pub1"
+        publication.tstamp = time.time ()
+        pub.send_multipart ([bytes (publication.topic, "utf-8"), publication.SerializeToString ()])
+      stop.wait (1 / self.args.rate)
+    pub.close (linger=0)
+
+  #################
+  # a broker: what BrokerAppln does in its ACTIVE state, counting
+  #################
+  def broker (self, mw_obj, forwarded, name):
+    while True:
+      publication = mw_obj.consume ()
+      mw_obj.disseminate (publication.pub_id, publication.topic, publication.content, publication.tstamp, publication.strength)
+      forwarded[name] += 1
+
+  #################
+  # a subscriber that goes wherever it is assigned
+  #################
+  def subscriber (self, context, name, assignment, latencies, stop):
+    sub = context.socket (zmq.SUB)
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    endpoint = None
+    while not stop.is_set ():
+      if assignment[name] != endpoint:
+        if endpoint is not None:
+          sub.disconnect (endpoint)
+        endpoint = assignment[name]
+        sub.connect (endpoint)
+      if sub.poll (timeout=50):
+        topic, buf = sub.recv_multipart ()
+        publication = topic_pb2.Publication ()
+        publication.ParseFromString (buf)
+        latencies.append (time.time () - publication.tstamp)
+    sub.close (linger=0)
+
+  #################
+  # measure one phase
+  #################
+  def phase (self, label, threshold, balancer, forwarded, latencies):
+    start = {name: count for name, count in forwarded.items ()}
+    del latencies[:]
+    time.sleep (self.args.duration)
+    seconds = self.args.duration
+
+    samples = sorted (latencies)
+    mean = sum (samples) / len (samples) if samples else 0.0
+    p99 = samples[min (len (samples) - 1, int (len (samples) * 0.99))] if samples else 0.0
+    load = balancer.load ()
+    egress = {name: (forwarded[name] - start[name]) / seconds * load.get (name, 0) for name in forwarded}
+    self.logger.info ("threshold {:3d} {:7s}: fan-out {}; egress samples/s {}; latency mean {:.2f} ms p99 {:.2f} ms; {} moved".format (
+      threshold, label, load, {name: round (rate) for name, rate in egress.items () if name in load},
+      mean * 1000, p99 * 1000, balancer.moves))
+    self.results.append ((threshold, label, max (load.values ()), max (egress.values ()), mean, p99, balancer.moves))
+
+  #################
+  # one threshold
+  #################
+  def run (self, threshold, port):
+    args = self.args
+    context = zmq.Context ()
+    stop = threading.Event ()
+    topics = ["topic{}".format (t) for t in range (args.topics)]
+    threading.Thread (target=self.publisher, args=(context, port, stop), daemon=True).start ()
+
+    # the brokers, configured as BrokerAppln --no_election would be
+    endpoints = {}
+    forwarded = {}
+    for b in range (args.brokers):
+      name = "broker{}".format (b)
+      broker_port = port + 10 * (b + 1)
+      broker_args = argparse.Namespace (addr="localhost", port=broker_port, discovery="localhost:{}".format (broker_port + 3),
+                                        zookeeper=None, no_election=True, zk_timeout=3.0, watch_window=0.05, history=0,
+                                        history_port=None, no_last_value=True, log_dir=None, log_port=None, workers=0, egress="pub")
+      mw_obj = BrokerMW (self.logger)
+      mw_obj.configure (broker_args)
+      mw_obj.connect_to_publisher ("localhost", port, topics)
+      endpoints[name] = "tcp://localhost:{}".format (broker_port)
+      forwarded[name] = 0
+      threading.Thread (target=self.broker, args=(mw_obj, forwarded, name), daemon=True).start ()
+
+    # all but the last broker are there when the subscribers look up
+    balancer = BrokerBalancer (threshold)
+    names = list (endpoints)
+    for name in names[:-1]:
+      balancer.add_broker (name)
+    assignment = {}
+    latencies = []
+    for s in range (args.subscribers):
+      subscriber = "sub{}".format (s)
+      assignment[subscriber] = endpoints[balancer.assign (subscriber)]
+      threading.Thread (target=self.subscriber, args=(context, subscriber, assignment, latencies, stop), daemon=True).start ()
+
+    time.sleep (1.0)
+    self.phase ("steady", threshold, balancer, forwarded, latencies)
+
+    # the last broker joins
+    for subscriber, broker in balancer.add_broker (names[-1]).items ():
+      assignment[subscriber] = endpoints[broker]
+    time.sleep (0.5)
+    self.phase ("joined", threshold, balancer, forwarded, latencies)
+
+    stop.set ()
+    time.sleep (0.2)
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("BalanceBenchmark::driver")
+
+    for i, threshold in enumerate (self.args.thresholds):
+      self.run (threshold, self.args.port + 100 * i)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/balance_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("threshold,phase,brokers,subscribers,topics,rate,max_fanout,max_egress_per_s,latency_mean_ms,latency_p99_ms,moved\n")
+      for threshold, label, fanout, egress, mean, p99, moved in self.results:
+        f.write ("{},{},{},{},{},{},{},{:.0f},{:.3f},{:.3f},{}\n".format (threshold, label, self.args.brokers, self.args.subscribers,
+                                                                        self.args.topics, self.args.rate, fanout, egress,
+                                                                        mean * 1000, p99 * 1000, moved))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Subscriber to broker balancing benchmark")
+
+  parser.add_argument ("-B", "--brokers", type=int, default=3, help="Brokers, the last one joins halfway, default 3")
+  parser.add_argument ("-S", "--subscribers", type=int, default=12, help="Subscribers, default 12")
+  parser.add_argument ("-t", "--thresholds", type=int, nargs="+", default=[12, 2], help="Discovery thresholds to compare, default 12 (no balancing) 2")
+  parser.add_argument ("-T", "--topics", type=int, default=4, help="Topics, default 4")
+  parser.add_argument ("-r", "--rate", type=float, default=200.0, help="Publishing rounds over all topics per second, default 200")
+  parser.add_argument ("--size", type=int, default=256, help="Content bytes per sample, default 256")
+  parser.add_argument ("--duration", type=float, default=3.0, help="Seconds measured per phase, default 3")
+  parser.add_argument ("-p", "--port", type=int, default=7400, help="First of the ports used (100 per threshold), default 7400")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("BalanceBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = BalanceBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,177 @@
+###############################################
+#
+# Purpose: Compare the old counter rewrite on /barrier with the double barrier
+#
+# For every participant count we let N sessions on the in-process ZooKeeper
+# stand-in (InMemoryZK) arrive at the barrier one after the other and report
+# the znode writes, reads and watch notifications it took until everybody
+# knew the system was complete, plus the wall clock time.
+#
+#   counter: what ZK_Driver.run_driver used to do. Every participant keeps a
+#            ChildrenWatch on /barrier that rewrites the child count into
+#            /barrier, and a DataWatch on /barrier to learn the count.
+#   double:  ZK_Driver.enter_barrier / leave_barrier
+#
+# Results are appended to ./csv/barrier_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+from InMemoryZK import InMemoryZKServer, InMemoryKazooClient
+from ZookeeperClient import ZK_Driver
+
+class BarrierBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+    # the drivers log every call; keep that chatter out of the report
+    self.zk_logger = logging.getLogger ("BarrierBenchmark.zk")
+    self.zk_logger.setLevel (logging.WARNING)
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("BarrierBenchmark::configure")
+    self.args = args
+
+  #################
+  # the old scheme
+  #################
+  def run_counter (self, num):
+    server = InMemoryZKServer ()
+    ready = set ()
+    clients = []
+
+    def participant (i):
+      zk = InMemoryKazooClient (server)
+      zk.start ()
+      zk.ensure_path ("/barrier")
+
+      @zk.ChildrenWatch ("/barrier")
+      def child_change_watcher (children):
+        if zk.exists ("/barrier"):
+          zk.set ("/barrier", bytes (str (len (children)), "utf-8"))
+
+      @zk.DataWatch ("/barrier")
+      def count_watcher (data, stat):
+        if data and int (data) >= num:
+          ready.add (i)
+
+      zk.create ("/barrier/p{}".format (i), ephemeral=True)
+      return zk
+
+    server.reset_stats ()
+    start = time.perf_counter ()
+    for i in range (num):
+      clients.append (participant (i))
+    elapsed = time.perf_counter () - start
+
+    if len (ready) != num:
+      raise RuntimeError ("counter barrier: only {} of {} saw the system complete".format (len (ready), num))
+    return dict (server.stats), elapsed
+
+  #################
+  # the double barrier
+  #################
+  def run_double (self, num):
+    server = InMemoryZKServer ()
+    ready = set ()
+    left = set ()
+    drivers = []
+
+    server.reset_stats ()
+    start = time.perf_counter ()
+    for i in range (num):
+      driver = ZK_Driver (self.zk_logger, "inmemory", totalEntities=num)
+      driver.init_driver (InMemoryKazooClient (server))
+      driver.start_session ()
+      driver.enter_barrier ("p{:05d}".format (i), lambda i=i: ready.add (i))
+      drivers.append (driver)
+    elapsed = time.perf_counter () - start
+    enter_stats = dict (server.stats)
+
+    if len (ready) != num:
+      raise RuntimeError ("double barrier: only {} of {} were released".format (len (ready), num))
+
+    server.reset_stats ()
+    start = time.perf_counter ()
+    for i, driver in enumerate (drivers):
+      driver.leave_barrier (lambda i=i: left.add (i))
+    leave_elapsed = time.perf_counter () - start
+
+    if len (left) != num:
+      raise RuntimeError ("double barrier: only {} of {} left".format (len (left), num))
+    return enter_stats, elapsed, dict (server.stats), leave_elapsed
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("BarrierBenchmark::driver")
+
+    for num in self.args.participants:
+      stats, elapsed = self.run_counter (num)
+      self.record ("counter", "enter", num, stats, elapsed)
+
+      enter_stats, enter_elapsed, leave_stats, leave_elapsed = self.run_double (num)
+      self.record ("double", "enter", num, enter_stats, enter_elapsed)
+      self.record ("double", "leave", num, leave_stats, leave_elapsed)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/barrier_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("scheme,phase,participants,writes,reads,notifications,elapsed_ms\n")
+      for row in self.results:
+        f.write ("{},{},{},{},{},{},{:.3f}\n".format (*row))
+
+  def record (self, scheme, phase, num, stats, elapsed):
+    self.logger.info ("{:8s} {:5s} N={:4d}: writes={:7d} reads={:7d} notifications={:7d} ({:.1f} per participant) {:.1f} ms".format (
+      scheme, phase, num, stats["writes"], stats["reads"], stats["notifications"], stats["notifications"] / num, elapsed * 1000))
+    self.results.append ((scheme, phase, num, stats["writes"], stats["reads"], stats["notifications"], elapsed * 1000))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Barrier benchmark")
+
+  parser.add_argument ("-n", "--participants", type=int, nargs="+", default=[10, 25, 50, 100, 200], help="Participant counts to measure, default 10 25 50 100 200")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("BarrierBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = BarrierBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
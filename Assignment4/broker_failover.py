@@ -0,0 +1,205 @@
+###############################################
+#
+# Purpose: Measure broker failover
+#
+# Starts a discovery service, two broker replicas that elect a leader in
+# ZooKeeper, one publisher and one subscriber (Broker dissemination). The
+# subscriber is connected to both brokers but only the leader forwards. Once
+# data is flowing the leading broker is killed and we report, from the
+# subscriber's csv,
+#
+#   - takeover time: broker leader znode lost -> new leader znode
+#   - max gap: largest pause between two arrivals at the subscriber
+#   - estimated loss: per (publisher, topic) stream, round (gap * frequency) - 1
+#
+# Results are appended to ./csv/broker_failover.csv
+#
+###############################################
+
+import os
+import sys
+import csv
+import time
+import signal
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+import subprocess
+
+import zmq
+
+from ZookeeperClient import LeaderWatcher
+
+class BrokerFailoverExperiment ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.procs = {} # name -> Popen
+    self.brokers = {} # "addr:port" -> broker name
+    self.watcher = None
+    self.context = zmq.Context.instance ()
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("BrokerFailoverExperiment::configure")
+    self.args = args
+
+  def spawn (self, name, cmd):
+    self.logger.debug ("BrokerFailoverExperiment::spawn - {}".format (" ".join (cmd)))
+    self.procs[name] = subprocess.Popen ([sys.executable] + cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+  #################
+  # start everybody
+  #################
+  def start_system (self):
+    zk_addr, zk_port = self.args.zookeeper.split (":")
+    discovery = "{}:{}".format (self.args.addr, self.args.discovery_port)
+    level = str (logging.WARNING)
+    pub_iters = int (self.args.duration * self.args.frequency)
+
+    # the subscriber stops (and writes its csv) before the publisher runs dry,
+    # leaving room for the messages lost during the failover
+    sub_iters = int (self.args.duration * 0.75 * self.args.frequency * self.args.num_topics)
+
+    self.spawn ("disc", ["DiscoveryAppln.py", "-a", self.args.addr, "-p", str (self.args.discovery_port),
+                         "-P", "1", "-S", "1", "-B", "2", "-z", zk_addr, "--zookeeper_port", zk_port, "-l", level])
+    time.sleep (1)
+
+    for i in range (2):
+      name = "broker{}".format (i + 1)
+      port = self.args.broker_port + i
+      self.brokers["{}:{}".format (self.args.addr, port)] = name
+      self.spawn (name, ["BrokerAppln.py", "-n", name, "-a", self.args.addr, "-p", str (port), "-d", discovery,
+                         "-z", self.args.zookeeper, "--zk_timeout", str (self.args.zk_timeout), "-l", level])
+      # stagger so broker1 is the first leader
+      time.sleep (0.5)
+
+    self.spawn ("pub1", ["PublisherAppln.py", "-n", "pub1", "-a", self.args.addr, "-p", str (self.args.pub_port),
+                         "-d", discovery, "-T", str (self.args.num_topics), "-f", str (self.args.frequency),
+                         "-i", str (pub_iters), "-l", level])
+    self.spawn ("sub1", ["SubscriberAppln.py", "-n", "sub1", "-a", self.args.addr, "-p", str (self.args.sub_port),
+                         "-d", discovery, "-T", str (self.args.num_topics), "-f", str (self.args.frequency * self.args.num_topics * 10),
+                         "-i", str (sub_iters), "-l", level])
+
+  #################
+  # analyse the subscriber csv
+  #################
+  def analyse (self, path):
+    last_seen = {} # (pub, topic) -> last arrival
+    lost = 0
+    max_gap = 0.0
+    previous = None
+    with open (path) as f:
+      for row in csv.DictReader (f):
+        received = float (row["received"])
+        if previous is not None:
+          max_gap = max (max_gap, received - previous)
+        previous = received
+
+        stream = (row["publisher_id"], row["topic"])
+        if stream in last_seen:
+          lost += max (0, round ((received - last_seen[stream]) * self.args.frequency) - 1)
+        last_seen[stream] = received
+
+    return max_gap, lost
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("BrokerFailoverExperiment::driver")
+
+    os.makedirs ("./csv", exist_ok=True)
+    sub_csv = "./csv/sub1_broker_output.csv"
+    if os.path.exists (sub_csv):
+      os.remove (sub_csv)
+
+    self.start_system ()
+    self.watcher = LeaderWatcher (self.logger, self.args.zookeeper, "/broker/leader", self.context)
+    leader = self.watcher.wait (timeout=30)
+    if leader is None:
+      raise RuntimeError ("no broker leader elected")
+    self.logger.info ("broker leader is {} ({})".format (leader, self.brokers.get (leader)))
+
+    time.sleep (self.args.warmup)
+    victim = self.brokers[leader]
+    self.procs.pop (victim).send_signal (signal.SIGKILL)
+    self.logger.info ("killed {}".format (victim))
+
+    # wait for the subscriber to finish and write its csv
+    try:
+      self.procs["sub1"].wait (timeout=self.args.duration * 2)
+    except subprocess.TimeoutExpired:
+      raise RuntimeError ("subscriber did not finish; too many messages lost?")
+
+    takeover = self.watcher.failover_times[-1] if self.watcher.failover_times else float ("nan")
+    max_gap, lost = self.analyse (sub_csv)
+
+    self.logger.info ("takeover (zk) = {:.3f} s, max subscriber gap = {:.3f} s, estimated lost = {}".format (takeover, max_gap, lost))
+
+    path = "./csv/broker_failover.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("zk_timeout,frequency,num_topics,takeover_s,max_gap_s,estimated_lost\n")
+      f.write ("{},{},{},{:.4f},{:.4f},{}\n".format (self.args.zk_timeout, self.args.frequency, self.args.num_topics,
+                                                    takeover, max_gap, lost))
+
+  def cleanup (self):
+    for proc in self.procs.values ():
+      proc.kill ()
+    if self.watcher is not None:
+      self.watcher.close ()
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Broker failover experiment")
+
+  parser.add_argument ("-z", "--zookeeper", default="localhost:2181", help="IP Addr:Port of a running zookeeper, default localhost:2181")
+  parser.add_argument ("-a", "--addr", default="localhost", help="IP addr everybody advertises, default localhost")
+  parser.add_argument ("--discovery_port", type=int, default=5556, help="Discovery port, default 5556")
+  parser.add_argument ("--broker_port", type=int, default=5564, help="Port of the first broker, the second uses the next one, default 5564")
+  parser.add_argument ("--pub_port", type=int, default=5577, help="Publisher port, default 5577")
+  parser.add_argument ("--sub_port", type=int, default=5566, help="Subscriber port, default 5566")
+  parser.add_argument ("-T", "--num_topics", type=int, choices=range(1,10), default=9, help="Topics published (and subscribed), default 9")
+  parser.add_argument ("-f", "--frequency", type=int, default=20, help="Publications per second per topic, default 20")
+  parser.add_argument ("-t", "--zk_timeout", type=float, default=2.0, help="Zookeeper session timeout of the brokers, default 2 s")
+  parser.add_argument ("--warmup", type=float, default=5.0, help="Seconds of traffic before the leading broker is killed, default 5")
+  parser.add_argument ("--duration", type=float, default=30.0, help="Seconds the publisher runs for, default 30")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("BrokerFailover")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  experiment = BrokerFailoverExperiment (logger)
+  experiment.configure (args)
+  try:
+    experiment.driver ()
+  finally:
+    experiment.cleanup ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,212 @@
+###############################################
+#
+# Purpose: Forwarding throughput of the broker with 1, 2, 4, 8 worker
+# processes (BrokerAppln --workers)
+#
+# P publisher processes send T topics as fast as they can for --duration
+# seconds into a BrokerMW configured as BrokerAppln would (no discovery
+# needed). With --workers 0 the broker forwards in a thread of this process,
+# as the ACTIVE state does; otherwise the BrokerMW runs its XSUB/XPUB proxy
+# and the worker processes forward. A subscriber on all topics counts what
+# comes out after a warm up; that rate is the broker's throughput (ZMQ drops
+# what the broker cannot keep up with at the publishers' high water mark).
+#
+# Workers can only add throughput with cores to run on: on a single core
+# machine expect the numbers to stay flat or drop.
+#
+# Results are appended to ./csv/broker_scaling_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import threading
+import multiprocessing
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW import topic_pb2
+from CS6381_MW import discovery_pb2
+
+#################
+# a publisher process: blast every topic until the deadline
+#################
+def publisher (name, port, topics, size, deadline):
+  context = zmq.Context ()
+  pub = context.socket (zmq.PUB)
+  pub.bind ("tcp://*:{}".format (port))
+
+  content = "x" * size
+  frames = [bytes ("topic{}".format (t), "utf-8") for t in range (topics)]
+  while time.time () < deadline:
+    for topic in frames:
+      publication = topic_pb2.Publication ()
+      publication.topic = topic.decode ("utf-8")
+      publication.content = content
+      publication.pub_id = name
+      publication.tstamp = time.time ()
+      pub.send_multipart ([topic, publication.SerializeToString ()])
+
+  pub.close (linger=0)
+  context.term ()
+
+class BrokerScalingBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("BrokerScalingBenchmark::configure")
+    self.args = args
+
+  #################
+  # the single process broker: what BrokerAppln does in its ACTIVE state
+  #################
+  def broker (self, mw_obj):
+    while True:
+      publication = mw_obj.consume ()
+      mw_obj.disseminate (publication.pub_id, publication.topic, publication.content, publication.tstamp, publication.strength)
+
+  #################
+  # one run
+  #################
+  def run (self, workers, port):
+    args = self.args
+    topics = ["topic{}".format (t) for t in range (args.topics)]
+
+    # a broker middleware configured as BrokerAppln would
+    broker_args = argparse.Namespace (addr="localhost", port=port, discovery="localhost:{}".format (port + 3),
+                                      zookeeper=None, no_election=False, zk_timeout=3.0, watch_window=0.05, history=args.history, history_port=port + 1,
+                                      no_last_value=False, log_dir=None, log_port=None, segment_bytes=16 * 1024 * 1024,
+                                      sync_every=0, ownership_threshold=5, workers=workers, egress="pub", loglevel=logging.WARNING)
+    mw_obj = BrokerMW (self.logger)
+    mw_obj.configure (broker_args)
+
+    # the publishers, as discovery would hand them out
+    publishers = []
+    for k in range (args.publishers):
+      info = discovery_pb2.RegistrantInfo ()
+      info.id = "pub{}".format (k)
+      info.addr = "localhost"
+      info.port = port + 4 + k
+      publishers.append (info)
+
+    if workers > 0:
+      mw_obj.start_workers (publishers, topics)
+    else:
+      for info in publishers:
+        mw_obj.connect_to_publisher (info.addr, info.port, topics)
+      threading.Thread (target=self.broker, args=(mw_obj,), daemon=True).start ()
+
+    context = zmq.Context ()
+    sub = context.socket (zmq.SUB)
+    sub.connect ("tcp://localhost:{}".format (port))
+    for topic in topics:
+      sub.setsockopt (zmq.SUBSCRIBE, bytes (topic, "utf-8"))
+
+    # give spawned workers time to import and connect before the clock starts
+    time.sleep (args.startup)
+    start = time.time ()
+    deadline = start + args.warmup + args.duration
+    spawn = multiprocessing.get_context ("spawn")
+    processes = [spawn.Process (target=publisher, args=(info.id, info.port, args.topics, args.size, deadline))
+                 for info in publishers]
+    for process in processes:
+      process.start ()
+
+    # count what the broker gets out after the warm up
+    count = 0
+    while True:
+      now = time.time ()
+      if now >= deadline:
+        break
+      if sub.poll (timeout=100):
+        sub.recv_multipart ()
+        if now >= start + args.warmup:
+          count += 1
+
+    for process in processes:
+      process.join ()
+    if mw_obj.front is not None:
+      mw_obj.front.stop ()
+    sub.close (linger=0)
+    context.term ()
+
+    rate = count / args.duration
+    self.logger.info ("workers={} P={} T={}: {} samples forwarded in {:.1f} s, {:.0f} samples/s".format (
+      workers, args.publishers, args.topics, count, args.duration, rate))
+    self.results.append ((workers, count, rate))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("BrokerScalingBenchmark::driver")
+    self.logger.info ("{} cores available".format (os.cpu_count ()))
+
+    for i, workers in enumerate (self.args.workers):
+      self.run (workers, self.args.port + 50 * i)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/broker_scaling_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("workers,cores,publishers,topics,size,history,duration_s,forwarded,samples_per_s\n")
+      for workers, count, rate in self.results:
+        f.write ("{},{},{},{},{},{},{},{},{:.0f}\n".format (workers, os.cpu_count (), self.args.publishers, self.args.topics,
+                                                           self.args.size, self.args.history, self.args.duration, count, rate))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Sharded broker throughput benchmark")
+
+  parser.add_argument ("-w", "--workers", type=int, nargs="+", default=[0, 1, 2, 4, 8], help="Worker counts to compare, 0 is the single process broker, default 0 1 2 4 8")
+  parser.add_argument ("-P", "--publishers", type=int, default=4, help="Publisher processes, default 4")
+  parser.add_argument ("-T", "--topics", type=int, default=32, help="Topics, spread over the workers by hash, default 32")
+  parser.add_argument ("--size", type=int, default=64, help="Content bytes per sample, default 64")
+  parser.add_argument ("--history", type=int, default=10, help="Samples per topic of broker history, default 10")
+  parser.add_argument ("--duration", type=float, default=5.0, help="Seconds measured, default 5")
+  parser.add_argument ("--warmup", type=float, default=1.0, help="Seconds of publishing before measuring, default 1")
+  parser.add_argument ("--startup", type=float, default=3.0, help="Seconds the workers get to start, default 3")
+  parser.add_argument ("-p", "--port", type=int, default=6800, help="First of the ports used (50 per run), default 6800")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("BrokerScalingBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = BrokerScalingBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
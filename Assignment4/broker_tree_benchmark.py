@@ -0,0 +1,215 @@
+###############################################
+#
+# Purpose: One broker against a tree of brokers as the subscribers grow
+# (DiscoveryAppln --tree_fanout)
+#
+# One publisher sends T topics at --rate rounds/s into real BrokerMWs laid
+# out as discovery would: either a single broker, or --brokers brokers where
+# broker i subscribes to broker tree_parent (i, fanout) and only the root to
+# the publisher. Subscribers are spread over the brokers by the
+# BrokerBalancer discovery uses. For S subscribers we measure
+#
+#   egress:   bytes/s every broker sends (forwarded bytes x (children +
+#             subscribers)); the busiest broker is what limits a flat setup
+#   latency:  publisher -> subscriber, mean and p99, over all subscribers
+#
+# Everything runs in this process over tcp on localhost, so the latency
+# includes the extra hops but not a real network; the mininet scripts
+# mininet_broker_1S_11H_1P_8S_1B.sh and mininet_broker_tree_1S_17H_1P_8S_7B.sh
+# run the same comparison on hosts.
+#
+# Results are appended to ./csv/broker_tree_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import threading
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.Common import BrokerBalancer, tree_parent
+from CS6381_MW import topic_pb2
+
+class BrokerTreeBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("BrokerTreeBenchmark::configure")
+    self.args = args
+
+  #################
+  # the publisher
+  #################
+  def publisher (self, context, port, stop):
+    pub = context.socket (zmq.PUB)
+    pub.bind ("tcp://*:{}".format (port))
+    content = "x" * self.args.size
+    while not stop.is_set ():
+      for t in range (self.args.topics):
+        publication = topic_pb2.Publication ()
+        publication.topic = "topic{}".format (t)
+        publication.content = content
+        publication.pub_id = "pub1"
+        publication.tstamp = time.time ()
+        pub.send_multipart ([bytes (publication.topic, "utf-8"), publication.SerializeToString ()])
+      stop.wait (1 / self.args.rate)
+    pub.close (linger=0)
+
+  #################
+  # a broker: what BrokerAppln does in its ACTIVE state, counting bytes
+  #################
+  def broker (self, mw_obj, forwarded, index):
+    while True:
+      publication = mw_obj.consume ()
+      mw_obj.disseminate (publication.pub_id, publication.topic, publication.content, publication.tstamp, publication.strength)
+      forwarded[index] += len (publication.topic) + publication.ByteSize ()
+
+  #################
+  # a subscriber
+  #################
+  def subscriber (self, context, port, latencies, stop):
+    sub = context.socket (zmq.SUB)
+    sub.connect ("tcp://localhost:{}".format (port))
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    while not stop.is_set ():
+      if sub.poll (timeout=50):
+        topic, buf = sub.recv_multipart ()
+        publication = topic_pb2.Publication ()
+        publication.ParseFromString (buf)
+        latencies.append (time.time () - publication.tstamp)
+    sub.close (linger=0)
+
+  #################
+  # one layout and subscriber count
+  #################
+  def run (self, fanout, subscribers, port):
+    args = self.args
+    brokers = args.brokers if fanout > 0 else 1
+    context = zmq.Context ()
+    stop = threading.Event ()
+    topics = ["topic{}".format (t) for t in range (args.topics)]
+    threading.Thread (target=self.publisher, args=(context, port, stop), daemon=True).start ()
+
+    # the brokers, in registration order; each takes its data from its parent
+    forwarded = [0] * brokers
+    children = [0] * brokers
+    broker_ports = []
+    for b in range (brokers):
+      broker_port = port + 10 * (b + 1)
+      broker_args = argparse.Namespace (addr="localhost", port=broker_port, discovery="localhost:{}".format (broker_port + 3),
+                                        zookeeper=None, no_election=True, zk_timeout=3.0, watch_window=0.05, history=0,
+                                        history_port=None, no_last_value=True, log_dir=None, log_port=None, workers=0, egress="pub")
+      mw_obj = BrokerMW (self.logger)
+      mw_obj.configure (broker_args)
+      parent = tree_parent (b, fanout) if fanout > 0 else None
+      if parent is None:
+        mw_obj.connect_to_publisher ("localhost", port, topics)
+      else:
+        mw_obj.connect_to_publisher ("localhost", broker_ports[parent], topics)
+        children[parent] += 1
+      broker_ports.append (broker_port)
+      threading.Thread (target=self.broker, args=(mw_obj, forwarded, b), daemon=True).start ()
+
+    # the subscribers, spread over all brokers as discovery does in a tree
+    balancer = BrokerBalancer (1)
+    for b in range (brokers):
+      balancer.add_broker (b)
+    latencies = []
+    for s in range (subscribers):
+      b = balancer.assign ("sub{}".format (s))
+      threading.Thread (target=self.subscriber, args=(context, broker_ports[b], latencies, stop), daemon=True).start ()
+
+    time.sleep (1.0)
+    start = list (forwarded)
+    del latencies[:]
+    time.sleep (args.duration)
+    load = balancer.load ()
+    egress = [(forwarded[b] - start[b]) / args.duration * (children[b] + load[b]) for b in range (brokers)]
+    samples = sorted (latencies)
+    stop.set ()
+    time.sleep (0.2)
+
+    mean = sum (samples) / len (samples) if samples else 0.0
+    p99 = samples[min (len (samples) - 1, int (len (samples) * 0.99))] if samples else 0.0
+    layout = "tree/{}".format (fanout) if fanout > 0 else "single"
+    self.logger.info ("{:8s} {:2d} brokers, {:3d} subscribers: egress kB/s per broker {}; latency mean {:.2f} ms p99 {:.2f} ms".format (
+      layout, brokers, subscribers, [round (rate / 1000) for rate in egress], mean * 1000, p99 * 1000))
+    self.results.append ((layout, brokers, subscribers, max (egress), sum (egress), mean, p99))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("BrokerTreeBenchmark::driver")
+
+    run = 0
+    for subscribers in self.args.subscribers:
+      for fanout in self.args.fanouts:
+        self.run (fanout, subscribers, self.args.port + 200 * run)
+        run += 1
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/broker_tree_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("layout,brokers,subscribers,topics,rate,size,max_egress_bytes_per_s,total_egress_bytes_per_s,latency_mean_ms,latency_p99_ms\n")
+      for layout, brokers, subscribers, max_egress, total_egress, mean, p99 in self.results:
+        f.write ("{},{},{},{},{},{},{:.0f},{:.0f},{:.3f},{:.3f}\n".format (layout, brokers, subscribers, self.args.topics, self.args.rate,
+                                                                         self.args.size, max_egress, total_egress, mean * 1000, p99 * 1000))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Broker tree benchmark")
+
+  parser.add_argument ("-f", "--fanouts", type=int, nargs="+", default=[0, 2], help="Tree fan-outs to compare, 0 is a single broker, default 0 2")
+  parser.add_argument ("-B", "--brokers", type=int, default=7, help="Brokers in a tree, default 7")
+  parser.add_argument ("-S", "--subscribers", type=int, nargs="+", default=[4, 16, 32], help="Subscriber counts, default 4 16 32")
+  parser.add_argument ("-T", "--topics", type=int, default=4, help="Topics, default 4")
+  parser.add_argument ("-r", "--rate", type=float, default=50.0, help="Publishing rounds over all topics per second, default 50")
+  parser.add_argument ("--size", type=int, default=1024, help="Content bytes per sample, default 1024")
+  parser.add_argument ("--duration", type=float, default=3.0, help="Seconds measured per run, default 3")
+  parser.add_argument ("-p", "--port", type=int, default=7600, help="First of the ports used (200 per run), default 7600")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("BrokerTreeBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = BrokerTreeBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,188 @@
+###############################################
+#
+# Purpose: Staleness and memory of a slow subscriber with conflation on
+# and off (SubscriberAppln --conflate)
+#
+# A publisher sends T topics at --rate samples/s per topic; a real
+# SubscriberMW in its own process consumes one sample every --work seconds,
+# i.e. slower than the samples come in. For each setting we measure
+#
+#   staleness:  how old a sample is when the application gets it, mean
+#               and p99, over the second half of the run
+#   consumed:   samples the application got, and how many conflation
+#               skipped
+#   memory:     growth of the subscriber process's peak RSS over the run
+#               (the backlog ZMQ keeps for us, up to its high water mark)
+#
+# Results are appended to ./csv/conflation_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import resource
+import threading
+import multiprocessing
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW import topic_pb2
+
+#################
+# the subscriber process: consume slowly for "duration" seconds
+#################
+def subscriber (port, topics, conflate, work, duration, results):
+  from CS6381_MW.SubscriberMW import SubscriberMW
+
+  logger = logging.getLogger ("ConflationSubscriber")
+  logger.setLevel (logging.WARNING)
+  args = argparse.Namespace (addr="localhost", port=port + 1, discovery="localhost:{}".format (port + 2),
+                             zookeeper=None, conflate=conflate, credit=100, decoders=0)
+  mw_obj = SubscriberMW (logger)
+  mw_obj.configure (args)
+  mw_obj.connect_to_publisher ("localhost", port, topics)
+
+  rss_start = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+  start = time.time ()
+  ages = []
+  consumed = 0
+  while time.time () < start + duration:
+    publication = mw_obj.consume ()
+    now = time.time ()
+    consumed += 1
+    if now > start + duration / 2:
+      ages.append (now - publication.tstamp)
+    time.sleep (work)
+
+  rss_growth = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss - rss_start
+  results.put ((consumed, mw_obj.conflated, ages, rss_growth))
+
+class ConflationBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+    self.sent = 0 # samples the last run published
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("ConflationBenchmark::configure")
+    self.args = args
+
+  #################
+  # the publisher
+  #################
+  def publisher (self, context, port, stop):
+    pub = context.socket (zmq.PUB)
+    pub.bind ("tcp://*:{}".format (port))
+    content = "x" * self.args.size
+    sent = 0
+    while not stop.is_set ():
+      for t in range (self.args.topics):
+        publication = topic_pb2.Publication ()
+        publication.topic = "topic{}".format (t)
+        publication.content = content
+        publication.pub_id = "pub1"
+        publication.tstamp = time.time ()
+        pub.send_multipart ([bytes (publication.topic, "utf-8"), publication.SerializeToString ()])
+        sent += 1
+      stop.wait (1 / self.args.rate)
+    self.sent = sent
+    pub.close (linger=0)
+
+  #################
+  # one setting
+  #################
+  def run (self, conflate, port):
+    args = self.args
+    topics = ["topic{}".format (t) for t in range (args.topics)]
+    context = zmq.Context ()
+    stop = threading.Event ()
+    publisher = threading.Thread (target=self.publisher, args=(context, port, stop), daemon=True)
+    publisher.start ()
+
+    spawn = multiprocessing.get_context ("spawn")
+    results = spawn.Queue ()
+    process = spawn.Process (target=subscriber, args=(port, topics, [] if conflate else None, args.work, args.duration, results))
+    process.start ()
+    consumed, conflated, ages, rss_growth = results.get ()
+    process.join ()
+    stop.set ()
+    publisher.join ()
+    context.term ()
+
+    ages.sort ()
+    mean = sum (ages) / len (ages) if ages else 0.0
+    p99 = ages[min (len (ages) - 1, int (len (ages) * 0.99))] if ages else 0.0
+    label = "on" if conflate else "off"
+    self.logger.info ("conflation {:3s}: published {}, consumed {}, conflated {}; staleness mean {:.1f} ms p99 {:.1f} ms; subscriber RSS +{} kB".format (
+      label, self.sent, consumed, conflated, mean * 1000, p99 * 1000, rss_growth))
+    self.results.append ((label, self.sent, consumed, conflated, mean, p99, rss_growth))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("ConflationBenchmark::driver")
+
+    self.run (False, self.args.port)
+    self.run (True, self.args.port + 10)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/conflation_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("conflation,topics,rate,size,work_ms,duration_s,published,consumed,conflated,staleness_mean_ms,staleness_p99_ms,rss_growth_kb\n")
+      for label, sent, consumed, conflated, mean, p99, rss_growth in self.results:
+        f.write ("{},{},{},{},{:.1f},{},{},{},{},{:.3f},{:.3f},{}\n".format (label, self.args.topics, self.args.rate, self.args.size,
+                                                                           self.args.work * 1000, self.args.duration, sent, consumed,
+                                                                           conflated, mean * 1000, p99 * 1000, rss_growth))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Slow subscriber conflation benchmark")
+
+  parser.add_argument ("-T", "--topics", type=int, default=4, help="Topics, default 4")
+  parser.add_argument ("-r", "--rate", type=float, default=200.0, help="Samples per second per topic, default 200")
+  parser.add_argument ("--size", type=int, default=8192, help="Content bytes per sample, default 8192")
+  parser.add_argument ("--work", type=float, default=0.005, help="Seconds the subscriber spends on every sample, default 0.005")
+  parser.add_argument ("--duration", type=float, default=10.0, help="Seconds the subscriber runs, default 10")
+  parser.add_argument ("-p", "--port", type=int, default=7900, help="First of the ports used, default 7900")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("ConflationBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = ConflationBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
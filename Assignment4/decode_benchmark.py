@@ -0,0 +1,210 @@
+###############################################
+#
+# Purpose: Samples/s a Direct subscriber takes in against the number of
+# decoder processes (SubscriberAppln --decoders)
+#
+# P publisher processes each send every one of T topics as fast as they can
+# (or at --rate samples/s each). A real SubscriberMW is connected to all of
+# them and its samples are decoded and kept as SubscriberAppln keeps them
+# (SampleHandler: parse, sequence tracking, ownership, results writer,
+# latency histograms), either in this process (0 decoders) or by a
+# DecodePool of N decoder processes. For each N we measure
+#
+#   samples/s:  samples consumed per second, over --duration seconds after
+#               a second of warm-up
+#   missing:    samples the sequence numbers say never arrived (dropped at
+#               a high water mark because we could not keep up)
+#
+# The decoders split the topics between them, so use at least as many
+# topics as decoders; the gain needs as many free cores.
+#
+# Results are appended to ./csv/decode_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+import multiprocessing
+
+import zmq
+
+from CS6381_MW import topic_pb2
+
+#################
+# a publisher process
+#################
+def publish (port, name, topics, size, rate, stop):
+  context = zmq.Context ()
+  pub = context.socket (zmq.PUB)
+  pub.bind ("tcp://*:{}".format (port))
+  content = "x" * size
+  seqs = {}
+  while not stop.is_set ():
+    for topic in topics:
+      publication = topic_pb2.Publication ()
+      publication.topic = topic
+      publication.content = content
+      publication.pub_id = name
+      publication.tstamp = time.time ()
+      publication.seq = seqs[topic] = seqs.get (topic, 0) + 1
+      pub.send_multipart ([bytes (topic, "utf-8"), publication.SerializeToString ()])
+    if rate > 0:
+      stop.wait (1 / rate)
+  pub.close (linger=0)
+  context.term ()
+
+class DecodeBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("DecodeBenchmark::configure")
+    self.args = args
+
+  #################
+  # what the subscriber and its decoders are configured with
+  #################
+  def sub_args (self, decoders, port):
+    return argparse.Namespace (addr="localhost", port=port, discovery="localhost:{}".format (port + 1),
+                               zookeeper=None, conflate=None, credit=100, decoders=decoders,
+                               results=self.args.results, flush_interval=1.0, stats_interval=0, ownership_threshold=5,
+                               frequency=0, filter=[], loglevel=logging.WARNING)
+
+  def outputs (self, names):
+    extension = "csv" if self.args.results == "csv" else "bin"
+    return [(name, "./csv/{}_output.{}".format (name, extension), "./csv/{}_latency.json".format (name)) for name in names]
+
+  #################
+  # one number of decoders
+  #################
+  def run (self, decoders, port):
+    from CS6381_MW.SubscriberMW import SubscriberMW
+    from CS6381_MW.DecodePool import SampleHandler
+
+    args = self.args
+    topics = ["topic{}".format (t) for t in range (args.topics)]
+    spawn = multiprocessing.get_context ("spawn")
+    stop = spawn.Event ()
+    publishers = []
+    for p in range (args.publishers):
+      process = spawn.Process (target=publish, args=(port + p, "pub{}".format (p), topics, args.size, args.rate, stop), daemon=True)
+      process.start ()
+      publishers.append (process)
+
+    logger = logging.getLogger ("DecodeSubscriber")
+    logger.setLevel (logging.WARNING)
+    mw_obj = SubscriberMW (logger)
+    mw_obj.configure (self.sub_args (decoders, port + 90))
+    mw_obj.subscribe (topics)
+    for p in range (args.publishers):
+      mw_obj.connect_to_publisher ("localhost", port + p, topics)
+
+    if decoders == 0:
+      # what SubscriberAppln does, in this process
+      (name, results_path, snapshot_path), = self.outputs (["decode_benchmark"])
+      handler = SampleHandler (logger, name, self.sub_args (0, port + 90), results_path, snapshot_path)
+      handler.start ()
+      outputs = [(name, results_path, snapshot_path)]
+      end = time.time () + 1.0
+      while time.time () < end:
+        handler.handle (mw_obj.receive (mw_obj.sub)[1])
+      start = handler.consumed
+      end = time.time () + args.duration
+      while time.time () < end:
+        handler.handle (mw_obj.receive (mw_obj.sub)[1])
+      consumed = handler.consumed - start
+      handler.close ()
+      received, missing, duplicates, reordered, late = handler.sequences.totals ()
+    else:
+      outputs = self.outputs (["decode_benchmark-{}".format (index) for index in range (decoders)])
+      mw_obj.start_decoders (outputs)
+      time.sleep (1.0)
+      start = mw_obj.decoders.update (timeout=0)
+      time.sleep (args.duration)
+      consumed = mw_obj.decoders.update (timeout=0) - start
+      received, missing, duplicates, reordered, late = mw_obj.stop_decoders ()
+
+    stop.set ()
+    for process in publishers:
+      process.join ()
+    for name, results_path, snapshot_path in outputs:
+      for path in (results_path, snapshot_path):
+        if os.path.exists (path):
+          os.remove (path)
+
+    rate = consumed / args.duration
+    loss = missing / (received + missing) if received + missing else 0.0
+    self.logger.info ("{} decoders: {:.0f} samples/s, {:.2f}% missing".format (decoders, rate, loss * 100))
+    self.results.append ((decoders, rate, loss))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("DecodeBenchmark::driver")
+
+    os.makedirs ("./csv", exist_ok=True)
+    for i, decoders in enumerate (self.args.decoders):
+      self.run (decoders, self.args.port + 100 * i)
+
+    path = "./csv/decode_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("decoders,publishers,topics,size,rate,cores,samples_per_s,missing_pct\n")
+      for decoders, rate, loss in self.results:
+        f.write ("{},{},{},{},{},{},{:.0f},{:.3f}\n".format (decoders, self.args.publishers, self.args.topics, self.args.size,
+                                                          self.args.rate, os.cpu_count (), rate, loss * 100))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Subscriber decoder pool benchmark")
+
+  parser.add_argument ("-N", "--decoders", type=int, nargs="+", default=[0, 1, 2, 4], help="Numbers of decoder processes to compare (0: decode in the subscriber), default 0 1 2 4")
+  parser.add_argument ("-P", "--publishers", type=int, default=4, help="Publisher processes, default 4")
+  parser.add_argument ("-T", "--topics", type=int, default=8, help="Topics, every publisher sending all of them, default 8")
+  parser.add_argument ("-r", "--rate", type=float, default=0, help="Rounds of all topics per second per publisher, 0 as fast as possible (default)")
+  parser.add_argument ("--size", type=int, default=64, help="Content bytes per sample, default 64")
+  parser.add_argument ("--results", choices=["csv", "binary"], default="csv", help="How the samples are kept (SubscriberAppln --results), default csv")
+  parser.add_argument ("--duration", type=float, default=5.0, help="Seconds measured per setting, default 5")
+  parser.add_argument ("-p", "--port", type=int, default=8700, help="First of the ports used (100 per setting), default 8700")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("DecodeBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = DecodeBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
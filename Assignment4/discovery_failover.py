@@ -0,0 +1,225 @@
+###############################################
+#
+# Purpose: Measure discovery failover
+#
+# Starts several DiscoveryAppln replicas against a running ZooKeeper,
+# registers a set of publishers through the leader, and then keeps a client
+# issuing lookup requests while the leader is killed. We report
+#
+#   - takeover time: leader znode lost -> new leader znode (ZooKeeper view)
+#   - client gap: last reply from the old leader -> first reply from the new one
+#   - requests lost: requests that timed out and had to be resent
+#   - whether the new leader answered from a warm registry (no re-registration)
+#
+# Results are appended to ./csv/discovery_failover.csv
+#
+###############################################
+
+import os
+import sys
+import time
+import signal
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+import subprocess
+
+import zmq
+
+from CS6381_MW import discovery_pb2
+from ZookeeperClient import LeaderWatcher
+
+class DiscoveryFailoverExperiment ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.replicas = {} # "addr:port" -> Popen
+    self.watcher = None
+    self.context = zmq.Context.instance ()
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("DiscoveryFailoverExperiment::configure")
+    self.args = args
+
+  #################
+  # start the replicas
+  #################
+  def start_replicas (self):
+    zk_addr, zk_port = self.args.zookeeper.split (":")
+    for i in range (self.args.replicas):
+      port = self.args.base_port + i
+      cmd = [sys.executable, "DiscoveryAppln.py", "-a", self.args.addr, "-p", str (port),
+             "-P", str (self.args.num_publishers), "-S", "1",
+             "-z", zk_addr, "--zookeeper_port", zk_port,
+             "--zk_timeout", str (self.args.zk_timeout), "-l", str (logging.WARNING)]
+      self.replicas["{}:{}".format (self.args.addr, port)] = subprocess.Popen (cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+      # stagger the replicas so the election order is predictable
+      time.sleep (0.5)
+
+  #################
+  # one request with a deadline; returns the reply or None if it was lost
+  #################
+  def request (self, sock, buf):
+    sock.send (buf)
+    if sock.poll (self.args.req_timeout * 1000):
+      disc_resp = discovery_pb2.DiscoveryResp ()
+      disc_resp.ParseFromString (sock.recv ())
+      return disc_resp
+    return None
+
+  def connect (self, leader, sock=None):
+    if sock is not None:
+      sock.close (linger=0)
+    sock = self.context.socket (zmq.REQ)
+    sock.connect ("tcp://" + leader)
+    return sock
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("DiscoveryFailoverExperiment::driver")
+
+    self.start_replicas ()
+    self.watcher = LeaderWatcher (self.logger, self.args.zookeeper, "/discovery/leader", self.context)
+    leader = self.watcher.wait (timeout=30)
+    if leader is None:
+      raise RuntimeError ("no discovery leader elected")
+    self.logger.info ("leader is {}".format (leader))
+    sock = self.connect (leader)
+
+    # register the publishers through the leader
+    for i in range (self.args.num_publishers):
+      disc_req = discovery_pb2.DiscoveryReq ()
+      disc_req.msg_type = discovery_pb2.TYPE_REGISTER
+      disc_req.register_req.role = discovery_pb2.ROLE_PUBLISHER
+      disc_req.register_req.info.id = "pub{}".format (i)
+      disc_req.register_req.info.addr = "10.0.0.{}".format (i + 2)
+      disc_req.register_req.info.port = 5577
+      disc_req.register_req.topiclist[:] = ["weather"]
+      if self.request (sock, disc_req.SerializeToString ()) is None:
+        raise RuntimeError ("registration of pub{} timed out".format (i))
+
+    lookup = discovery_pb2.DiscoveryReq ()
+    lookup.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS
+    lookup.lookup_all_req.SetInParent ()
+    buf = lookup.SerializeToString ()
+
+    sent = 0
+    lost = 0
+    killed_at = None
+    last_reply_before = None
+    first_reply_after = None
+    pubs_after = None
+    start = time.time ()
+
+    while first_reply_after is None or time.time () - first_reply_after < 1.0:
+      now = time.time ()
+      if killed_at is None and now - start > self.args.warmup:
+        # kill the current leader the hard way
+        victim = self.replicas.pop (leader)
+        victim.send_signal (signal.SIGKILL)
+        killed_at = time.time ()
+        self.logger.info ("killed leader {}".format (leader))
+
+      sent += 1
+      reply = self.request (sock, buf)
+      if reply is None:
+        lost += 1
+        # lazy pirate: the REQ socket is stuck, rebuild it against the current leader
+        current = self.watcher.latest () or self.watcher.value or leader
+        sock = self.connect (current, sock)
+        leader = current
+      else:
+        if killed_at is None:
+          last_reply_before = time.time ()
+        elif first_reply_after is None:
+          first_reply_after = time.time ()
+          pubs_after = len (reply.lookup_all_resp.publisher_list)
+        # follow a redirect even if nothing was lost
+        current = self.watcher.latest () or leader
+        if current != leader:
+          sock = self.connect (current, sock)
+          leader = current
+
+      if killed_at is not None and time.time () - killed_at > self.args.max_wait:
+        raise RuntimeError ("no new leader within {} s".format (self.args.max_wait))
+
+      time.sleep (self.args.interval)
+
+    takeover = self.watcher.failover_times[-1] if self.watcher.failover_times else float ("nan")
+    gap = first_reply_after - last_reply_before
+    warm = (pubs_after == self.args.num_publishers)
+
+    self.logger.info ("takeover (zk) = {:.3f} s, client gap = {:.3f} s, requests sent = {}, lost = {}, publishers at new leader = {} ({})".format (
+      takeover, gap, sent, lost, pubs_after, "warm" if warm else "COLD"))
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/discovery_failover.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("replicas,zk_timeout,interval,takeover_s,client_gap_s,sent,lost,publishers_after,warm\n")
+      f.write ("{},{},{},{:.4f},{:.4f},{},{},{},{}\n".format (self.args.replicas, self.args.zk_timeout, self.args.interval,
+                                                            takeover, gap, sent, lost, pubs_after, warm))
+
+    sock.close (linger=0)
+
+  def cleanup (self):
+    for proc in self.replicas.values ():
+      proc.kill ()
+    if self.watcher is not None:
+      self.watcher.close ()
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Discovery failover experiment")
+
+  parser.add_argument ("-z", "--zookeeper", default="localhost:2181", help="IP Addr:Port of a running zookeeper, default localhost:2181")
+  parser.add_argument ("-a", "--addr", default="localhost", help="IP addr the replicas advertise, default localhost")
+  parser.add_argument ("-b", "--base_port", type=int, default=5556, help="Port of the first replica, default 5556")
+  parser.add_argument ("-r", "--replicas", type=int, default=3, help="Number of discovery replicas, default 3")
+  parser.add_argument ("-P", "--num_publishers", type=int, default=10, help="Publishers registered before the failover, default 10")
+  parser.add_argument ("-t", "--zk_timeout", type=float, default=2.0, help="Zookeeper session timeout of the replicas, default 2 s")
+  parser.add_argument ("-i", "--interval", type=float, default=0.01, help="Pause between client requests in seconds, default 0.01")
+  parser.add_argument ("--req_timeout", type=float, default=0.25, help="Client request deadline in seconds, default 0.25")
+  parser.add_argument ("--warmup", type=float, default=2.0, help="Seconds of traffic before the leader is killed, default 2")
+  parser.add_argument ("--max_wait", type=float, default=60.0, help="Give up if no new leader answers within this many seconds")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("DiscoveryFailover")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  experiment = DiscoveryFailoverExperiment (logger)
+  experiment.configure (args)
+  try:
+    experiment.driver ()
+  finally:
+    experiment.cleanup ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
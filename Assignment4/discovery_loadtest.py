@@ -0,0 +1,319 @@
+###############################################
+#
+# Purpose: Load test and fail over the discovery service on one box
+#
+# Runs several DiscoveryAppln replicas in this process (one thread each)
+# on the in-process coordination backend (--coordination inmemory), so no
+# ZooKeeper is needed. The replicas elect a leader and mirror the registry
+# exactly as they do against ZooKeeper. We then
+#
+#   register: -P publishers registered by -C concurrent clients
+#   lookup:   -C clients each issuing -n lookup_all requests
+#   failover: one client looking up while the leader's session is expired
+#             and its event loop stopped; reports takeover time, client gap,
+#             lost requests and whether the new leader's registry was warm
+#
+# Everything shares one interpreter, so absolute throughput is bounded by the
+# GIL; compare runs against each other (e.g. --latency 0 vs 0.002) rather
+# than against a real deployment.
+#
+# Results are appended to ./csv/discovery_loadtest.csv
+#
+###############################################
+
+import os
+import time
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+import threading
+
+import zmq
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW.Coordination import InMemoryCoordination
+from DiscoveryAppln import DiscoveryAppln
+from ZookeeperClient import LeaderWatcher
+
+class DiscoveryLoadTest ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.replicas = {} # "addr:port" -> (DiscoveryAppln, Thread)
+    self.watcher = None
+    self.context = zmq.Context.instance ()
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("DiscoveryLoadTest::configure")
+    self.args = args
+
+  #################
+  # start the replicas in this process
+  #################
+  def start_replicas (self):
+    replica_logger = logging.getLogger ("DiscoveryLoadTest.replica")
+    replica_logger.setLevel (logging.WARNING)
+
+    for i in range (self.args.replicas):
+      port = self.args.base_port + i
+      replica_args = argparse.Namespace (name="disc{}".format (i), addr="localhost", port=port,
+                                         num_publishers=self.args.num_publishers, num_subscribers=1, num_brokers=1,
+                                         loglevel=logging.WARNING, config="config.ini",
+                                         zookeeper_addr="loadtest", zookeeper_port=0, zk_timeout=self.args.zk_timeout,
+                                         threshold=0, tree_fanout=0, hybrid_min_saved=1, topic_ids=False,
+                                         coordination="inmemory", coord_latency=self.args.latency,
+                                         watch_window=self.args.watch_window)
+      appln = DiscoveryAppln (replica_logger)
+      appln.configure (replica_args)
+      thread = threading.Thread (target=appln.driver, daemon=True)
+      thread.start ()
+      self.replicas["localhost:{}".format (port)] = (appln, thread)
+
+  #################
+  # one request with a deadline; returns (reply or None, socket to use next)
+  #################
+  def request (self, sock, buf, endpoint):
+    sock.send (buf)
+    if sock.poll (self.args.req_timeout * 1000):
+      disc_resp = discovery_pb2.DiscoveryResp ()
+      disc_resp.ParseFromString (sock.recv ())
+      return disc_resp, sock
+    # lazy pirate: a REQ socket without a reply is stuck, rebuild it
+    sock.close (linger=0)
+    return None, self.connect (endpoint)
+
+  def connect (self, endpoint):
+    sock = self.context.socket (zmq.REQ)
+    sock.connect ("tcp://" + endpoint)
+    return sock
+
+  @staticmethod
+  def register_buf (i):
+    disc_req = discovery_pb2.DiscoveryReq ()
+    disc_req.msg_type = discovery_pb2.TYPE_REGISTER
+    disc_req.register_req.role = discovery_pb2.ROLE_PUBLISHER
+    disc_req.register_req.info.id = "pub{}".format (i)
+    disc_req.register_req.info.addr = "10.0.{}.{}".format (i // 250, i % 250 + 2)
+    disc_req.register_req.info.port = 5577
+    disc_req.register_req.topiclist[:] = ["weather", "humidity"]
+    return disc_req.SerializeToString ()
+
+  @staticmethod
+  def lookup_buf ():
+    disc_req = discovery_pb2.DiscoveryReq ()
+    disc_req.msg_type = discovery_pb2.TYPE_LOOKUP_ALL_PUBS
+    disc_req.lookup_all_req.SetInParent ()
+    return disc_req.SerializeToString ()
+
+  #################
+  # run "work" on every client thread and collect latencies
+  #################
+  def run_clients (self, phase, leader, bufs_per_client):
+    latencies = []
+    lost = [0]
+    lock = threading.Lock ()
+
+    def client (bufs):
+      sock = self.connect (leader)
+      mine = []
+      for buf in bufs:
+        start = time.perf_counter ()
+        reply, sock = self.request (sock, buf, leader)
+        if reply is None:
+          with lock:
+            lost[0] += 1
+          continue
+        mine.append (time.perf_counter () - start)
+      sock.close (linger=0)
+      with lock:
+        latencies.extend (mine)
+
+    threads = [threading.Thread (target=client, args=(bufs,)) for bufs in bufs_per_client]
+    start = time.perf_counter ()
+    for thread in threads:
+      thread.start ()
+    for thread in threads:
+      thread.join ()
+    elapsed = time.perf_counter () - start
+
+    self.record (phase, latencies, lost[0], elapsed)
+
+  def record (self, phase, latencies, lost, elapsed, gap=None, takeover=None):
+    latencies = sorted (latencies)
+
+    def pct (p):
+      return latencies[min (len (latencies) - 1, int (p * len (latencies)))] * 1000 if latencies else float ("nan")
+
+    throughput = len (latencies) / elapsed if elapsed else float ("nan")
+    self.logger.info ("{:8s}: {} replies, {} lost, {:.0f} req/s, p50 {:.2f} ms, p99 {:.2f} ms{}".format (
+      phase, len (latencies), lost, throughput, pct (0.5), pct (0.99),
+      "" if gap is None else ", client gap {:.1f} ms, takeover {:.1f} ms".format (gap * 1000, takeover * 1000)))
+    self.results.append ((phase, len (latencies), lost, throughput, pct (0.5), pct (0.99),
+                          "" if gap is None else "{:.3f}".format (gap * 1000),
+                          "" if takeover is None else "{:.3f}".format (takeover * 1000)))
+
+  #################
+  # fail the leader over while a client keeps looking up
+  #################
+  def failover (self, leader):
+    buf = self.lookup_buf ()
+    sock = self.connect (leader)
+    latencies = []
+    lost = 0
+    killed_at = None
+    last_before = None
+    first_after = None
+    pubs_after = None
+    start = time.perf_counter ()
+
+    while first_after is None:
+      if killed_at is None and time.perf_counter () - start > self.args.warmup:
+        # "crash" the leader: its session (and leader znode) goes away and
+        # it stops answering
+        appln, thread = self.replicas.pop (leader)
+        killed_wall = time.time ()
+        killed_at = time.perf_counter ()
+        appln.mw_obj.zk_client.zk.expire ()
+        self.stop_replica (leader, appln, thread)
+        appln.mw_obj.rep.close (linger=0)
+        self.logger.info ("expired leader {}".format (leader))
+
+      sent = time.perf_counter ()
+      reply, sock = self.request (sock, buf, leader)
+      if reply is None:
+        lost += 1
+      else:
+        latencies.append (time.perf_counter () - sent)
+        if killed_at is None:
+          last_before = time.perf_counter ()
+        else:
+          first_after = time.perf_counter ()
+          pubs_after = len (reply.lookup_all_resp.publisher_list)
+
+      current = self.watcher.latest () or leader
+      if current != leader:
+        sock.close (linger=0)
+        sock = self.connect (current)
+        leader = current
+
+      if killed_at is not None and time.perf_counter () - killed_at > self.args.max_wait:
+        raise RuntimeError ("no new leader within {} s".format (self.args.max_wait))
+
+    sock.close (linger=0)
+    # the first leader the watcher saw after the expiry
+    takeover = next ((t - killed_wall for t, value in self.watcher.changes if t >= killed_wall), float ("nan"))
+    self.record ("failover", latencies, lost, time.perf_counter () - start, first_after - last_before, takeover)
+    self.logger.info ("new leader {} answered with {} of {} publishers ({})".format (
+      leader, pubs_after, self.args.num_publishers, "warm" if pubs_after == self.args.num_publishers else "COLD"))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("DiscoveryLoadTest::driver")
+
+    self.start_replicas ()
+    self.watcher = LeaderWatcher (self.logger, None, "/discovery/leader", self.context,
+                                  client=InMemoryCoordination ("loadtest:0", latency=self.args.latency))
+    leader = self.watcher.wait (timeout=10)
+    if leader is None:
+      raise RuntimeError ("no discovery leader elected")
+    self.logger.info ("leader is {}".format (leader))
+
+    # registrations spread round robin over the clients
+    clients = self.args.clients
+    bufs = [self.register_buf (i) for i in range (self.args.num_publishers)]
+    self.run_clients ("register", leader, [bufs[c::clients] for c in range (clients)])
+
+    # what mirroring the burst cost the standbys
+    time.sleep (2 * self.args.watch_window)
+    for endpoint, (appln, thread) in self.replicas.items ():
+      if endpoint != leader:
+        self.logger.info ("standby {} registry watch: {}".format (endpoint, appln.mw_obj.zk_client.watch_stats ()))
+
+    lookup = self.lookup_buf ()
+    self.run_clients ("lookup", leader, [[lookup] * self.args.num_requests for c in range (clients)])
+
+    if self.args.replicas > 1:
+      self.failover (leader)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/discovery_loadtest.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("replicas,clients,publishers,latency_s,phase,replies,lost,throughput_rps,p50_ms,p99_ms,client_gap_ms,takeover_ms\n")
+      for row in self.results:
+        f.write ("{},{},{},{},{},{},{},{:.1f},{:.3f},{:.3f},{},{}\n".format (
+          self.args.replicas, clients, self.args.num_publishers, self.args.latency, *row))
+
+  #################
+  # the replica's event loop may be blocked in poll; one last request wakes
+  # it up so it notices it was disabled
+  #################
+  def stop_replica (self, endpoint, appln, thread):
+    appln.mw_obj.disable_event_loop ()
+    sock = self.connect (endpoint)
+    self.request (sock, self.lookup_buf (), endpoint)[1].close (linger=0)
+    thread.join (timeout=1)
+
+  def cleanup (self):
+    for endpoint, (appln, thread) in self.replicas.items ():
+      self.stop_replica (endpoint, appln, thread)
+    if self.watcher is not None:
+      self.watcher.close ()
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Discovery load test on the in-process coordination backend")
+
+  parser.add_argument ("-r", "--replicas", type=int, default=3, help="Number of discovery replicas, default 3")
+  parser.add_argument ("-b", "--base_port", type=int, default=5556, help="Port of the first replica, default 5556")
+  parser.add_argument ("-P", "--num_publishers", type=int, default=200, help="Publishers to register, default 200")
+  parser.add_argument ("-C", "--clients", type=int, default=8, help="Concurrent clients, default 8")
+  parser.add_argument ("-n", "--num_requests", type=int, default=500, help="Lookups per client, default 500")
+  parser.add_argument ("--latency", type=float, default=0.0, help="Seconds added to every coordination call, default 0")
+  parser.add_argument ("-w", "--watch_window", type=float, default=0.05, help="Registry watch coalescing window of the replicas in seconds, default 0.05")
+  parser.add_argument ("-t", "--zk_timeout", type=float, default=3.0, help="Session timeout handed to the replicas, default 3 s")
+  parser.add_argument ("--req_timeout", type=float, default=0.25, help="Client request deadline in seconds, default 0.25")
+  parser.add_argument ("--warmup", type=float, default=1.0, help="Seconds of lookups before the leader is expired, default 1")
+  parser.add_argument ("--max_wait", type=float, default=30.0, help="Give up if no new leader answers within this many seconds")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("DiscoveryLoadTest")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  loadtest = DiscoveryLoadTest (logger)
+  loadtest.configure (args)
+  try:
+    loadtest.driver ()
+  finally:
+    loadtest.cleanup ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,217 @@
+###############################################
+#
+# Purpose: What a subscriber interested in one hot topic pays for the rest,
+# consuming every sample against handlers per topic (SubscriberMW
+# register_handler / dispatch)
+#
+# A publisher process sends --samples samples over 9 topics at skewed rates
+# (topic i gets a share proportional to 1 / (i + 1)^--skew) as fast as it
+# can; nothing is dropped (no high water marks). The subscriber, a real
+# SubscriberMW, is only interested in --hot and handles its samples the
+# way SubscriberAppln does (duplicate check, latency, histogram, the debug
+# line of the full tuple). It takes them
+#
+#   generic:  with consume (), parsing every sample of every topic
+#   handler:  through dispatch (), with a handler for the hot topic only;
+#             the other topics are dropped before they are parsed
+#   batch:    the same with a batch handler, once per dispatch ()
+#
+# and we measure the subscriber's CPU time per sample and the hot topic
+# samples it gets through per second of CPU.
+#
+# Results are appended to ./csv/dispatch_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import random
+import logging # for logging. Use it in place of print statements.
+import argparse # argument parsing
+import multiprocessing
+
+import zmq
+
+from CS6381_MW import topic_pb2
+
+TOPICS = ["topic{}".format (t) for t in range (9)]
+
+#################
+# the publisher process: serialize everything first, then send it all
+#################
+def publish (port, samples, skew, ready, go):
+  weights = [1 / (t + 1) ** skew for t in range (len (TOPICS))]
+  chooser = random.Random (1)
+  frames = []
+  seqs = {}
+  for i in range (samples):
+    topic = chooser.choices (TOPICS, weights)[0]
+    publication = topic_pb2.Publication ()
+    publication.topic = topic
+    publication.content = "x" * 64
+    publication.pub_id = "pub1"
+    publication.tstamp = time.time ()
+    publication.seq = seqs[topic] = seqs.get (topic, 0) + 1
+    frames.append ([bytes (topic, "utf-8"), publication.SerializeToString ()])
+
+  context = zmq.Context ()
+  pub = context.socket (zmq.PUB)
+  pub.setsockopt (zmq.SNDHWM, 0)
+  pub.bind ("tcp://127.0.0.1:{}".format (port))
+  ready.set ()
+  go.wait ()
+  for frame in frames:
+    pub.send_multipart (frame)
+  time.sleep (1.0)
+  pub.close ()
+  context.term ()
+
+#################
+# the subscriber's handling of a hot topic sample, as SubscriberAppln's
+#################
+class HotTopic ():
+
+  def __init__ (self, logger):
+    from CS6381_MW.Histogram import LatencyStats
+    from CS6381_MW.Common import SequenceTracker
+    self.logger = logger
+    self.latency = LatencyStats ()
+    self.kept = SequenceTracker ()
+    self.handled = 0
+
+  def handle (self, publication):
+    if not self.kept.observe (publication.pub_id, publication.topic, publication.seq, publication.epoch):
+      return
+    received = time.time ()
+    latency = received - publication.tstamp
+    self.latency.record (publication.topic, publication.pub_id, latency)
+    self.logger.debug ("HotTopic::handle - Received Data: %s", (publication, latency, received, False))
+    self.handled += 1
+
+  def handle_batch (self, publications):
+    for publication in publications:
+      self.handle (publication)
+
+class DispatchBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("DispatchBenchmark::configure")
+    self.args = args
+
+  #################
+  # one way of taking the samples
+  #################
+  def run (self, way, port):
+    from CS6381_MW.SubscriberMW import SubscriberMW
+
+    args = self.args
+    hot = TOPICS[args.hot]
+    spawn = multiprocessing.get_context ("spawn")
+    ready, go = spawn.Event (), spawn.Event ()
+    publisher = spawn.Process (target=publish, args=(port, args.samples, args.skew, ready, go), daemon=True)
+    publisher.start ()
+
+    logger = logging.getLogger ("DispatchSubscriber")
+    logger.setLevel (logging.WARNING)
+    mw_obj = SubscriberMW (logger)
+    mw_obj.configure (argparse.Namespace (addr="127.0.0.1", port=port + 1, discovery="127.0.0.1:{}".format (port + 2),
+                                          zookeeper=None, conflate=None, credit=100, decoders=0))
+    mw_obj.sub.setsockopt (zmq.RCVHWM, 0)
+    hot_topic = HotTopic (logger)
+    if way == "handler":
+      mw_obj.register_handler (hot, hot_topic.handle)
+    elif way == "batch":
+      mw_obj.register_handler (hot, hot_topic.handle_batch, batch=True)
+    mw_obj.subscribe (TOPICS)
+    ready.wait ()
+    mw_obj.connect_to_publisher ("127.0.0.1", port, TOPICS)
+    time.sleep (0.5)
+    go.set ()
+
+    # CPU time only: waiting for the first sample costs none
+    taken = 0
+    start = time.process_time ()
+    while taken < args.samples:
+      if way == "generic":
+        publication = mw_obj.consume ()
+        if publication.topic == hot:
+          hot_topic.handle (publication)
+        taken += 1
+      else:
+        taken += mw_obj.dispatch (args.samples - taken)
+    cpu = time.process_time () - start
+    publisher.join ()
+
+    per_sample = cpu / taken
+    hot_rate = hot_topic.handled / cpu if cpu > 0 else 0.0
+    self.logger.info ("{:7s}: {} samples, {} of {}; {:.1f} us CPU per sample, {:.0f} {} samples per CPU second".format (
+      way, taken, hot_topic.handled, hot, per_sample * 1e6, hot_rate, hot))
+    self.results.append ((way, taken, hot_topic.handled, per_sample, hot_rate))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("DispatchBenchmark::driver")
+
+    for i, way in enumerate (self.args.ways):
+      self.run (way, self.args.port + 10 * i)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/dispatch_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("way,samples,skew,hot,hot_samples,us_cpu_per_sample,hot_samples_per_cpu_s\n")
+      for way, taken, handled, per_sample, hot_rate in self.results:
+        f.write ("{},{},{},{},{},{:.2f},{:.0f}\n".format (way, taken, self.args.skew, TOPICS[self.args.hot], handled, per_sample * 1e6, hot_rate))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Per topic handler dispatch benchmark")
+
+  parser.add_argument ("--ways", nargs="+", choices=["generic", "handler", "batch"], default=["generic", "handler", "batch"], help="Ways of taking samples to compare, default generic handler batch")
+  parser.add_argument ("-n", "--samples", type=int, default=50000, help="Samples sent over all topics, default 50000")
+  parser.add_argument ("--skew", type=float, default=1.0, help="Topic i gets a share of the samples proportional to 1 / (i + 1)^skew, default 1")
+  parser.add_argument ("--hot", type=int, choices=range (len (TOPICS)), default=2, help="The topic the subscriber is interested in (0 is the busiest), default 2")
+  parser.add_argument ("-p", "--port", type=int, default=9600, help="First of the ports used (10 per way), default 9600")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("DispatchBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = DispatchBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
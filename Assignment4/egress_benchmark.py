@@ -0,0 +1,213 @@
+###############################################
+#
+# Purpose: One slow subscriber among fast ones, with the broker publishing
+# on its XPUB socket or serving everybody a queue of their own on its
+# ROUTER egress (BrokerAppln --egress router --drop_policy ...)
+#
+# A publisher sends T topics at --rate samples/s per topic through a real
+# BrokerMW (in a thread, as BrokerAppln's ACTIVE state) to N fast
+# SubscriberMWs and one that spends --work seconds on every sample. For each
+# egress we measure
+#
+#   fast:   latency mean and p99 and samples received, over all fast
+#           subscribers
+#   slow:   how stale its samples are (mean), how many it got, and what
+#           the broker reports for it: deepest queue, drops, disconnects
+#
+# Results are appended to ./csv/egress_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import threading
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.SubscriberMW import SubscriberMW
+from CS6381_MW import topic_pb2
+
+class EgressBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("EgressBenchmark::configure")
+    self.args = args
+
+  #################
+  # the publisher
+  #################
+  def publisher (self, context, port, stop):
+    pub = context.socket (zmq.PUB)
+    pub.bind ("tcp://*:{}".format (port))
+    content = "x" * self.args.size
+    while not stop.is_set ():
+      for t in range (self.args.topics):
+        publication = topic_pb2.Publication ()
+        publication.topic = "topic{}".format (t)
+        publication.content = content
+        publication.pub_id = "pub1"
+        publication.tstamp = time.time ()
+        pub.send_multipart ([bytes (publication.topic, "utf-8"), publication.SerializeToString ()])
+      stop.wait (1 / self.args.rate)
+    pub.close (linger=0)
+
+  #################
+  # the broker: what BrokerAppln does in its ACTIVE state
+  #################
+  def broker (self, mw_obj):
+    while True:
+      publication = mw_obj.consume ()
+      mw_obj.disseminate (publication.pub_id, publication.topic, publication.content, publication.tstamp, publication.strength)
+
+  #################
+  # a subscriber, as SubscriberAppln connects to the broker
+  #################
+  def subscriber (self, name, broker_port, egress_port, topics, work, ages, stop):
+    sub_args = argparse.Namespace (addr="localhost", port=0, discovery="localhost:{}".format (broker_port + 9),
+                                   zookeeper=None, conflate=None, credit=self.args.credit, decoders=0)
+    mw_obj = SubscriberMW (self.logger)
+    mw_obj.configure (sub_args)
+    mw_obj.name = name
+    if egress_port:
+      mw_obj.connect_to_egress ("localhost", egress_port, topics)
+    else:
+      mw_obj.connect_to_publisher ("localhost", broker_port, topics)
+
+    while not stop.is_set ():
+      publication = mw_obj.consume ()
+      ages.append ((time.time (), time.time () - publication.tstamp))
+      if work:
+        time.sleep (work)
+
+  #################
+  # one egress setting
+  #################
+  def run (self, egress, policy, port):
+    args = self.args
+    topics = ["topic{}".format (t) for t in range (args.topics)]
+    context = zmq.Context ()
+    stop = threading.Event ()
+    threading.Thread (target=self.publisher, args=(context, port, stop), daemon=True).start ()
+
+    broker_port = port + 1
+    broker_args = argparse.Namespace (addr="localhost", port=broker_port, discovery="localhost:{}".format (broker_port + 9),
+                                      zookeeper=None, no_election=True, zk_timeout=3.0, watch_window=0.05, history=0,
+                                      history_port=None, no_last_value=True, log_dir=None, log_port=None, workers=0,
+                                      egress=egress, egress_port=broker_port + 3, queue_limit=args.queue_limit, drop_policy=policy)
+    mw_obj = BrokerMW (self.logger)
+    mw_obj.configure (broker_args)
+    mw_obj.connect_to_publisher ("localhost", port, topics)
+    threading.Thread (target=self.broker, args=(mw_obj,), daemon=True).start ()
+
+    fast = [[] for i in range (args.fast)]
+    slow = []
+    for i in range (args.fast):
+      threading.Thread (target=self.subscriber, args=("fast{}".format (i), broker_port, mw_obj.egress_port, topics, 0, fast[i], stop),
+                        daemon=True).start ()
+    threading.Thread (target=self.subscriber, args=("slow", broker_port, mw_obj.egress_port, topics, args.work, slow, stop),
+                      daemon=True).start ()
+
+    time.sleep (args.warmup)
+    start = time.time ()
+    time.sleep (args.duration)
+    end = time.time ()
+    stats = mw_obj.egress.stats ().get ("slow") if mw_obj.egress is not None else None
+    dropped = mw_obj.egress.dropped if mw_obj.egress is not None else 0
+    disconnects = mw_obj.egress.disconnects if mw_obj.egress is not None else 0
+    stop.set ()
+
+    def window (ages):
+      return [age for at, age in list (ages) if start <= at < end]
+
+    fast_ages = sorted (age for ages in fast for age in window (ages))
+    slow_ages = window (slow)
+    fast_mean = sum (fast_ages) / len (fast_ages) if fast_ages else 0.0
+    fast_p99 = fast_ages[min (len (fast_ages) - 1, int (len (fast_ages) * 0.99))] if fast_ages else 0.0
+    slow_mean = sum (slow_ages) / len (slow_ages) if slow_ages else 0.0
+    deepest = stats[4] if stats is not None else 0
+    label = egress if egress == "pub" else "{}/{}".format (egress, policy)
+    self.logger.info ("{:17s}: fast {} samples/s each, latency mean {:.2f} ms p99 {:.2f} ms; slow {} samples/s, {:.0f} ms stale; broker queue for slow {}, {} dropped, {} disconnects".format (
+      label, round (len (fast_ages) / args.fast / args.duration), fast_mean * 1000, fast_p99 * 1000,
+      round (len (slow_ages) / args.duration), slow_mean * 1000, deepest, dropped, disconnects))
+    self.results.append ((label, len (fast_ages) / args.fast / args.duration, fast_mean, fast_p99,
+                          len (slow_ages) / args.duration, slow_mean, deepest, dropped, disconnects))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("EgressBenchmark::driver")
+
+    self.run ("pub", "oldest", self.args.port)
+    for i, policy in enumerate (self.args.policies):
+      self.run ("router", policy, self.args.port + 20 * (i + 1))
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/egress_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("egress,fast,topics,rate,work_ms,queue_limit,credit,fast_per_s,fast_latency_mean_ms,fast_latency_p99_ms,slow_per_s,slow_staleness_mean_ms,slow_deepest_queue,dropped,disconnects\n")
+      for label, fast_rate, fast_mean, fast_p99, slow_rate, slow_mean, deepest, dropped, disconnects in self.results:
+        f.write ("{},{},{},{},{:.1f},{},{},{:.0f},{:.3f},{:.3f},{:.0f},{:.1f},{},{},{}\n".format (
+          label, self.args.fast, self.args.topics, self.args.rate, self.args.work * 1000, self.args.queue_limit, self.args.credit,
+          fast_rate, fast_mean * 1000, fast_p99 * 1000, slow_rate, slow_mean * 1000, deepest, dropped, disconnects))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Slow consumer isolation benchmark")
+
+  parser.add_argument ("-F", "--fast", type=int, default=4, help="Fast subscribers, default 4")
+  parser.add_argument ("-T", "--topics", type=int, default=4, help="Topics, default 4")
+  parser.add_argument ("-r", "--rate", type=float, default=100.0, help="Samples per second per topic, default 100")
+  parser.add_argument ("--size", type=int, default=1024, help="Content bytes per sample, default 1024")
+  parser.add_argument ("--work", type=float, default=0.01, help="Seconds the slow subscriber spends on every sample, default 0.01")
+  parser.add_argument ("--queue_limit", type=int, default=100, help="Samples the broker queues per subscriber, default 100")
+  parser.add_argument ("--credit", type=int, default=20, help="Samples a subscriber lets the broker send ahead, default 20")
+  parser.add_argument ("--policies", nargs="+", default=["oldest", "newest", "disconnect"], help="Drop policies to compare, default oldest newest disconnect")
+  parser.add_argument ("--warmup", type=float, default=3.0, help="Seconds before measuring, default 3")
+  parser.add_argument ("--duration", type=float, default=5.0, help="Seconds measured, default 5")
+  parser.add_argument ("-p", "--port", type=int, default=8100, help="First of the ports used (20 per run), default 8100")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("EgressBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = EgressBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
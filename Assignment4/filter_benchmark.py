@@ -0,0 +1,199 @@
+###############################################
+#
+# Purpose: What content filters save when the publisher applies them before
+# sending (SubscriberAppln --filter), against the subscriber filtering alone
+#
+# A publisher process, a real PublisherMW, sends --samples samples of one
+# topic with the contents TopicSelector generates for it. A real
+# SubscriberMW takes them in and keeps those passing its filter the way
+# SubscriberAppln does (parse, filter, latency). Either
+#
+#   subscriber:  the publisher sends everything and the subscriber filters
+#   publisher:   the publisher filters too, on the filters discovery hands
+#                it in its isready response
+#
+# and for each filter (from selective to not at all) we measure
+#
+#   bytes:  what reached the subscriber (topic and frame), i.e. what the
+#           network carried
+#   CPU:    the subscriber's CPU time per sample it wanted
+#
+# Results are appended to ./csv/filter_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import random
+import logging # for logging. Use it in place of print statements.
+import argparse # argument parsing
+import multiprocessing
+
+import zmq
+
+from CS6381_MW import discovery_pb2
+from CS6381_MW.Common import parse_filter, payload_value
+
+#################
+# the publisher process
+#################
+def publish (port, topic, samples, filters, ready, go):
+  from CS6381_MW.PublisherMW import PublisherMW
+  from topic_selector import TopicSelector
+
+  logger = logging.getLogger ("FilterPublisher")
+  logger.setLevel (logging.WARNING)
+  mw_obj = PublisherMW (logger)
+  mw_obj.configure (argparse.Namespace (addr="127.0.0.1", port=port, discovery="127.0.0.1:{}".format (port + 1),
+                                        zookeeper=None, strength=0, history=0, history_port=0))
+  mw_obj.pub.setsockopt (zmq.SNDHWM, 0)
+
+  # as discovery would hand them to us
+  isready_resp = discovery_pb2.IsReadyResp ()
+  isready_resp.status = True
+  for filter_topic, op, values in filters:
+    content_filter = isready_resp.filters.add ()
+    content_filter.topic = filter_topic
+    content_filter.op = op
+    content_filter.values[:] = values
+  mw_obj.set_filters (isready_resp.filters)
+
+  random.seed (1)
+  ts = TopicSelector ()
+  ready.set ()
+  go.wait ()
+  for i in range (samples):
+    mw_obj.disseminate ("pub1", topic, ts.gen_publication (topic))
+  mw_obj.pub.send_multipart ([b"end", b""])
+  time.sleep (1.0)
+
+class FilterBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("FilterBenchmark::configure")
+    self.args = args
+
+  #################
+  # one filter, filtered at one place
+  #################
+  def run (self, where, text, port):
+    from CS6381_MW.SubscriberMW import SubscriberMW
+    from CS6381_MW.Common import ContentFilters
+    from CS6381_MW.Histogram import LatencyStats
+
+    args = self.args
+    content_filter = parse_filter (text)
+    topic = content_filter[0]
+    spawn = multiprocessing.get_context ("spawn")
+    ready, go = spawn.Event (), spawn.Event ()
+    sender_filters = [content_filter] if where == "publisher" else []
+    publisher = spawn.Process (target=publish, args=(port, topic, args.samples, sender_filters, ready, go), daemon=True)
+    publisher.start ()
+
+    logger = logging.getLogger ("FilterSubscriber")
+    logger.setLevel (logging.WARNING)
+    mw_obj = SubscriberMW (logger)
+    mw_obj.configure (argparse.Namespace (addr="127.0.0.1", port=port + 2, discovery="127.0.0.1:{}".format (port + 1),
+                                          zookeeper=None, conflate=None, credit=100, decoders=0))
+    mw_obj.sub.setsockopt (zmq.RCVHWM, 0)
+    mw_obj.subscribe ([topic, "end"])
+    ready.wait ()
+    mw_obj.connect_to_publisher ("127.0.0.1", port, [topic, "end"])
+    time.sleep (0.5)
+    go.set ()
+
+    # what SubscriberAppln does with every sample; CPU time only
+    from CS6381_MW import topic_pb2
+    filters = ContentFilters ([content_filter])
+    latency = LatencyStats ()
+    received = received_bytes = wanted = 0
+    start = time.process_time ()
+    while True:
+      name, frame = mw_obj.next_frame ()
+      if name == b"end":
+        break
+      received += 1
+      received_bytes += len (name) + len (frame)
+      publication = topic_pb2.Publication ()
+      publication.ParseFromString (frame)
+      if not filters.passes (publication.topic, payload_value (publication)):
+        continue
+      latency.record (publication.topic, publication.pub_id, time.time () - publication.tstamp)
+      wanted += 1
+    cpu = time.process_time () - start
+    publisher.join ()
+
+    per_wanted = cpu / wanted if wanted else 0.0
+    self.logger.info ("{:10s} '{}': {} of {} samples wanted, {} received, {} bytes; {:.1f} us subscriber CPU per wanted sample".format (
+      where, text, wanted, args.samples, received, received_bytes, per_wanted * 1e6))
+    self.results.append ((where, text, wanted, received, received_bytes, cpu, per_wanted))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("FilterBenchmark::driver")
+
+    run = 0
+    for text in self.args.filters:
+      for where in self.args.where:
+        self.run (where, text, self.args.port + 10 * run)
+        run += 1
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/filter_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("filtered_at,filter,samples,wanted,received,received_bytes,subscriber_cpu_s,us_cpu_per_wanted\n")
+      for where, text, wanted, received, received_bytes, cpu, per_wanted in self.results:
+        f.write ("{},{},{},{},{},{},{:.3f},{:.2f}\n".format (where, text, self.args.samples, wanted, received, received_bytes, cpu, per_wanted * 1e6))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Content filter benchmark")
+
+  parser.add_argument ("--filters", nargs="+", default=["temperature > 90", "temperature > 50", "temperature > 0", "temperature > -101"], help="Filters to compare, as SubscriberAppln --filter takes them (temperatures are -100 to 100), default from 5%% to all of the samples")
+  parser.add_argument ("--where", nargs="+", choices=["subscriber", "publisher"], default=["subscriber", "publisher"], help="Where to filter, default subscriber publisher")
+  parser.add_argument ("-n", "--samples", type=int, default=20000, help="Samples the publisher generates per run, default 20000")
+  parser.add_argument ("-p", "--port", type=int, default=9800, help="First of the ports used (10 per run), default 9800")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("FilterBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = FilterBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
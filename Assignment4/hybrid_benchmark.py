@@ -0,0 +1,252 @@
+###############################################
+#
+# Purpose: Direct, Broker and per topic Hybrid dissemination side by side
+# ([Dissemination] Strategy in config.ini, DiscoveryAppln --hybrid_min_saved)
+#
+# The topics come in two kinds:
+#
+#   broadcast:  --broadcast topics with one publisher each, which every
+#               subscriber wants (one-to-many)
+#   shared:     --shared topics that all of --shared_publishers publish and
+#               every subscriber wants (many-to-many)
+#
+# Every topic is routed as discovery would with each strategy: directly
+# from its publishers, through a real BrokerMW, or per topic by via_broker ()
+# from its publisher and subscriber counts. The subscribers are real
+# SubscriberMWs connected the way SubscriberAppln follows the routes. For
+# each strategy we measure
+#
+#   connections:  publisher -> subscriber, publisher -> broker and
+#                 broker -> subscriber connections over the whole system
+#   latency:      publisher -> subscriber, mean and p99, per kind of topic
+#   broker:       samples/s the broker takes in
+#
+# Everything runs in this process over tcp on localhost.
+#
+# Results are appended to ./csv/hybrid_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import threading
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.SubscriberMW import SubscriberMW
+from CS6381_MW.Common import via_broker
+from CS6381_MW import topic_pb2
+
+class HybridBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("HybridBenchmark::configure")
+    self.args = args
+
+  #################
+  # the topics of every publisher
+  #################
+  def layout (self):
+    args = self.args
+    publishers = [["broadcast{}".format (b)] for b in range (args.broadcast)]
+    publishers += [["shared{}".format (m) for m in range (args.shared)] for p in range (args.shared_publishers)]
+    return publishers
+
+  #################
+  # topic -> via the broker, as discovery decides for a strategy
+  #################
+  def routes (self, strategy, publishers):
+    routes = {}
+    for topics in publishers:
+      for topic in topics:
+        count = sum (1 for other in publishers if topic in other)
+        if strategy == "direct":
+          routes[topic] = False
+        elif strategy == "broker":
+          routes[topic] = True
+        else:
+          routes[topic] = via_broker (count, self.args.subscribers, self.args.min_saved)
+    return routes
+
+  #################
+  # a publisher
+  #################
+  def publisher (self, context, port, name, topics, stop):
+    pub = context.socket (zmq.PUB)
+    pub.bind ("tcp://*:{}".format (port))
+    content = "x" * self.args.size
+    while not stop.is_set ():
+      for topic in topics:
+        publication = topic_pb2.Publication ()
+        publication.topic = topic
+        publication.content = content
+        publication.pub_id = name
+        publication.tstamp = time.time ()
+        pub.send_multipart ([bytes (topic, "utf-8"), publication.SerializeToString ()])
+      stop.wait (1 / self.args.rate)
+    pub.close (linger=0)
+
+  #################
+  # the broker: what BrokerAppln does in its ACTIVE state, counting
+  #################
+  def broker (self, mw_obj, forwarded):
+    while True:
+      publication = mw_obj.consume ()
+      mw_obj.disseminate (publication.pub_id, publication.topic, publication.content, publication.tstamp, publication.strength, publication.seq, publication.epoch)
+      forwarded[0] += 1
+
+  #################
+  # a subscriber, connected as SubscriberAppln follows the routes
+  #################
+  def subscriber (self, mw_obj, latencies, stop):
+    while not stop.is_set ():
+      publication = mw_obj.consume ()
+      kind = "broadcast" if publication.topic.startswith ("broadcast") else "shared"
+      latencies[kind].append (time.time () - publication.tstamp)
+
+  #################
+  # one strategy
+  #################
+  def run (self, strategy, port):
+    args = self.args
+    context = zmq.Context ()
+    stop = threading.Event ()
+    publishers = self.layout ()
+    routes = self.routes (strategy, publishers)
+    for p, topics in enumerate (publishers):
+      threading.Thread (target=self.publisher, args=(context, port + p, "pub{}".format (p), topics, stop), daemon=True).start ()
+
+    # the broker takes in only the topics routed through it
+    connections = 0
+    forwarded = [0]
+    broker_port = port + 90
+    forwarded_topics = [topic for topic, via in routes.items () if via]
+    if forwarded_topics:
+      broker_args = argparse.Namespace (addr="localhost", port=broker_port, discovery="localhost:{}".format (broker_port + 5),
+                                        zookeeper=None, no_election=True, zk_timeout=3.0, watch_window=0.05, history=0,
+                                        history_port=None, no_last_value=True, log_dir=None, log_port=None, workers=0, egress="pub")
+      mw_obj = BrokerMW (self.logger)
+      mw_obj.configure (broker_args)
+      for p, topics in enumerate (publishers):
+        topics = [topic for topic in topics if routes[topic]]
+        if topics:
+          mw_obj.connect_to_publisher ("localhost", port + p, topics)
+          connections += 1
+      threading.Thread (target=self.broker, args=(mw_obj, forwarded), daemon=True).start ()
+
+    # every subscriber wants every topic
+    latencies = {"broadcast": [], "shared": []}
+    for s in range (args.subscribers):
+      sub_args = argparse.Namespace (addr="localhost", port=0, discovery="localhost:{}".format (broker_port + 5),
+                                     zookeeper=None, conflate=None, credit=100, decoders=0)
+      mw_obj = SubscriberMW (self.logger)
+      mw_obj.configure (sub_args)
+      for p, topics in enumerate (publishers):
+        topics = [topic for topic in topics if not routes[topic]]
+        if topics:
+          mw_obj.connect_to_publisher ("localhost", port + p, topics)
+          connections += 1
+      if forwarded_topics:
+        mw_obj.connect_to_publisher ("localhost", broker_port, forwarded_topics, via_broker=True)
+        connections += 1
+      threading.Thread (target=self.subscriber, args=(mw_obj, latencies, stop), daemon=True).start ()
+
+    time.sleep (1.0)
+    start = forwarded[0]
+    for samples in latencies.values ():
+      del samples[:]
+    time.sleep (args.duration)
+    broker_rate = (forwarded[0] - start) / args.duration
+    measured = {kind: sorted (samples) for kind, samples in latencies.items ()}
+    stop.set ()
+    time.sleep (0.2)
+
+    def summary (samples):
+      mean = sum (samples) / len (samples) if samples else 0.0
+      p99 = samples[min (len (samples) - 1, int (len (samples) * 0.99))] if samples else 0.0
+      return mean, p99
+
+    broadcast_mean, broadcast_p99 = summary (measured["broadcast"])
+    shared_mean, shared_p99 = summary (measured["shared"])
+    self.logger.info ("{:7s}: {} topics via the broker, {} connections; broadcast latency mean {:.2f} ms p99 {:.2f} ms; shared latency mean {:.2f} ms p99 {:.2f} ms; broker takes in {} samples/s".format (
+      strategy, len (forwarded_topics), connections, broadcast_mean * 1000, broadcast_p99 * 1000,
+      shared_mean * 1000, shared_p99 * 1000, round (broker_rate)))
+    self.results.append ((strategy, len (forwarded_topics), connections, broadcast_mean, broadcast_p99, shared_mean, shared_p99, broker_rate))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("HybridBenchmark::driver")
+
+    for i, strategy in enumerate (self.args.strategies):
+      self.run (strategy, self.args.port + 100 * i)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/hybrid_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("strategy,broadcast,shared,shared_publishers,subscribers,rate,topics_via_broker,connections,broadcast_latency_mean_ms,broadcast_latency_p99_ms,shared_latency_mean_ms,shared_latency_p99_ms,broker_samples_per_s\n")
+      for strategy, via, connections, broadcast_mean, broadcast_p99, shared_mean, shared_p99, broker_rate in self.results:
+        f.write ("{},{},{},{},{},{},{},{},{:.3f},{:.3f},{:.3f},{:.3f},{:.0f}\n".format (
+          strategy, self.args.broadcast, self.args.shared, self.args.shared_publishers, self.args.subscribers, self.args.rate,
+          via, connections, broadcast_mean * 1000, broadcast_p99 * 1000, shared_mean * 1000, shared_p99 * 1000, broker_rate))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Direct, Broker and Hybrid dissemination benchmark")
+
+  parser.add_argument ("--strategies", nargs="+", choices=["direct", "broker", "hybrid"], default=["direct", "broker", "hybrid"], help="Strategies to compare, default direct broker hybrid")
+  parser.add_argument ("-b", "--broadcast", type=int, default=2, help="One-to-many topics, one publisher each, default 2")
+  parser.add_argument ("-m", "--shared", type=int, default=2, help="Many-to-many topics, default 2")
+  parser.add_argument ("-P", "--shared_publishers", type=int, default=6, help="Publishers of every shared topic, default 6")
+  parser.add_argument ("-S", "--subscribers", type=int, default=8, help="Subscribers, each wanting every topic, default 8")
+  parser.add_argument ("--min_saved", type=int, default=1, help="DiscoveryAppln --hybrid_min_saved, default 1")
+  parser.add_argument ("-r", "--rate", type=float, default=50.0, help="Samples per second per topic and publisher, default 50")
+  parser.add_argument ("--size", type=int, default=256, help="Content bytes per sample, default 256")
+  parser.add_argument ("--duration", type=float, default=3.0, help="Seconds measured per strategy, default 3")
+  parser.add_argument ("-p", "--port", type=int, default=8400, help="First of the ports used (100 per strategy), default 8400")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("HybridBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = HybridBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,139 @@
+###############################################
+#
+# Purpose: Latency across subscribers from their histogram snapshots
+#
+# Every subscriber keeps its latencies in log bucketed histograms per topic
+# and per publisher (CS6381_MW/Histogram.py) and writes them to
+# ./csv/<name>_<strategy>_latency.json. This merges the snapshots given
+# (all of them by default) into one histogram per topic, per publisher and
+# overall, exactly as if a single subscriber had received every sample, and
+# reports for each
+#
+#   samples, samples/s (summed over the subscribers), mean and the
+#   p50, p90, p99 and p99.9 latency
+#   missing, duplicate, reordered and late samples by sequence number
+#   (summed over the subscribers), and the loss: missing / (received +
+#   missing)
+#
+# Results are appended to ./csv/latency_report.csv
+#
+###############################################
+
+import os
+import glob
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+from CS6381_MW.Histogram import LatencyHistogram, PERCENTILES, load_snapshot
+
+class LatencyReport ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("LatencyReport::configure")
+    self.args = args
+
+  #################
+  # fold one subscriber's histograms into the merged ones
+  #################
+  def merge (self, merged, rates, histograms, seconds):
+    for key, histogram in histograms.items ():
+      if key not in merged:
+        merged[key] = LatencyHistogram (histogram.bits)
+        rates[key] = 0.0
+      merged[key].merge (histogram)
+      rates[key] += histogram.count / seconds if seconds > 0 else 0.0
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("LatencyReport::driver")
+
+    paths = self.args.snapshots or sorted (glob.glob ("./csv/*_latency.json"))
+    topics, publishers, overall = {}, {}, {}
+    topic_rates, publisher_rates, overall_rates = {}, {}, {}
+    sequences = {} # (by, key) -> [received, missing, duplicates, reordered, late]
+    for path in paths:
+      name, seconds, by_topic, by_publisher, by_stream = load_snapshot (path)
+      self.logger.info ("{}: {} samples over {:.0f} s".format (name, sum (h.count for h in by_topic.values ()), seconds))
+      for (pub_id, topic), counts in by_stream.items ():
+        for key in (("topic", topic), ("publisher", pub_id), ("all", "all")):
+          totals = sequences.setdefault (key, [0] * len (counts))
+          for i, count in enumerate (counts):
+            totals[i] += count
+      self.merge (topics, topic_rates, by_topic, seconds)
+      self.merge (publishers, publisher_rates, by_publisher, seconds)
+      for histogram in by_topic.values ():
+        self.merge (overall, overall_rates, {"all": histogram}, seconds)
+    if not paths:
+      self.logger.info ("no snapshots found")
+      return
+
+    for kind, merged, rates in (("topic", topics, topic_rates), ("publisher", publishers, publisher_rates), ("all", overall, overall_rates)):
+      for key in sorted (merged):
+        histogram = merged[key]
+        percentiles = [histogram.percentile (p) for p in PERCENTILES]
+        received, missing, duplicates, reordered, late = sequences.get ((kind, key), [0] * 5)
+        loss = missing / (received + missing) if received + missing else 0.0
+        self.logger.info ("{:9s} {:12s}: {} samples, {:.1f}/s, mean {:.2f} ms, {}; {} missing ({:.2f}%), {} duplicates, {} reordered, {} late".format (
+          kind, key, histogram.count, rates[key], histogram.mean () * 1000,
+          ", ".join ("p{:g} {:.2f} ms".format (p, latency * 1000) for p, latency in zip (PERCENTILES, percentiles)),
+          missing, loss * 100, duplicates, reordered, late))
+        self.results.append ((kind, key, histogram.count, rates[key], histogram.mean (), percentiles, missing, duplicates, reordered, late, loss))
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/latency_report.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("subscribers,by,key,samples,samples_per_s,mean_ms,p50_ms,p90_ms,p99_ms,p99_9_ms,missing,duplicates,reordered,late,loss_pct\n")
+      for kind, key, count, rate, mean, percentiles, missing, duplicates, reordered, late, loss in self.results:
+        f.write ("{},{},{},{},{:.1f},{:.3f},{},{},{},{},{},{:.3f}\n".format (len (paths), kind, key, count, rate, mean * 1000,
+                                                                      ",".join ("{:.3f}".format (latency * 1000) for latency in percentiles),
+                                                                      missing, duplicates, reordered, late, loss * 100))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Merge subscriber latency histograms")
+
+  parser.add_argument ("snapshots", nargs="*", help="Snapshot files, default ./csv/*_latency.json")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("LatencyReport")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  report = LatencyReport (logger)
+  report.configure (args)
+  report.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,199 @@
+###############################################
+#
+# Purpose: Throughput of the broker's durable topic log
+#
+# Appends N serialized Publications spread over T topics to a TopicLog (as
+# BrokerMW.disseminate does with --log_dir), then measures how fast a
+# subscriber catches up on all of it:
+#
+#   append:    frames appended per second, for each --sync_every
+#   reopen:    scanning the segments when the broker restarts
+#   read:      SegmentedLog.read straight from the maps
+#   fetch:     fetch_log over tcp against a LogService, frames only
+#   fetch+parse: the same, also parsing the Publications, as
+#              SubscriberAppln --resume_since does (with the pure python
+#              protobuf runtime this is where the time goes)
+#
+# The log lives in a temporary directory that is removed afterwards.
+#
+# Results are appended to ./csv/log_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW import topic_pb2
+from CS6381_MW.TopicLog import TopicLog, LogService, fetch_log
+
+class LogBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("LogBenchmark::configure")
+    self.args = args
+
+  #################
+  # the frames a broker would forward
+  #################
+  def frames (self):
+    frames = []
+    for t in range (self.args.topics):
+      publication = topic_pb2.Publication ()
+      publication.topic = "topic{}".format (t)
+      publication.content = "x" * self.args.size
+      publication.pub_id = "pub1"
+      publication.tstamp = time.time ()
+      frames.append ((publication.topic, publication.SerializeToString ()))
+    return frames
+
+  def record (self, phase, sync_every, seconds, count, nbytes):
+    self.logger.info ("{:11s} sync_every={:<5d} {:8d} samples in {:7.3f} s: {:10.0f} samples/s {:8.1f} MB/s".format (
+      phase, sync_every, count, seconds, count / seconds, nbytes / seconds / 1e6))
+    self.results.append ((phase, sync_every, count, seconds, count / seconds, nbytes / seconds / 1e6))
+
+  #################
+  # one pass with a given sync setting
+  #################
+  def run (self, sync_every):
+    args = self.args
+    directory = tempfile.mkdtemp (prefix="topiclog")
+    try:
+      frames = self.frames ()
+      nbytes = args.samples * sum (len (frame) for topic, frame in frames) // len (frames)
+
+      # append
+      topic_log = TopicLog (directory, args.segment_bytes, sync_every)
+      start = time.perf_counter ()
+      for i in range (args.samples):
+        topic, frame = frames[i % len (frames)]
+        topic_log.append (topic, frame)
+      topic_log.flush ()
+      self.record ("append", sync_every, time.perf_counter () - start, args.samples, nbytes)
+      topic_log.close ()
+
+      # a broker restart
+      start = time.perf_counter ()
+      topic_log = TopicLog (directory, args.segment_bytes, sync_every)
+      self.record ("reopen", sync_every, time.perf_counter () - start, args.samples, nbytes)
+
+      # straight from the maps
+      start = time.perf_counter ()
+      count = 0
+      for topic, segmented in topic_log.logs.items ():
+        offset = 0
+        while True:
+          first, batch = segmented.read (offset, args.max_bytes)
+          if not batch:
+            break
+          count += len (batch)
+          offset = first + len (batch)
+      self.record ("read", sync_every, time.perf_counter () - start, count, nbytes)
+
+      # through the fetch API
+      context = zmq.Context ()
+      service = LogService (self.logger, context, topic_log, args.max_bytes)
+      service.bind (args.port)
+      stop = threading.Event ()
+
+      def serve ():
+        while not stop.is_set ():
+          if service.socket.poll (timeout=100):
+            service.serve ()
+
+      server = threading.Thread (target=serve)
+      server.start ()
+      for phase, parse in (("fetch", False), ("fetch+parse", True)):
+        start = time.perf_counter ()
+        count = 0
+        for topic in topic_log.logs:
+          publications, offset = fetch_log (self.logger, context, "localhost", args.port, topic, offset=0,
+                                            max_bytes=args.max_bytes, parse=parse)
+          count += len (publications)
+        self.record (phase, sync_every, time.perf_counter () - start, count, nbytes)
+        if count != args.samples:
+          raise RuntimeError ("fetched {} of {} samples".format (count, args.samples))
+      stop.set ()
+      server.join ()
+      service.close ()
+      context.term ()
+      topic_log.close ()
+    finally:
+      shutil.rmtree (directory)
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("LogBenchmark::driver")
+
+    for sync_every in self.args.sync_every:
+      self.run (sync_every)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/log_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("phase,sync_every,size,topics,segment_bytes,samples,seconds,samples_per_s,mb_per_s\n")
+      for phase, sync_every, count, seconds, rate, mbps in self.results:
+        f.write ("{},{},{},{},{},{},{:.4f},{:.0f},{:.2f}\n".format (phase, sync_every, self.args.size, self.args.topics,
+                                                                   self.args.segment_bytes, count, seconds, rate, mbps))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Durable topic log benchmark")
+
+  parser.add_argument ("-n", "--samples", type=int, default=200000, help="Samples appended, default 200000")
+  parser.add_argument ("-T", "--topics", type=int, default=9, help="Topics the samples are spread over, default 9")
+  parser.add_argument ("--size", type=int, default=128, help="Content bytes per sample, default 128")
+  parser.add_argument ("--segment_bytes", type=int, default=4 * 1024 * 1024, help="Segment file size, default 4 MB")
+  parser.add_argument ("--sync_every", type=int, nargs="+", default=[0, 1000], help="Sync settings to compare, default 0 1000")
+  parser.add_argument ("--max_bytes", type=int, default=1024 * 1024, help="Bytes per read or fetch, default 1 MB")
+  parser.add_argument ("-p", "--port", type=int, default=6700, help="Port for the fetch API, default 6700")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("LogBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = LogBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,189 @@
+###############################################
+#
+# Purpose: Time to first message through the broker, with and without the
+# last value cache
+#
+# One publisher sends every topic once per 1/frequency seconds into a real
+# BrokerMW (consume/disseminate in a thread, as BrokerAppln does). After a
+# warm up, subscribers join one at a time at random moments, subscribe to all
+# topics and measure how long each topic takes to show up.
+#
+#   none:  BrokerMW --no_last_value; a joiner waits for the next publication,
+#          on average half a period
+#   lvc:   the broker answers the subscription with the cached sample
+#
+# Everything runs in this process over tcp on localhost.
+#
+# Results are appended to ./csv/lvc_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import random
+import argparse # argument parsing
+import threading
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW import topic_pb2
+
+class LVCBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("LVCBenchmark::configure")
+    self.args = args
+
+  #################
+  # the slow publisher
+  #################
+  def publisher (self, context, port, stop):
+    pub = context.socket (zmq.PUB)
+    pub.bind ("tcp://*:{}".format (port))
+
+    topics = ["topic{}".format (t) for t in range (self.args.topics)]
+    while not stop.is_set ():
+      for topic in topics:
+        publication = topic_pb2.Publication ()
+        publication.topic = topic
+        publication.content = "x"
+        publication.pub_id = "pub1"
+        publication.tstamp = time.time ()
+        pub.send_multipart ([bytes (topic, "utf-8"), publication.SerializeToString ()])
+      stop.wait (1 / self.args.frequency)
+
+    pub.close (linger=0)
+
+  #################
+  # the broker: what BrokerAppln does in its ACTIVE state
+  #################
+  def broker (self, mw_obj):
+    while True:
+      publication = mw_obj.consume ()
+      mw_obj.disseminate (publication.pub_id, publication.topic, publication.content, publication.tstamp, publication.strength)
+
+  #################
+  # one joiner; returns seconds to the first sample of every topic
+  #################
+  def join (self, context, broker_port):
+    sub = context.socket (zmq.SUB)
+    start = time.perf_counter ()
+    sub.connect ("tcp://localhost:{}".format (broker_port))
+    for t in range (self.args.topics):
+      sub.setsockopt (zmq.SUBSCRIBE, bytes ("topic{}".format (t), "utf-8"))
+
+    first = {}
+    while len (first) < self.args.topics:
+      if not sub.poll (timeout=int (10000 / self.args.frequency)):
+        raise RuntimeError ("no data from the broker")
+      topic, buf = sub.recv_multipart ()
+      if topic not in first:
+        first[topic] = time.perf_counter () - start
+
+    sub.close (linger=0)
+    return list (first.values ())
+
+  #################
+  # one scheme
+  #################
+  def run (self, scheme, pub_port, broker_port):
+    context = zmq.Context ()
+
+    stop = threading.Event ()
+    threading.Thread (target=self.publisher, args=(context, pub_port, stop), daemon=True).start ()
+
+    # a broker middleware configured as BrokerAppln would (no discovery needed)
+    args = argparse.Namespace (addr="localhost", port=broker_port, discovery="localhost:{}".format (broker_port + 2),
+                               zookeeper=None, no_election=False, zk_timeout=3.0, watch_window=0.05, history=0, history_port=None,
+                               no_last_value=(scheme == "none"), log_dir=None, log_port=None, workers=0, egress="pub")
+    mw_obj = BrokerMW (self.logger)
+    mw_obj.configure (args)
+    mw_obj.connect_to_publisher ("localhost", pub_port, ["topic{}".format (t) for t in range (self.args.topics)])
+    threading.Thread (target=self.broker, args=(mw_obj,), daemon=True).start ()
+
+    # let the cache fill
+    time.sleep (2 / self.args.frequency)
+
+    ttfm = []
+    for i in range (self.args.joiners):
+      time.sleep (random.uniform (0, 1 / self.args.frequency))
+      ttfm.extend (self.join (context, broker_port))
+    stop.set ()
+
+    ttfm.sort ()
+    mean = sum (ttfm) / len (ttfm)
+    p50 = ttfm[len (ttfm) // 2]
+    p99 = ttfm[min (len (ttfm) - 1, int (len (ttfm) * 0.99))]
+    self.logger.info ("{:5s} {} joiners x {} topics at {} Hz: time to first message mean {:.1f} ms, p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms ({} cached samples sent)".format (
+      scheme, self.args.joiners, self.args.topics, self.args.frequency, mean * 1000, p50 * 1000, p99 * 1000, ttfm[-1] * 1000, mw_obj.lvc_sent))
+    self.results.append ((scheme, mean, p50, p99, ttfm[-1], mw_obj.lvc_sent))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("LVCBenchmark::driver")
+
+    self.run ("none", self.args.port, self.args.port + 10)
+    self.run ("lvc", self.args.port + 20, self.args.port + 30)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/lvc_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("scheme,frequency,topics,joiners,mean_ms,p50_ms,p99_ms,max_ms,cached_sent\n")
+      for scheme, mean, p50, p99, worst, sent in self.results:
+        f.write ("{},{},{},{},{:.3f},{:.3f},{:.3f},{:.3f},{}\n".format (scheme, self.args.frequency, self.args.topics, self.args.joiners,
+                                                                       mean * 1000, p50 * 1000, p99 * 1000, worst * 1000, sent))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Last value cache time to first message benchmark")
+
+  parser.add_argument ("-f", "--frequency", type=float, default=1.0, help="Publications per topic per second, default 1")
+  parser.add_argument ("-T", "--topics", type=int, default=3, help="Topics, default 3")
+  parser.add_argument ("-j", "--joiners", type=int, default=10, help="Subscribers joining one after another, default 10")
+  parser.add_argument ("-p", "--port", type=int, default=6600, help="First of the ports used (port .. port + 32), default 6600")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("LVCBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = LVCBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
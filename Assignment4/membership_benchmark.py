@@ -0,0 +1,175 @@
+###############################################
+#
+# Purpose: Cost of following a burst of registrations
+#
+# One writer session creates N children under /registry/pub, one every
+# --interval seconds (registrations trickling in through the discovery
+# leader), while W watcher sessions (the standby replicas) keep a mirror of
+# the membership. With no interval the burst outruns the watchers and their
+# one shot watches coalesce it anyway.
+# Everything runs on the in-process ZooKeeper stand-in (InMemoryZK), with
+# an optional per call latency. For each scheme we report the watch
+# notifications, reads and child names returned to the watchers, and the
+# time until every watcher had all N members.
+#
+#   rewatch:     what ZK_Driver.watch_registry used to do; a re-arming
+#                ChildrenWatch re-reads the whole list on every change
+#   debounce-W:  MembershipWatcher with a W ms coalescing window
+#
+# Results are appended to ./csv/membership_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+from kazoo.exceptions import NoNodeError
+
+from InMemoryZK import InMemoryZKServer, InMemoryKazooClient
+from ZookeeperClient import MembershipWatcher
+
+class MembershipBenchmark ():
+
+  PATH = "/registry/pub"
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("MembershipBenchmark::configure")
+    self.args = args
+
+  #################
+  # the watcher schemes; each returns a function telling how many members
+  # the watcher knows about
+  #################
+  def rewatch (self, zk):
+    members = {}
+
+    @zk.ChildrenWatch (self.PATH)
+    def registry_watcher (children):
+      current = set (children)
+      for name in current - members.keys ():
+        try:
+          members[name] = zk.get (self.PATH + "/" + name)[0]
+        except NoNodeError:
+          continue
+      for name in members.keys () - current:
+        del members[name]
+
+    return lambda: len (members)
+
+  def debounce (self, zk, window):
+    watcher = MembershipWatcher (self.logger, zk, self.PATH, lambda added, removed: None, window)
+    return lambda: len (watcher.members)
+
+  #################
+  # one burst
+  #################
+  def run (self, scheme, num, window=None):
+    server = InMemoryZKServer ()
+    writer = InMemoryKazooClient (server)
+    writer.start ()
+    writer.ensure_path (self.PATH)
+
+    sessions = []
+    known = []
+    for i in range (self.args.watchers):
+      zk = InMemoryKazooClient (server, latency=self.args.latency, threaded=True)
+      zk.start ()
+      sessions.append (zk)
+      known.append (self.rewatch (zk) if window is None else self.debounce (zk, window))
+
+    server.reset_stats ()
+    start = time.perf_counter ()
+    for i in range (num):
+      writer.create ("{}/pub{}".format (self.PATH, i), b"10.0.0.1:5577")
+      if self.args.interval:
+        time.sleep (self.args.interval)
+
+    while any (count () < num for count in known):
+      if time.perf_counter () - start > self.args.max_wait:
+        raise RuntimeError ("{}: watchers did not converge".format (scheme))
+      time.sleep (0.001)
+    converged = time.perf_counter () - start
+
+    # let stragglers drain so the counters are final
+    time.sleep (max (0.05, 2 * (window or 0)))
+    stats = dict (server.stats)
+    for zk in sessions + [writer]:
+      zk.stop ()
+
+    self.logger.info ("{:14s} N={:4d}: notifications={:6d} reads={:6d} names returned={:8d} converged in {:.1f} ms".format (
+      scheme, num, stats["notifications"], stats["reads"], stats["entries"], converged * 1000))
+    self.results.append ((scheme, num, stats["notifications"], stats["reads"], stats["entries"], converged * 1000))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("MembershipBenchmark::driver")
+
+    for num in self.args.burst:
+      self.run ("rewatch", num)
+      for window in self.args.windows:
+        self.run ("debounce-{:g}".format (window * 1000), num, window)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/membership_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("scheme,watchers,latency_s,burst,notifications,reads,names_returned,converged_ms\n")
+      for scheme, num, notifications, reads, entries, converged in self.results:
+        f.write ("{},{},{},{},{},{},{},{:.3f}\n".format (scheme, self.args.watchers, self.args.latency,
+                                                          num, notifications, reads, entries, converged))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Membership watch benchmark")
+
+  parser.add_argument ("-n", "--burst", type=int, nargs="+", default=[50, 100, 200], help="Registrations per burst, default 50 100 200")
+  parser.add_argument ("-W", "--watchers", type=int, default=3, help="Watching sessions (standby replicas), default 3")
+  parser.add_argument ("-w", "--windows", type=float, nargs="+", default=[0.0, 0.01, 0.05], help="Coalescing windows in seconds, default 0 0.01 0.05")
+  parser.add_argument ("--latency", type=float, default=0.0005, help="Seconds added to every watcher call, default 0.0005")
+  parser.add_argument ("-i", "--interval", type=float, default=0.001, help="Pause between registrations in seconds (as they trickle in through the leader), default 0.001")
+  parser.add_argument ("--max_wait", type=float, default=60.0, help="Give up if the watchers have not converged after this many seconds")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("MembershipBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = MembershipBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,17 @@
+h1 python3 DiscoveryAppln.py -P 1 -S 8 -B 7 --tree_fanout 2 > discovery.out 2>&1 &
+h2 python3 PublisherAppln.py -d "10.0.0.1:5556" -a "10.0.0.2" -T 5 -n pub1 > pub1.out 2>&1 &
+h3 python3 BrokerAppln.py -d "10.0.0.1:5556"  -a "10.0.0.3" -n broker1 > broker1.out 2>&1 &
+h4 python3 BrokerAppln.py -d "10.0.0.1:5556"  -a "10.0.0.4" -n broker2 > broker2.out 2>&1 &
+h5 python3 BrokerAppln.py -d "10.0.0.1:5556"  -a "10.0.0.5" -n broker3 > broker3.out 2>&1 &
+h6 python3 BrokerAppln.py -d "10.0.0.1:5556"  -a "10.0.0.6" -n broker4 > broker4.out 2>&1 &
+h7 python3 BrokerAppln.py -d "10.0.0.1:5556"  -a "10.0.0.7" -n broker5 > broker5.out 2>&1 &
+h8 python3 BrokerAppln.py -d "10.0.0.1:5556"  -a "10.0.0.8" -n broker6 > broker6.out 2>&1 &
+h9 python3 BrokerAppln.py -d "10.0.0.1:5556"  -a "10.0.0.9" -n broker7 > broker7.out 2>&1 &
+h10 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 4 -n sub1 -i 60 > sub1.out 2>&1 &
+h11 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 5 -n sub2 -i 60 > sub2.out 2>&1 &
+h12 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 4 -n sub3 -i 60 > sub3.out 2>&1 &
+h13 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 5 -n sub4 -i 60 > sub4.out 2>&1 &
+h14 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 4 -n sub5 -i 60 > sub5.out 2>&1 &
+h15 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 5 -n sub6 -i 60 > sub6.out 2>&1 &
+h16 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 4 -n sub7 -i 60 > sub7.out 2>&1 &
+h17 python3 SubscriberAppln.py -d "10.0.0.1:5556" -T 5 -n sub8 -i 60 > sub8.out 2>&1 &
\ No newline at end of file
@@ -0,0 +1,256 @@
+###############################################
+#
+# Purpose: Bandwidth saved by arbitrating ownership strength at the broker
+#
+# K publishers with strengths 1..K publish on each of T topics through one
+# broker to S subscribers (ZMQ over inproc, all in this process). Every
+# subscriber wants only the strongest publisher of a topic.
+#
+#   subscriber:  the broker forwards every sample and each subscriber drops
+#                the weaker ones itself (what SubscriberMW.collect used to do)
+#   broker:      the broker runs OwnershipArbiter before forwarding
+#                (BrokerAppln) and subscribers take what they get
+#
+# With --owner_fails the strongest publisher stops halfway through, so the
+# threshold handover to the next strongest is exercised as well.
+#
+# For each scheme we report the bytes on the broker -> subscriber links, the
+# samples the subscribers had to parse and how many were delivered.
+#
+# Results are appended to ./csv/ownership_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import threading
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import OwnershipArbiter
+
+class OwnershipBenchmark ():
+
+  IN = "inproc://ownership-in"
+  OUT = "inproc://ownership-out"
+  END = b"__end__"
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("OwnershipBenchmark::configure")
+    self.args = args
+
+  #################
+  # one publisher: "samples" rounds over all topics
+  #################
+  def publisher (self, context, name, strength, samples):
+    pub = context.socket (zmq.PUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    pub.connect (self.IN)
+    time.sleep (0.2) # slow joiner
+
+    content = "x" * self.args.size
+    for i in range (samples):
+      for t in range (self.args.topics):
+        publication = topic_pb2.Publication ()
+        publication.topic = "topic{}".format (t)
+        publication.content = content
+        publication.pub_id = name
+        publication.tstamp = time.time ()
+        publication.strength = strength
+        pub.send_multipart ([bytes (publication.topic, "utf-8"), publication.SerializeToString ()])
+      time.sleep (self.args.interval)
+
+    pub.close (linger=-1)
+
+  #################
+  # the broker: forward everything, or only the owners
+  #################
+  def broker (self, context, arbitrate, stats, ready):
+    sub = context.socket (zmq.SUB)
+    sub.setsockopt (zmq.RCVHWM, 0)
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    sub.bind (self.IN)
+    pub = context.socket (zmq.PUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    pub.bind (self.OUT)
+    ready.set ()
+
+    arbiter = OwnershipArbiter (self.args.threshold)
+    while True:
+      if not sub.poll (timeout=500):
+        break # the publishers are done
+      topic, buf = sub.recv_multipart ()
+      stats["offered"] += 1
+      stats["offered_bytes"] += len (topic) + len (buf)
+
+      publication = topic_pb2.Publication ()
+      publication.ParseFromString (buf)
+      if arbitrate and not arbiter.admit (publication.topic, publication.pub_id, publication.strength, len (buf)):
+        continue
+
+      pub.send_multipart ([topic, buf])
+      stats["forwarded"] += 1
+      stats["forwarded_bytes"] += len (topic) + len (buf)
+
+    stats["handovers"] = arbiter.handovers
+    time.sleep (0.1)
+    pub.send_multipart ([self.END, b""])
+    pub.close (linger=-1)
+    sub.close ()
+
+  #################
+  # a subscriber; arbitrates itself unless the broker does
+  #################
+  def subscriber (self, context, arbitrate, stats, lock):
+    sub = context.socket (zmq.SUB)
+    sub.setsockopt (zmq.RCVHWM, 0)
+    sub.setsockopt (zmq.SUBSCRIBE, b"")
+    sub.connect (self.OUT)
+
+    arbiter = OwnershipArbiter (self.args.threshold)
+    received = 0
+    received_bytes = 0
+    delivered = 0
+    owners = set ()
+    while True:
+      topic, buf = sub.recv_multipart ()
+      if topic == self.END:
+        break
+      received += 1
+      received_bytes += len (topic) + len (buf)
+
+      publication = topic_pb2.Publication ()
+      publication.ParseFromString (buf)
+      if arbitrate and not arbiter.admit (publication.topic, publication.pub_id, publication.strength):
+        continue
+      delivered += 1
+      owners.add (publication.pub_id)
+
+    sub.close ()
+    with lock:
+      stats["received"] += received
+      stats["link_bytes"] += received_bytes
+      stats["delivered"] += delivered
+      stats["owners"] |= owners
+
+  #################
+  # one run
+  #################
+  def run (self, scheme):
+    args = self.args
+    context = zmq.Context ()
+    stats = {"offered": 0, "offered_bytes": 0, "forwarded": 0, "forwarded_bytes": 0, "handovers": 0,
+             "received": 0, "link_bytes": 0, "delivered": 0, "owners": set ()}
+    lock = threading.Lock ()
+
+    ready = threading.Event ()
+    broker = threading.Thread (target=self.broker, args=(context, scheme == "broker", stats, ready))
+    broker.start ()
+    ready.wait ()
+
+    subscribers = [threading.Thread (target=self.subscriber, args=(context, scheme == "subscriber", stats, lock))
+                   for i in range (args.subscribers)]
+    for thread in subscribers:
+      thread.start ()
+
+    publishers = []
+    for k in range (1, args.publishers + 1):
+      # the strongest publisher may go away halfway through
+      samples = args.samples // 2 if args.owner_fails and k == args.publishers else args.samples
+      publishers.append (threading.Thread (target=self.publisher, args=(context, "pub{}".format (k), k, samples)))
+    start = time.perf_counter ()
+    for thread in publishers:
+      thread.start ()
+
+    for thread in publishers + [broker] + subscribers:
+      thread.join ()
+    elapsed = time.perf_counter () - start
+    context.term ()
+
+    self.logger.info ("{:10s} K={} T={} S={}: offered {} ({} B), link {} B, parsed {} at subscribers, delivered {}, {} handovers, owners {}".format (
+      scheme, args.publishers, args.topics, args.subscribers, stats["offered"], stats["offered_bytes"],
+      stats["link_bytes"], stats["received"], stats["delivered"], stats["handovers"], sorted (stats["owners"])))
+    self.results.append ((scheme, stats, elapsed))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("OwnershipBenchmark::driver")
+
+    for scheme in ("subscriber", "broker"):
+      self.run (scheme)
+
+    baseline = self.results[0][1]["link_bytes"]
+    for scheme, stats, elapsed in self.results[1:]:
+      if baseline:
+        self.logger.info ("{}: {:.1f}% of the broker -> subscriber bytes saved".format (
+          scheme, 100.0 * (baseline - stats["link_bytes"]) / baseline))
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/ownership_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("scheme,publishers_per_topic,topics,subscribers,owner_fails,offered,offered_bytes,link_bytes,parsed,delivered,handovers,elapsed_s\n")
+      for scheme, stats, elapsed in self.results:
+        f.write ("{},{},{},{},{},{},{},{},{},{},{},{:.3f}\n".format (scheme, self.args.publishers, self.args.topics,
+                                                                  self.args.subscribers, int (self.args.owner_fails),
+                                                                  stats["offered"], stats["offered_bytes"], stats["link_bytes"],
+                                                                  stats["received"], stats["delivered"], stats["handovers"], elapsed))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Ownership strength bandwidth benchmark")
+
+  parser.add_argument ("-K", "--publishers", type=int, default=4, help="Competing publishers per topic, strengths 1..K, default 4")
+  parser.add_argument ("-T", "--topics", type=int, default=3, help="Topics, default 3")
+  parser.add_argument ("-S", "--subscribers", type=int, default=3, help="Subscribers, default 3")
+  parser.add_argument ("-n", "--samples", type=int, default=500, help="Samples per topic per publisher, default 500")
+  parser.add_argument ("--size", type=int, default=256, help="Content bytes per sample, default 256")
+  parser.add_argument ("--threshold", type=int, default=5, help="Ownership handover threshold, default 5")
+  parser.add_argument ("--interval", type=float, default=0.001, help="Pause between publishing rounds in seconds, default 0.001")
+  parser.add_argument ("--owner_fails", action="store_true", help="Stop the strongest publisher halfway through")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("OwnershipBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = OwnershipBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
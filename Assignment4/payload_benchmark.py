@@ -0,0 +1,151 @@
+###############################################
+#
+# Purpose: Frame size and encode/decode time of typed sample payloads
+# (Publication's payload oneof) against the stringified content we used to
+# send
+#
+# For every topic TopicSelector knows we generate --samples values and
+# send each as a publisher does (topic, payload, pub_id, tstamp, strength,
+# seq), either
+#
+#   string:  the value formatted into content, as gen_publication used to;
+#            the consumer parses numbers back (float () or int ())
+#   typed:   set_payload () puts the native value in its typed field;
+#            the consumer takes it with payload_value ()
+#
+# and measure the mean serialized frame size and the time per sample to
+# build and serialize it, and to parse it and get the value back.
+#
+# Results are appended to ./csv/payload_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import random
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import set_payload, payload_value
+from topic_selector import TopicSelector
+
+# what a consumer of the string form turns the content of a topic back into
+NUMBERS = {"humidity": float, "light": int, "pressure": int, "temperature": int, "sound": int, "altitude": int}
+
+class PayloadBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("PayloadBenchmark::configure")
+    self.args = args
+
+  #################
+  # one topic, one form
+  #################
+  def run (self, form, topic, values):
+    seq = 0
+    frames = []
+    start = time.perf_counter ()
+    for value in values:
+      publication = topic_pb2.Publication ()
+      publication.topic = topic
+      if form == "string":
+        publication.content = str (value)
+      else:
+        set_payload (publication, topic, value)
+      publication.pub_id = "pub1"
+      publication.tstamp = time.time ()
+      publication.strength = 0
+      seq += 1
+      publication.seq = seq
+      frames.append (publication.SerializeToString ())
+    encode = (time.perf_counter () - start) / len (values)
+
+    convert = NUMBERS.get (topic)
+    start = time.perf_counter ()
+    for frame in frames:
+      publication = topic_pb2.Publication ()
+      publication.ParseFromString (frame)
+      if form == "string":
+        value = convert (publication.content) if convert is not None else publication.content
+      else:
+        value = payload_value (publication)
+    decode = (time.perf_counter () - start) / len (frames)
+
+    size = sum (len (frame) for frame in frames) / len (frames)
+    self.logger.info ("{:11s} {:6s}: {:.1f} bytes per frame, encode {:.2f} us, decode {:.2f} us".format (topic, form, size, encode * 1e6, decode * 1e6))
+    self.results.append ((topic, form, size, encode, decode))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("PayloadBenchmark::driver")
+
+    random.seed (1)
+    ts = TopicSelector ()
+    for topic in ts.topiclist:
+      values = [ts.gen_publication (topic) for i in range (self.args.samples)]
+      for form in self.args.forms:
+        self.run (form, topic, values)
+
+    for form in self.args.forms:
+      rows = [result for result in self.results if result[1] == form]
+      self.logger.info ("all topics  {:6s}: {:.1f} bytes per frame, encode {:.2f} us, decode {:.2f} us".format (
+        form, *(sum (row[i] for row in rows) / len (rows) * (1 if i == 2 else 1e6) for i in (2, 3, 4))))
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/payload_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("topic,form,samples,bytes_per_frame,us_encode,us_decode\n")
+      for topic, form, size, encode, decode in self.results:
+        f.write ("{},{},{},{:.2f},{:.3f},{:.3f}\n".format (topic, form, self.args.samples, size, encode * 1e6, decode * 1e6))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Typed payload benchmark")
+
+  parser.add_argument ("--forms", nargs="+", choices=["string", "typed"], default=["string", "typed"], help="Payload forms to compare, default string typed")
+  parser.add_argument ("-n", "--samples", type=int, default=50000, help="Samples per topic, default 50000")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("PayloadBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = PayloadBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
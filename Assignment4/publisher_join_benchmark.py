@@ -0,0 +1,241 @@
+###############################################
+#
+# Purpose: How fast a running broker picks up publishers that join late and
+# drops the ones that leave
+#
+# A real BrokerMW (consume/disseminate in a thread, as BrokerAppln does)
+# follows the live publishers (BrokerMW.watch_publishers) on the in-process
+# ZooKeeper stand-in. One steady publisher is there from the start; then N
+# publishers join one at a time: each binds its PUB socket, starts
+# publishing and announces itself as PublisherMW.register does. A
+# subscriber on the broker measures
+#
+#   join:   announce -> first sample of the new publisher at the subscriber
+#   leave:  session closed -> broker disconnected from the publisher
+#   gap:    longest silence of the steady publisher at the subscriber while
+#           all this goes on (forwarding must not stall)
+#
+# for each --watch_window.
+#
+# Results are appended to ./csv/publisher_join_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import threading
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW.BrokerMW import BrokerMW
+from CS6381_MW.Coordination import InMemoryCoordination
+from CS6381_MW import topic_pb2
+from CS6381_MW import discovery_pb2
+from ZookeeperClient import announce, LIVE_PUBLISHERS
+
+class PublisherJoinBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("PublisherJoinBenchmark::configure")
+    self.args = args
+
+  #################
+  # a publisher thread: one sample of "topic" every period until stopped
+  #################
+  def publisher (self, context, name, port, stop, ready):
+    pub = context.socket (zmq.PUB)
+    pub.bind ("tcp://*:{}".format (port))
+    ready.set ()
+    while not stop.is_set ():
+      publication = topic_pb2.Publication ()
+      publication.topic = "topic0"
+      publication.content = "x"
+      publication.pub_id = name
+      publication.tstamp = time.time ()
+      pub.send_multipart ([b"topic0", publication.SerializeToString ()])
+      stop.wait (self.args.period)
+    pub.close (linger=0)
+
+  #################
+  # the broker: what BrokerAppln does in its ACTIVE state
+  #################
+  def broker (self, mw_obj):
+    while True:
+      publication = mw_obj.consume ()
+      mw_obj.disseminate (publication.pub_id, publication.topic, publication.content, publication.tstamp, publication.strength)
+
+  #################
+  # the subscriber: first arrival per publisher and the steady one's gaps
+  #################
+  def subscriber (self, context, port, first, gaps, stop):
+    sub = context.socket (zmq.SUB)
+    sub.connect ("tcp://localhost:{}".format (port))
+    sub.setsockopt (zmq.SUBSCRIBE, b"topic0")
+    last_steady = None
+    while not stop.is_set ():
+      if not sub.poll (timeout=100):
+        continue
+      topic, buf = sub.recv_multipart ()
+      now = time.time ()
+      publication = topic_pb2.Publication ()
+      publication.ParseFromString (buf)
+      first.setdefault (publication.pub_id, now)
+      if publication.pub_id == "steady":
+        if last_steady is not None:
+          gaps.append (now - last_steady)
+        last_steady = now
+    sub.close (linger=0)
+
+  def announcement (self, name, port):
+    reg_req = discovery_pb2.RegisterReq ()
+    reg_req.role = discovery_pb2.ROLE_PUBLISHER
+    reg_req.info.id = name
+    reg_req.info.addr = "localhost"
+    reg_req.info.port = port
+    reg_req.topiclist[:] = ["topic0"]
+    return reg_req.SerializeToString ()
+
+  def wait_for (self, condition, timeout=10.0):
+    deadline = time.time () + timeout
+    while not condition ():
+      if time.time () > deadline:
+        raise RuntimeError ("timed out")
+      time.sleep (0.0005)
+
+  #################
+  # one window setting
+  #################
+  def run (self, window, port):
+    args = self.args
+    server = "publisher-join-{}".format (port)
+    context = zmq.Context ()
+    stop = threading.Event ()
+
+    # a broker middleware configured as BrokerAppln would
+    broker_args = argparse.Namespace (addr="localhost", port=port, discovery="localhost:{}".format (port + 3),
+                                      zookeeper=None, no_election=False, zk_timeout=3.0, watch_window=window, history=0, history_port=None,
+                                      no_last_value=True, log_dir=None, log_port=None, workers=0, egress="pub")
+    mw_obj = BrokerMW (self.logger)
+    mw_obj.configure (broker_args)
+
+    # the steady publisher, found through the lookup as before
+    ready = threading.Event ()
+    threading.Thread (target=self.publisher, args=(context, "steady", port + 4, stop, ready), daemon=True).start ()
+    ready.wait ()
+    mw_obj.connect_to_publisher ("localhost", port + 4, ["topic0"])
+    mw_obj.watch_publishers (["topic0"], client=InMemoryCoordination (server))
+    threading.Thread (target=self.broker, args=(mw_obj,), daemon=True).start ()
+
+    first = {}
+    gaps = []
+    threading.Thread (target=self.subscriber, args=(context, port, first, gaps, stop), daemon=True).start ()
+    time.sleep (0.5)
+
+    joins = []
+    leaves = []
+    for k in range (args.joiners):
+      name = "pub{}".format (k)
+      pub_port = port + 5 + k
+      pub_stop = threading.Event ()
+      ready = threading.Event ()
+      threading.Thread (target=self.publisher, args=(context, name, pub_port, pub_stop, ready), daemon=True).start ()
+      ready.wait ()
+
+      # join
+      session = InMemoryCoordination (server)
+      session.start ()
+      start = time.time ()
+      announce (session, LIVE_PUBLISHERS, name, self.announcement (name, pub_port))
+      self.wait_for (lambda: name in first)
+      joins.append (first[name] - start)
+
+      # leave: the session goes, and its live node with it
+      pub_stop.set ()
+      start = time.time ()
+      session.stop ()
+      self.wait_for (lambda: "tcp://localhost:{}".format (pub_port) not in mw_obj.connected)
+      leaves.append (time.time () - start)
+
+    stop.set ()
+    time.sleep (0.2)
+    mw_obj.membership.close ()
+
+    joins.sort ()
+    leaves.sort ()
+    mean_join = sum (joins) / len (joins)
+    mean_leave = sum (leaves) / len (leaves)
+    max_gap = max (gaps) if gaps else 0.0
+    self.logger.info ("window {:5.1f} ms: join -> first sample mean {:.1f} ms, max {:.1f} ms; leave -> disconnect mean {:.1f} ms; steady publisher gap max {:.1f} ms (period {:.1f} ms)".format (
+      window * 1000, mean_join * 1000, joins[-1] * 1000, mean_leave * 1000, max_gap * 1000, args.period * 1000))
+    self.results.append ((window, mean_join, joins[-1], mean_leave, leaves[-1], max_gap))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("PublisherJoinBenchmark::driver")
+
+    for i, window in enumerate (self.args.windows):
+      self.run (window, self.args.port + 50 * i)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/publisher_join_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("window_ms,joiners,period_ms,join_mean_ms,join_max_ms,leave_mean_ms,leave_max_ms,steady_gap_max_ms\n")
+      for window, mean_join, max_join, mean_leave, max_leave, max_gap in self.results:
+        f.write ("{:.1f},{},{:.1f},{:.3f},{:.3f},{:.3f},{:.3f},{:.3f}\n".format (window * 1000, self.args.joiners, self.args.period * 1000,
+                                                                              mean_join * 1000, max_join * 1000, mean_leave * 1000,
+                                                                              max_leave * 1000, max_gap * 1000))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Late joining publisher benchmark")
+
+  parser.add_argument ("-n", "--joiners", type=int, default=10, help="Publishers joining (and leaving) one after another, default 10")
+  parser.add_argument ("--period", type=float, default=0.002, help="Seconds between samples of every publisher, default 0.002")
+  parser.add_argument ("-w", "--windows", type=float, nargs="+", default=[0.0, 0.05], help="Watch windows to compare in seconds, default 0 0.05")
+  parser.add_argument ("-p", "--port", type=int, default=7000, help="First of the ports used (50 per window), default 7000")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("PublisherJoinBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = PublisherJoinBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
@@ -0,0 +1,168 @@
+###############################################
+#
+# Purpose: What a subscriber pays for keeping its results (SubscriberAppln
+# --results, --flush_interval)
+#
+# In a fresh process each, N publications are parsed and recorded the way
+# SubscriberAppln records them, either
+#
+#   list:    kept with their parsed publication until the end, then written
+#            to csv (what SubscriberAppln used to do)
+#   csv:     streamed by a ResultsWriter as csv
+#   binary:  streamed by a ResultsWriter in binary columns
+#
+# and we measure the growth of peak RSS, the time the receiving thread
+# spends per result (parse + record), how long writing takes after the last
+# result, and the size of the file.
+#
+# Results are appended to ./csv/results_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import resource
+import multiprocessing
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+from CS6381_MW import topic_pb2
+
+#################
+# one mode, in its own process
+#################
+def record (mode, count, size, path, results):
+  import csv
+  import datetime
+  from CS6381_MW.ResultsWriter import ResultsWriter, HEADER
+
+  logger = logging.getLogger ("ResultsRecorder")
+  publication = topic_pb2.Publication ()
+  publication.topic = "weather"
+  publication.content = "x" * size
+  publication.pub_id = "pub1"
+  publication.tstamp = time.time ()
+  buf = publication.SerializeToString ()
+
+  kept = []
+  writer = None
+  if mode != "list":
+    writer = ResultsWriter (logger, path, mode)
+    writer.start ()
+
+  rss_start = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+  start = time.perf_counter ()
+  for i in range (count):
+    publication = topic_pb2.Publication ()
+    publication.ParseFromString (buf)
+    received = time.time ()
+    if writer is None:
+      kept.append ((publication, received - publication.tstamp, received, False))
+    else:
+      writer.write (publication, received - publication.tstamp, received, False)
+  recorded = time.perf_counter ()
+
+  if writer is None:
+    with open (path, "w", newline="") as f:
+      out = csv.writer (f)
+      out.writerow (HEADER)
+      for publication, latency, received, replayed in kept:
+        out.writerow ([publication.topic, publication.content, publication.pub_id,
+                       datetime.datetime.fromtimestamp (publication.tstamp).isoformat (), str (latency), repr (received), str (replayed),
+                       str (publication.seq)])
+  else:
+    writer.close ()
+  finished = time.perf_counter ()
+
+  rss_growth = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss - rss_start
+  results.put (((recorded - start) / count, finished - recorded, rss_growth, os.path.getsize (path)))
+
+class ResultsBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("ResultsBenchmark::configure")
+    self.args = args
+
+  #################
+  # one mode
+  #################
+  def run (self, mode):
+    args = self.args
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/results_benchmark_{}.{}".format (mode, "bin" if mode == "binary" else "csv")
+    spawn = multiprocessing.get_context ("spawn")
+    results = spawn.Queue ()
+    process = spawn.Process (target=record, args=(mode, args.count, args.size, path, results))
+    process.start ()
+    per_result, tail, rss_growth, file_size = results.get ()
+    process.join ()
+    os.remove (path)
+
+    self.logger.info ("{:6s}: {:.1f} us per result, {:.2f} s writing after the last one, RSS +{} kB, file {} kB".format (
+      mode, per_result * 1e6, tail, rss_growth, file_size // 1024))
+    self.results.append ((mode, per_result, tail, rss_growth, file_size))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("ResultsBenchmark::driver")
+
+    for mode in self.args.modes:
+      self.run (mode)
+
+    path = "./csv/results_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("mode,count,size,us_per_result,seconds_after_last,rss_growth_kb,file_bytes\n")
+      for mode, per_result, tail, rss_growth, file_size in self.results:
+        f.write ("{},{},{},{:.2f},{:.3f},{},{}\n".format (mode, self.args.count, self.args.size, per_result * 1e6, tail, rss_growth, file_size))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Subscriber results recording benchmark")
+
+  parser.add_argument ("-n", "--count", type=int, default=200000, help="Results recorded, default 200000")
+  parser.add_argument ("--size", type=int, default=32, help="Content bytes per sample, default 32")
+  parser.add_argument ("--modes", nargs="+", choices=["list", "csv", "binary"], default=["list", "csv", "binary"], help="Ways to record to compare, default list csv binary")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("ResultsBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = ResultsBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
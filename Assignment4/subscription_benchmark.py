@@ -0,0 +1,213 @@
+###############################################
+#
+# Purpose: What a subscriber's subscriptions cost its publishers, with a
+# subscribe per topic per publisher against the SubscriptionManager
+# (SubscriberMW)
+#
+# A subscriber wants T topics from each of P publishers. It either
+#
+#   per_publisher:  subscribes the socket to its topics, then connects to
+#                   each publisher and subscribes to every topic again
+#                   (what SubscriberMW used to do)
+#   manager:        goes through a real SubscriberMW, whose
+#                   SubscriptionManager subscribes to each topic once
+#
+# and then the publisher list changes: --churn publishers leave and as many
+# new ones join. The publishers are XPUB sockets that pass every
+# subscription message up (XPUB_VERBOSER), so for each way we count
+#
+#   setup, churn:  subscription messages the publishers got, and the
+#                  (un)subscribe calls the subscriber made
+#   matching:      time a publisher takes per sample it sends, every sample
+#                  being matched against what the subscriber subscribed to
+#                  (half the samples are on topics nobody wants)
+#
+# Results are appended to ./csv/subscription_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW import topic_pb2
+
+class SubscriptionBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("SubscriptionBenchmark::configure")
+    self.args = args
+
+  #################
+  # subscription messages waiting at the publishers
+  #################
+  def drain (self, publishers):
+    time.sleep (self.args.settle)
+    messages = 0
+    for xpub in publishers:
+      while xpub.poll (timeout=0):
+        xpub.recv ()
+        messages += 1
+    return messages
+
+  #################
+  # seconds per sample a publisher sends
+  #################
+  def matching (self, xpub, topics):
+    unwanted = ["other{}".format (t) for t in range (len (topics))]
+    publication = topic_pb2.Publication ()
+    publication.content = "x" * 64
+    buf = publication.SerializeToString ()
+    start = time.perf_counter ()
+    for i in range (self.args.samples):
+      for topic in topics + unwanted:
+        xpub.send_multipart ([bytes (topic, "utf-8"), buf], zmq.NOBLOCK)
+    return (time.perf_counter () - start) / (self.args.samples * len (topics) * 2)
+
+  #################
+  # one way of subscribing
+  #################
+  def run (self, way, port):
+    from CS6381_MW.SubscriberMW import SubscriberMW
+
+    args = self.args
+    topics = ["topic{}".format (t) for t in range (args.topics)]
+    context = zmq.Context ()
+    publishers = {}
+    def start_publisher (p):
+      xpub = context.socket (zmq.XPUB)
+      xpub.setsockopt (zmq.XPUB_VERBOSER, 1)
+      xpub.setsockopt (zmq.SNDHWM, 0)
+      xpub.bind ("tcp://127.0.0.1:{}".format (port + p))
+      publishers[p] = xpub
+    for p in range (args.publishers):
+      start_publisher (p)
+
+    # set up
+    calls = 0
+    if way == "per_publisher":
+      sub = context.socket (zmq.SUB)
+      for topic in topics:
+        sub.setsockopt (zmq.SUBSCRIBE, bytes (topic, "utf-8"))
+        calls += 1
+      def connect (p):
+        sub.connect ("tcp://127.0.0.1:{}".format (port + p))
+        for topic in topics:
+          sub.subscribe (topic)
+        return len (topics)
+      def disconnect (p):
+        sub.disconnect ("tcp://127.0.0.1:{}".format (port + p))
+        return 0
+    else:
+      logger = logging.getLogger ("SubscriptionSubscriber")
+      logger.setLevel (logging.WARNING)
+      mw_obj = SubscriberMW (logger)
+      mw_obj.configure (argparse.Namespace (addr="127.0.0.1", port=port + 98, discovery="127.0.0.1:{}".format (port + 99),
+                                            zookeeper=None, conflate=None, credit=100, decoders=0))
+      mw_obj.subscribe (topics)
+      def connect (p):
+        mw_obj.connect_to_publisher ("127.0.0.1", port + p, topics)
+        return 0
+      def disconnect (p):
+        mw_obj.disconnect_from_publisher ("127.0.0.1", port + p)
+        return 0
+
+    start = time.perf_counter ()
+    for p in range (args.publishers):
+      calls += connect (p)
+    setup_seconds = time.perf_counter () - start
+    setup_messages = self.drain (publishers.values ())
+
+    # the publisher list changes
+    churn_calls = 0
+    for p in range (args.churn):
+      churn_calls += disconnect (p)
+      start_publisher (args.publishers + p)
+      churn_calls += connect (args.publishers + p)
+    churn_messages = self.drain (publishers.values ())
+    if way == "manager":
+      calls = mw_obj.subscriptions.calls
+      churn_calls = 0 # counted in calls
+    match = self.matching (publishers[args.publishers + args.churn - 1], topics)
+
+    for xpub in publishers.values ():
+      xpub.close (linger=0)
+    context.destroy (linger=0)
+
+    self.logger.info ("{:13s}: setup {} subscription messages in {:.1f} ms, churn {} messages; {} (un)subscribe calls; {:.2f} us per sample sent".format (
+      way, setup_messages, setup_seconds * 1000, churn_messages, calls + churn_calls, match * 1e6))
+    self.results.append ((way, setup_messages, setup_seconds, churn_messages, calls + churn_calls, match))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("SubscriptionBenchmark::driver")
+
+    for i, way in enumerate (self.args.ways):
+      self.run (way, self.args.port + 500 * i)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/subscription_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("way,publishers,topics,churn,setup_messages,setup_ms,churn_messages,subscribe_calls,us_per_sample_sent\n")
+      for way, setup_messages, setup_seconds, churn_messages, calls, match in self.results:
+        f.write ("{},{},{},{},{},{:.2f},{},{},{:.3f}\n".format (way, self.args.publishers, self.args.topics, self.args.churn,
+                                                              setup_messages, setup_seconds * 1000, churn_messages, calls, match * 1e6))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Subscription manager benchmark")
+
+  parser.add_argument ("--ways", nargs="+", choices=["per_publisher", "manager"], default=["per_publisher", "manager"], help="Ways of subscribing to compare, default per_publisher manager")
+  parser.add_argument ("-P", "--publishers", type=int, default=20, help="Publishers, each sending every topic, default 20")
+  parser.add_argument ("-T", "--topics", type=int, default=9, help="Topics the subscriber wants, default 9")
+  parser.add_argument ("--churn", type=int, default=5, help="Publishers replaced after setting up, default 5")
+  parser.add_argument ("-n", "--samples", type=int, default=2000, help="Samples per topic sent to measure matching, default 2000")
+  parser.add_argument ("--settle", type=float, default=0.5, help="Seconds given subscription messages to arrive, default 0.5")
+  parser.add_argument ("-p", "--port", type=int, default=9000, help="First of the ports used (500 per way), default 9000")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("SubscriptionBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = SubscriptionBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
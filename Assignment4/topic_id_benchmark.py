@@ -0,0 +1,185 @@
+###############################################
+#
+# Purpose: What compact topic ids (DiscoveryAppln --topic_ids) save against
+# sending every sample with its topic name
+#
+# For --topics topics (the 9 TopicSelector knows, or synthetic ones named
+# like "building42/floor7/room13/sensor5/temperature") we send samples as a
+# publisher does, either
+#
+#   name:  the name as envelope and in Publication.topic
+#   id:    the 4 byte id discovery gave the topic as envelope and in
+#          Publication.topic_id (TopicIds stamp () and envelope ())
+#
+# and measure
+#
+#   bytes:     per message on the wire, envelope and frame
+#   matching:  time a publisher's socket takes per sample it sends to a
+#              SUB subscribed to every topic, i.e. matching the envelope
+#              against its subscriptions
+#   restore:   time per sample to parse it and get its topic name back
+#
+# Results are appended to ./csv/topic_id_benchmark.csv
+#
+###############################################
+
+import os
+import time
+import random
+import argparse # argument parsing
+import logging # for logging. Use it in place of print statements.
+
+import zmq
+
+from CS6381_MW import topic_pb2
+from CS6381_MW.Common import TopicIds, set_payload
+from topic_selector import TopicSelector
+
+class TopicIdBenchmark ():
+
+  #################
+  # constructor
+  #################
+  def __init__ (self, logger):
+    self.logger = logger
+    self.args = None
+    self.results = []
+
+  #################
+  # configuration
+  #################
+  def configure (self, args):
+    self.logger.debug ("TopicIdBenchmark::configure")
+    self.args = args
+
+  #################
+  # the topic names
+  #################
+  def topics (self):
+    if self.args.topics == 0:
+      return TopicSelector ().topiclist
+    chooser = random.Random (1)
+    kinds = TopicSelector ().topiclist
+    return ["building{}/floor{}/room{}/sensor{}/{}".format (t, chooser.randrange (20), chooser.randrange (100), chooser.randrange (10), chooser.choice (kinds))
+            for t in range (self.args.topics)]
+
+  #################
+  # one way of naming topics
+  #################
+  def run (self, form, topics, port):
+    args = self.args
+    topic_ids = TopicIds ()
+    if form == "id":
+      topic_ids.assign (topics)
+
+    # the messages, as a publisher sends them
+    chooser = random.Random (2)
+    messages = []
+    for i in range (args.samples):
+      topic = chooser.choice (topics)
+      publication = topic_pb2.Publication ()
+      topic_ids.stamp (publication, topic)
+      set_payload (publication, topic, chooser.randint (-100, 100))
+      publication.pub_id = "pub1"
+      publication.tstamp = time.time ()
+      publication.seq = i + 1
+      messages.append ([topic_ids.envelope (topic), publication.SerializeToString ()])
+    size = sum (len (envelope) + len (frame) for envelope, frame in messages) / len (messages)
+
+    # matching at the publisher's socket, an XPUB to see the subscriptions
+    # arrive before we send
+    context = zmq.Context ()
+    pub = context.socket (zmq.XPUB)
+    pub.setsockopt (zmq.SNDHWM, 0)
+    pub.bind ("tcp://127.0.0.1:{}".format (port))
+    sub = context.socket (zmq.SUB)
+    sub.setsockopt (zmq.RCVHWM, 0)
+    sub.setsockopt (zmq.SNDHWM, 0) # or it only sends the first 1000 subscriptions
+    for topic in topics:
+      sub.setsockopt (zmq.SUBSCRIBE, topic_ids.envelope (topic))
+    sub.connect ("tcp://127.0.0.1:{}".format (port))
+    subscriptions = 0
+    while subscriptions < len (topics) and pub.poll (timeout=int (args.settle * 1000)):
+      pub.recv ()
+      subscriptions += 1
+    start = time.perf_counter ()
+    for message in messages:
+      pub.send_multipart (message)
+    match = (time.perf_counter () - start) / len (messages)
+    received = 0
+    while received < len (messages) and sub.poll (timeout=1000):
+      sub.recv_multipart ()
+      received += 1
+    pub.close (linger=0)
+    sub.close (linger=0)
+    context.term ()
+
+    # and the receiver getting the name back
+    start = time.perf_counter ()
+    for envelope, frame in messages:
+      publication = topic_pb2.Publication ()
+      publication.ParseFromString (frame)
+      topic_ids.restore (publication)
+    restore = (time.perf_counter () - start) / len (messages)
+
+    self.logger.info ("{:5d} topics {:4s}: {:.1f} bytes per message, {:.2f} us matching, {:.2f} us parse and restore; {} of {} received".format (
+      len (topics), form, size, match * 1e6, restore * 1e6, received, len (messages)))
+    self.results.append ((len (topics), form, size, match, restore))
+
+  #################
+  # Driver program
+  #################
+  def driver (self):
+    self.logger.debug ("TopicIdBenchmark::driver")
+
+    topics = self.topics ()
+    for i, form in enumerate (self.args.forms):
+      self.run (form, topics, self.args.port + i)
+
+    os.makedirs ("./csv", exist_ok=True)
+    path = "./csv/topic_id_benchmark.csv"
+    new_file = not os.path.exists (path)
+    with open (path, "a") as f:
+      if new_file:
+        f.write ("topics,form,samples,bytes_per_message,us_matching,us_restore\n")
+      for count, form, size, match, restore in self.results:
+        f.write ("{},{},{},{:.2f},{:.3f},{:.3f}\n".format (count, form, self.args.samples, size, match * 1e6, restore * 1e6))
+
+###################################
+#
+# Parse command line arguments
+#
+###################################
+def parseCmdLineArgs ():
+  parser = argparse.ArgumentParser (description="Compact topic id benchmark")
+
+  parser.add_argument ("--forms", nargs="+", choices=["name", "id"], default=["name", "id"], help="Ways of naming topics on the wire to compare, default name id")
+  parser.add_argument ("-T", "--topics", type=int, default=0, help="Synthetic topics with long hierarchical names, 0 for the 9 TopicSelector knows, default 0")
+  parser.add_argument ("-n", "--samples", type=int, default=50000, help="Samples sent over all topics, default 50000")
+  parser.add_argument ("--settle", type=float, default=0.5, help="Seconds to wait for the next subscription to reach the publisher, default 0.5")
+  parser.add_argument ("-p", "--port", type=int, default=9900, help="First of the ports used (one per form), default 9900")
+  parser.add_argument ("-l", "--loglevel", type=int, default=logging.INFO, choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], help="logging level, choices 10,20,30,40,50: default 20=logging.INFO")
+
+  return parser.parse_args ()
+
+###################################
+#
+# Main program
+#
+###################################
+def main ():
+  logger = logging.getLogger ("TopicIdBenchmark")
+  args = parseCmdLineArgs ()
+  logger.setLevel (args.loglevel)
+
+  benchmark = TopicIdBenchmark (logger)
+  benchmark.configure (args)
+  benchmark.driver ()
+
+if __name__ == "__main__":
+
+  # set underlying default logging capabilities
+  logging.basicConfig (level=logging.DEBUG,
+                       format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+  main ()
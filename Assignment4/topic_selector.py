@@ -39,30 +39,33 @@ class TopicSelector ():
     return random.sample (self.topiclist, num)
 
   # generate a publication on a given topic
+  #
+  # values are native (float, int, or one of the words of the topic's enum
+  # in topic.proto); the middleware puts them in the matching typed field
   def gen_publication (self, topic):
     if (topic == "weather"):
       return random.choice (["sunny", "cloudy", "rainy", "foggy", "icy"])
     elif (topic == "humidity"):
-      return str (random.uniform (10.0, 100.0))
+      return random.uniform (10.0, 100.0)
     elif (topic == "airquality"):
       return random.choice (["good", "smog", "poor"])
     elif (topic == "light"):
       # in lumens
-      return random.choice (["450", "800", "1100", "1600"])
+      return random.choice ([450, 800, 1100, 1600])
     elif (topic == "pressure"):
       # in millibars (lowest recorded to highest recorded)
-      return str (random.randint (870, 1084))
+      return random.randint (870, 1084)
     elif (topic == "temperature"):
       # in fahrenheit
-      return str (random.randint (-100, 100))
+      return random.randint (-100, 100)
     elif (topic == "sound"):
       # in decibels
-      return str (random.randint (30, 95))
+      return random.randint (30, 95)
     elif (topic == "altitude"):
       # in feet
-      return str (random.randint (0, 40000))
+      return random.randint (0, 40000)
     elif (topic == "location"):
-      return random.choice (["America", "Europe", "Asia", "Africa", "Australia"])
+      return random.choice (["america", "europe", "asia", "africa", "australia"])
                             
         
 